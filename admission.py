@@ -0,0 +1,155 @@
+# In admission.py
+import os
+import math
+import subprocess
+
+import video_pipeline
+
+
+# --- Configuration ---
+# 'clamp' scales jobs down to fit the budgets, 'reject' refuses them, 'off' admits everything unprobed
+ADMISSION_POLICY = os.environ.get('ADMISSION_POLICY', 'clamp')
+ADMISSION_MAX_FRAME_PIXELS = int(os.environ.get('ADMISSION_MAX_FRAME_PIXELS', 1280 * 720))
+ADMISSION_MAX_OUTPUT_FRAMES = int(os.environ.get('ADMISSION_MAX_OUTPUT_FRAMES', 1200))
+# Source pixels the decoder has to touch: width * height * source fps * trimmed source seconds
+ADMISSION_MAX_DECODE_PIXELS = int(os.environ.get('ADMISSION_MAX_DECODE_PIXELS', 1920 * 1080 * 30 * 120))
+ADMISSION_MAX_GIF_BYTES = int(os.environ.get('ADMISSION_MAX_GIF_BYTES', 80 * 1024 * 1024))
+ADMISSION_MIN_FPS = int(os.environ.get('ADMISSION_MIN_FPS', 8))
+# Encoded GIF bytes per output pixel; palette GIFs of camera footage land around 0.1-0.2
+GIF_BYTES_PER_PIXEL = float(os.environ.get('GIF_BYTES_PER_PIXEL', 0.15))
+
+
+class AdmissionError(Exception):
+    """
+    Raised when a job exceeds its budgets and cannot (or may not) be clamped (HTTP 413),
+    or when its source cannot be read as a video at all (HTTP 415).
+    """
+
+    def __init__(self, message, estimate=None, status_code=413):
+        super().__init__(message)
+        self.estimate = estimate
+        self.status_code = status_code
+
+
+def estimate_cost(options, probe):
+    """Output frames, pixels processed and expected GIF size for options applied to a probed source."""
+    plan = video_pipeline.build_decode_plan(options, probe)
+    source_seconds = plan['end_time'] - plan['start_time']
+    source_fps = probe.get('fps') or 30.0
+    output_pixels = plan['width'] * plan['height'] * plan['frame_count']
+    decode_pixels = int(probe['width'] * probe['height'] * source_fps * source_seconds)
+    return {
+        'source_width': probe['width'],
+        'source_height': probe['height'],
+        'source_duration': round(probe['duration'], 3),
+        'source_fps': round(source_fps, 3),
+        'codec': probe.get('codec'),
+        'width': plan['width'],
+        'height': plan['height'],
+        'fps': plan['fps'],
+        'duration': round(plan['duration'], 3),
+        'output_frames': plan['frame_count'],
+        'decode_pixels': decode_pixels,
+        'pixels_processed': decode_pixels + output_pixels,
+        'estimated_gif_bytes': int(output_pixels * GIF_BYTES_PER_PIXEL),
+    }
+
+
+def over_budget(estimate):
+    """Names of the budgets an estimate exceeds."""
+    exceeded = []
+    if estimate['width'] * estimate['height'] > ADMISSION_MAX_FRAME_PIXELS:
+        exceeded.append('frame_pixels')
+    if estimate['output_frames'] > ADMISSION_MAX_OUTPUT_FRAMES:
+        exceeded.append('output_frames')
+    if estimate['decode_pixels'] > ADMISSION_MAX_DECODE_PIXELS:
+        exceeded.append('decode_pixels')
+    if estimate['estimated_gif_bytes'] > ADMISSION_MAX_GIF_BYTES:
+        exceeded.append('gif_bytes')
+    return exceeded
+
+
+def _even_width(width):
+    return max(2, int(width) // 2 * 2)
+
+
+def clamp_options(options, probe):
+    """
+    Scales a job down until it fits every budget: output width first, then frame
+    rate (no lower than ADMISSION_MIN_FPS), then the clip's end time. Returns the
+    new options and a list of human-readable adjustments.
+    """
+    options = dict(options)
+    adjustments = []
+    estimate = estimate_cost(options, probe)
+
+    frame_pixels = estimate['width'] * estimate['height']
+    if frame_pixels > ADMISSION_MAX_FRAME_PIXELS:
+        width = _even_width(estimate['width'] * math.sqrt(ADMISSION_MAX_FRAME_PIXELS / frame_pixels))
+        options['resize'] = str(width)
+        adjustments.append(f"width reduced to {width}px")
+        estimate = estimate_cost(options, probe)
+
+    if estimate['output_frames'] > ADMISSION_MAX_OUTPUT_FRAMES and estimate['fps'] > ADMISSION_MIN_FPS:
+        fps = max(ADMISSION_MIN_FPS, int(ADMISSION_MAX_OUTPUT_FRAMES / max(estimate['duration'], 1e-6)))
+        if fps < estimate['fps']:
+            options['fps'] = str(fps)
+            adjustments.append(f"frame rate reduced to {fps} fps")
+            estimate = estimate_cost(options, probe)
+
+    plan = video_pipeline.build_decode_plan(options, probe)
+    source_seconds = plan['end_time'] - plan['start_time']
+    limits = [source_seconds]
+    if estimate['output_frames'] > ADMISSION_MAX_OUTPUT_FRAMES:
+        limits.append(ADMISSION_MAX_OUTPUT_FRAMES / plan['fps'] * plan['speed'])
+    if estimate['decode_pixels'] > ADMISSION_MAX_DECODE_PIXELS:
+        limits.append(source_seconds * ADMISSION_MAX_DECODE_PIXELS / estimate['decode_pixels'])
+    if min(limits) < source_seconds:
+        end_time = math.floor((plan['start_time'] + min(limits)) * 10) / 10
+        options['start_time'] = str(plan['start_time'])
+        options['end_time'] = str(end_time)
+        adjustments.append(f"clip shortened to end at {end_time:g}s")
+        estimate = estimate_cost(options, probe)
+
+    if estimate['estimated_gif_bytes'] > ADMISSION_MAX_GIF_BYTES:
+        scale = math.sqrt(ADMISSION_MAX_GIF_BYTES / estimate['estimated_gif_bytes'])
+        width = _even_width(estimate['width'] * scale)
+        options['resize'] = str(width)
+        adjustments.append(f"width reduced to {width}px to fit the size limit")
+        estimate = estimate_cost(options, probe)
+
+    return options, estimate, adjustments
+
+
+def admit(source, options, policy=ADMISSION_POLICY):
+    """
+    Probes a source (local path or URL ffprobe can read) and applies the admission
+    policy. Returns (options, estimate, adjustments); estimate is None when admission
+    is off or ffprobe is not installed. Raises AdmissionError for unreadable sources
+    and for over-budget jobs under the 'reject' policy.
+    """
+    if policy == 'off':
+        return options, None, []
+    try:
+        probe = video_pipeline.probe_video(source)
+    except FileNotFoundError:
+        print("ffprobe is not available; admitting job without a cost estimate")
+        return options, None, []
+    except subprocess.TimeoutExpired:
+        raise AdmissionError("Could not read the video: probing it took too long.", status_code=415)
+    except Exception as e:
+        raise AdmissionError(f"Could not read the video: {e}", status_code=415)
+    if probe['width'] <= 0 or probe['height'] <= 0 or probe['duration'] <= 0:
+        raise AdmissionError("The video has no readable frames.", status_code=415)
+
+    estimate = estimate_cost(options, probe)
+    exceeded = over_budget(estimate)
+    if not exceeded:
+        return options, estimate, []
+    if policy == 'reject':
+        raise AdmissionError(f"This conversion is too large ({', '.join(exceeded)} over budget). "
+                             f"Try a shorter clip, a lower frame rate or a smaller width.", estimate)
+    options, estimate, adjustments = clamp_options(options, probe)
+    if over_budget(estimate):
+        raise AdmissionError("This conversion is too large even after scaling it down.", estimate)
+    return options, estimate, adjustments
@@ -0,0 +1,81 @@
+# In animation_encoder.py
+import os
+import subprocess
+import tempfile
+
+import numpy as np
+
+
+# --- Configuration ---
+FFMPEG_BINARY = os.environ.get('FFMPEG_BINARY', 'ffmpeg')
+WEBP_QUALITY = int(os.environ.get('WEBP_QUALITY', 75))  # 0-100
+WEBP_COMPRESSION_LEVEL = int(os.environ.get('WEBP_COMPRESSION_LEVEL', 4))  # 0 (fastest) to 6 (smallest)
+MP4_CRF = int(os.environ.get('MP4_CRF', 23))
+MP4_PRESET = os.environ.get('MP4_PRESET', 'veryfast')
+
+# The ffmpeg encoder each output format is written with; workers check them at startup
+FORMAT_ENCODERS = {'gif': 'gif', 'webp': 'libwebp_anim', 'apng': 'apng', 'mp4': 'libx264'}
+
+
+def _codec_args(output_format):
+    """ffmpeg output arguments for each non-GIF format. All of them loop forever where the container can say so."""
+    if output_format == 'webp':
+        return ['-c:v', FORMAT_ENCODERS['webp'], '-lossless', '0', '-quality', str(WEBP_QUALITY),
+                '-compression_level', str(WEBP_COMPRESSION_LEVEL), '-loop', '0', '-f', 'webp']
+    if output_format == 'apng':
+        return ['-c:v', FORMAT_ENCODERS['apng'], '-pred', 'mixed', '-plays', '0', '-f', 'apng']
+    if output_format == 'mp4':
+        # yuv420p needs even dimensions; players loop it via the <video loop> attribute
+        return ['-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2', '-c:v', FORMAT_ENCODERS['mp4'], '-preset', MP4_PRESET,
+                '-crf', str(MP4_CRF), '-pix_fmt', 'yuv420p', '-movflags', '+faststart', '-an', '-f', 'mp4']
+    raise ValueError(f"Unknown output format: {output_format}")
+
+
+class FfmpegAnimationEncoder:
+    """
+    Single-pass encoder for animated WebP, APNG and looping MP4, fed one frame at a
+    time like the GIF encoders. Frames are piped straight into ffmpeg, so nothing is
+    spooled to disk and memory use is independent of clip length.
+    """
+
+    def __init__(self, output_path, width, height, fps, output_format):
+        self.output_path = output_path
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.output_format = output_format
+        self.frames_written = 0
+        self._stderr = tempfile.TemporaryFile()
+        self._process = subprocess.Popen(
+            [FFMPEG_BINARY, '-nostdin', '-hide_banner', '-loglevel', 'error', '-y',
+             '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-s', f'{width}x{height}', '-r', str(fps), '-i', '-',
+             *_codec_args(output_format), output_path],
+            stdin=subprocess.PIPE, stderr=self._stderr,
+        )
+
+    def write_frame(self, frame):
+        if frame.ndim == 3 and frame.shape[2] > 3:
+            frame = frame[:, :, :3]
+        self._process.stdin.write(np.ascontiguousarray(frame, dtype=np.uint8).tobytes())
+        self.frames_written += 1
+
+    def close(self):
+        try:
+            self._process.stdin.close()
+            return_code = self._process.wait()
+            if self.frames_written == 0:
+                raise RuntimeError(f"No frames were written to the {self.output_format} encoder.")
+            if return_code != 0:
+                self._stderr.seek(0)
+                raise RuntimeError(f"ffmpeg {self.output_format} encode failed ({return_code}): "
+                                   f"{self._stderr.read().decode(errors='replace')}")
+        finally:
+            self._stderr.close()
+
+    def abort(self):
+        if self._process.poll() is None:
+            self._process.kill()
+            self._process.wait()
+        self._stderr.close()
+        if os.path.exists(self.output_path):
+            os.remove(self.output_path)
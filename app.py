@@ -1,16 +1,28 @@
 import os
-from flask import Flask, render_template, request, jsonify, url_for, send_from_directory , Response, make_response # 👈 Import send_from_directory
+from flask import Flask, render_template, request, jsonify, url_for, send_from_directory , Response, make_response, send_file, abort, redirect, g # 👈 Import send_from_directory
 from werkzeug.utils import secure_filename
 from werkzeug.middleware.proxy_fix import ProxyFix
-from apscheduler.schedulers.background import BackgroundScheduler
 import atexit
-from celery_tasks import convert_video_to_gif_task, celery_app
-from celery.result import AsyncResult
+import task_client
+from task_client import celery_app
 import time
-from google.cloud import storage # Import GCS client
+from storage_backend import get_storage, LocalStorage, TRANSFER_CHUNK_SIZE
+from itsdangerous import URLSafeTimedSerializer, BadSignature
+import result_cache
+import progress_events
+import task_states
+import handoff
+import admission
+import task_routing
+import metrics
+import expiry_index
+from conversion_options import OUTPUT_FORMATS, output_mimetype
+import json
+import queue
 import requests
-import yt_dlp
 import re
+import uuid
+import hmac
 
 app = Flask(__name__)
 
@@ -30,19 +42,44 @@ app.config['MAX_CONTENT_LENGTH'] = 50 * 1024 * 1024
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 os.makedirs(app.config['GIF_FOLDER'], exist_ok=True)
 
+# Server-sent progress streams close after this long; the client reconnects or polls
+EVENT_STREAM_MAX_SECONDS = int(os.environ.get('EVENT_STREAM_MAX_SECONDS', 600))
+EVENT_STREAM_KEEPALIVE_SECONDS = int(os.environ.get('EVENT_STREAM_KEEPALIVE_SECONDS', 15))
+STATUS_BATCH_MAX_TASKS = int(os.environ.get('STATUS_BATCH_MAX_TASKS', 100))
+# 'proxy' streams GIF downloads through the app, 'redirect' answers with a 302 to a signed URL
+DOWNLOAD_MODE = os.environ.get('DOWNLOAD_MODE', 'proxy')
+DOWNLOAD_CHUNK_SIZE = int(os.environ.get('DOWNLOAD_CHUNK_SIZE', 64 * 1024))
+DOWNLOAD_POOL_SIZE = int(os.environ.get('DOWNLOAD_POOL_SIZE', 32))
+DOWNLOAD_SIGNED_URL_SECONDS = 600
+# Conditional and partial request headers forwarded to storage, and the response headers passed back
+_DOWNLOAD_REQUEST_HEADERS = ('Range', 'If-Range', 'If-None-Match', 'If-Modified-Since')
+_DOWNLOAD_RESPONSE_HEADERS = ('Content-Length', 'Content-Range', 'Accept-Ranges', 'ETag', 'Last-Modified')
+
+# Direct uploads go from the browser to storage in chunks; the web tier only signs sessions
+DIRECT_UPLOAD_MAX_BYTES = int(os.environ.get('DIRECT_UPLOAD_MAX_BYTES', 50 * 1024 * 1024))
+UPLOAD_SESSION_SECONDS = int(os.environ.get('UPLOAD_SESSION_SECONDS', 3600))
+UPLOAD_CHUNK_SIZE = TRANSFER_CHUNK_SIZE  # GCS needs multiples of 256 KB for all but the last chunk
+
+# Expired temp files and storage objects are swept this often (see expiry_index.py)
+EXPIRY_SWEEP_MINUTES = int(os.environ.get('EXPIRY_SWEEP_MINUTES', 10))
+
+# Variants one /convert_batch job may ask for; they share one decode of the source
+BATCH_MAX_VARIANTS = int(os.environ.get('BATCH_MAX_VARIANTS', 6))
+
+# /metrics is only served to scrapers presenting this as a bearer token; unset, it is not served at all
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
 ALLOWED_EXTENSIONS = {'mp4', 'mov', 'avi', 'mkv', 'webm'}
-BUCKET_NAME = "video-to-gif-cheap-us-central1" # Updated to use single-region, low-cost bucket
 VIDEO_UPLOAD_GCS_PREFIX = "video_uploads/"
+# Proxy videos, sprite sheets and timeline strips built for URL previews
+PREVIEW_GCS_PREFIX = "previews/"
 
 def upload_to_gcs_from_app(local_file_path, destination_blob_name):
     """Uploads a file to the bucket from the Flask app."""
     try:
-        storage_client = storage.Client()
-        bucket = storage_client.bucket(BUCKET_NAME)
-        blob = bucket.blob(destination_blob_name)
-
-        blob.upload_from_filename(local_file_path)
+        get_storage().upload_file(local_file_path, destination_blob_name)
         app.logger.info(f"Successfully uploaded {local_file_path} to GCS as {destination_blob_name}")
+        expiry_index.register(destination_blob_name, expiry_index.UPLOAD_EXPIRY_SECONDS)
         return destination_blob_name # Return the blob name
     except Exception as e:
         app.logger.error(f"Error uploading {local_file_path} to GCS: {e}")
@@ -51,259 +88,656 @@ def upload_to_gcs_from_app(local_file_path, destination_blob_name):
         # app.logger.error(traceback.format_exc())
         return None
 
+def _conversion_options(form):
+    """Conversion options from the converter form, shared by every entry point that enqueues a task."""
+    return {
+        'start_time': form.get('start_time', 0.0),
+        'end_time': form.get('end_time'),
+        'fps': form.get('fps', 10),
+        'resize': form.get('resize', 'original'),
+        'speed': form.get('speed', 1.0),
+        'target_bytes': form.get('target_bytes'),
+        'output_format': form.get('output_format', 'gif'),
+        'crop_x': form.get('crop_x'),
+        'crop_y': form.get('crop_y'),
+        'crop_width': form.get('crop_width'),
+        'crop_height': form.get('crop_height'),
+        'text_overlay': form.get('text-overlay') or form.get('text_overlay'),
+        'text_size': form.get('text-size'),
+        'text_color': form.get('text-color'),
+        'text_bg_color': 'none' if form.get('text-bg-color-none') else form.get('text-bg-color'),
+        'font_style': form.get('font-style'),
+        'text_position': form.get('text-position'),
+        'text_align': form.get('text-align'),
+    }
+
 def allowed_file(filename):
     """Checks if the file extension is allowed."""
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+@app.before_request
+def _start_request_clock():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def _record_request_metrics(response):
+    """Times every request by route, and counts the bytes it received and sent."""
+    started = g.pop('request_started', None)
+    if started is not None:
+        endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        metrics.observe('gifconv_http_request_seconds', time.perf_counter() - started,
+                        endpoint=endpoint, method=request.method, status=response.status_code)
+    if request.content_length:
+        metrics.inc('gifconv_bytes_in_total', request.content_length, source='http')
+    sent = response.headers.get('Content-Length')
+    if sent and sent.isdigit():
+        metrics.inc('gifconv_bytes_out_total', int(sent), kind='response')
+    return response
+
 @app.route('/')
 def index():
     """Renders the main page."""
     return render_template('index.html')
 
-# 👇 **CHANGE 2: Add a new route to serve files from /tmp**
-@app.route('/temp/<filename>')
-def serve_temp_file(filename):
-    """Serves a file from the temporary GIF folder with CORS headers."""
-    response = make_response(send_from_directory(app.config['GIF_FOLDER'], filename))
-    response.headers['Access-Control-Allow-Origin'] = '*'
-    response.headers['Access-Control-Allow-Methods'] = 'GET, OPTIONS'
-    response.headers['Access-Control-Allow-Headers'] = 'Content-Type'
-    return response
+def _stage_for_worker(local_temp_video_path, unique_filename, source_digest, queue_class):
+    """
+    Hands a saved upload to the workers: on this host's disk when a local worker serves
+    queue_class, otherwise through storage. Returns (blob_name, task_kwargs, queue_name),
+    or None if the upload to storage failed.
+    """
+    gcs_video_blob_name = VIDEO_UPLOAD_GCS_PREFIX + unique_filename
+    task_kwargs = {'source_digest': source_digest}
+    queue_name = None
+    if handoff.HANDOFF_ENABLED and handoff.local_worker_alive(queue_class):
+        # A worker shares this filesystem: pass the file over on disk and route the task to that worker
+        task_kwargs['handoff_ref'] = handoff.stage(local_temp_video_path, source_digest)
+        queue_name = handoff.local_queue_name(queue_class)
+        app.logger.info(f"Staged {unique_filename} for local handoff at {task_kwargs['handoff_ref']['path']}")
+    else:
+        # Upload the video to GCS
+        uploaded_blob_name = upload_to_gcs_from_app(local_temp_video_path, gcs_video_blob_name)
+        # Uploaded videos stay private; only the generated GIFs are public
+        if os.path.exists(local_temp_video_path):
+            os.remove(local_temp_video_path)
+            app.logger.info(f"Cleaned up local video {local_temp_video_path}")
+        if not uploaded_blob_name:
+            return None
+    return gcs_video_blob_name, task_kwargs, queue_name
+
+def _submit_staged(task_name, args, task_kwargs, queue_class, queue_name):
+    """
+    Submits the task for a job staged by _stage_for_worker. A handed-off job is recorded
+    first, so it can be rerouted through storage if the local worker never claims it.
+    """
+    options = task_routing.publish_options(queue_class, queue=queue_name)
+    handoff_ref = task_kwargs.get('handoff_ref')
+    if handoff_ref is None:
+        return task_client.submit(task_name, args=args, kwargs=task_kwargs, **options)
+    task_id = str(uuid.uuid4())
+    handoff.record_task(handoff_ref, task_name, task_id, args, task_kwargs, queue_class)
+    try:
+        return task_client.submit(task_name, args=args, kwargs=task_kwargs, task_id=task_id, **options)
+    except Exception:
+        handoff.forget_task(handoff_ref)
+        raise
+
+def _reroute_handoff(record, path):
+    """Sends a handed-off job no local worker claimed through storage, under its original task ID."""
+    blob_name = record['args'][0]
+    if not upload_to_gcs_from_app(path, blob_name):
+        raise RuntimeError(f"Could not upload {path} to reroute task {record['task_id']}")
+    task_client.submit(record['task_name'], args=record['args'], kwargs=record['task_kwargs'],
+                       task_id=record['task_id'], **task_routing.publish_options(record['queue_class']))
+    app.logger.info(f"Rerouted unclaimed handoff task {record['task_id']} through storage as {blob_name}")
 
 @app.route('/convert', methods=['POST'])
 def start_conversion_task():
     video_url = request.form.get('video_url', '').strip()
     file = request.files.get('video')
-    temp_download_path = None
+    if video_url and not file:
+        return _start_url_conversion(video_url)
     try:
-        if video_url and not file:
-            # Download video from URL using yt-dlp
-            ydl_opts = {
-                'outtmpl': os.path.join(app.config['UPLOAD_FOLDER'], '%(id)s.%(ext)s'),
-                'format': 'bestvideo+bestaudio/best',
-                'noplaylist': True,
-                'quiet': True,
-                'merge_output_format': 'mp4',
-            }
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(video_url, download=True)
-                temp_download_path = ydl.prepare_filename(info)
-                # If not mp4, try to find the merged file
-                if not temp_download_path.endswith('.mp4'):
-                    base = os.path.splitext(temp_download_path)[0]
-                    mp4_path = base + '.mp4'
-                    if os.path.exists(mp4_path):
-                        temp_download_path = mp4_path
-            filename = os.path.basename(temp_download_path)
-            unique_filename = f"{os.urandom(8).hex()}_{filename}"
-            local_temp_video_path = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
-            os.rename(temp_download_path, local_temp_video_path)
-            app.logger.info(f"Video downloaded from URL to {local_temp_video_path}")
-        elif file and file.filename != '':
+        if file and file.filename != '':
             if not allowed_file(file.filename):
                 return jsonify({'error': 'File type not allowed.'}), 400
             filename = secure_filename(file.filename)
             unique_filename = f"{os.urandom(8).hex()}_{filename}"
             local_temp_video_path = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
-            file.save(local_temp_video_path)
+            source_digest = result_cache.save_stream_with_digest(file.stream, local_temp_video_path)
+            expiry_index.register_local(local_temp_video_path)
             app.logger.info(f"Video saved locally to {local_temp_video_path}")
         else:
-            return jsonify({'error': 'No video file or URL provided.'), 400
+            return jsonify({'error': 'No video file or URL provided.'}), 400
 
-        # Upload the video to GCS
-        gcs_video_blob_name = VIDEO_UPLOAD_GCS_PREFIX + unique_filename
-        uploaded_blob_name = upload_to_gcs_from_app(local_temp_video_path, gcs_video_blob_name)
-        if uploaded_blob_name:
-            # Make the blob public and get its URL
-            storage_client = storage.Client()
-            bucket = storage_client.bucket(BUCKET_NAME)
-            blob = bucket.blob(uploaded_blob_name)
-            # blob.make_public()  # Do not make uploaded videos public
-            public_url = None  # No public URL since file is private
-        else:
-            public_url = None
-        if os.path.exists(local_temp_video_path):
+        # --- NEW: Submit Celery task for GIF conversion ---
+        # Parse options from request (add more as needed)
+        options = _conversion_options(request.form)
+        try:
+            options, estimate, adjustments = admission.admit(local_temp_video_path, options)
+        except admission.AdmissionError as e:
             os.remove(local_temp_video_path)
-            app.logger.info(f"Cleaned up local video {local_temp_video_path}")
-        if not uploaded_blob_name:
+            app.logger.info(f"Rejected {unique_filename}: {e}")
+            return jsonify({'error': str(e), 'estimate': e.estimate}), e.status_code
+        if adjustments:
+            app.logger.info(f"Clamped {unique_filename}: {', '.join(adjustments)}")
+
+        # Identical upload with identical options: hand back the existing GIF without enqueueing
+        cached_result = result_cache.lookup(source_digest, options)
+        if cached_result:
+            os.remove(local_temp_video_path)
+            app.logger.info(f"Result cache hit for {unique_filename}, returning {cached_result.get('gif_url')}")
+            return jsonify(cached_result)
+
+        # Short jobs and long jobs run on separate queues, so a long clip never delays a short one
+        queue_class = task_routing.queue_for(estimate)
+        staged = _stage_for_worker(local_temp_video_path, unique_filename, source_digest, queue_class)
+        if staged is None:
             return jsonify({'error': 'Failed to upload video to cloud storage.'}), 500
+        gcs_video_blob_name, task_kwargs, queue_name = staged
 
-        # --- NEW: Submit Celery task for GIF conversion ---
-        # Parse options from request (add more as needed)
-        options = {
-            'start_time': request.form.get('start_time', 0.0),
-            'end_time': request.form.get('end_time'),
-            'fps': request.form.get('fps', 10),
-            'resize': request.form.get('resize', 'original'),
-            'speed': request.form.get('speed', 1.0),
-            'crop_x': request.form.get('crop_x'),
-            'crop_y': request.form.get('crop_y'),
-            'crop_width': request.form.get('crop_width'),
-            'crop_height': request.form.get('crop_height'),
-            # Add more options as needed
-        }
         app.logger.info(f"Submitting Celery task for GIF conversion: gcs_video_blob_name={gcs_video_blob_name}, options={options}")
         try:
-            task = convert_video_to_gif_task.apply_async(args=[gcs_video_blob_name, options])
+            task = _submit_staged(task_client.CONVERT_TASK, [gcs_video_blob_name, options], task_kwargs,
+                                  queue_class, queue_name)
             app.logger.info(f"Celery task submitted. Task ID: {task.id}")
         except Exception as e:
             app.logger.error(f"Failed to submit Celery task: {e}")
             return jsonify({'error': 'Failed to submit GIF conversion task.'}), 500
 
-        return jsonify({'task_id': task.id, 'status_url': url_for('task_status', task_id=task.id, _external=True)})
-    except yt_dlp.utils.DownloadError as e:
-        app.logger.error(f"yt-dlp download error: {e}")
-        return jsonify({'error': 'Failed to download video from URL. Please check the link and try again.'}), 400
+        return jsonify({'task_id': task.id, 'status_url': url_for('task_status', task_id=task.id, _external=True),
+                        'estimate': estimate, 'adjustments': adjustments})
     except Exception as e:
         app.logger.error(f"An error occurred during file upload or task submission: {e}")
         return jsonify({'error': 'An unexpected error occurred during file upload or URL processing.'}), 500
-    finally:
-        # Clean up any temp file if it still exists
-        if temp_download_path and os.path.exists(temp_download_path):
-            os.remove(temp_download_path)
+
+def _start_url_conversion(video_url):
+    """
+    URL conversions are downloaded by a worker, not in the request: the ingest task
+    fetches only the requested section and then continues as the conversion itself.
+    """
+    options = _conversion_options(request.form)
+    crop_reference_width = parse_int(request.form.get('crop_reference_width'), None)
+    try:
+        # The cost is unknown until the video is fetched; the conversion the task becomes is routed by its estimate
+        task = task_client.submit(task_client.INGEST_URL_TASK, args=[video_url, options],
+                                  kwargs={'crop_reference_width': crop_reference_width},
+                                  **task_routing.publish_options(task_routing.INTERACTIVE_QUEUE))
+        app.logger.info(f"Celery task submitted for {video_url}. Task ID: {task.id}")
+    except Exception as e:
+        app.logger.error(f"Failed to submit URL ingest task: {e}")
+        return jsonify({'error': 'Failed to submit GIF conversion task.'}), 500
+    return jsonify({'task_id': task.id, 'status_url': url_for('task_status', task_id=task.id, _external=True)})
+
+@app.route('/convert_batch', methods=['POST'])
+def start_batch_conversion():
+    """
+    Converts one uploaded video into several variants as a single job. The form carries
+    the video, the shared conversion options and 'variants', a JSON list of option
+    overrides (e.g. [{"resize": "160"}, {"resize": "480", "fps": "15"}]).
+    """
+    file = request.files.get('video')
+    if not file or file.filename == '':
+        return jsonify({'error': 'No video file provided.'}), 400
+    if not allowed_file(file.filename):
+        return jsonify({'error': 'File type not allowed.'}), 400
+    try:
+        overrides = json.loads(request.form.get('variants') or '[]')
+    except ValueError:
+        return jsonify({'error': 'variants must be a JSON list of option objects.'}), 400
+    if not isinstance(overrides, list) or not overrides or not all(isinstance(item, dict) for item in overrides):
+        return jsonify({'error': 'variants must be a JSON list of option objects.'}), 400
+    if len(overrides) > BATCH_MAX_VARIANTS:
+        return jsonify({'error': f'At most {BATCH_MAX_VARIANTS} variants can be requested at once.'}), 400
+
+    base_options = _conversion_options(request.form)
+    unique_filename = f"{os.urandom(8).hex()}_{secure_filename(file.filename)}"
+    local_temp_video_path = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
+    try:
+        source_digest = result_cache.save_stream_with_digest(file.stream, local_temp_video_path)
+        expiry_index.register_local(local_temp_video_path)
+        variants, estimates, adjustments = [], [], []
+        for index, override in enumerate(overrides):
+            options = dict(base_options, **{key: (None if value is None else str(value)) for key, value in override.items()})
+            try:
+                options, estimate, variant_adjustments = admission.admit(local_temp_video_path, options)
+            except admission.AdmissionError as e:
+                os.remove(local_temp_video_path)
+                app.logger.info(f"Rejected variant {index} of {unique_filename}: {e}")
+                return jsonify({'error': f"Variant {index + 1}: {e}", 'estimate': e.estimate}), e.status_code
+            variants.append(options)
+            estimates.append(estimate)
+            adjustments.extend(f"variant {index + 1}: {adjustment}" for adjustment in variant_adjustments)
+
+        # The variants run as one task, so the job is routed by their combined cost
+        estimate = None
+        if all(estimates):
+            estimate = {'pixels_processed': sum(item['pixels_processed'] for item in estimates)}
+        queue_class = task_routing.queue_for(estimate)
+        staged = _stage_for_worker(local_temp_video_path, unique_filename, source_digest, queue_class)
+        if staged is None:
+            return jsonify({'error': 'Failed to upload video to cloud storage.'}), 500
+        gcs_video_blob_name, task_kwargs, queue_name = staged
+
+        app.logger.info(f"Submitting variant task for {gcs_video_blob_name} with {len(variants)} variants")
+        try:
+            task = _submit_staged(task_client.CONVERT_VARIANTS_TASK, [gcs_video_blob_name, variants], task_kwargs,
+                                  queue_class, queue_name)
+        except Exception as e:
+            app.logger.error(f"Failed to submit Celery task: {e}")
+            return jsonify({'error': 'Failed to submit GIF conversion task.'}), 500
+        return jsonify({'task_id': task.id, 'status_url': url_for('task_status', task_id=task.id, _external=True),
+                        'variants': len(variants), 'adjustments': adjustments})
+    except Exception as e:
+        app.logger.error(f"An error occurred during batch upload or task submission: {e}")
+        if os.path.exists(local_temp_video_path):
+            os.remove(local_temp_video_path)
+        return jsonify({'error': 'An unexpected error occurred during file upload.'}), 500
+
+def _upload_serializer():
+    return URLSafeTimedSerializer(app.config['SECRET_KEY'], salt='upload-session')
+
+def _load_upload_session(upload_id):
+    """Decodes a signed upload ID back into its session, or None if it is forged or expired."""
+    try:
+        return _upload_serializer().loads(upload_id, max_age=UPLOAD_SESSION_SECONDS)
+    except BadSignature:
+        return None
+
+@app.route('/uploads', methods=['POST'])
+def create_upload_session():
+    """
+    Starts a direct upload. The browser sends the video in chunks straight to the
+    returned upload_url (a GCS resumable session, or the local stand-in below), then
+    calls /uploads/<upload_id>/complete to enqueue the conversion. The upload ID is a
+    signed token, so no session state is kept on the web tier.
+    """
+    data = request.get_json(silent=True) or {}
+    filename = secure_filename(str(data.get('filename') or ''))
+    try:
+        size = int(data.get('size'))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Upload size is required.'}), 400
+    if not filename or not allowed_file(filename):
+        return jsonify({'error': 'File type not allowed.'}), 400
+    if size <= 0 or size > DIRECT_UPLOAD_MAX_BYTES:
+        return jsonify({'error': f'Videos must be smaller than {DIRECT_UPLOAD_MAX_BYTES // (1024 * 1024)} MB.'}), 413
+
+    blob_name = VIDEO_UPLOAD_GCS_PREFIX + f"{os.urandom(8).hex()}_{filename}"
+    content_type = data.get('content_type') or 'application/octet-stream'
+    try:
+        upload_url = get_storage().create_upload_session(blob_name, content_type=content_type, size=size,
+                                                         origin=request.headers.get('Origin'))
+    except Exception as e:
+        app.logger.error(f"Failed to start upload session for {blob_name}: {e}")
+        return jsonify({'error': 'Failed to start upload.'}), 500
+    # Deleted by the conversion; indexed in case the browser never finishes the upload
+    expiry_index.register(blob_name, expiry_index.UPLOAD_EXPIRY_SECONDS)
+    upload_id = _upload_serializer().dumps({'blob': blob_name, 'size': size})
+    if upload_url is None:
+        upload_url = url_for('receive_upload_chunk', upload_id=upload_id, _external=True)
+    return jsonify({
+        'upload_id': upload_id,
+        'upload_url': upload_url,
+        'chunk_size': UPLOAD_CHUNK_SIZE,
+        'complete_url': url_for('complete_upload', upload_id=upload_id, _external=True),
+    })
+
+@app.route('/uploads/<upload_id>', methods=['PUT'])
+def receive_upload_chunk(upload_id):
+    """Local stand-in for a GCS resumable session: accepts Content-Range chunks, answers 308 until complete."""
+    storage_backend = get_storage()
+    session = _load_upload_session(upload_id)
+    if session is None or not isinstance(storage_backend, LocalStorage):
+        abort(404)
+    match = re.match(r'bytes (\d+)-(\d+)/(\d+)', request.headers.get('Content-Range', ''))
+    if not match or int(match.group(3)) != session['size']:
+        return jsonify({'error': 'Invalid Content-Range.'}), 400
+    try:
+        received = storage_backend.receive_chunk(session['blob'], int(match.group(1)), request.stream, session['size'])
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if received < session['size']:
+        response = make_response('', 308)
+        response.headers['Range'] = f'bytes=0-{received - 1}'
+        return response
+    return jsonify({'size': received})
+
+@app.route('/uploads/<upload_id>/complete', methods=['POST'])
+def complete_upload(upload_id):
+    """Enqueues the conversion once every byte of a direct upload has reached storage."""
+    session = _load_upload_session(upload_id)
+    if session is None:
+        return jsonify({'error': 'Upload session is invalid or has expired.'}), 400
+    blob_name = session['blob']
+    try:
+        stored_size = get_storage().size(blob_name)
+    except Exception as e:
+        app.logger.error(f"Failed to check uploaded video {blob_name}: {e}")
+        return jsonify({'error': 'Failed to check uploaded video.'}), 500
+    if stored_size != session['size']:
+        return jsonify({'error': 'Upload is incomplete.'}), 409
+    # The upload ID stays valid for UPLOAD_SESSION_SECONDS, so a replayed completion must not enqueue again
+    try:
+        first_completion = expiry_index.claim_once(f'upload-complete:{blob_name}', UPLOAD_SESSION_SECONDS)
+    except Exception as e:
+        app.logger.error(f"Failed to mark upload {blob_name} as completed: {e}")
+        return jsonify({'error': 'Failed to check uploaded video.'}), 500
+    if not first_completion:
+        return jsonify({'error': 'This upload has already been submitted.'}), 409
+
+    options = _conversion_options(request.form)
+    storage_backend = get_storage()
+    # ffprobe reads only the headers and index it needs, straight from storage
+    source = storage_backend.local_path(blob_name) or storage_backend.signed_url(blob_name, expiration=600)
+    try:
+        options, estimate, adjustments = admission.admit(source, options)
+    except admission.AdmissionError as e:
+        storage_backend.delete(blob_name)
+        app.logger.info(f"Rejected {blob_name}: {e}")
+        return jsonify({'error': str(e), 'estimate': e.estimate}), e.status_code
+    if adjustments:
+        app.logger.info(f"Clamped {blob_name}: {', '.join(adjustments)}")
+    app.logger.info(f"Submitting Celery task for direct upload: gcs_video_blob_name={blob_name}, options={options}")
+    try:
+        # The web tier never saw the bytes, so the worker hashes the source for the result cache
+        task = task_client.submit(
+            task_client.CONVERT_TASK, args=[blob_name, options],
+            **task_routing.publish_options(task_routing.queue_for(estimate))
+        )
+    except Exception as e:
+        app.logger.error(f"Failed to submit Celery task: {e}")
+        # Nothing was enqueued, so the browser may complete the upload again
+        expiry_index.release_claim(f'upload-complete:{blob_name}')
+        return jsonify({'error': 'Failed to submit GIF conversion task.'}), 500
+    return jsonify({'task_id': task.id, 'status_url': url_for('task_status', task_id=task.id, _external=True),
+                    'estimate': estimate, 'adjustments': adjustments})
 
 @app.route('/upload_url', methods=['POST'])
 def upload_video_from_url():
     video_url = request.form.get('video_url', '').strip()
     if not video_url:
         return jsonify({'error': 'No video URL provided.'}), 400
-    temp_download_path = None
     try:
-        ydl_opts = {
-            'outtmpl': os.path.join(app.config['UPLOAD_FOLDER'], '%(id)s.%(ext)s'),
-            'format': 'bestvideo+bestaudio/best',
-            'noplaylist': True,
-            'quiet': True,
-            'merge_output_format': 'mp4',
-            # Set cache dir to a writable location
-            'cachedir': app.config['UPLOAD_FOLDER'],
-        }
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(video_url, download=True)
-            temp_download_path = ydl.prepare_filename(info)
-            if not temp_download_path.endswith('.mp4'):
-                base = os.path.splitext(temp_download_path)[0]
-                mp4_path = base + '.mp4'
-                if os.path.exists(mp4_path):
-                    temp_download_path = mp4_path
-        filename = os.path.basename(temp_download_path)
-        unique_filename = f"{os.urandom(8).hex()}_{filename}"
-        local_temp_video_path = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
-        os.rename(temp_download_path, local_temp_video_path)
-        app.logger.info(f"Video downloaded from URL to {local_temp_video_path}")
-        preview_url = url_for('serve_temp_file', filename=unique_filename, _external=True)
-        return jsonify({'preview_url': preview_url, 'filename': unique_filename})
-    except yt_dlp.utils.DownloadError as e:
-        app.logger.error(f"yt-dlp download error: {e}")
-        return jsonify({'error': 'Failed to download video from URL. Please check the link and try again.'}), 400
+        task = task_client.submit(task_client.FETCH_PREVIEW_TASK, args=[video_url],
+                                  **task_routing.publish_options(task_routing.INTERACTIVE_QUEUE))
     except Exception as e:
-        import traceback
-        tb = traceback.format_exc()
-        app.logger.error(f"An error occurred during URL upload: {e}\nTraceback:\n{tb}\nvideo_url={video_url} temp_download_path={temp_download_path}")
-        return jsonify({'error': 'An unexpected error occurred during URL upload.'}), 500
-    finally:
-        if temp_download_path and os.path.exists(temp_download_path):
-            os.remove(temp_download_path)
-
-@app.route('/status/<task_id>')
-def task_status(task_id):
-    """Endpoint for the frontend to poll the status of a background task."""
-    task = AsyncResult(task_id, app=celery_app)
-    if task.state == 'PENDING':
-        response = {'state': task.state, 'status': 'Pending...'}
-    elif task.state != 'FAILURE':
-        response = {'state': task.state, 'status': 'In Progress...'}
-        if task.state == 'SUCCESS':
+        app.logger.error(f"Failed to submit preview task for {video_url}: {e}")
+        return jsonify({'error': 'Failed to start the video download.'}), 500
+    # The preview is fetched by a worker; the client polls status_url for its preview_url
+    return jsonify({'task_id': task.id, 'status_url': url_for('task_status', task_id=task.id, _external=True)})
+
+def _status_payload(state, info):
+    """Shapes a task state and its result or progress meta into the JSON the frontend expects."""
+    if state == 'PENDING':
+        response = {'state': state, 'status': 'Pending...'}
+    elif state != 'FAILURE':
+        response = {'state': state, 'status': 'In Progress...'}
+        if state == 'PROGRESS' and isinstance(info, dict):
+            # stage, frames_done, frames_total and eta_seconds published by the worker
+            response.update(info)
+        if state == 'SUCCESS':
             # The Celery task returns a dict with gif_url, width, height, etc.
-            response = task.info
+            response = info
     else:
         response = {
-            'state': task.state,
+            'state': state,
             'status': 'Task failed',
-            'error': str(task.info)
+            'error': str(info)
         }
-    return jsonify(response)
+    return response
+
+@app.route('/status/<task_id>')
+def task_status(task_id):
+    """Endpoint for the frontend to poll the status of a background task."""
+    state, info = task_states.get_state(celery_app.backend, task_id)
+    return jsonify(_status_payload(state, info))
+
+@app.route('/status', methods=['GET', 'POST'])
+def batch_task_status():
+    """
+    Status of many tasks in one request: ?ids=a,b,c or a JSON body {"task_ids": [...]}.
+    Unfinished tasks are read from the backend in one round-trip.
+    """
+    if request.method == 'POST':
+        task_ids = (request.get_json(silent=True) or {}).get('task_ids') or []
+    else:
+        task_ids = [task_id for task_id in request.args.get('ids', '').split(',') if task_id]
+    if not isinstance(task_ids, list) or not all(isinstance(task_id, str) and task_id for task_id in task_ids):
+        return jsonify({'error': 'task_ids must be a list of task IDs.'}), 400
+    if not task_ids:
+        return jsonify({'error': 'No task IDs provided.'}), 400
+    if len(task_ids) > STATUS_BATCH_MAX_TASKS:
+        return jsonify({'error': f'At most {STATUS_BATCH_MAX_TASKS} task IDs per request.'}), 400
+    states = task_states.get_states(celery_app.backend, task_ids)
+    return jsonify({task_id: _status_payload(*states[task_id]) for task_id in task_ids})
+
+@app.route('/events/<task_id>')
+def task_events(task_id):
+    """
+    Server-sent event stream of a task's state. Updates come from the process-wide
+    subscription to the result backend, so an open stream does no polling of its own.
+    """
+    try:
+        watcher = progress_events.get_listener(celery_app.backend).watch(task_id)
+    except Exception as e:
+        app.logger.error(f"Progress events unavailable: {e}")
+        return jsonify({'error': 'Progress events unavailable.'}), 503
+
+    def stream():
+        try:
+            # Read the current state after subscribing so no update can slip between the two
+            state, info = task_states.get_state(celery_app.backend, task_id)
+            deadline = time.monotonic() + EVENT_STREAM_MAX_SECONDS
+            while True:
+                if state is not None:
+                    yield f"data: {json.dumps(_status_payload(state, info))}\n\n"
+                    if state in progress_events.TERMINAL_STATES:
+                        return
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return
+                try:
+                    update = watcher.get(timeout=min(EVENT_STREAM_KEEPALIVE_SECONDS, remaining))
+                except queue.Empty:
+                    state = None
+                    yield ": keepalive\n\n"
+                    continue
+                if update is None:
+                    return
+                state, info = update
+                task_states.remember(task_id, state, info)
+        finally:
+            progress_events.get_listener(celery_app.backend).unwatch(task_id, watcher)
+
+    response = Response(stream(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
 
 
 def cleanup_old_files():
-    with app.app_context():
-        app.logger.info("--- Running scheduled cleanup for old GIFs ---")
-        now = time.time()
-        twenty_four_hours_ago = now - 86400
-        # This now correctly cleans up /tmp
-        folder_path = app.config['GIF_FOLDER']
+    """Removes this host's expired temp files and stale handoffs; one process per host does the work."""
+    with app.app_context(), expiry_index.host_lock('local-cleanup') as elected:
+        if not elected:
+            return
         try:
-            for filename in os.listdir(folder_path):
-                file_path = os.path.join(folder_path, filename)
-                if os.path.isfile(file_path):
-                    if os.path.getmtime(file_path) < twenty_four_hours_ago:
-                        os.remove(file_path)
-                        app.logger.info(f"Deleted old GIF: {filename}")
+            removed = expiry_index.expire_local_files()
+            if removed:
+                app.logger.info(f"Deleted {removed} expired temp files")
         except Exception as e:
             app.logger.error(f"Error during cleanup: {e}")
-    app.logger.info("--- Cleanup complete ---")
-
-scheduler = BackgroundScheduler(daemon=True)
-scheduler.add_job(cleanup_old_files, 'interval', hours=24)
+        try:
+            removed = handoff.cleanup_stale()
+            if removed:
+                app.logger.info(f"Deleted {removed} stale handoff files")
+        except Exception as e:
+            app.logger.error(f"Error during handoff cleanup: {e}")
 
-def cleanup_old_gcs_gifs():
-    """Delete GIFs older than 24 hours from the GCS bucket."""
-    from google.cloud import storage
-    import datetime
-    BUCKET_NAME = "video-to-gif-cheap-us-central1"
-    try:
-        storage_client = storage.Client()
-        bucket = storage_client.bucket(BUCKET_NAME)
-        now = datetime.datetime.utcnow().replace(tzinfo=datetime.timezone.utc)
-        cutoff = now - datetime.timedelta(hours=24)
-        deleted_count = 0
-        for blob in bucket.list_blobs():
-            if blob.name.lower().endswith('.gif'):
-                if blob.time_created < cutoff:
-                    blob.delete()
-                    app.logger.info(f"Deleted old GCS GIF: {blob.name}")
-                    deleted_count += 1
-        app.logger.info(f"GCS GIF cleanup complete. Deleted {deleted_count} old GIFs.")
-    except Exception as e:
-        app.logger.error(f"Error during GCS GIF cleanup: {e}")
+_OUTPUT_EXTENSIONS = tuple(extension for extension, _ in OUTPUT_FORMATS.values())
 
-# Schedule GCS cleanup every 24 hours
-scheduler.add_job(cleanup_old_gcs_gifs, 'interval', hours=24)
+def _expiry_for_existing_object(name):
+    """Lifetime of objects stored before the expiry index existed, for its one-off backfill."""
+    if name.startswith(VIDEO_UPLOAD_GCS_PREFIX):
+        return expiry_index.UPLOAD_EXPIRY_SECONDS
+    if name.lower().endswith(_OUTPUT_EXTENSIONS) or name.startswith(PREVIEW_GCS_PREFIX):
+        return result_cache.GIF_EXPIRY_SECONDS
+    return None
 
-scheduler.start()
-atexit.register(lambda: scheduler.shutdown(wait=False))
+def cleanup_old_gcs_gifs():
+    """
+    Deletes converted GIFs, other outputs, previews and orphaned uploads whose expiry
+    has passed. Objects are indexed by expiry time when they are written, so this reads
+    only the due entries; a single process across the deployment runs it at a time.
+    """
+    with app.app_context():
+        try:
+            deleted_count = expiry_index.expire_storage(get_storage(), backfill_ttl=_expiry_for_existing_object)
+            if deleted_count:
+                app.logger.info(f"GCS cleanup complete. Deleted {deleted_count} expired objects.")
+        except Exception as e:
+            app.logger.error(f"Error during GCS GIF cleanup: {e}")
 
+def reroute_stale_handoffs():
+    """Sends jobs staged on this host that no local worker claimed, e.g. because it died, through storage."""
+    with app.app_context():
+        try:
+            rerouted = handoff.reroute_stale(_reroute_handoff)
+            if rerouted:
+                app.logger.info(f"Rerouted {rerouted} unclaimed handoff jobs through storage")
+        except Exception as e:
+            app.logger.error(f"Error rerouting stale handoffs: {e}")
+
+# One gunicorn worker per host runs the scheduler; the lock is held for the worker's lifetime,
+# so a replacement for that worker takes over if it dies
+if expiry_index.hold_host_lock('scheduler'):
+    from apscheduler.schedulers.background import BackgroundScheduler
+
+    scheduler = BackgroundScheduler(daemon=True)
+    # Both jobs only touch due entries, so they can run often
+    scheduler.add_job(cleanup_old_files, 'interval', minutes=EXPIRY_SWEEP_MINUTES)
+    scheduler.add_job(cleanup_old_gcs_gifs, 'interval', minutes=EXPIRY_SWEEP_MINUTES)
+    if handoff.HANDOFF_ENABLED:
+        scheduler.add_job(reroute_stale_handoffs, 'interval', minutes=1)
+
+    scheduler.start()
+    atexit.register(lambda: scheduler.shutdown(wait=False))
+
+
+_download_session = None
+
+def _get_download_session():
+    """One pooled HTTP session per process for fetching GIFs from signed URLs."""
+    global _download_session
+    if _download_session is None:
+        from requests.adapters import HTTPAdapter
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=DOWNLOAD_POOL_SIZE, pool_maxsize=DOWNLOAD_POOL_SIZE)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        _download_session = session
+    return _download_session
 
 @app.route('/download_gif/<string:filename>')
 def download_gif(filename):
     """
-    Downloads a file from GCS and serves it to the user.
-    This acts as a proxy to enforce the download.
+    Serves a GIF as an attachment. By default the bytes are streamed from a signed
+    URL in fixed-size chunks, passing Range and conditional requests through, so a
+    download costs constant memory here; DOWNLOAD_MODE=redirect hands the client
+    the signed URL instead.
     """
-    # Generate a signed URL for the object in the bucket (valid for 10 minutes)
+    disposition = f'attachment; filename="{filename}"'
+    mimetype = output_mimetype(filename)
     try:
-        storage_client = storage.Client()
-        bucket = storage_client.bucket(BUCKET_NAME)
-        blob = bucket.blob(filename)
-        signed_url = blob.generate_signed_url(version="v4", expiration=600, method="GET")
-
-        # Fetch the file content from the signed URL
-        r = requests.get(signed_url, stream=True)
-
-        # Check if the request to GCS was successful
-        if r.status_code != 200:
+        storage_backend = get_storage()
+        local_path = storage_backend.local_path(filename)
+        if local_path is not None:
+            # Local storage stand-in: serve straight from disk
+            if not os.path.isfile(local_path):
+                return "File not found or error fetching file.", 404
+            return send_file(local_path, mimetype=mimetype, as_attachment=True, download_name=filename,
+                             conditional=True)
+
+        if DOWNLOAD_MODE == 'redirect':
+            signed_url = storage_backend.signed_url(
+                filename, expiration=DOWNLOAD_SIGNED_URL_SECONDS,
+                response_disposition=disposition, response_type=mimetype,
+            )
+            return redirect(signed_url, code=302)
+
+        signed_url = storage_backend.signed_url(filename, expiration=DOWNLOAD_SIGNED_URL_SECONDS)
+        forwarded = {name: request.headers[name] for name in _DOWNLOAD_REQUEST_HEADERS if name in request.headers}
+        r = _get_download_session().get(signed_url, headers=forwarded, stream=True, timeout=(5, 60))
+
+        if r.status_code not in (200, 206, 304, 416):
+            r.close()
             return "File not found or error fetching file.", 404
 
-        # Create a Flask response object with the file content
-        return Response(
-            r.content,
-            mimetype='image/gif',
-            headers={'Content-Disposition': f'attachment; filename={filename}'}
+        headers = {name: r.headers[name] for name in _DOWNLOAD_RESPONSE_HEADERS if name in r.headers}
+        headers['Content-Disposition'] = disposition
+        if r.status_code in (304, 416):
+            r.close()
+            return Response(status=r.status_code, headers=headers)
+
+        response = Response(
+            r.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE),
+            status=r.status_code,
+            mimetype=mimetype,
+            headers=headers,
         )
+        # Return the pooled connection even if the client disconnects mid-transfer. Not with
+        # direct_passthrough: Werkzeug then hands the bare iterator to the server and never calls this
+        response.call_on_close(r.close)
+        return response
     except Exception as e:
         app.logger.error(f"Error during download proxy: {e}")
         return "An error occurred.", 500
 
+@app.route('/storage/<path:name>')
+def serve_local_storage(name):
+    """Serves objects when the local storage stand-in is active (offline runs and benchmarks)."""
+    storage_backend = get_storage()
+    if not isinstance(storage_backend, LocalStorage):
+        abort(404)
+    try:
+        local_path = storage_backend.local_path(name)
+    except ValueError:
+        abort(404)
+    if not os.path.isfile(local_path):
+        abort(404)
+    response = make_response(send_file(local_path, conditional=True))
+    response.headers['Access-Control-Allow-Origin'] = '*'
+    return response
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """
+    Prometheus scrape target: metrics flushed by every web and worker process, plus live
+    queue depths. Requires METRICS_TOKEN as a bearer token, since it exposes internals.
+    """
+    if not metrics.METRICS_ENABLED or not METRICS_TOKEN:
+        abort(404)
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    if scheme.lower() != 'bearer' or not hmac.compare_digest(token.strip().encode(), METRICS_TOKEN.encode()):
+        response = make_response('Unauthorized.', 401)
+        response.headers['WWW-Authenticate'] = 'Bearer realm="metrics"'
+        return response
+    queues = list(task_routing.QUEUES)
+    if handoff.HANDOFF_ENABLED:
+        queues += [handoff.local_queue_name(queue) for queue in task_routing.QUEUES]
+    gauges = {}
+    try:
+        depths = metrics.queue_depths(celery_app.conf.broker_url, queues)
+        gauges['gifconv_queue_depth'] = ('Tasks waiting in each broker queue.',
+                                         {(('queue', queue),): depth for queue, depth in depths.items()})
+    except Exception as e:
+        app.logger.warning(f"Could not read queue depths: {e}")
+    try:
+        body = metrics.render(gauges)
+    except Exception as e:
+        app.logger.error(f"Could not read metrics: {e}")
+        return "Metrics are unavailable.", 503
+    return Response(body, content_type='text/plain; version=0.0.4; charset=utf-8')
+
 @app.route('/help')
 def help_page():
     return render_template('help.html')
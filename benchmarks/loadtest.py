@@ -0,0 +1,666 @@
+"""
+Load test of the HTTP API: how many concurrent uploads and status polls the web tier takes.
+
+Usage:
+    python benchmarks/loadtest.py [--users 20] [--duration 60] [--ramp-up 10] [--mix upload=3,url=1]
+                                  [--upload-sizes 1,5,20] [--poll-status] [--stub] [--stub-seconds 5]
+                                  [--gunicorn-workers 5] [--worker-class gevent] [--worker-concurrency 2]
+                                  [--output loadtest_results.json] [--baseline old.json]
+
+The harness starts a whole local stack, every part in its own process:
+  - a Redis stand-in for the broker, result backend and indexes: redis-server when it is
+    on PATH, otherwise the fakeredis package's TCP server (or --redis-url for an existing one)
+  - the Flask app under gunicorn, started like supervisord.conf starts it, with
+    --gunicorn-workers and --worker-class
+  - a Celery worker serving both queues. With --stub, a stand-in worker registers the same
+    task names and answers each one after --stub-seconds with a canned GIF, so the numbers
+    are the web tier's alone; otherwise the real worker converts
+  - a static file server, the origin for URL submissions
+Storage is the local stand-in throughout, so no GCS is needed. --target points the
+users at a running deployment instead, and nothing is started.
+
+Virtual users (--users, started over --ramp-up seconds) repeat the page's flows for
+--duration seconds, picking each one by the --mix weights:
+  upload  the page's direct upload of a video of one of --upload-sizes MB: POST /uploads,
+          PUT it in chunk_size pieces with Content-Range, then POST /uploads/<id>/complete
+          (falling back to POST /convert when the server has no direct uploads), follow
+          the task on /events/<id>, then fetch the result and, with --download-ratio,
+          /download_gif as the download button does
+  form    the same video sent as one multipart POST /convert, as API clients do
+  url     POST /upload_url and poll every 1.5s for the preview as the page does, then
+          convert the URL and follow it like an upload
+Tasks are followed over server-sent events as in browsers with EventSource, falling back to
+polling /status every 2.5s when the stream fails; --poll-status polls throughout, as script.js
+does without EventSource. Upload videos are generated once with ffmpeg and cached in --video-dir.
+
+The report gives each endpoint's requests, errors, throughput and p50/p95/p99 latency,
+and the conversions' end-to-end times. Results are saved as JSON; with --baseline each
+endpoint is compared with an earlier file, and --max-regression makes the run exit
+non-zero when any endpoint's p95 regresses by more than that percentage.
+"""
+import argparse
+import functools
+import http.server
+import importlib.util
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from urllib.parse import urlparse
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Poll intervals of static/js/script.js: pollTaskStatus and waitForPreview
+STATUS_POLL_SECONDS = 2.5
+PREVIEW_POLL_SECONDS = 1.5
+CONVERSION_FORM = {'fps': '10', 'resize': '320', 'start_time': '0', 'end_time': '3'}
+FAKE_REDIS_SERVER = (
+    "import sys\n"
+    "from fakeredis import TcpFakeServer\n"
+    "TcpFakeServer(('127.0.0.1', int(sys.argv[1])), server_type='redis').serve_forever()\n"
+)
+
+
+class Recorder:
+    """Collects request latencies per endpoint and conversion outcomes from every user thread."""
+
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+        self.statuses = {}
+        self.conversions = {'completed': [], 'failed': 0, 'abandoned': 0}
+        self._lock = threading.Lock()
+
+    def request(self, session, endpoint, method, url, stream=False, **kwargs):
+        """
+        Makes a request, recording its latency; returns the response, or None if it raised.
+        A streamed response's latency ends at its headers, and the caller reads and closes it.
+        """
+        started = time.perf_counter()
+        try:
+            response = session.request(method, url, timeout=120, stream=stream, **kwargs)
+            if not stream:
+                response.content  # the latency includes reading the body
+        except requests.RequestException:
+            response = None
+        elapsed = time.perf_counter() - started
+        status = response.status_code if response is not None else 'exception'
+        with self._lock:
+            self.latencies.setdefault(endpoint, []).append(elapsed)
+            counts = self.statuses.setdefault(endpoint, {})
+            counts[str(status)] = counts.get(str(status), 0) + 1
+            if response is None or response.status_code >= 400:
+                self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+        return response
+
+    def conversion(self, outcome, seconds=None):
+        with self._lock:
+            if outcome == 'completed':
+                self.conversions['completed'].append(seconds)
+            else:
+                self.conversions[outcome] += 1
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    return sorted_values[max(0, math.ceil(fraction * len(sorted_values)) - 1)]
+
+
+def summarize(recorder, elapsed):
+    endpoints = {}
+    for endpoint, values in sorted(recorder.latencies.items()):
+        values = sorted(values)
+        endpoints[endpoint] = {
+            'requests': len(values),
+            'errors': recorder.errors.get(endpoint, 0),
+            'statuses': recorder.statuses.get(endpoint, {}),
+            'throughput_rps': round(len(values) / elapsed, 2),
+            **{f'p{int(fraction * 100)}_ms': round(percentile(values, fraction) * 1000, 1)
+               for fraction in (0.5, 0.95, 0.99)},
+            'max_ms': round(values[-1] * 1000, 1),
+        }
+    completed = sorted(recorder.conversions['completed'])
+    conversions = {
+        'completed': len(completed),
+        'failed': recorder.conversions['failed'],
+        'abandoned': recorder.conversions['abandoned'],
+        'per_minute': round(len(completed) / elapsed * 60, 2),
+        'p50_seconds': round(percentile(completed, 0.5), 2) if completed else None,
+        'p95_seconds': round(percentile(completed, 0.95), 2) if completed else None,
+    }
+    return endpoints, conversions
+
+
+class VirtualUser(threading.Thread):
+    """One browser: runs the flows picked by the mix until the test ends, pausing between them."""
+
+    def __init__(self, base_url, recorder, mix, uploads, source_urls, args, start_delay, stop_at):
+        super().__init__(daemon=True)
+        self.base_url = base_url
+        self.recorder = recorder
+        self.mix = mix
+        self.uploads = uploads
+        self.source_urls = source_urls
+        self.args = args
+        self.start_delay = start_delay
+        self.stop_at = stop_at
+        self.session = requests.Session()
+        self.random = random.Random()
+
+    def run(self):
+        time.sleep(self.start_delay)
+        while time.monotonic() < self.stop_at:
+            flow = self.random.choices(list(self.mix), weights=list(self.mix.values()))[0]
+            getattr(self, f'_{flow}_flow')()
+            self._sleep(self.args.think_seconds * self.random.uniform(0.5, 1.5))
+
+    def _sleep(self, seconds):
+        time.sleep(max(0.0, min(seconds, self.stop_at - time.monotonic())))
+
+    def _upload_flow(self):
+        name, data = self.random.choice(list(self.uploads.values()))
+        started = time.monotonic()
+        response = self.recorder.request(self.session, 'POST /uploads', 'POST', self.base_url + '/uploads',
+                                         json={'filename': name, 'size': len(data), 'content_type': 'video/mp4'})
+        if response is not None and response.status_code in (404, 405):
+            # As uploadDirect does, servers without direct uploads take the form instead
+            self._form_flow((name, data), started)
+            return
+        if response is None or not response.ok:
+            self.recorder.conversion('failed')
+            return
+        upload = response.json()
+        for start in range(0, len(data), upload['chunk_size']):
+            end = min(start + upload['chunk_size'], len(data))
+            # Resumable sessions answer 308 until the last chunk arrives
+            chunk = self.recorder.request(self.session, 'PUT /uploads (chunk)', 'PUT', upload['upload_url'],
+                                          data=data[start:end], allow_redirects=False,
+                                          headers={'Content-Range': f'bytes {start}-{end - 1}/{len(data)}'})
+            if chunk is None or (not chunk.ok and chunk.status_code != 308):
+                self.recorder.conversion('failed')
+                return
+        response = self.recorder.request(self.session, 'POST /uploads/complete', 'POST', upload['complete_url'],
+                                         data=CONVERSION_FORM)
+        self._follow_conversion(response, started)
+
+    def _form_flow(self, upload=None, started=None):
+        name, data = upload or self.random.choice(list(self.uploads.values()))
+        started = started or time.monotonic()
+        response = self.recorder.request(self.session, 'POST /convert (upload)', 'POST', self.base_url + '/convert',
+                                         data=CONVERSION_FORM, files={'video': (name, data, 'video/mp4')})
+        self._follow_conversion(response, started)
+
+    def _url_flow(self):
+        video_url = self.random.choice(self.source_urls)
+        response = self.recorder.request(self.session, 'POST /upload_url', 'POST', self.base_url + '/upload_url',
+                                         data={'video_url': video_url})
+        if response is None or not response.ok:
+            return
+        preview = self._poll(response.json().get('task_id'), PREVIEW_POLL_SECONDS)
+        if preview is None or not preview.get('preview_url'):
+            return
+        self.recorder.request(self.session, 'GET preview', 'GET', preview['preview_url'])
+        started = time.monotonic()
+        response = self.recorder.request(self.session, 'POST /convert (url)', 'POST', self.base_url + '/convert',
+                                         data=dict(CONVERSION_FORM, video_url=video_url))
+        self._follow_conversion(response, started)
+
+    def _poll(self, task_id, interval):
+        """Polls /status until the task finishes; None if the test ends first or polling fails."""
+        deadline = time.monotonic() + self.args.task_timeout
+        while task_id and time.monotonic() < min(deadline, self.stop_at):
+            self._sleep(interval)
+            response = self.recorder.request(self.session, 'GET /status', 'GET', f'{self.base_url}/status/{task_id}')
+            if response is None or not response.ok:
+                return None
+            data = response.json()
+            if _finished(data):
+                return data
+        return None
+
+    def _watch(self, task_id):
+        """Follows /events until the task finishes, as watchTaskStatus does; polls /status if the stream fails."""
+        if not task_id or self.args.poll_status:
+            return self._poll(task_id, STATUS_POLL_SECONDS)
+        response = self.recorder.request(self.session, 'GET /events', 'GET', f'{self.base_url}/events/{task_id}',
+                                         stream=True)
+        if response is None:
+            return self._poll(task_id, STATUS_POLL_SECONDS)
+        deadline = min(time.monotonic() + self.args.task_timeout, self.stop_at)
+        try:
+            if response.ok:
+                # Keepalive comments arrive every EVENT_STREAM_KEEPALIVE_SECONDS, so the deadline is checked often
+                for line in response.iter_lines(decode_unicode=True):
+                    if time.monotonic() >= deadline:
+                        return None
+                    if line.startswith('data:'):
+                        data = json.loads(line[len('data:'):])
+                        if _finished(data):
+                            return data
+        except (requests.RequestException, ValueError):
+            pass
+        finally:
+            response.close()
+        return self._poll(task_id, STATUS_POLL_SECONDS)
+
+    def _follow_conversion(self, response, started):
+        if response is None or not response.ok:
+            self.recorder.conversion('failed')
+            return
+        result = response.json()
+        if not (result.get('cached') and result.get('gif_url')):
+            result = self._watch(result.get('task_id'))
+        if result is None:
+            self.recorder.conversion('abandoned')
+            return
+        if result.get('status') != 'SUCCESS' or not result.get('gif_url'):
+            self.recorder.conversion('failed')
+            return
+        self.recorder.conversion('completed', time.monotonic() - started)
+        self.recorder.request(self.session, 'GET result', 'GET', result['gif_url'])
+        if self.random.random() < self.args.download_ratio:
+            filename = urlparse(result['gif_url']).path.rsplit('/', 1)[-1]
+            self.recorder.request(self.session, 'GET /download_gif', 'GET', f'{self.base_url}/download_gif/{filename}')
+
+
+def _finished(status):
+    """Whether a /status or /events payload is a task's final state."""
+    return status.get('status') in ('SUCCESS', 'FAILURE') or status.get('state') in ('SUCCESS', 'FAILURE', 'REVOKED')
+
+
+def generate_upload(video_dir, size_mb):
+    """A 10s H.264 clip of about size_mb MB (grain fills the bitrate), cached in video_dir."""
+    os.makedirs(video_dir, exist_ok=True)
+    path = os.path.join(video_dir, f'upload_{size_mb:g}mb.mp4')
+    if os.path.exists(path):
+        return path
+    duration = 10
+    kbps = int(size_mb * 8 * 1024 / duration)
+    subprocess.run(['ffmpeg', '-nostdin', '-hide_banner', '-loglevel', 'error', '-y',
+                    '-f', 'lavfi', '-i', f'testsrc2=size=1280x720:rate=30:duration={duration},noise=alls=40:allf=t',
+                    '-c:v', 'libx264', '-preset', 'ultrafast', '-b:v', f'{kbps}k', '-maxrate', f'{kbps}k',
+                    '-bufsize', f'{kbps}k', '-pix_fmt', 'yuv420p', path + '.tmp.mp4'], check=True)
+    os.replace(path + '.tmp.mp4', path)
+    return path
+
+
+def generate_stub_output(video_dir, source):
+    """The GIF the stub worker hands back for every conversion: a real one, so downloads are realistic."""
+    path = os.path.join(video_dir, 'stub_output.gif')
+    if not os.path.exists(path):
+        subprocess.run(['ffmpeg', '-nostdin', '-hide_banner', '-loglevel', 'error', '-y', '-t', '3', '-i', source,
+                        '-vf', 'fps=10,scale=320:-2', path], check=True)
+    return path
+
+
+def run_stub_worker(config):
+    """Serves every queue with stand-ins for the conversion tasks, registered on the web tier's Celery app."""
+    from progress_events import ProgressReporter
+    from storage_backend import get_storage
+    import task_client
+
+    stub_seconds, stub_output = config['stub_seconds'], config['stub_output']
+
+    def convert(task, blob_name=None):
+        # Sleeps through a fake encode, publishing progress as a real conversion does
+        progress = ProgressReporter(task)
+        frames = 30
+        progress.set_stage('encoding', frames_total=frames)
+        for _ in range(frames):
+            time.sleep(stub_seconds * random.uniform(0.5, 1.5) / frames)
+            progress.advance()
+        storage = get_storage()
+        if blob_name:
+            try:
+                storage.delete(blob_name)
+            except FileNotFoundError:
+                pass
+        gif_url = storage.upload_file(stub_output, f'{uuid.uuid4().hex}.gif', content_type='image/gif')
+        return {'status': 'SUCCESS', 'gif_url': gif_url, 'width': 320, 'height': 180}
+
+    @task_client.celery_app.task(bind=True, name=task_client.CONVERT_TASK)
+    def convert_video_to_gif_task(self, gcs_video_blob_name, options, source_digest=None, handoff_ref=None):
+        return convert(self, gcs_video_blob_name)
+
+    @task_client.celery_app.task(bind=True, name=task_client.INGEST_URL_TASK)
+    def ingest_url_task(self, video_url, options, crop_reference_width=None):
+        return convert(self)
+
+    @task_client.celery_app.task(bind=True, name=task_client.FETCH_PREVIEW_TASK)
+    def fetch_preview_task(self, video_url):
+        time.sleep(stub_seconds * random.uniform(0.1, 0.3))
+        preview_url = get_storage().upload_file(stub_output, f'previews/{uuid.uuid4().hex}.gif',
+                                                content_type='image/gif')
+        return {'status': 'SUCCESS', 'preview_url': preview_url, 'sprite_url': None, 'strip_url': None}
+
+    task_client.celery_app.worker_main(['worker', '--pool', 'threads', '--concurrency', str(config['concurrency']),
+                                        '-Q', ','.join(config['queues']), '-n', 'loadtest-stub@%h',
+                                        '--loglevel', 'info', '--without-gossip', '--without-mingle'])
+
+
+class RangeRequestHandler(http.server.SimpleHTTPRequestHandler):
+    """Static files with single-range requests, which ffmpeg needs to seek in a remote video as on real hosts."""
+
+    def send_head(self):
+        self._range_length = None
+        header = self.headers.get('Range', '')
+        path = self.translate_path(self.path)
+        if not header.startswith('bytes=') or not os.path.isfile(path):
+            return super().send_head()
+        size = os.path.getsize(path)
+        first, _, last = header[len('bytes='):].split(',')[0].strip().partition('-')
+        try:
+            start, end = (int(first), int(last) if last else size - 1) if first else (size - int(last), size - 1)
+        except ValueError:
+            return super().send_head()
+        if start >= size or start > end:
+            self.send_response(416)
+            self.send_header('Content-Range', f'bytes */{size}')
+            self.end_headers()
+            return None
+        end = min(end, size - 1)
+        f = open(path, 'rb')
+        f.seek(start)
+        self.send_response(206)
+        self.send_header('Content-Type', self.guess_type(path))
+        self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+        self.send_header('Content-Length', str(end - start + 1))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.end_headers()
+        self._range_length = end - start + 1
+        return f
+
+    def copyfile(self, source, outputfile):
+        if self._range_length is None:
+            return super().copyfile(source, outputfile)
+        remaining = self._range_length
+        while remaining > 0:
+            chunk = source.read(min(64 * 1024, remaining))
+            if not chunk:
+                break
+            outputfile.write(chunk)
+            remaining -= len(chunk)
+
+
+def run_file_server(config):
+    handler = functools.partial(RangeRequestHandler, directory=config['directory'])
+    http.server.ThreadingHTTPServer(('127.0.0.1', config['port']), handler).serve_forever()
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _wait_for(check, timeout, what):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if check():
+                return
+        except (OSError, requests.RequestException):
+            pass
+        time.sleep(0.25)
+    raise RuntimeError(f"{what} did not start within {timeout}s")
+
+
+def _port_open(port):
+    with socket.create_connection(('127.0.0.1', port), timeout=1):
+        return True
+
+
+class LocalStack:
+    """Starts and stops the processes the web tier needs; each one logs to a file in scratch."""
+
+    def __init__(self, args, scratch, video_dir, stub_output):
+        self.args = args
+        self.scratch = scratch
+        self.video_dir = video_dir
+        self.stub_output = stub_output
+        self.processes = []
+
+    def _start(self, name, command, env=None):
+        log = open(os.path.join(self.scratch, f'{name}.log'), 'w')
+        process = subprocess.Popen(command, cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT,
+                                   start_new_session=True)
+        self.processes.append((name, process, log))
+        return process
+
+    def _redis_url(self):
+        if self.args.redis_url:
+            return self.args.redis_url
+        port = _free_port()
+        if shutil.which('redis-server'):
+            self._start('redis', ['redis-server', '--port', str(port), '--save', '', '--appendonly', 'no'])
+        else:
+            if importlib.util.find_spec('fakeredis') is None:
+                raise SystemExit("Needs redis-server on PATH, the fakeredis package, or --redis-url")
+            self._start('redis', [sys.executable, '-c', FAKE_REDIS_SERVER, str(port)])
+        _wait_for(lambda: _port_open(port), 15, 'Redis')
+        return f'redis://127.0.0.1:{port}/0'
+
+    def start(self):
+        """Starts the stack; returns (web base URL, origin URL for URL submissions)."""
+        web_port, files_port = _free_port(), _free_port()
+        redis_url = self._redis_url()
+        env = dict(os.environ)
+        env.update({
+            'STORAGE_BACKEND': 'local',
+            'LOCAL_STORAGE_ROOT': os.path.join(self.scratch, 'storage'),
+            'LOCAL_STORAGE_PUBLIC_URL': f'http://127.0.0.1:{web_port}/storage',
+            'CELERY_BROKER_URL': redis_url,
+            'CELERY_RESULT_BACKEND': redis_url,
+            'URL_CACHE_DIR': os.path.join(self.scratch, 'url_cache'),
+            'HOST_LOCK_DIR': self.scratch,
+            'NODE_ID': f'loadtest-{uuid.uuid4().hex[:8]}',
+        })
+        if not self.args.result_cache:
+            # Users upload the same few files, which would otherwise all be cache hits after the first
+            env['RESULT_CACHE_ENABLED'] = '0'
+        if self.args.stub:
+            # The stub serves the shared queues only
+            env['HANDOFF_ENABLED'] = '0'
+
+        self._start('files', [sys.executable, os.path.abspath(__file__), '--run-file-server',
+                              json.dumps({'directory': self.video_dir, 'port': files_port})])
+        self._start('gunicorn', [sys.executable, '-m', 'gunicorn', '--bind', f'127.0.0.1:{web_port}',
+                                 '--workers', str(self.args.gunicorn_workers),
+                                 '--worker-class', self.args.worker_class, '--timeout', '120', 'app:app'], env=env)
+        queues = ['interactive', 'bulk']
+        if self.args.stub:
+            config = {'stub_seconds': self.args.stub_seconds, 'stub_output': self.stub_output,
+                      'concurrency': self.args.worker_concurrency, 'queues': queues}
+            worker = [sys.executable, os.path.abspath(__file__), '--run-stub-worker', json.dumps(config)]
+        else:
+            worker = [sys.executable, '-m', 'celery', '-A', 'celery_tasks.celery_app', 'worker',
+                      '-Q', ','.join(queues), '--concurrency', str(self.args.worker_concurrency),
+                      '--prefetch-multiplier', '1', '-O', 'fair', '-n', 'loadtest@%h', '--loglevel', 'info']
+        self._start('worker', worker, env=env)
+
+        base_url = f'http://127.0.0.1:{web_port}'
+        _wait_for(lambda: requests.get(base_url + '/', timeout=5).ok, 60, 'gunicorn')
+        _wait_for(lambda: ' ready.' in self._log('worker'), 120, 'The Celery worker')
+        _wait_for(lambda: _port_open(files_port), 15, 'The file server')
+        return base_url, f'http://127.0.0.1:{files_port}'
+
+    def _log(self, name):
+        with open(os.path.join(self.scratch, f'{name}.log')) as f:
+            return f.read()
+
+    def stop(self):
+        for name, process, log in reversed(self.processes):
+            if process.poll() is None:
+                os.killpg(process.pid, signal.SIGTERM)
+                try:
+                    process.wait(timeout=15)
+                except subprocess.TimeoutExpired:
+                    os.killpg(process.pid, signal.SIGKILL)
+                    process.wait()
+            log.close()
+
+
+def parse_mix(mix):
+    weights = {}
+    for item in mix.split(','):
+        flow, _, weight = item.partition('=')
+        if flow not in ('upload', 'form', 'url'):
+            raise SystemExit(f"Unknown flow in --mix: {flow}")
+        weights[flow] = float(weight or 1)
+    return weights
+
+
+def compare(endpoints, baseline_path, max_regression):
+    """Prints per-endpoint changes against a baseline results file; returns True if any p95 regression exceeds the limit."""
+    with open(baseline_path) as f:
+        baseline = json.load(f)['endpoints']
+    print(f"\nAgainst {baseline_path}:")
+    print(f"{'endpoint':<26}{'req/s':>9}{'p50':>9}{'p95':>9}{'p99':>9}")
+    regressed = False
+
+    def change(new, old):
+        return (new - old) / old * 100 if old else 0.0
+
+    for endpoint, stats in endpoints.items():
+        old = baseline.get(endpoint)
+        if old is None:
+            continue
+        p95 = change(stats['p95_ms'], old['p95_ms'])
+        regressed = regressed or (max_regression is not None and p95 > max_regression)
+        print(f"{endpoint:<26}{change(stats['throughput_rps'], old['throughput_rps']):>+8.1f}%"
+              f"{change(stats['p50_ms'], old['p50_ms']):>+8.1f}%{p95:>+8.1f}%"
+              f"{change(stats['p99_ms'], old['p99_ms']):>+8.1f}%")
+    return regressed
+
+
+def environment_info(args):
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=ROOT).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'settings': {name: getattr(args, name) for name in
+                     ('target', 'users', 'duration', 'ramp_up', 'mix', 'upload_sizes', 'think_seconds',
+                      'download_ratio', 'poll_status', 'stub', 'stub_seconds', 'gunicorn_workers', 'worker_class',
+                      'worker_concurrency', 'result_cache')},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--duration', type=float, default=60, help='seconds of load after the ramp-up starts')
+    parser.add_argument('--ramp-up', type=float, default=10, help='seconds over which users start')
+    parser.add_argument('--mix', default='upload=3,url=1', help='flow weights')
+    parser.add_argument('--upload-sizes', default='1,5,20', help='upload video sizes in MB')
+    parser.add_argument('--think-seconds', type=float, default=5, help='mean pause between a user\'s flows')
+    parser.add_argument('--download-ratio', type=float, default=0.5, help='share of results also downloaded')
+    parser.add_argument('--task-timeout', type=float, default=300, help='seconds a user follows one task')
+    parser.add_argument('--poll-status', action='store_true', help='poll /status instead of following /events')
+    parser.add_argument('--stub', action='store_true', help='answer tasks with a stand-in instead of converting')
+    parser.add_argument('--stub-seconds', type=float, default=5, help='mean time a stubbed conversion takes')
+    parser.add_argument('--gunicorn-workers', type=int, default=5)
+    parser.add_argument('--worker-class', default='gevent')
+    parser.add_argument('--worker-concurrency', type=int, default=2, help='Celery worker processes (threads with --stub)')
+    parser.add_argument('--result-cache', action='store_true', help='keep the result cache on')
+    parser.add_argument('--redis-url', help='use this Redis instead of starting a stand-in')
+    parser.add_argument('--target', help='load this running deployment instead of starting a local stack')
+    parser.add_argument('--video-dir', default=os.path.join(tempfile.gettempdir(), 'loadtest_videos'))
+    parser.add_argument('--keep-logs', action='store_true', help='keep the scratch directory with every process log')
+    parser.add_argument('--output', default='loadtest_results.json')
+    parser.add_argument('--baseline')
+    parser.add_argument('--max-regression', type=float, help='fail when an endpoint\'s p95 regresses by more than this %%')
+    parser.add_argument('--run-stub-worker', help=argparse.SUPPRESS)
+    parser.add_argument('--run-file-server', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_stub_worker:
+        run_stub_worker(json.loads(args.run_stub_worker))
+        return
+    if args.run_file_server:
+        run_file_server(json.loads(args.run_file_server))
+        return
+
+    mix = parse_mix(args.mix)
+    sizes = [float(size) for size in args.upload_sizes.split(',')]
+    paths = {size: generate_upload(args.video_dir, size) for size in sizes}
+    uploads = {}
+    for size, path in paths.items():
+        with open(path, 'rb') as f:
+            uploads[size] = (os.path.basename(path), f.read())
+    print('Uploads: ' + ', '.join(f'{name} {len(data) / 1048576:.1f} MB' for name, data in uploads.values()))
+
+    scratch = tempfile.mkdtemp(prefix='loadtest_')
+    stack = None
+    try:
+        if args.target:
+            base_url = args.target.rstrip('/')
+            # A remote deployment cannot reach this machine's files; URL flows need a public origin
+            source_origin = None
+            mix.pop('url', None)
+            if not mix:
+                raise SystemExit("--target only supports the upload and form flows")
+        else:
+            stack = LocalStack(args, scratch, args.video_dir, generate_stub_output(args.video_dir, paths[min(sizes)]))
+            base_url, source_origin = stack.start()
+            print(f"Started the local stack at {base_url} ({args.gunicorn_workers} {args.worker_class} workers, "
+                  f"{'stubbed' if args.stub else 'real'} conversions); logs in {scratch}")
+        source_urls = [f'{source_origin}/{name}' for name, _ in uploads.values()] if source_origin else []
+
+        recorder = Recorder()
+        started = time.monotonic()
+        stop_at = started + args.duration
+        users = [VirtualUser(base_url, recorder, mix, uploads, source_urls, args,
+                             args.ramp_up * index / max(args.users, 1), stop_at) for index in range(args.users)]
+        for user in users:
+            user.start()
+        for user in users:
+            # Requests in flight when the time is up are allowed to finish
+            user.join(timeout=max(0.0, stop_at - time.monotonic()) + 130)
+        elapsed = time.monotonic() - started
+    finally:
+        if stack is not None:
+            stack.stop()
+        if not args.keep_logs:
+            shutil.rmtree(scratch, ignore_errors=True)
+
+    endpoints, conversions = summarize(recorder, elapsed)
+    print(f"\n{'endpoint':<26}{'requests':>9}{'errors':>8}{'req/s':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}")
+    for endpoint, stats in endpoints.items():
+        print(f"{endpoint:<26}{stats['requests']:>9}{stats['errors']:>8}{stats['throughput_rps']:>8.2f}"
+              f"{stats['p50_ms']:>9.1f}{stats['p95_ms']:>9.1f}{stats['p99_ms']:>9.1f}{stats['max_ms']:>9.1f}")
+    print(f"\nConversions: {conversions['completed']} completed ({conversions['per_minute']}/min), "
+          f"{conversions['failed']} failed, {conversions['abandoned']} unfinished at the end; "
+          f"end to end p50 {conversions['p50_seconds']}s, p95 {conversions['p95_seconds']}s")
+
+    with open(args.output, 'w') as f:
+        json.dump({'environment': environment_info(args), 'elapsed_seconds': round(elapsed, 2),
+                   'endpoints': endpoints, 'conversions': conversions}, f, indent=2)
+    print(f"\nWrote results to {args.output}")
+    if args.baseline and compare(endpoints, args.baseline, args.max_regression):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,355 @@
+"""
+Offline benchmark of convert_video_to_gif_task, end to end and stage by stage.
+
+Usage:
+    python benchmarks/pipeline_bench.py [--resolutions 640x360,1280x720] [--durations 5] [--motion static,medium,high]
+                                        [--codecs h264] [--matrix quick|full] [--modes e2e,stages]
+                                        [--repeat 1] [--output results.json] [--baseline old.json]
+
+Synthetic source videos are generated with ffmpeg test sources and cached in --video-dir:
+  motion  static = SMPTE bars, medium = testsrc2's moving patterns, high = testsrc2 with
+          per-frame grain, so every pixel changes between frames
+  codecs  h264, hevc, mpeg4 (in .mp4 with AAC audio) and vp9 (in .webm with Opus audio)
+
+Option combinations (fps, resize, speed, crop, overlay) are the baseline plus one change
+at a time with --matrix quick, or every combination with --matrix full.
+
+Each case runs in a fresh Python process. It uses the local storage stand-in and calls the
+task eagerly with an in-memory result backend, so no broker, Redis or GCS is needed.
+  e2e     runs the task as a worker would: storage download, conversion, upload
+  stages  calls the same stages directly and records the time spent in each one
+Each case records wall time, frames/sec, peak RSS (of the Python process and, sampled, of
+its ffmpeg children combined) and output bytes. DECODE_ENGINE, GIF_ENCODER and the other knobs are read
+from the environment as usual.
+
+With --baseline, each case is compared with the same case in an earlier results file;
+--max-regression makes the run exit non-zero when any case's wall time regresses by more
+than that percentage.
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+RESULT_MARKER = 'PIPELINE_BENCH_RESULT '
+
+MOTION_SOURCES = {
+    'static': ('smptehdbars', ''),
+    'medium': ('testsrc2', ''),
+    'high': ('testsrc2', 'noise=alls=24:allf=t,'),
+}
+CODECS = {
+    'h264': ('.mp4', ['-c:v', 'libx264', '-preset', 'medium', '-crf', '23'], ['-c:a', 'aac']),
+    'hevc': ('.mp4', ['-c:v', 'libx265', '-preset', 'medium', '-crf', '28', '-tag:v', 'hvc1'], ['-c:a', 'aac']),
+    'mpeg4': ('.mp4', ['-c:v', 'mpeg4', '-q:v', '5'], ['-c:a', 'aac']),
+    'vp9': ('.webm', ['-c:v', 'libvpx-vp9', '-crf', '34', '-b:v', '0', '-deadline', 'realtime', '-cpu-used', '8'],
+            ['-c:a', 'libopus']),
+}
+SOURCE_FPS = 30
+
+BASE_OPTIONS = {'fps': '10', 'resize': '480', 'speed': '1.0', 'crop': 'none', 'overlay': 'none'}
+OPTION_VALUES = {
+    'fps': ['10', '15', '24'],
+    'resize': ['320', '480', 'original'],
+    'speed': ['1.0', '2.0'],
+    'crop': ['none', 'center'],
+    'overlay': ['none', 'caption'],
+}
+CAPTION_OPTIONS = {
+    'text_overlay': 'Benchmark caption that wraps onto a second line',
+    'text_size': '28',
+    'text_color': '#ffffff',
+    'text_bg_color': '#000000',
+    'text_position': 'bottom',
+    'font_style': 'Roboto',
+}
+
+
+def generate_video(video_dir, width, height, duration, motion, codec):
+    """Generates (or reuses) one synthetic source video and returns its path."""
+    extension, video_args, audio_args = CODECS[codec]
+    path = os.path.join(video_dir, f'{width}x{height}_{duration:g}s_{motion}_{codec}{extension}')
+    if os.path.exists(path):
+        return path
+    source, filters = MOTION_SOURCES[motion]
+    os.makedirs(video_dir, exist_ok=True)
+    temp_path = path + '.part' + extension
+    subprocess.run([
+        'ffmpeg', '-nostdin', '-hide_banner', '-loglevel', 'error', '-y',
+        '-f', 'lavfi', '-i', f'{source}=size={width}x{height}:rate={SOURCE_FPS}:duration={duration}',
+        '-f', 'lavfi', '-i', f'sine=frequency=440:sample_rate=48000:duration={duration}',
+        '-vf', f'{filters}format=yuv420p', *video_args, '-g', str(SOURCE_FPS * 2), *audio_args,
+        '-shortest', temp_path,
+    ], check=True)
+    os.replace(temp_path, path)
+    return path
+
+
+def option_matrix(matrix):
+    """Benchmark option sets as dicts of the OPTION_VALUES keys."""
+    if matrix == 'full':
+        keys = list(OPTION_VALUES)
+        return [dict(zip(keys, values)) for values in itertools.product(*(OPTION_VALUES[key] for key in keys))]
+    combos = [dict(BASE_OPTIONS)]
+    for key, values in OPTION_VALUES.items():
+        combos.extend(dict(BASE_OPTIONS, **{key: value}) for value in values if value != BASE_OPTIONS[key])
+    return combos
+
+
+def options_label(combo):
+    return ' '.join(f'{key}={combo[key]}' for key in OPTION_VALUES)
+
+
+def conversion_options(combo, width, height):
+    """The task options for a benchmark option set on a width x height source."""
+    options = {'start_time': 0.0, 'end_time': None, 'fps': combo['fps'], 'resize': combo['resize'],
+               'speed': combo['speed'], 'output_format': 'gif'}
+    if combo['crop'] == 'center':
+        options.update(crop_x=width // 4, crop_y=height // 4, crop_width=width // 2, crop_height=height // 2)
+    if combo['overlay'] == 'caption':
+        options.update(CAPTION_OPTIONS)
+    return options
+
+
+class ChildRssSampler:
+    """
+    Samples the combined resident memory of this process's children (the ffmpeg decoders
+    and encoders) from /proc. getrusage cannot be used: forked children inherit the
+    parent's peak. Reports None where /proc is unavailable.
+    """
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.peak_kb = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+    @property
+    def peak_mb(self):
+        return round(self.peak_kb / 1024, 1) if os.path.isdir('/proc/self') else None
+
+    def _children_rss_kb(self):
+        total = 0
+        parent = str(os.getpid())
+        for pid in os.listdir('/proc'):
+            if not pid.isdigit():
+                continue
+            try:
+                with open(f'/proc/{pid}/status') as f:
+                    fields = dict(line.split(':', 1) for line in f if ':' in line)
+            except OSError:
+                continue
+            if fields.get('PPid', '').strip() == parent and 'VmRSS' in fields:
+                total += int(fields['VmRSS'].split()[0])
+        return total
+
+    def _run(self):
+        if not os.path.isdir('/proc/self'):
+            return
+        while not self._stop.wait(self.interval):
+            self.peak_kb = max(self.peak_kb, self._children_rss_kb())
+
+
+class _NoProgress:
+    def set_stage(self, stage, frames_total=None):
+        pass
+
+    def advance(self, frames=1):
+        pass
+
+
+def run_case(case, scratch):
+    """Runs one benchmark case in this process, using scratch as storage and /tmp, and returns its measurements."""
+    os.environ.update({
+        'STORAGE_BACKEND': 'local',
+        'LOCAL_STORAGE_ROOT': os.path.join(scratch, 'storage'),
+        'CELERY_BROKER_URL': 'memory://',
+        'CELERY_RESULT_BACKEND': 'cache+memory://',
+        'RESULT_CACHE_ENABLED': '0',
+        'METRICS_ENABLED': '0',
+        'HANDOFF_ENABLED': '0',
+    })
+    import celery_tasks
+    import metrics
+    import video_pipeline
+    from storage_backend import get_storage
+
+    baseline_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    storage = get_storage()
+    options = case['options']
+    blob_name = f"video_uploads/bench_{uuid.uuid4().hex}{os.path.splitext(case['video'])[1]}"
+    storage.upload_file(case['video'], blob_name)
+    frames = video_pipeline.build_decode_plan(options, video_pipeline.probe_video(case['video']))['frame_count']
+    timings = {}
+
+    with ChildRssSampler() as sampler:
+        started = time.perf_counter()
+        if case['mode'] == 'e2e':
+            result = celery_tasks.convert_video_to_gif_task.apply(args=[blob_name, options],
+                                                                  task_id=uuid.uuid4().hex).get()
+            wall_seconds = time.perf_counter() - started
+        else:
+            local_path = os.path.join(scratch, os.path.basename(blob_name))
+            output_path = os.path.join(scratch, 'output.gif')
+            with metrics.span('download', timings):
+                storage.download_file(blob_name, local_path)
+            celery_tasks._render_gif(local_path, options, output_path, _NoProgress(), timings=timings)
+            with metrics.span('upload', timings):
+                storage.upload_file(output_path, f'bench_{uuid.uuid4().hex}.gif')
+            wall_seconds = time.perf_counter() - started
+    if case['mode'] == 'e2e':
+        if result.get('status') != 'SUCCESS':
+            raise RuntimeError(result.get('error'))
+        output_bytes = os.path.getsize(storage.local_path(result['gif_url'][len(storage.public_base_url) + 1:]))
+    else:
+        output_bytes = os.path.getsize(output_path)
+
+    return {
+        'wall_seconds': round(wall_seconds, 4),
+        'frames': frames,
+        'frames_per_second': round(frames / wall_seconds, 2) if wall_seconds else None,
+        'output_bytes': output_bytes,
+        'baseline_rss_mb': round(baseline_rss_mb, 1),
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'peak_child_rss_mb': sampler.peak_mb,
+        'stages': {stage: round(seconds, 4) for stage, seconds in timings.items()},
+    }
+
+
+def run_case_subprocess(case, timeout):
+    """Runs a case in a fresh interpreter so peak RSS belongs to that case alone."""
+    completed = subprocess.run([sys.executable, os.path.abspath(__file__), '--run-case', json.dumps(case)],
+                               capture_output=True, text=True, timeout=timeout, cwd=ROOT)
+    for line in completed.stdout.splitlines():
+        if line.startswith(RESULT_MARKER):
+            return json.loads(line[len(RESULT_MARKER):])
+    tail = (completed.stderr or completed.stdout).strip().splitlines()[-5:]
+    return {'error': '\n'.join(tail) or f'exit status {completed.returncode}'}
+
+
+def case_key(result):
+    return f"{result['video_name']} | {result['label']} | {result['mode']}"
+
+
+def compare(results, baseline_path, max_regression):
+    """Prints per-case changes against a baseline results file; returns True if any regression exceeds the limit."""
+    with open(baseline_path) as f:
+        baseline = {case_key(result): result for result in json.load(f)['results'] if 'error' not in result}
+    print(f"\nAgainst {baseline_path}:")
+    print(f"{'case':<90}{'wall':>9}{'frames/s':>10}{'bytes':>9}{'peak RSS':>10}")
+    regressed = False
+
+    def change(new, old):
+        return (new - old) / old * 100 if old else 0.0
+
+    for result in results:
+        old = baseline.get(case_key(result))
+        if old is None or 'error' in result:
+            continue
+        wall = change(result['wall_seconds'], old['wall_seconds'])
+        regressed = regressed or (max_regression is not None and wall > max_regression)
+        print(f"{case_key(result):<90}{wall:>+8.1f}%{change(result['frames_per_second'], old['frames_per_second']):>+9.1f}%"
+              f"{change(result['output_bytes'], old['output_bytes']):>+8.1f}%"
+              f"{change(result['peak_rss_mb'], old['peak_rss_mb']):>+9.1f}%")
+    return regressed
+
+
+def environment_info():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=ROOT).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'settings': {name: os.environ.get(name) for name in
+                     ('DECODE_ENGINE', 'GIF_ENCODER', 'QUANTIZER_DITHER', 'SEGMENT_WORKERS')
+                     if os.environ.get(name) is not None},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--resolutions', default='640x360,1280x720')
+    parser.add_argument('--durations', default='5')
+    parser.add_argument('--motion', default='static,medium,high')
+    parser.add_argument('--codecs', default='h264')
+    parser.add_argument('--matrix', choices=('quick', 'full'), default='quick')
+    parser.add_argument('--modes', default='e2e,stages')
+    parser.add_argument('--repeat', type=int, default=1, help='runs per case; the fastest is kept')
+    parser.add_argument('--video-dir', default=os.path.join(tempfile.gettempdir(), 'pipeline_bench_videos'))
+    parser.add_argument('--output', default='pipeline_bench_results.json')
+    parser.add_argument('--baseline')
+    parser.add_argument('--max-regression', type=float, help='fail when wall time regresses by more than this %%')
+    parser.add_argument('--timeout', type=int, default=900, help='seconds allowed per case')
+    parser.add_argument('--run-case', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_case:
+        scratch = tempfile.mkdtemp(prefix='pipeline_bench_')
+        try:
+            print(RESULT_MARKER + json.dumps(run_case(json.loads(args.run_case), scratch)))
+        finally:
+            shutil.rmtree(scratch, ignore_errors=True)
+        return
+
+    results = []
+    combos = option_matrix(args.matrix)
+    print(f"{'video':<28}{'options':<58}{'mode':<8}{'wall s':>8}{'frames/s':>10}{'bytes':>10}{'RSS MB':>8}{'ffmpeg MB':>10}")
+    for resolution, duration, motion, codec in itertools.product(
+            args.resolutions.split(','), args.durations.split(','), args.motion.split(','), args.codecs.split(',')):
+        width, height = (int(value) for value in resolution.split('x'))
+        video = generate_video(args.video_dir, width, height, float(duration), motion, codec)
+        video_name = os.path.splitext(os.path.basename(video))[0]
+        for combo, mode in itertools.product(combos, args.modes.split(',')):
+            case = {'video': video, 'options': conversion_options(combo, width, height), 'mode': mode}
+            runs = [run_case_subprocess(case, args.timeout) for _ in range(args.repeat)]
+            succeeded = [run for run in runs if 'error' not in run]
+            measured = min(succeeded, key=lambda run: run['wall_seconds']) if succeeded else runs[0]
+            result = dict(measured, video_name=video_name, label=options_label(combo), mode=mode,
+                          video={'width': width, 'height': height, 'duration': float(duration),
+                                 'motion': motion, 'codec': codec, 'bytes': os.path.getsize(video)},
+                          options=combo)
+            results.append(result)
+            if 'error' in result:
+                print(f"{video_name:<28}{result['label']:<58}{mode:<8} failed: {result['error']}")
+                continue
+            print(f"{video_name:<28}{result['label']:<58}{mode:<8}{result['wall_seconds']:>8.2f}"
+                  f"{result['frames_per_second']:>10.1f}{result['output_bytes']:>10}{result['peak_rss_mb']:>8.0f}"
+                  f"{result['peak_child_rss_mb'] or 0:>10.0f}")
+            if result['stages']:
+                print(' ' * 28 + ', '.join(f'{stage} {seconds:.3f}s' for stage, seconds in result['stages'].items()))
+
+    with open(args.output, 'w') as f:
+        json.dump({'environment': environment_info(), 'results': results}, f, indent=2)
+    print(f"\nWrote {len(results)} results to {args.output}")
+    if args.baseline and compare(results, args.baseline, args.max_regression):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
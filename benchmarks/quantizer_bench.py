@@ -0,0 +1,99 @@
+"""
+Micro-benchmark: in-process NumPy GIF quantizer vs. the imageio path behind MoviePy's write_gif.
+
+Usage:
+    python benchmarks/quantizer_bench.py [--video path.mp4] [--width 480] [--fps 10] [--seconds 5]
+
+Without --video, synthetic frames (gradient background with moving shapes) are used.
+Reports encode frames/sec, bytes/frame and PSNR against the source frames.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image, ImageSequence
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import gif_encoder  # noqa: E402
+import video_pipeline  # noqa: E402
+
+
+def synthetic_frames(width, height, count):
+    """Gradient background with a few moving discs, roughly like screen or camera content."""
+    yy, xx = np.mgrid[0:height, 0:width].astype(np.float32)
+    background = np.stack([xx / width * 255, yy / height * 255, np.full_like(xx, 96)], axis=-1)
+    frames = []
+    for i in range(count):
+        frame = background.copy()
+        for k, colour in enumerate(([255, 64, 64], [64, 255, 64], [64, 64, 255])):
+            cx = (width * (0.2 + 0.3 * k) + i * (3 + k)) % width
+            cy = height / 2 + np.sin(i / 8.0 + k) * height / 4
+            mask = (xx - cx) ** 2 + (yy - cy) ** 2 < (height / 8) ** 2
+            frame[mask] = colour
+        frames.append(frame.astype(np.uint8))
+    return frames
+
+
+def video_frames(path, width, fps, seconds):
+    plan = video_pipeline.build_decode_plan(
+        {'start_time': 0, 'end_time': seconds, 'fps': fps, 'resize': width}, video_pipeline.probe_video(path)
+    )
+    return list(video_pipeline.iter_frames(path, plan))
+
+
+def psnr(path, frames):
+    decoded = [np.asarray(frame.convert('RGB'), dtype=np.float32) for frame in ImageSequence.Iterator(Image.open(path))]
+    count = min(len(decoded), len(frames))
+    mse = np.mean([np.mean((decoded[i] - frames[i].astype(np.float32)) ** 2) for i in range(count)])
+    return 10 * np.log10(255.0 ** 2 / max(mse, 1e-9))
+
+
+def encode_imageio(frames, path, fps):
+    from moviepy import ImageSequenceClip
+    ImageSequenceClip(frames, fps=fps).write_gif(path, fps=fps, logger=None)
+
+
+def encode_with(name, frames, path, fps):
+    height, width = frames[0].shape[:2]
+    encoder = gif_encoder.create_encoder(name, path, width, height, fps)
+    for frame in frames:
+        encoder.write_frame(frame)
+    encoder.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--video')
+    parser.add_argument('--width', type=int, default=480)
+    parser.add_argument('--height', type=int, default=270)
+    parser.add_argument('--fps', type=int, default=10)
+    parser.add_argument('--seconds', type=float, default=5.0)
+    parser.add_argument('--encoders', default='imageio,numpy,ffmpeg')
+    args = parser.parse_args()
+
+    if args.video:
+        frames = video_frames(args.video, args.width, args.fps, args.seconds)
+    else:
+        frames = synthetic_frames(args.width, args.height, int(args.seconds * args.fps))
+    print(f"{len(frames)} frames of {frames[0].shape[1]}x{frames[0].shape[0]}")
+    print(f"{'encoder':<10}{'frames/s':>10}{'bytes/frame':>14}{'PSNR dB':>10}")
+
+    with tempfile.TemporaryDirectory() as scratch:
+        for name in args.encoders.split(','):
+            path = os.path.join(scratch, f"{name}.gif")
+            start = time.perf_counter()
+            if name == 'imageio':
+                encode_imageio(frames, path, args.fps)
+            else:
+                encode_with(name, frames, path, args.fps)
+            elapsed = time.perf_counter() - start
+            size = os.path.getsize(path)
+            print(f"{name:<10}{len(frames) / elapsed:>10.1f}{size / len(frames):>14.0f}{psnr(path, frames):>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
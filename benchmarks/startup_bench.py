@@ -0,0 +1,204 @@
+"""
+Cold-start benchmark of the web tier and the workers: import time and memory.
+
+Usage:
+    python benchmarks/startup_bench.py [--targets web,worker,worker-warm] [--repeat 5] [--top 10]
+                                       [--output startup_results.json] [--baseline old.json]
+
+Each target starts in a fresh interpreter, --repeat times, and the median run is reported:
+  web          import app, as every gunicorn worker does when it boots
+  worker       import celery_tasks, as a Celery worker does before it forks
+  worker-warm  the worker import plus its worker_init warmup, i.e. everything a forked
+               child inherits before its first task
+Each run records the import time, the process's RSS once it is done (VmRSS) and its peak
+(VmHWM), plus the wall time of the whole interpreter from spawn to exit. The report also
+lists which of the heavy media modules the target loaded and, from one extra run under
+python -X importtime, its slowest imports by cumulative time.
+
+Runs use the local storage stand-in and an in-memory broker, so no Redis or GCS is needed.
+With --baseline, each target is compared with the same target in an earlier results file;
+--max-regression makes the run exit non-zero when any target's import time regresses by
+more than that percentage.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+RESULT_MARKER = 'STARTUP_BENCH_RESULT '
+TARGETS = ('web', 'worker', 'worker-warm')
+# Media-stack modules the web tier should never need
+HEAVY_MODULES = ('numpy', 'PIL', 'moviepy', 'imageio', 'yt_dlp', 'matplotlib', 'google.cloud.storage',
+                 'celery_tasks')
+
+
+def _status_kb(field):
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith(field + ':'):
+                return int(line.split()[1])
+    return 0
+
+
+def run_target(target):
+    """Starts one target in this (fresh) process and returns its measurements."""
+    started = time.perf_counter()
+    if target == 'web':
+        import app
+    else:
+        import celery_tasks
+        if target == 'worker-warm':
+            celery_tasks._warm_worker()
+    import_seconds = time.perf_counter() - started
+    return {
+        'import_seconds': round(import_seconds, 4),
+        'rss_mb': round(_status_kb('VmRSS') / 1024, 1),
+        'peak_rss_mb': round(_status_kb('VmHWM') / 1024, 1),
+        'modules': len(sys.modules),
+        'heavy_modules': [name for name in HEAVY_MODULES if name in sys.modules],
+    }
+
+
+def _environment(scratch):
+    env = dict(os.environ)
+    env.update({
+        'STORAGE_BACKEND': 'local',
+        'LOCAL_STORAGE_ROOT': os.path.join(scratch, 'storage'),
+        'CELERY_BROKER_URL': 'memory://',
+        'CELERY_RESULT_BACKEND': 'cache+memory://',
+        'METRICS_ENABLED': '0',
+        'HANDOFF_ENABLED': '0',
+        # Every run elects itself scheduler, as the first gunicorn worker on a host does
+        'HOST_LOCK_DIR': scratch,
+    })
+    return env
+
+
+def run_target_subprocess(target, scratch, timeout, importtime=False):
+    """Runs a target in a fresh interpreter; returns its measurements, or its -X importtime log."""
+    command = [sys.executable]
+    if importtime:
+        command += ['-X', 'importtime']
+    command += [os.path.abspath(__file__), '--run-target', target]
+    started = time.perf_counter()
+    completed = subprocess.run(command, capture_output=True, text=True, timeout=timeout, cwd=ROOT,
+                               env=_environment(scratch))
+    process_seconds = time.perf_counter() - started
+    if importtime:
+        return completed.stderr
+    for line in completed.stdout.splitlines():
+        if line.startswith(RESULT_MARKER):
+            return dict(json.loads(line[len(RESULT_MARKER):]), process_seconds=round(process_seconds, 4))
+    tail = (completed.stderr or completed.stdout).strip().splitlines()[-5:]
+    return {'error': '\n'.join(tail) or f'exit status {completed.returncode}'}
+
+
+def slowest_imports(importtime_log, top):
+    """(module, cumulative seconds) of the slowest top-level and nested imports in a -X importtime log."""
+    imports = []
+    for line in importtime_log.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        imports.append((name.strip(), int(cumulative) / 1e6))
+    return [(name, round(seconds, 4)) for name, seconds in sorted(imports, key=lambda item: -item[1])[:top]]
+
+
+def compare(results, baseline_path, max_regression):
+    """Prints per-target changes against a baseline results file; returns True if any regression exceeds the limit."""
+    with open(baseline_path) as f:
+        baseline = {result['target']: result for result in json.load(f)['results'] if 'error' not in result}
+    print(f"\nAgainst {baseline_path}:")
+    print(f"{'target':<14}{'import':>9}{'process':>9}{'RSS':>9}{'peak RSS':>10}")
+    regressed = False
+
+    def change(new, old):
+        return (new - old) / old * 100 if old else 0.0
+
+    for result in results:
+        old = baseline.get(result['target'])
+        if old is None or 'error' in result:
+            continue
+        import_change = change(result['import_seconds'], old['import_seconds'])
+        regressed = regressed or (max_regression is not None and import_change > max_regression)
+        print(f"{result['target']:<14}{import_change:>+8.1f}%"
+              f"{change(result['process_seconds'], old['process_seconds']):>+8.1f}%"
+              f"{change(result['rss_mb'], old['rss_mb']):>+8.1f}%"
+              f"{change(result['peak_rss_mb'], old['peak_rss_mb']):>+9.1f}%")
+    return regressed
+
+
+def environment_info():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=ROOT).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'settings': {name: os.environ.get(name) for name in ('WORKER_PRELOAD_MODULES', 'DECODE_ENGINE', 'GIF_ENCODER')
+                     if os.environ.get(name) is not None},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--targets', default=','.join(TARGETS))
+    parser.add_argument('--repeat', type=int, default=5, help='runs per target; the median is kept')
+    parser.add_argument('--top', type=int, default=10, help='slowest imports listed per target')
+    parser.add_argument('--output', default='startup_bench_results.json')
+    parser.add_argument('--baseline')
+    parser.add_argument('--max-regression', type=float, help='fail when import time regresses by more than this %%')
+    parser.add_argument('--timeout', type=int, default=120, help='seconds allowed per run')
+    parser.add_argument('--run-target', choices=TARGETS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_target:
+        print(RESULT_MARKER + json.dumps(run_target(args.run_target)))
+        return
+
+    results = []
+    print(f"{'target':<14}{'import s':>10}{'process s':>11}{'RSS MB':>8}{'peak MB':>9}{'modules':>9}  heavy modules")
+    for target in args.targets.split(','):
+        scratch = tempfile.mkdtemp(prefix='startup_bench_')
+        try:
+            runs = [run_target_subprocess(target, scratch, args.timeout) for _ in range(args.repeat)]
+            succeeded = sorted((run for run in runs if 'error' not in run), key=lambda run: run['import_seconds'])
+            if not succeeded:
+                results.append(dict(runs[0], target=target))
+                print(f"{target:<14} failed: {runs[0]['error']}")
+                continue
+            result = dict(succeeded[len(succeeded) // 2], target=target,
+                          import_seconds_runs=[run['import_seconds'] for run in succeeded],
+                          process_seconds=round(statistics.median(run['process_seconds'] for run in succeeded), 4),
+                          slowest_imports=slowest_imports(
+                              run_target_subprocess(target, scratch, args.timeout, importtime=True), args.top))
+        finally:
+            shutil.rmtree(scratch, ignore_errors=True)
+        results.append(result)
+        print(f"{target:<14}{result['import_seconds']:>10.3f}{result['process_seconds']:>11.3f}{result['rss_mb']:>8.0f}"
+              f"{result['peak_rss_mb']:>9.0f}{result['modules']:>9}  {', '.join(result['heavy_modules']) or '-'}")
+        print(' ' * 14 + ', '.join(f'{name} {seconds:.3f}s' for name, seconds in result['slowest_imports']))
+
+    with open(args.output, 'w') as f:
+        json.dump({'environment': environment_info(), 'results': results}, f, indent=2)
+    print(f"\nWrote {len(results)} results to {args.output}")
+    if args.baseline and compare(results, args.baseline, args.max_regression):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,30 +1,167 @@
 # In celery_tasks.py
 import os
+import json
+import shutil
+import mimetypes
+import time
+import importlib
+import threading
 import traceback # Import traceback
-from celery import Celery
-from moviepy import VideoFileClip, vfx, TextClip, CompositeVideoClip
-from google.cloud import storage
-from PIL import ImageFont # For checking font existence with Pillow
+from celery.canvas import Signature
+from celery.exceptions import Ignore, SoftTimeLimitExceeded
+from celery.signals import (celeryd_after_setup, worker_init, worker_process_init, worker_ready, worker_shutdown,
+                            task_prerun, task_postrun)
+import storage_backend
+from storage_backend import get_storage
+import result_cache
+import handoff
+import task_routing
+import video_pipeline
+import gif_encoder
+import animation_encoder
+import parallel_encoder
+import size_predictor
+import variant_fanout
+import preview_assets
+import admission
+import url_ingest
+import metrics
+import expiry_index
+from progress_events import ProgressReporter
+from conversion_options import normalize_options, output_mimetype, OUTPUT_FORMATS
+import font_index
+import text_overlay
+import task_client
+from task_client import celery_app
 
 
-# --- Configuration ---
-BUCKET_NAME = "video-to-gif-cheap-us-central1"  # Updated to use single-region, low-cost bucket
+DECODE_ENGINE = os.environ.get('DECODE_ENGINE', 'ffmpeg')  # 'ffmpeg' filter graph or legacy 'moviepy'
+GIF_ENCODER = os.environ.get('GIF_ENCODER', 'ffmpeg')  # 'ffmpeg' two-pass palette, in-process 'numpy', or legacy 'imageio'
+# Full encodes allowed when a conversion has a target size and the first one misses it
+TARGET_MAX_ATTEMPTS = int(os.environ.get('TARGET_MAX_ATTEMPTS', 2))
+# Storage prefixes for videos fetched from URLs (same as the web tier's uploads) and their previews
+VIDEO_UPLOAD_PREFIX = 'video_uploads/'
+PREVIEW_PREFIX = 'previews/'
+# Imported by the worker's parent process before it forks; celery_tasks itself imports them lazily
+# (moviepy backs the clip wrappers; yt_dlp is only needed by URL jobs)
+WORKER_PRELOAD_MODULES = [name for name in os.environ.get('WORKER_PRELOAD_MODULES', 'moviepy,yt_dlp').split(',') if name]
+# The worker's parent process sweeps this host's expired temp files this often, as the web tier's
+# scheduler does, so hosts without a web process (or whose scheduler is down) are swept too
+LOCAL_SWEEP_SECONDS = int(os.environ.get('EXPIRY_SWEEP_MINUTES', 10)) * 60
 
-celery_app = Celery(
-    'tasks',
-    broker=os.environ.get('CELERY_BROKER_URL', 'redis://localhost:6379/0'),
-    backend=os.environ.get('CELERY_RESULT_BACKEND', 'redis://localhost:6379/0')
-)
+_sweep_stopped = threading.Event()
+
+@celeryd_after_setup.connect
+def _consume_handoff_queues(sender, instance, **kwargs):
+    """Also consume this host's handoff variant of each conversion queue, where the co-located web process routes staged uploads."""
+    if handoff.HANDOFF_ENABLED:
+        for queue in list(instance.app.amqp.queues.consume_from):
+            if queue in task_routing.QUEUES:
+                instance.app.amqp.queues.select_add(handoff.local_queue_name(queue))
+
+@worker_init.connect
+def _warm_worker(**kwargs):
+    """
+    Does the one-off work of a conversion in the parent process, so forked children
+    inherit it rather than each paying for it on their first task: the lazily imported
+    modules, yt-dlp's URL patterns, the font index and a probe of ffmpeg's encoders.
+    """
+    started = time.perf_counter()
+    for module_name in WORKER_PRELOAD_MODULES:
+        try:
+            importlib.import_module(module_name)
+        except ImportError as e:
+            print(f"[WARNING] Could not preload {module_name}: {e}")
+    storage_backend.preload()
+    url_ingest.warm_up()
+    print(f"Indexed {len(font_index.get_index())} font names")
+    try:
+        encoders = video_pipeline.ffmpeg_encoders()
+        missing = [output_format for output_format, encoder in animation_encoder.FORMAT_ENCODERS.items()
+                   if encoder not in encoders]
+        if missing:
+            print(f"[WARNING] ffmpeg cannot encode {', '.join(missing)}; those conversions will fail")
+    except Exception as e:
+        print(f"[WARNING] Could not probe ffmpeg's encoders: {e}")
+    print(f"Worker warmed up in {time.perf_counter() - started:.2f}s")
+
+@worker_process_init.connect
+def _connect_child(**kwargs):
+    """Builds each child's storage client (clients cannot cross a fork) in the background, before its first task."""
+    def connect():
+        try:
+            storage_backend.connect()
+        except Exception as e:
+            print(f"[WARNING] Could not connect to storage: {e}")
+    # worker_process_init handlers must return within seconds, so the connection is not awaited
+    threading.Thread(target=connect, daemon=True).start()
+
+@worker_ready.connect
+def _advertise_handoff(sender, **kwargs):
+    if handoff.HANDOFF_ENABLED:
+        handoff.mark_worker_alive(sender.app.amqp.queues.consume_from)
+
+def sweep_local_files():
+    """Removes this host's expired temp files and stale handoffs, unless another process on the host is already at it."""
+    with expiry_index.host_lock('local-cleanup') as elected:
+        if not elected:
+            return
+        try:
+            removed = expiry_index.expire_local_files()
+            if removed:
+                print(f"Deleted {removed} expired temp files")
+        except Exception as e:
+            print(f"Error during local cleanup: {e}")
+        try:
+            removed = handoff.cleanup_stale()
+            if removed:
+                print(f"Deleted {removed} stale handoff files")
+        except Exception as e:
+            print(f"Error during handoff cleanup: {e}")
+
+@worker_ready.connect
+def _start_local_sweep(sender, **kwargs):
+    """Sweeps in a thread of the parent process, which outlives the children that write the temp files."""
+    def run():
+        while not _sweep_stopped.wait(LOCAL_SWEEP_SECONDS):
+            sweep_local_files()
+    threading.Thread(target=run, name='local-sweep', daemon=True).start()
+
+@worker_shutdown.connect
+def _withdraw_handoff(sender, **kwargs):
+    if handoff.HANDOFF_ENABLED:
+        handoff.mark_worker_stopped()
+    _sweep_stopped.set()
+    metrics.flush()
+
+@task_prerun.connect
+def _start_task_clock(task_id=None, task=None, **kwargs):
+    task.request.started_at = time.monotonic()
+    enqueued_at = getattr(task.request, 'enqueued_at', None)
+    if enqueued_at:
+        metrics.observe('gifconv_task_queue_wait_seconds', max(0.0, time.time() - float(enqueued_at)),
+                        task=task.name, queue=(task.request.delivery_info or {}).get('routing_key') or 'unknown')
+
+@task_postrun.connect
+def _stop_task_clock(task_id=None, task=None, retval=None, state=None, **kwargs):
+    started_at = getattr(task.request, 'started_at', None)
+    if started_at is not None:
+        metrics.observe('gifconv_task_run_seconds', time.monotonic() - started_at, task=task.name)
+    # Tasks report their own failures in the result dict rather than raising
+    if isinstance(retval, dict) and retval.get('status'):
+        state = retval['status']
+    metrics.inc('gifconv_tasks_total', task=task.name, state=state or 'UNKNOWN')
+    metrics.flush()
 
 def _upload_gif_to_gcs(local_file_path, destination_blob_name):
     """Uploads a file to the bucket."""
     try:
-        storage_client = storage.Client()
-        bucket = storage_client.bucket(BUCKET_NAME)
-        blob = bucket.blob(destination_blob_name)
-        blob.upload_from_filename(local_file_path)
+        public_url = get_storage().upload_file(local_file_path, destination_blob_name,
+                                               content_type=output_mimetype(destination_blob_name))
         print(f"Successfully uploaded {local_file_path} to GCS as {destination_blob_name}")
-        return blob.public_url
+        expiry_index.register(destination_blob_name)
+        metrics.inc('gifconv_bytes_out_total', os.path.getsize(local_file_path), kind='result')
+        return public_url
     except Exception as e:
         print(f"Error uploading {local_file_path} to GCS: {e}\n{traceback.format_exc()}")
         return None
@@ -32,11 +169,9 @@ def _upload_gif_to_gcs(local_file_path, destination_blob_name):
 def _download_from_gcs(blob_name, local_destination_path):
     """Downloads a blob from GCS to a local path."""
     try:
-        storage_client = storage.Client()
-        bucket = storage_client.bucket(BUCKET_NAME)
-        blob = bucket.blob(blob_name)
-        blob.download_to_filename(local_destination_path)
+        get_storage().download_file(blob_name, local_destination_path)
         print(f"Successfully downloaded {blob_name} from GCS to {local_destination_path}")
+        metrics.inc('gifconv_bytes_in_total', os.path.getsize(local_destination_path), source='storage')
         return local_destination_path
     except Exception as e:
         print(f"Error downloading {blob_name} from GCS: {e}\n{traceback.format_exc()}")
@@ -45,240 +180,273 @@ def _download_from_gcs(blob_name, local_destination_path):
 def _delete_from_gcs(blob_name):
     """Deletes a blob from GCS."""
     try:
-        storage_client = storage.Client()
-        bucket = storage_client.bucket(BUCKET_NAME)
-        blob = bucket.blob(blob_name)
-        blob.delete()
+        get_storage().delete(blob_name)
+        expiry_index.forget(blob_name)
         print(f"Successfully deleted {blob_name} from GCS.")
     except Exception as e:
         print(f"Error deleting {blob_name} from GCS: {e}\n{traceback.format_exc()}")
 
-def get_available_font(preferred_fonts):
+def _apply_moviepy_effects(clip, options):
+    """Legacy per-frame effect chain (trim, crop, speed, resize) evaluated by MoviePy in NumPy."""
+    from moviepy import vfx
+
+    start_time_opt = options.get('start_time', 0.0)
+    end_time_opt_str = options.get('end_time')
+    resize_opt_str = options.get('resize', 'original')
+    speed_opt = options.get('speed', 1.0)
+    crop_x_opt_str = options.get('crop_x')
+    crop_y_opt_str = options.get('crop_y')
+    crop_width_opt_str = options.get('crop_width')
+    crop_height_opt_str = options.get('crop_height')
+    try:
+        start_time = float(start_time_opt)
+        if start_time < 0:
+            start_time = 0.0
+    except (ValueError, TypeError):
+        start_time = 0.0
+    end_time = clip.duration
+    if end_time_opt_str:
+        try:
+            parsed_end_time = float(end_time_opt_str)
+            if 0 < parsed_end_time <= clip.duration:
+                end_time = parsed_end_time
+        except (ValueError, TypeError):
+            pass
+    if start_time >= end_time:
+        start_time = 0.0
+        if end_time <= start_time and clip.duration > 0:
+            end_time = clip.duration
+    subclip = clip.subclipped(start_time, end_time)
+    if all(val is not None and val != '' for val in [crop_x_opt_str, crop_y_opt_str, crop_width_opt_str, crop_height_opt_str]):
+        try:
+            crop_effect = vfx.Crop(x1=int(float(crop_x_opt_str)), y1=int(float(crop_y_opt_str)), width=int(float(crop_width_opt_str)), height=int(float(crop_height_opt_str)))
+            subclip = subclip.with_effects([crop_effect])
+        except (ValueError, Exception):
+            pass
+    try:
+        actual_speed = float(speed_opt)
+        if actual_speed != 1.0 and actual_speed > 0:
+            subclip = subclip.with_speed_scaled(factor=actual_speed)
+    except (ValueError, TypeError):
+        pass
+    if resize_opt_str != 'original':
+        try:
+            resize_width = int(resize_opt_str)
+            if resize_width > 0:
+                resize_effect = vfx.Resize(width=resize_width)
+                subclip = subclip.with_effects([resize_effect])
+        except ValueError:
+            pass
+    return subclip
+
+def _apply_text_overlay(subclip, options, clock=None):
+    """Blends the optional pre-rendered text caption onto every frame of the clip, timing the blends on clock."""
+    try:
+        overlay = text_overlay.overlay_for_options(options, subclip.w, subclip.h)
+    except Exception as e:
+        print(f"[ERROR] Failed to render text overlay: {e}")
+        print(traceback.format_exc())
+        return subclip, None
+    if overlay is None:
+        return subclip, None
+    blend = overlay.blend
+    if clock is not None:
+        def blend(frame):
+            with clock:
+                return overlay.blend(frame)
+    return subclip.image_transform(blend), overlay
+
+def _encode_gif_stage(subclip, temp_gif_path, fps, progress=None, max_colors=gif_encoder.GIF_MAX_COLORS,
+                      output_format='gif', timings=None, overlay_clock=None):
     """
-    Tries to load a font from a list of preferred fonts.
-    Returns the path to the first font file that can be loaded by Pillow.
-    If no valid font file is found, falls back to a bundled DejaVuSans.ttf in the project directory.
+    Streams the clip's frames through the encoder for its output format, one frame at a time.
+    Time spent waiting on the next frame is recorded as the decode stage (decoding and the
+    effect chain), less the caption blending timed on overlay_clock; time in the encoder as encode.
     """
-    from pathlib import Path
-    # Always include a bundled fallback font (ensure this file exists in your repo)
-    bundled_font = os.path.join(os.path.dirname(__file__), "DejaVuSans.ttf")
-    font_candidates = list(preferred_fonts) + [bundled_font]
-    for font_choice in font_candidates:
-        try:
-            # If it's a font name, try to resolve to a file path using font_manager (if available)
-            if not os.path.isfile(font_choice):
-                try:
-                    from matplotlib import font_manager
-                    font_path = font_manager.findfont(font_choice, fallback_to_default=False)
-                    if os.path.isfile(font_path):
-                        font_choice = font_path
-                except Exception:
-                    pass
-            ImageFont.truetype(font_choice, size=10)
-            print(f"Font '{font_choice}' is available and will be used.")
-            return font_choice
-        except Exception as e:
-            print(f"Font '{font_choice}' not found or cannot be opened. Trying next. Error: {e}")
-    print(f"WARNING: No preferred fonts found. Falling back to bundled font: {bundled_font}")
-    return bundled_font
+    if output_format != 'gif':
+        encoder = animation_encoder.FfmpegAnimationEncoder(temp_gif_path, subclip.w, subclip.h, fps, output_format)
+    elif GIF_ENCODER == 'imageio':
+        with metrics.span('write_gif', timings):
+            subclip.write_gif(temp_gif_path, fps=fps)
+        return
+    else:
+        encoder = gif_encoder.create_encoder(GIF_ENCODER, temp_gif_path, subclip.w, subclip.h, fps,
+                                             max_colors=max_colors)
+    decode_clock, encode_clock = metrics.Stopwatch(), metrics.Stopwatch()
+    try:
+        frames = subclip.iter_frames(fps=fps, dtype='uint8')
+        while True:
+            with decode_clock:
+                frame = next(frames, None)
+            if frame is None:
+                break
+            with encode_clock:
+                encoder.write_frame(frame)
+            if progress is not None:
+                progress.advance()
+        if progress is not None:
+            progress.set_stage('finalizing')
+    except Exception:
+        encoder.abort()
+        raise
+    with metrics.span('finalize', timings):
+        encoder.close()
+    overlay_seconds = overlay_clock.seconds if overlay_clock is not None else 0.0
+    metrics.record_stage('decode', max(0.0, decode_clock.seconds - overlay_seconds), timings)
+    metrics.record_stage('encode', encode_clock.seconds, timings)
+
+def _render_gif(video_path, options, temp_gif_path, progress, max_colors=gif_encoder.GIF_MAX_COLORS, timings=None):
+    """Decodes, captions and encodes the clip into temp_gif_path in its output format; returns (width, height)."""
+    decode_plan = None
+    with metrics.span('open', timings):
+        if DECODE_ENGINE == 'moviepy':
+            from moviepy import VideoFileClip
+            source_clip = VideoFileClip(video_path)
+            subclip = _apply_moviepy_effects(source_clip, options)
+        else:
+            # Seek, trim, crop, retime, resample and scale inside one ffmpeg filter graph
+            source_clip, decode_plan = video_pipeline.open_filtered_clip(video_path, options)
+            subclip = source_clip
+            print(f"Decoding with filter graph: {video_pipeline.build_filter_graph(decode_plan)}")
+    overlay_clock = metrics.Stopwatch()
+    try:
+        with metrics.span('overlay_render', timings):
+            subclip, overlay = _apply_text_overlay(subclip, options, clock=overlay_clock)
 
-def is_imagemagick_available():
-    """Check if ImageMagick's 'convert' command is available on the system."""
-    from shutil import which
-    return which('convert') is not None
+        normalized = normalize_options(options)
+        actual_fps = normalized['fps']
+        if decode_plan is not None:
+            total_frames = decode_plan['frame_count']
+        else:
+            total_frames = int(subclip.duration * actual_fps)
+        progress.set_stage('encoding', frames_total=total_frames)
 
-@celery_app.task(bind=True)
-def convert_video_to_gif_task(self, gcs_video_blob_name, options):
+        # Long GIFs from the numpy encoder are split into segments encoded across cores; the other formats have fast single-pass encoders
+        if (normalized['output_format'] == 'gif' and decode_plan is not None
+                and parallel_encoder.should_parallelize(decode_plan, GIF_ENCODER)):
+            print(f"Encoding {decode_plan['frame_count']} frames in {parallel_encoder.SEGMENT_WORKERS} parallel segments")
+            # Segments decode and encode concurrently, so they are timed as one stage
+            with metrics.span('parallel_encode', timings):
+                parallel_encoder.encode_gif_parallel(video_path, decode_plan, temp_gif_path, max_colors=max_colors,
+                                                     on_frame=progress.advance,
+                                                     frame_filter=overlay.blend if overlay is not None else None)
+        else:
+            _encode_gif_stage(subclip, temp_gif_path, actual_fps, progress=progress, max_colors=max_colors,
+                              output_format=normalized['output_format'], timings=timings,
+                              overlay_clock=overlay_clock if overlay is not None else None)
+            if overlay is not None:
+                metrics.record_stage('overlay', overlay_clock.seconds, timings)
+        metrics.inc('gifconv_frames_encoded_total', total_frames, format=normalized['output_format'])
+        return subclip.w, subclip.h
+    finally:
+        source_clip.close()
+
+def _claim_handoff(handoff_ref, local_path):
+    """
+    Claims a staged upload for this task. Raises Ignore, so no state is stored, if the
+    job was rerouted through storage instead; the resubmitted task reports under the same ID.
+    """
+    if handoff.was_rerouted(handoff_ref):
+        raise Ignore()
+    try:
+        handoff.claim(handoff_ref, local_path)
+    except FileNotFoundError:
+        if handoff.was_rerouted(handoff_ref):
+            raise Ignore()
+        raise
+    print(f"Claimed handed-off video {handoff_ref['path']}")
+    metrics.inc('gifconv_bytes_in_total', os.path.getsize(local_path), source='handoff')
+
+@celery_app.task(bind=True, name=task_client.CONVERT_TASK)
+def convert_video_to_gif_task(self, gcs_video_blob_name, options, source_digest=None, handoff_ref=None):
     temp_gif_path = None
     local_video_path_for_worker = None
+    progress = ProgressReporter(self)
+    timings = {}
+    task_started = time.perf_counter()
+    if handoff_ref and handoff.was_rerouted(handoff_ref):
+        raise Ignore()
     try:
+        progress.set_stage('downloading')
         # Download video from GCS to worker's local /tmp
         base_video_filename = os.path.basename(gcs_video_blob_name)
         local_video_path_for_worker = os.path.join('/tmp', base_video_filename)
+        expiry_index.register_local(local_video_path_for_worker)
         
-        if not _download_from_gcs(gcs_video_blob_name, local_video_path_for_worker):
-            raise Exception(f"Failed to download video {gcs_video_blob_name} from GCS.")
+        with metrics.span('download', timings):
+            if handoff_ref:
+                # Staged on this host's disk by the web process; no storage round-trip
+                _claim_handoff(handoff_ref, local_video_path_for_worker)
+            elif not _download_from_gcs(gcs_video_blob_name, local_video_path_for_worker):
+                raise Exception(f"Failed to download video {gcs_video_blob_name} from GCS.")
+
+        # Identical source bytes and options already produced a GIF that is still live
+        with metrics.span('cache_lookup', timings):
+            if source_digest is None:
+                source_digest = result_cache.file_digest(local_video_path_for_worker)
+            cached_result = result_cache.lookup(source_digest, options)
+        if cached_result:
+            print(f"Result cache hit for {gcs_video_blob_name}, reusing {cached_result.get('gif_url')}")
+            return cached_result
 
-        unique_gif_name = os.path.splitext(base_video_filename)[0] + '.gif'
+        output_format = normalize_options(options)['output_format']
+        unique_gif_name = os.path.splitext(base_video_filename)[0] + OUTPUT_FORMATS[output_format][0]
         temp_gif_path = os.path.join('/tmp', unique_gif_name)
+        expiry_index.register_local(temp_gif_path)
 
         # --- Video processing logic using local_video_path_for_worker ---
-        with VideoFileClip(local_video_path_for_worker) as clip:
-            start_time_opt = options.get('start_time', 0.0)
-            end_time_opt_str = options.get('end_time')
-            # ... (rest of your existing video processing logic remains unchanged)
-            fps_opt = options.get('fps', 10)
-            resize_opt_str = options.get('resize', 'original')
-            speed_opt = options.get('speed', 1.0)
-            crop_x_opt_str = options.get('crop_x')
-            crop_y_opt_str = options.get('crop_y')
-            crop_width_opt_str = options.get('crop_width')
-            crop_height_opt_str = options.get('crop_height')
-            try:
-                start_time = float(start_time_opt)
-                if start_time < 0:
-                    start_time = 0.0
-            except (ValueError, TypeError):
-                start_time = 0.0
-            end_time = clip.duration
-            if end_time_opt_str:
-                try:
-                    parsed_end_time = float(end_time_opt_str)
-                    if 0 < parsed_end_time <= clip.duration:
-                        end_time = parsed_end_time
-                except (ValueError, TypeError):
-                    pass
-            if start_time >= end_time:
-                start_time = 0.0
-                if end_time <= start_time and clip.duration > 0:
-                    end_time = clip.duration
-            subclip = clip.subclipped(start_time, end_time)
-            if all(val is not None and val != '' for val in [crop_x_opt_str, crop_y_opt_str, crop_width_opt_str, crop_height_opt_str]):
-                try:
-                    crop_effect = vfx.Crop(x1=int(float(crop_x_opt_str)), y1=int(float(crop_y_opt_str)), width=int(float(crop_width_opt_str)), height=int(float(crop_height_opt_str)))
-                    subclip = subclip.with_effects([crop_effect])
-                except (ValueError, Exception):
-                    pass
-            try:
-                actual_speed = float(speed_opt)
-                if actual_speed != 1.0 and actual_speed > 0:
-                    subclip = subclip.with_speed_scaled(factor=actual_speed)
-            except (ValueError, TypeError):
-                pass
-            if resize_opt_str != 'original':
-                try:
-                    resize_width = int(resize_opt_str)
-                    if resize_width > 0:
-                        resize_effect = vfx.Resize(width=resize_width)
-                        subclip = subclip.with_effects([resize_effect])
-                except ValueError:
-                    pass
-            final_width = subclip.w
-            final_height = subclip.h
-            try:
-                actual_fps = int(fps_opt)
-                if actual_fps <= 0:
-                    actual_fps = 10
-            except (ValueError, TypeError):
-                actual_fps = 10
-            # Your video processing logic ends here
-            # =================== FIX FOR TEXT OVERLAY START ===================
-            text_overlay = options.get('text_overlay')
-            if text_overlay:
-                try:
-                    def noneify(val):
-                        if val is None:
-                            return None
-                        if isinstance(val, str) and val.strip().lower() in ('none', 'null', ''):
-                            return None
-                        return val
-                    text_font = options.get('font_style') or options.get('text_font')
-                    text_font_size = int(options.get('text_size') or options.get('text-size') or 24)
-                    text_color = options.get('text_color') or options.get('text-color') or 'white'
-                    text_bg_color = noneify(options.get('text_bg_color') or options.get('text-bg-color'))
-                    text_align = options.get('text_align') or options.get('text-align') or 'center'
-                    horizontal_align = options.get('horizontal_align') or options.get('horizontal-align') or 'center'
-                    vertical_align = options.get('vertical_align') or options.get('vertical-align') or 'center'
-                    text_position = (options.get('text_position') or options.get('text-position') or 'center').lower()
-
-                    # Map UI text position to MoviePy position tuple
-                    position_map = {
-                        'center': ('center', 'center'),
-                        'top': ('center', 'top'),
-                        'bottom': ('center', 'bottom'),
-                        'left': ('left', 'center'),
-                        'right': ('right', 'center'),
-                        'top-left': ('left', 'top'),
-                        'top-right': ('right', 'top'),
-                        'bottom-left': ('left', 'bottom'),
-                        'bottom-right': ('right', 'bottom'),
-                    }
-                    mp_position = position_map.get(text_position, ('center', 'center'))
-
-                    # Font handling: try to resolve font name to a file, fallback to bundled DejaVuSans.ttf
-                    font_preferences = []
-                    if text_font:
-                        font_preferences.append(text_font)
-                    font_preferences += [
-                        "/Library/Fonts/Roboto-Regular.ttf",
-                        "/usr/share/fonts/truetype/roboto/Roboto-Regular.ttf",
-                        "/Library/Fonts/Arial.ttf",
-                        "arial",
-                        os.path.join(os.path.dirname(__file__), "DejaVuSans.ttf"),
-                    ]
-                    font_path = get_available_font(font_preferences)
-
-                    # Use method='caption' for all overlays, with calculated size and no extra newlines
-                    method = 'caption'
-                    lines = text_overlay.count('\n') + 1
-                    # For single-line: at least 2x font size + margin; for multiline: 1.5x font size per line + margin
-                    if lines == 1:
-                        box_height = int(text_font_size * 2.2) + 12
-                    else:
-                        box_height = int(text_font_size * lines * 1.5) + 16
-                    # Cap box height to 80% of video height
-                    box_height = min(box_height, int(subclip.h * 0.8))
-                    size = (int(subclip.w * 0.96), box_height)
-                    padded_text = text_overlay  # No extra newlines
-                    print(f"[DEBUG] Text overlay: font_path={font_path}, method={method}, size={size}, position={mp_position}, vertical_align=center, bg_color={text_bg_color}")
-
-                    txt_clip = None
-                    try:
-                        if method == 'caption':
-                            txt_clip = TextClip(
-                                text=padded_text,
-                                font=font_path,
-                                font_size=text_font_size,
-                                color=text_color,
-                                bg_color=text_bg_color,
-                                method=method,
-                                size=size,
-                                text_align=text_align,
-                                horizontal_align=horizontal_align,
-                                vertical_align='center',
-                            ).with_position(mp_position).with_duration(subclip.duration)
-                        else:
-                            txt_clip = TextClip(
-                                text=padded_text,
-                                font=font_path,
-                                font_size=text_font_size,
-                                color=text_color,
-                                bg_color=text_bg_color,
-                                method=method,
-                                text_align=text_align,
-                                horizontal_align=horizontal_align,
-                                vertical_align='center',
-                            ).with_position(mp_position).with_duration(subclip.duration)
-                        subclip = CompositeVideoClip([subclip, txt_clip])
-                        print(f"[INFO] Text overlay applied successfully.")
-                    except Exception as e:
-                        print(f"[ERROR] Failed to apply text overlay: {e}")
-                        print(traceback.format_exc())
-                except Exception as e:
-                    print(f"[ERROR] Text overlay logic failed: {e}")
-                    print(traceback.format_exc())
-            # =================== FIX FOR TEXT OVERLAY END =====================
-
-            final_width = subclip.w
-            final_height = subclip.h
-            actual_fps = int(options.get('fps', 10))
-
-            subclip.write_gif(temp_gif_path, fps=actual_fps)
+        target_bytes = normalize_options(options)['target_bytes']
+        render_options, max_colors, fit = options, gif_encoder.GIF_MAX_COLORS, None
+        # Size prediction models GIF compression, so target sizes apply to GIF output only
+        if target_bytes and output_format == 'gif' and DECODE_ENGINE != 'moviepy':
+            progress.set_stage('sizing')
+            with metrics.span('sizing', timings):
+                predictor = size_predictor.SizePredictor(local_video_path_for_worker, options, encoder=GIF_ENCODER)
+                fit = predictor.fit(target_bytes)
+            render_options, max_colors = fit['options'], fit['colors']
+            print(f"Target {target_bytes} bytes: {fit['width']}px at {fit['fps']} fps with {fit['colors']} colours, "
+                  f"predicted {fit['predicted_bytes']} bytes")
+
+        for attempt in range(1, TARGET_MAX_ATTEMPTS + 1):
+            final_width, final_height = _render_gif(local_video_path_for_worker, render_options, temp_gif_path,
+                                                    progress, max_colors=max_colors, timings=timings)
+            gif_bytes = os.path.getsize(temp_gif_path)
+            if fit is None or gif_bytes <= target_bytes or attempt == TARGET_MAX_ATTEMPTS:
+                break
+            # The full encode came out over the target: correct the estimate and render once more
+            print(f"GIF is {gif_bytes} bytes, over the {target_bytes} byte target; refitting")
+            predictor.observe(fit, gif_bytes)
+            fit = predictor.fit(target_bytes)
+            render_options, max_colors = fit['options'], fit['colors']
 
+        progress.set_stage('uploading')
         # Upload the generated GIF to Google Cloud Storage
         # Note: The GIF name in GCS should not have any prefix if your download_gif route expects that.
-        public_gif_url = _upload_gif_to_gcs(temp_gif_path, unique_gif_name)
+        with metrics.span('upload', timings):
+            public_gif_url = _upload_gif_to_gcs(temp_gif_path, unique_gif_name)
         # Check if the upload was successful
         if not public_gif_url:
             raise Exception("Failed to upload GIF to Cloud Storage.")
 
         # Return the GCS public URL
-        return {
+        result = {
             'status': 'SUCCESS',
             'gif_url': public_gif_url, # ✅ CORRECTED: Return the direct public URL
             'width': final_width, # Ensure final_width and final_height are defined
             'height': final_height
         }
+        if fit is not None:
+            result['target_bytes'] = target_bytes
+            result['bytes'] = gif_bytes
+            result['chosen'] = {key: fit[key] for key in ('width', 'height', 'fps', 'colors', 'predicted_bytes')}
+        result_cache.store(source_digest, options, result, os.path.getsize(temp_gif_path))
+        return result
+    except SoftTimeLimitExceeded:
+        print(f"Conversion of {gcs_video_blob_name} hit its time limit")
+        return {'status': 'FAILURE', 'error': 'The conversion took too long and was stopped. Try a shorter clip or a smaller size.'}
+    except Ignore:
+        print(f"Handed-off video {handoff_ref['path']} was rerouted through storage; standing down")
+        raise
     except Exception as e:
         # This will catch any error, including the upload failure
         # Log the full traceback for server-side debugging
@@ -292,5 +460,231 @@ def convert_video_to_gif_task(self, gcs_video_blob_name, options):
         if temp_gif_path and os.path.exists(temp_gif_path):
             os.remove(temp_gif_path)
         # Clean up original uploaded video from GCS
-        if gcs_video_blob_name:
-            _delete_from_gcs(gcs_video_blob_name)
\ No newline at end of file
+        if gcs_video_blob_name and not handoff_ref:
+            _delete_from_gcs(gcs_video_blob_name)
+        metrics.record_stage('total', time.perf_counter() - task_started, timings)
+        print(f"Stage timings for {gcs_video_blob_name}: {json.dumps(timings)}")
+
+def _prepare_url_conversion(video_url, options, crop_reference_width, progress):
+    """
+    Fetches the clip a URL conversion needs and stages it for convert_video_to_gif_task
+    exactly as the web tier stages uploads. Returns the conversion's signature, or a
+    finished result dict (a result cache hit or a failure).
+    """
+    local_video_path = None
+    try:
+        progress.set_stage('fetching')
+        opts = normalize_options(options)
+        with metrics.span('url_fetch'):
+            meta = url_ingest.fetch(video_url, url_ingest.required_width(options, crop_reference_width),
+                                    opts['start_time'], opts['end_time'])
+        options = url_ingest.options_for_section(options, meta, crop_reference_width)
+        print(f"Fetched {video_url} as {meta['path']} ({meta['width']}x{meta['height']} from {meta['start']}s)")
+
+        # The cached download stays put for later requests; the conversion gets its own link to it
+        local_video_path = os.path.join('/tmp', f"{os.urandom(8).hex()}_{os.path.basename(meta['path'])}")
+        expiry_index.register_local(local_video_path)
+        try:
+            os.link(meta['path'], local_video_path)
+        except OSError:
+            shutil.copyfile(meta['path'], local_video_path)
+        source_digest = result_cache.file_digest(local_video_path)
+        cached_result = result_cache.lookup(source_digest, options)
+        if cached_result:
+            print(f"Result cache hit for {video_url}, reusing {cached_result.get('gif_url')}")
+            return cached_result
+
+        options, estimate, adjustments = admission.admit(local_video_path, options)
+        if adjustments:
+            print(f"Clamped {video_url}: {', '.join(adjustments)}")
+
+        blob_name = VIDEO_UPLOAD_PREFIX + os.path.basename(local_video_path)
+        task_kwargs = {'source_digest': source_digest}
+        queue_class = task_routing.queue_for(estimate)
+        queue_name = None
+        if handoff.HANDOFF_ENABLED and handoff.local_worker_alive(queue_class):
+            task_kwargs['handoff_ref'] = handoff.stage(local_video_path, source_digest)
+            queue_name = handoff.local_queue_name(queue_class)
+            # The conversion replaces this task and keeps its ID
+            handoff.record_task(task_kwargs['handoff_ref'], task_client.CONVERT_TASK, progress.task.request.id,
+                                [blob_name, options], task_kwargs, queue_class)
+        else:
+            get_storage().upload_file(local_video_path, blob_name)
+            expiry_index.register(blob_name, expiry_index.UPLOAD_EXPIRY_SECONDS)
+        return convert_video_to_gif_task.signature(
+            args=[blob_name, options], kwargs=task_kwargs,
+            **task_routing.publish_options(queue_class, queue=queue_name)
+        )
+    except (url_ingest.IngestError, admission.AdmissionError) as e:
+        print(f"Could not ingest {video_url}: {e}")
+        return {'status': 'FAILURE', 'error': str(e)}
+    except SoftTimeLimitExceeded:
+        return {'status': 'FAILURE', 'error': 'Downloading the video took too long. Try a shorter clip.'}
+    except Exception as e:
+        return {'status': 'FAILURE', 'error': f"Task failed: {str(e)}\n{traceback.format_exc()}"}
+    finally:
+        if local_video_path and os.path.exists(local_video_path):
+            os.remove(local_video_path)
+
+@celery_app.task(bind=True, name=task_client.INGEST_URL_TASK)
+def ingest_url_task(self, video_url, options, crop_reference_width=None):
+    """
+    Downloads the requested window of a video URL on a worker and then becomes the
+    conversion: the task is replaced under the same id, so status and progress
+    requests for it follow the conversion through to its result.
+    """
+    progress = ProgressReporter(self)
+    conversion = _prepare_url_conversion(video_url, options, crop_reference_width, progress)
+    if not isinstance(conversion, Signature):
+        return conversion
+    return self.replace(conversion)
+
+@celery_app.task(bind=True, name=task_client.FETCH_PREVIEW_TASK)
+def fetch_preview_task(self, video_url):
+    """
+    Fetches a small, video-only copy of a URL's first URL_PREVIEW_MAX_SECONDS and
+    builds the crop and trim preview from it: a low-bitrate proxy, a keyframe sprite
+    sheet and a timeline strip. The copy lands in the URL cache, so a conversion that
+    fits within it reuses it, and the preview assets are cached next to it.
+    """
+    progress = ProgressReporter(self)
+    try:
+        progress.set_stage('fetching')
+        meta = url_ingest.fetch(video_url, url_ingest.URL_PREVIEW_MAX_WIDTH, 0.0, url_ingest.URL_PREVIEW_MAX_SECONDS)
+        entry_name = os.path.splitext(os.path.basename(meta['path']))[0]
+        preview_dir = os.path.splitext(meta['path'])[0] + '.preview'
+        storage_prefix = f"{PREVIEW_PREFIX}{entry_name}/"
+        storage = get_storage()
+        manifest_path = os.path.join(preview_dir, preview_assets.MANIFEST_NAME)
+        if os.path.isfile(manifest_path) and storage.exists(storage_prefix + preview_assets.MANIFEST_NAME):
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+            os.utime(preview_dir)
+        else:
+            progress.set_stage('previewing')
+            with metrics.span('preview_assets'):
+                manifest = preview_assets.generate(meta['path'], preview_dir)
+            for filename in sorted(os.listdir(preview_dir)):
+                storage.upload_file(os.path.join(preview_dir, filename), storage_prefix + filename,
+                                    content_type=mimetypes.guess_type(filename)[0])
+        # Reused previews live on for another full lifetime
+        for filename in os.listdir(preview_dir):
+            expiry_index.register(storage_prefix + filename)
+
+        def asset_url(filename):
+            return storage.signed_url(storage_prefix + filename, expiration=url_ingest.URL_CACHE_MAX_AGE_SECONDS)
+
+        return {
+            'status': 'SUCCESS',
+            'preview_url': asset_url(preview_assets.PROXY_NAME),
+            'sprite_url': asset_url(preview_assets.SPRITE_NAME) if manifest['sprite'] else None,
+            'strip_url': asset_url(preview_assets.STRIP_NAME) if manifest['strip'] else None,
+            'sprite': manifest['sprite'],
+            'width': manifest['width'],
+            'height': manifest['height'],
+            'source_width': meta['width'],
+            'source_height': meta['height'],
+            'duration': meta['duration'] or manifest['duration'],
+            'title': meta['title'],
+        }
+    except url_ingest.IngestError as e:
+        print(f"Could not fetch a preview of {video_url}: {e}")
+        return {'status': 'FAILURE', 'error': str(e)}
+    except SoftTimeLimitExceeded:
+        return {'status': 'FAILURE', 'error': 'Downloading the video preview took too long. Try again or upload the file.'}
+    except Exception as e:
+        return {'status': 'FAILURE', 'error': f"Task failed: {str(e)}\n{traceback.format_exc()}"}
+
+@celery_app.task(bind=True, name=task_client.CONVERT_VARIANTS_TASK)
+def convert_variants_task(self, gcs_video_blob_name, variants, source_digest=None, handoff_ref=None):
+    """
+    Converts one video into several variants (sizes, frame rates, formats) in one job.
+    The source is fetched once and each group of variants sharing a crop and speed is
+    decoded once, with the frames fanned out to one encoder per variant. The result
+    lists each variant's own result, in order; variants already in the result cache
+    are not rendered again.
+    """
+    local_video_path_for_worker = None
+    temp_paths = []
+    progress = ProgressReporter(self)
+    if handoff_ref and handoff.was_rerouted(handoff_ref):
+        raise Ignore()
+    try:
+        progress.set_stage('downloading')
+        base_video_filename = os.path.basename(gcs_video_blob_name)
+        local_video_path_for_worker = os.path.join('/tmp', base_video_filename)
+        expiry_index.register_local(local_video_path_for_worker)
+        if handoff_ref:
+            _claim_handoff(handoff_ref, local_video_path_for_worker)
+        elif not _download_from_gcs(gcs_video_blob_name, local_video_path_for_worker):
+            raise Exception(f"Failed to download video {gcs_video_blob_name} from GCS.")
+        if source_digest is None:
+            source_digest = result_cache.file_digest(local_video_path_for_worker)
+
+        results = [result_cache.lookup(source_digest, options) for options in variants]
+        pending = []
+        for index, options in enumerate(variants):
+            if results[index]:
+                continue
+            output_format = normalize_options(options)['output_format']
+            output_name = f"{os.path.splitext(base_video_filename)[0]}_v{index}{OUTPUT_FORMATS[output_format][0]}"
+            temp_paths.append(os.path.join('/tmp', output_name))
+            expiry_index.register_local(temp_paths[-1])
+            render_options, max_colors, fit = options, gif_encoder.GIF_MAX_COLORS, None
+            target_bytes = normalize_options(options)['target_bytes']
+            # No DECODE_ENGINE check, unlike convert_video_to_gif_task: variants are always decoded
+            # through the ffmpeg pipeline the predictor samples with, so the fit holds under moviepy too
+            if target_bytes and output_format == 'gif':
+                progress.set_stage('sizing')
+                predictor = size_predictor.SizePredictor(local_video_path_for_worker, options, encoder=GIF_ENCODER)
+                fit = predictor.fit(target_bytes)
+                render_options, max_colors = fit['options'], fit['colors']
+            pending.append((index, output_name, render_options, max_colors, fit))
+
+        if pending:
+            with metrics.span('variant_render'):
+                rendered = variant_fanout.render_variants(
+                    local_video_path_for_worker,
+                    [(render_options, os.path.join('/tmp', output_name), max_colors)
+                     for _, output_name, render_options, max_colors, _ in pending],
+                    encoder_name=GIF_ENCODER, progress=progress,
+                )
+            progress.set_stage('uploading')
+            for (index, output_name, _, _, fit), size in zip(pending, rendered):
+                temp_path = os.path.join('/tmp', output_name)
+                if isinstance(size, Exception):
+                    print(f"Variant {index} of {gcs_video_blob_name} failed: {size}")
+                    results[index] = {'status': 'FAILURE', 'error': f"Variant failed: {size}"}
+                    continue
+                public_url = _upload_gif_to_gcs(temp_path, output_name)
+                if not public_url:
+                    results[index] = {'status': 'FAILURE', 'error': 'Failed to upload the result to Cloud Storage.'}
+                    continue
+                results[index] = {'status': 'SUCCESS', 'gif_url': public_url, 'width': size[0], 'height': size[1]}
+                if fit is not None:
+                    results[index]['target_bytes'] = normalize_options(variants[index])['target_bytes']
+                    results[index]['bytes'] = os.path.getsize(temp_path)
+                    results[index]['chosen'] = {key: fit[key] for key in
+                                                ('width', 'height', 'fps', 'colors', 'predicted_bytes')}
+                result_cache.store(source_digest, variants[index], results[index], os.path.getsize(temp_path))
+
+        if not any(result.get('status') == 'SUCCESS' for result in results):
+            return {'status': 'FAILURE', 'error': 'Every variant failed.', 'variants': results}
+        return {'status': 'SUCCESS', 'variants': results}
+    except SoftTimeLimitExceeded:
+        print(f"Variant conversion of {gcs_video_blob_name} hit its time limit")
+        return {'status': 'FAILURE', 'error': 'The conversion took too long and was stopped. Try fewer or smaller variants.'}
+    except Ignore:
+        print(f"Handed-off video {handoff_ref['path']} was rerouted through storage; standing down")
+        raise
+    except Exception as e:
+        detailed_error = f"Task failed: {str(e)}\n{traceback.format_exc()}"
+        return {'status': 'FAILURE', 'error': detailed_error}
+    finally:
+        if local_video_path_for_worker and os.path.exists(local_video_path_for_worker):
+            os.remove(local_video_path_for_worker)
+        for temp_path in temp_paths:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        if gcs_video_blob_name and not handoff_ref:
+            _delete_from_gcs(gcs_video_blob_name)
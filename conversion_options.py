@@ -0,0 +1,125 @@
+# In conversion_options.py
+import json
+
+# Keys that affect the rendered text overlay, with the legacy dashed spellings the form uses
+OVERLAY_OPTION_KEYS = {
+    'text_font': ('font_style', 'text_font', 'font-style'),
+    'text_size': ('text_size', 'text-size'),
+    'text_color': ('text_color', 'text-color'),
+    'text_bg_color': ('text_bg_color', 'text-bg-color'),
+    'text_align': ('text_align', 'text-align'),
+    'horizontal_align': ('horizontal_align', 'horizontal-align'),
+    'vertical_align': ('vertical_align', 'vertical-align'),
+    'text_position': ('text_position', 'text-position'),
+}
+
+# Output formats: file extension and Content-Type of the stored result
+OUTPUT_FORMATS = {
+    'gif': ('.gif', 'image/gif'),
+    'webp': ('.webp', 'image/webp'),
+    'apng': ('.png', 'image/apng'),
+    'mp4': ('.mp4', 'video/mp4'),
+}
+
+
+def output_mimetype(filename):
+    """Content-Type for a stored result, from its extension."""
+    extension = '.' + filename.rsplit('.', 1)[-1].lower()
+    for candidate, mimetype in OUTPUT_FORMATS.values():
+        if candidate == extension:
+            return mimetype
+    return 'application/octet-stream'
+
+
+def _first_present(options, keys):
+    for key in keys:
+        val = options.get(key)
+        if val is not None and val != '':
+            return val
+    return None
+
+
+def _to_float(val, default=None):
+    try:
+        if val is None or val == '':
+            return default
+        return float(val)
+    except (TypeError, ValueError):
+        return default
+
+
+def _to_int(val, default=None):
+    try:
+        if val is None or val == '':
+            return default
+        return int(float(val))
+    except (TypeError, ValueError):
+        return default
+
+
+def normalize_options(options):
+    """
+    Normalizes raw conversion options (form strings or task options) into canonical values.
+    Mirrors the fallbacks convert_video_to_gif_task applies, so two requests that render
+    the same GIF normalize to the same dict.
+    """
+    start_time = _to_float(options.get('start_time'), 0.0)
+    if start_time < 0:
+        start_time = 0.0
+    end_time = _to_float(options.get('end_time'))
+    if end_time is not None and end_time <= 0:
+        end_time = None
+
+    fps = _to_int(options.get('fps'), 10)
+    if fps <= 0:
+        fps = 10
+
+    resize = 'original'
+    resize_width = _to_int(options.get('resize'))
+    if resize_width is not None and resize_width > 0:
+        resize = resize_width
+
+    speed = _to_float(options.get('speed'), 1.0)
+    if speed <= 0:
+        speed = 1.0
+
+    # Maximum GIF size in bytes; the worker picks fps, width and palette size to fit it
+    target_bytes = _to_int(options.get('target_bytes'))
+    if target_bytes is not None and target_bytes <= 0:
+        target_bytes = None
+
+    output_format = str(options.get('output_format') or 'gif').strip().lower()
+    if output_format not in OUTPUT_FORMATS:
+        output_format = 'gif'
+
+    crop = None
+    crop_values = [_to_int(options.get(key)) for key in ('crop_x', 'crop_y', 'crop_width', 'crop_height')]
+    if all(val is not None for val in crop_values):
+        crop = crop_values
+
+    overlay = None
+    text_overlay = _first_present(options, ('text_overlay', 'text-overlay'))
+    if text_overlay:
+        overlay = {'text': text_overlay}
+        for name, keys in OVERLAY_OPTION_KEYS.items():
+            val = _first_present(options, keys)
+            if isinstance(val, str):
+                val = val.strip() if name == 'text_font' else val.strip().lower()
+            overlay[name] = val
+
+    return {
+        'start_time': round(start_time, 3),
+        'end_time': round(end_time, 3) if end_time is not None else None,
+        'fps': fps,
+        'resize': resize,
+        'speed': round(speed, 4),
+        'crop': crop,
+        'overlay': overlay,
+        'target_bytes': target_bytes,
+        'output_format': output_format,
+    }
+
+
+def options_fingerprint(options):
+    """Stable string form of the normalized options, suitable for hashing."""
+    return json.dumps(normalize_options(options), sort_keys=True, separators=(',', ':'))
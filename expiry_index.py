@@ -0,0 +1,269 @@
+# In expiry_index.py
+import os
+import time
+import fcntl
+import shutil
+import socket
+import threading
+import contextlib
+
+from result_cache import GIF_EXPIRY_SECONDS
+
+
+# --- Configuration ---
+EXPIRY_INDEX_URL = os.environ.get(
+    'EXPIRY_INDEX_URL', os.environ.get('CELERY_RESULT_BACKEND', 'redis://localhost:6379/0')
+)
+# Uploaded source videos are deleted by their task; this only catches uploads whose task never ran
+UPLOAD_EXPIRY_SECONDS = int(os.environ.get('UPLOAD_EXPIRY_SECONDS', 86400))
+# Local temp files are removed by the request or task that wrote them; this catches crashes
+LOCAL_FILE_MAX_AGE_SECONDS = int(os.environ.get('LOCAL_FILE_MAX_AGE_SECONDS', 86400))
+EXPIRY_BATCH_SIZE = int(os.environ.get('EXPIRY_BATCH_SIZE', 200))
+EXPIRY_LOCK_SECONDS = int(os.environ.get('EXPIRY_LOCK_SECONDS', 300))
+EXPIRY_RETRY_SECONDS = int(os.environ.get('EXPIRY_RETRY_SECONDS', 3600))
+HOST_LOCK_DIR = os.environ.get('HOST_LOCK_DIR', '/tmp')
+NODE_ID = os.environ.get('NODE_ID', socket.gethostname())
+
+_OBJECTS_KEY = 'expiry:objects'  # sorted set of storage object names scored by expiry time
+_FILES_KEY = f'expiry:files:{NODE_ID}'  # local paths on this host scored by expiry time
+_LOCK_KEY = 'expiry:cleaner'
+_BACKFILLED_KEY = 'expiry:backfilled'
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def _get_client():
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                import redis
+                _client = redis.Redis.from_url(EXPIRY_INDEX_URL, socket_timeout=2, socket_connect_timeout=2)
+    return _client
+
+
+def register(name, ttl_seconds=GIF_EXPIRY_SECONDS):
+    """Schedules a storage object for deletion ttl_seconds from now (re-registering pushes it back)."""
+    try:
+        _get_client().zadd(_OBJECTS_KEY, {name: time.time() + ttl_seconds})
+    except Exception as e:
+        print(f"Could not index {name} for expiry: {e}")
+
+
+def forget(name):
+    """Drops a storage object that was deleted before its expiry."""
+    try:
+        _get_client().zrem(_OBJECTS_KEY, name)
+    except Exception as e:
+        print(f"Could not remove {name} from the expiry index: {e}")
+
+
+def register_local(path, ttl_seconds=LOCAL_FILE_MAX_AGE_SECONDS):
+    """Schedules a temp file on this host for removal, in case its writer never gets to remove it."""
+    try:
+        _get_client().zadd(_FILES_KEY, {path: time.time() + ttl_seconds})
+    except Exception as e:
+        print(f"Could not index {path} for expiry: {e}")
+
+
+def _is_missing(error):
+    # LocalStorage raises FileNotFoundError, GCS google.api_core.exceptions.NotFound
+    return isinstance(error, FileNotFoundError) or type(error).__name__ == 'NotFound'
+
+
+def _pop_due(client, key, remove, deadline):
+    """
+    Removes due members of a sorted set in batches, calling remove(member) for each.
+    Members whose removal fails are retried after EXPIRY_RETRY_SECONDS. Returns the
+    number removed.
+    """
+    removed = 0
+    while time.monotonic() < deadline:
+        now = time.time()
+        due = client.zrangebyscore(key, '-inf', now, start=0, num=EXPIRY_BATCH_SIZE)
+        if not due:
+            break
+        retry = {}
+        for member in due:
+            name = member.decode()
+            try:
+                remove(name)
+                removed += 1
+            except Exception as e:
+                if not _is_missing(e):
+                    print(f"Could not expire {name}: {e}")
+                    retry[member] = now + EXPIRY_RETRY_SECONDS
+        pipe = client.pipeline()
+        pipe.zrem(key, *due)
+        if retry:
+            pipe.zadd(key, retry)
+        pipe.execute()
+    return removed
+
+
+def expire_storage(storage, backfill_ttl=None):
+    """
+    Deletes storage objects whose expiry has passed. Only one process in the whole
+    deployment runs at a time (a Redis lock), and it reads only due index entries, so
+    the cost follows the number of expired objects rather than the bucket's size.
+    With backfill_ttl, objects stored before the index existed are indexed first, once.
+    Returns the number deleted, or None if another process holds the lock.
+    """
+    client = _get_client()
+    token = os.urandom(16).hex()
+    if not client.set(_LOCK_KEY, token, nx=True, ex=EXPIRY_LOCK_SECONDS):
+        return None
+    try:
+        if backfill_ttl is not None and not client.exists(_BACKFILLED_KEY):
+            print(f"Indexed {_backfill(client, storage, backfill_ttl)} existing objects for expiry")
+        return _pop_due(client, _OBJECTS_KEY, storage.delete, time.monotonic() + EXPIRY_LOCK_SECONDS * 0.8)
+    finally:
+        _release_lock(client, token)
+
+
+def _release_lock(client, token):
+    """Deletes the cleaner lock only if this process still holds it."""
+    import redis
+    with client.pipeline() as pipe:
+        try:
+            pipe.watch(_LOCK_KEY)
+            if pipe.get(_LOCK_KEY) == token.encode():
+                pipe.multi()
+                pipe.delete(_LOCK_KEY)
+                pipe.execute()
+        except redis.WatchError:
+            pass
+
+
+def claim_once(key, ttl_seconds):
+    """
+    Marks key as used for ttl_seconds, atomically across the deployment. True for the
+    one caller that claims it, False for every later one until it expires.
+    """
+    return bool(_get_client().set(f'once:{key}', NODE_ID, nx=True, ex=ttl_seconds))
+
+
+def release_claim(key):
+    """Undoes claim_once, e.g. when the work it guarded could not be started."""
+    _get_client().delete(f'once:{key}')
+
+
+def expire_local_files():
+    """Removes this host's indexed temp files whose expiry has passed. Returns the number removed."""
+    return _pop_due(_get_client(), _FILES_KEY, os.remove, time.monotonic() + EXPIRY_LOCK_SECONDS * 0.8)
+
+
+@contextlib.contextmanager
+def host_lock(name):
+    """
+    Elects one process per host for a job: yields True in the process that holds the
+    lock and False, without waiting, everywhere else.
+    """
+    path = os.path.join(HOST_LOCK_DIR, f'.{name}.lock')
+    with open(path, 'a') as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+_held_locks = {}
+
+
+def hold_host_lock(name):
+    """
+    Claims a per-host role for the rest of this process's life: True in the one process
+    that gets it, False elsewhere. The OS releases it when the holder exits.
+    """
+    if name in _held_locks:
+        return True
+    lock_file = open(os.path.join(HOST_LOCK_DIR, f'.{name}.lock'), 'a')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock_file.close()
+        return False
+    _held_locks[name] = lock_file
+    return True
+
+
+def _entry_size(entry):
+    if not entry.is_dir(follow_symlinks=False):
+        return entry.stat(follow_symlinks=False).st_size
+    total = 0
+    for dirpath, _, filenames in os.walk(entry.path):
+        for filename in filenames:
+            try:
+                total += os.lstat(os.path.join(dirpath, filename)).st_size
+            except OSError:
+                pass
+    return total
+
+
+def trim_scratch(directory, budget_bytes, max_age=None):
+    """
+    Keeps a scratch directory within budget_bytes by evicting least recently used
+    entries first, plus any unused for max_age seconds. Files sharing a stem (name up
+    to the first dot, e.g. a cached video, its metadata and its preview directory) are
+    used and evicted together; hidden files are left alone. Returns (entries removed,
+    bytes freed).
+    """
+    if not os.path.isdir(directory):
+        return 0, 0
+    groups = {}
+    for entry in os.scandir(directory):
+        if entry.name.startswith('.'):
+            continue
+        try:
+            size, used = _entry_size(entry), entry.stat(follow_symlinks=False).st_mtime
+        except OSError:
+            continue
+        group = groups.setdefault(entry.name.split('.', 1)[0], {'paths': [], 'bytes': 0, 'used': 0.0})
+        group['paths'].append(entry.path)
+        group['bytes'] += size
+        group['used'] = max(group['used'], used)
+
+    total = sum(group['bytes'] for group in groups.values())
+    cutoff = time.time() - max_age if max_age else None
+    removed, freed = 0, 0
+    for group in sorted(groups.values(), key=lambda group: group['used']):
+        if total - freed <= budget_bytes and (cutoff is None or group['used'] >= cutoff):
+            break
+        for path in group['paths']:
+            if os.path.isdir(path) and not os.path.islink(path):
+                shutil.rmtree(path, ignore_errors=True)
+            elif os.path.exists(path):
+                os.remove(path)
+        removed += 1
+        freed += group['bytes']
+    return removed, freed
+
+
+def _backfill(client, storage, ttl_for):
+    """
+    One-off migration for objects written before the index existed: lists the bucket
+    once and indexes each object at its creation time plus ttl_for(name) (None skips
+    it). Returns the number indexed.
+    """
+    indexed = 0
+    batch = {}
+    for name, time_created in storage.list_objects():
+        ttl_seconds = ttl_for(name)
+        if ttl_seconds is None:
+            continue
+        batch[name] = time_created.timestamp() + ttl_seconds
+        if len(batch) >= EXPIRY_BATCH_SIZE:
+            client.zadd(_OBJECTS_KEY, batch, nx=True)
+            indexed += len(batch)
+            batch = {}
+    if batch:
+        client.zadd(_OBJECTS_KEY, batch, nx=True)
+        indexed += len(batch)
+    client.set(_BACKFILLED_KEY, int(time.time()))
+    return indexed
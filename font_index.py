@@ -0,0 +1,95 @@
+# In font_index.py
+import os
+import re
+import threading
+
+from PIL import ImageFont
+
+
+# --- Configuration ---
+FONT_DIRS = [
+    path for path in os.environ.get('FONT_DIRS', '').split(os.pathsep) if path
+] or [
+    os.path.dirname(os.path.abspath(__file__)),  # fonts bundled next to the app
+    '/usr/share/fonts',
+    '/usr/local/share/fonts',
+    os.path.expanduser('~/.fonts'),
+    os.path.expanduser('~/.local/share/fonts'),
+    '/Library/Fonts',
+    '/System/Library/Fonts',
+]
+# Tried in order when the requested font is not installed
+FALLBACK_FONTS = ['Roboto', 'Arial', 'Liberation Sans', 'DejaVu Sans']
+FONT_EXTENSIONS = ('.ttf', '.otf', '.ttc')
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def _key(name):
+    """Normalizes 'Times New Roman', 'times-new-roman.ttf' and 'TimesNewRoman' to the same key."""
+    name = os.path.splitext(os.path.basename(name))[0] if name.lower().endswith(FONT_EXTENSIONS) else name
+    return re.sub(r'[\s_\-]+', '', name).lower()
+
+
+def _font_dirs():
+    dirs = list(FONT_DIRS)
+    try:
+        # matplotlib is already a dependency and ships DejaVu, a last resort that is always present
+        import matplotlib
+        dirs.append(os.path.join(matplotlib.get_data_path(), 'fonts', 'ttf'))
+    except ImportError:
+        pass
+    return dirs
+
+
+def build_index():
+    """
+    Scans the font directories once and maps normalized names to font files: the
+    file name, the family name and 'family style' all resolve to the same path.
+    Regular styles win when several files share a family.
+    """
+    index = {}
+    for font_dir in _font_dirs():
+        if not os.path.isdir(font_dir):
+            continue
+        for dirpath, _, filenames in os.walk(font_dir):
+            for filename in sorted(filenames):
+                if not filename.lower().endswith(FONT_EXTENSIONS):
+                    continue
+                path = os.path.join(dirpath, filename)
+                try:
+                    family, style = ImageFont.truetype(path, size=10).getname()
+                except Exception:
+                    continue
+                index.setdefault(_key(filename), path)
+                index.setdefault(_key(f'{family} {style}'), path)
+                if (style or '').lower() in ('regular', 'book', 'roman', 'normal') or _key(family) not in index:
+                    index[_key(family)] = path
+    return index
+
+
+def get_index():
+    """Returns the process-wide font index, building it on first use."""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = build_index()
+    return _index
+
+
+def resolve(name=None):
+    """
+    Path of the font to render with: name itself if it is a font file, else the
+    indexed font of that name, else the first installed fallback. Returns None
+    when no font files exist at all (callers use Pillow's built-in font).
+    """
+    if name and os.path.isfile(name):
+        return name
+    index = get_index()
+    for candidate in ([name] if name else []) + FALLBACK_FONTS:
+        path = index.get(_key(candidate))
+        if path:
+            return path
+    return next(iter(index.values()), None)
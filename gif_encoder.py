@@ -0,0 +1,217 @@
+# In gif_encoder.py
+import os
+import subprocess
+import tempfile
+
+import numpy as np
+
+import gif_quantizer
+import gif_writer
+
+
+# --- Configuration ---
+FFMPEG_BINARY = os.environ.get('FFMPEG_BINARY', 'ffmpeg')
+# 'full' builds one global palette, 'diff' weights it towards moving regions,
+# 'single' gives every frame its own palette (best for clips with hard scene cuts)
+GIF_PALETTE_MODE = os.environ.get('GIF_PALETTE_MODE', 'diff')
+GIF_DITHER = os.environ.get('GIF_DITHER', 'sierra2_4a')
+GIF_MAX_COLORS = int(os.environ.get('GIF_MAX_COLORS', 256))
+# Drop duplicate frames and write only the changed rectangle of each frame, with unchanged pixels transparent
+GIF_FRAME_DELTAS = os.environ.get('GIF_FRAME_DELTAS', '1') == '1'
+# Exact-duplicate detection: any changed 8x8 block keeps the frame
+_DROP_DUPLICATES = 'mpdecimate=hi=0:lo=0:frac=0'
+
+
+def _as_rgb24(frame):
+    """Drops any alpha channel and returns a C-contiguous uint8 RGB frame."""
+    if frame.ndim == 3 and frame.shape[2] > 3:
+        frame = frame[:, :, :3]
+    return np.ascontiguousarray(frame, dtype=np.uint8)
+
+
+def _rawvideo_input_args(width, height, fps):
+    return ['-f', 'rawvideo', '-pix_fmt', 'rgb24', '-s', f'{width}x{height}', '-r', str(fps)]
+
+
+class FfmpegGifEncoder:
+    """
+    Two-pass palettegen/paletteuse GIF encoder fed one frame at a time.
+
+    Pass one streams frames into palettegen, which only keeps a colour histogram,
+    while the same bytes are spooled to a scratch file on disk. Pass two reads the
+    spool back through paletteuse with dithering. Memory use is independent of
+    clip length; the spool costs width*height*3 bytes of disk per frame.
+    """
+
+    def __init__(self, output_path, width, height, fps, palette_mode=GIF_PALETTE_MODE,
+                 dither=GIF_DITHER, max_colors=GIF_MAX_COLORS):
+        self.output_path = output_path
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.palette_mode = palette_mode
+        self.dither = dither
+        self.max_colors = max_colors
+        self.frames_written = 0
+        # Copies of the last distinct frame, which mpdecimate drops with nothing after them to lengthen
+        self._last_frame = None
+        self._trailing_repeats = 0
+
+        scratch_dir = os.path.dirname(os.path.abspath(output_path))
+        self._spool = tempfile.NamedTemporaryFile(dir=scratch_dir, suffix='.rgb', delete=False)
+        self._palette_path = os.path.join(scratch_dir, f"{os.path.basename(output_path)}.palette.png")
+        self._stderr = tempfile.TemporaryFile()
+        self._palettegen = None
+        if palette_mode != 'single':
+            self._palettegen = subprocess.Popen(
+                [FFMPEG_BINARY, '-nostdin', '-hide_banner', '-loglevel', 'error', '-y',
+                 *_rawvideo_input_args(width, height, fps), '-i', '-',
+                 '-vf', f'palettegen=max_colors={max_colors}:stats_mode={palette_mode}',
+                 '-update', '1', '-frames:v', '1', self._palette_path],
+                stdin=subprocess.PIPE, stderr=self._stderr,
+            )
+
+    def write_frame(self, frame):
+        data = _as_rgb24(frame).tobytes()
+        if data == self._last_frame:
+            self._trailing_repeats += 1
+        else:
+            self._last_frame, self._trailing_repeats = data, 0
+        self._spool.write(data)
+        if self._palettegen is not None:
+            self._palettegen.stdin.write(data)
+        self.frames_written += 1
+
+    def _run(self, cmd):
+        result = subprocess.run(cmd, capture_output=True)
+        if result.returncode != 0:
+            raise RuntimeError(f"ffmpeg failed ({result.returncode}): {result.stderr.decode(errors='replace')}")
+
+    def close(self):
+        """Finishes the palette pass and writes the dithered GIF."""
+        try:
+            self._spool.close()
+            if self.frames_written == 0:
+                raise RuntimeError("No frames were written to the GIF encoder.")
+            spool_input = [*_rawvideo_input_args(self.width, self.height, self.fps), '-i', self._spool.name]
+            base_cmd = [FFMPEG_BINARY, '-nostdin', '-hide_banner', '-loglevel', 'error', '-y']
+            # ffmpeg's GIF muxer already writes changed rectangles with transparent unchanged pixels
+            # (gifflags offsetting+transdiff); dropped duplicates lengthen the previous frame's delay
+            decimate, timing = (f'{_DROP_DUPLICATES},', ['-fps_mode', 'passthrough']) if GIF_FRAME_DELTAS else ('', [])
+            if GIF_FRAME_DELTAS and self._trailing_repeats:
+                # The muxer would show the last frame for one frame interval; keep the time its copies had
+                timing += ['-final_delay', str(round(100 * (self._trailing_repeats + 1) / self.fps))]
+            if self._palettegen is not None:
+                self._palettegen.stdin.close()
+                if self._palettegen.wait() != 0:
+                    self._stderr.seek(0)
+                    raise RuntimeError(f"palettegen failed: {self._stderr.read().decode(errors='replace')}")
+                self._run([
+                    *base_cmd, *spool_input, '-i', self._palette_path,
+                    '-lavfi', f'[0:v]{decimate}null[v];[v][1:v]paletteuse=dither={self.dither}:diff_mode=rectangle',
+                    *timing, '-loop', '0', self.output_path,
+                ])
+            else:
+                # Per-frame palettes need no separate histogram pass
+                self._run([
+                    *base_cmd, *spool_input,
+                    '-lavfi', f'{decimate}split[a][b];[a]palettegen=max_colors={self.max_colors}:stats_mode=single[p];'
+                              f'[b][p]paletteuse=new=1:dither={self.dither}',
+                    *timing, '-loop', '0', self.output_path,
+                ])
+        finally:
+            self._cleanup()
+
+    def abort(self):
+        """Stops any running pass and removes scratch files."""
+        if self._palettegen is not None and self._palettegen.poll() is None:
+            self._palettegen.kill()
+            self._palettegen.wait()
+        self._spool.close()
+        self._cleanup()
+
+    def _cleanup(self):
+        self._stderr.close()
+        for path in (self._spool.name, self._palette_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+class NumpyGifEncoder:
+    """
+    In-process GIF encoder for workers that should not shell out to ffmpeg.
+
+    The first frames of each scene (up to palette_window of them) are buffered to
+    build a median-cut palette and lookup table; later frames reuse that palette
+    until a scene change is detected, at which point the next palette is written as
+    a local colour table. Memory is bounded by palette_window frames.
+    """
+
+    def __init__(self, output_path, width, height, fps, max_colors=GIF_MAX_COLORS,
+                 dither=gif_quantizer.QUANTIZER_DITHER, palette_window=8):
+        self.output_path = output_path
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.max_colors = max_colors
+        self.dither = dither
+        self.palette_window = palette_window
+        self.frames_written = 0
+        self.palettes_built = 0
+        self._pending = []
+        self._quantizer = None
+        self._writer = None
+
+    def write_frame(self, frame):
+        frame = _as_rgb24(frame)
+        if self._quantizer is not None:
+            if not self._quantizer.scene_changed(frame):
+                self._emit(frame)
+                return
+            self._quantizer = None
+        self._pending.append(frame)
+        if len(self._pending) >= self.palette_window:
+            self._flush_pending()
+
+    def _flush_pending(self):
+        if not self._pending:
+            return
+        self._quantizer = gif_quantizer.PaletteQuantizer.from_frames(
+            self._pending, self.max_colors, dither=self.dither
+        )
+        self.palettes_built += 1
+        pending, self._pending = self._pending, []
+        for frame in pending:
+            self._emit(frame)
+
+    def _emit(self, frame):
+        if self._writer is None:
+            self._writer = gif_writer.FrameDeltaWriter(
+                gif_writer.GifStreamWriter(self.output_path, self.width, self.height, self._quantizer.palette),
+                enabled=GIF_FRAME_DELTAS,
+            )
+        self._writer.write_frame(self._quantizer.map_frame(frame), 1.0 / self.fps, palette=self._quantizer.palette)
+        self.frames_written += 1
+
+    def close(self):
+        self._flush_pending()
+        if self._writer is None:
+            raise RuntimeError("No frames were written to the GIF encoder.")
+        self._writer.close()
+
+    def abort(self):
+        self._pending = []
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        if os.path.exists(self.output_path):
+            os.remove(self.output_path)
+
+
+def create_encoder(name, output_path, width, height, fps, max_colors=GIF_MAX_COLORS):
+    """Builds the GIF encoder selected by name."""
+    if name == 'ffmpeg':
+        return FfmpegGifEncoder(output_path, width, height, fps, max_colors=max_colors)
+    if name == 'numpy':
+        return NumpyGifEncoder(output_path, width, height, fps, max_colors=max_colors)
+    raise ValueError(f"Unknown GIF encoder: {name}")
@@ -0,0 +1,143 @@
+# In gif_quantizer.py
+import os
+
+import numpy as np
+from PIL import Image
+
+
+# --- Configuration ---
+QUANTIZER_DITHER = os.environ.get('QUANTIZER_DITHER', 'none')  # 'none', 'ordered' or 'floyd_steinberg'
+QUANTIZER_LUT_BITS = int(os.environ.get('QUANTIZER_LUT_BITS', 5))  # bits per channel of the colour lookup table
+QUANTIZER_SAMPLE_PIXELS = int(os.environ.get('QUANTIZER_SAMPLE_PIXELS', 65536))
+# L1 distance between coarse colour histograms (0..2) above which a new palette is built
+SCENE_CHANGE_THRESHOLD = float(os.environ.get('SCENE_CHANGE_THRESHOLD', 0.6))
+
+# 8x8 Bayer matrix, normalised to thresholds in [-0.5, 0.5)
+_BAYER_8 = np.array([
+    [0, 32, 8, 40, 2, 34, 10, 42],
+    [48, 16, 56, 24, 50, 18, 58, 26],
+    [12, 44, 4, 36, 14, 46, 6, 38],
+    [60, 28, 52, 20, 62, 30, 54, 22],
+    [3, 35, 11, 43, 1, 33, 9, 41],
+    [51, 19, 59, 27, 49, 17, 57, 25],
+    [15, 47, 7, 39, 13, 45, 5, 37],
+    [63, 31, 55, 23, 61, 29, 53, 21],
+], dtype=np.float32) / 64.0 - 0.5
+
+
+def sample_pixels(frames, max_pixels=QUANTIZER_SAMPLE_PIXELS):
+    """Strided subsample of a frame stack as an (N, 3) pixel array."""
+    stack = np.stack([np.asarray(frame)[:, :, :3] for frame in frames])
+    total = stack.shape[0] * stack.shape[1] * stack.shape[2]
+    stride = max(1, int(np.sqrt(total / max_pixels)))
+    return stack[:, ::stride, ::stride].reshape(-1, 3)
+
+
+def median_cut_palette(pixels, max_colors=256):
+    """
+    Median-cut colour reduction over an (N, 3) pixel sample.
+    Repeatedly splits the box with the widest channel range (weighted by population)
+    at its median and returns each box's mean colour.
+    """
+    pixels = np.asarray(pixels, dtype=np.uint8).reshape(-1, 3)
+    boxes = [pixels]
+    scores = [_box_score(pixels)]
+    while len(boxes) < max_colors:
+        index = int(np.argmax(scores))
+        if scores[index] <= 0:
+            break
+        box = boxes.pop(index)
+        scores.pop(index)
+        channel = int(np.argmax(box.max(axis=0).astype(np.int16) - box.min(axis=0)))
+        middle = len(box) // 2
+        order = np.argpartition(box[:, channel], middle)
+        for half in (box[order[:middle]], box[order[middle:]]):
+            boxes.append(half)
+            scores.append(_box_score(half))
+    return np.array([box.mean(axis=0) for box in boxes]).round().astype(np.uint8)
+
+
+def _box_score(box):
+    if len(box) < 2:
+        return 0
+    spread = int((box.max(axis=0).astype(np.int16) - box.min(axis=0)).max())
+    return spread * np.sqrt(len(box))
+
+
+def build_lookup_table(palette, bits=QUANTIZER_LUT_BITS):
+    """Precomputes the nearest palette index for every cell of a (2**bits)^3 RGB grid."""
+    palette = np.asarray(palette, dtype=np.int32).reshape(-1, 3)
+    size = 1 << bits
+    levels = (np.arange(size, dtype=np.int32) << (8 - bits)) + (1 << (7 - bits))
+    grid = np.stack(np.meshgrid(levels, levels, levels, indexing='ij'), axis=-1).reshape(-1, 3)
+    lut = np.empty(len(grid), dtype=np.uint8)
+    chunk = 4096
+    for start in range(0, len(grid), chunk):
+        diff = grid[start:start + chunk, None, :] - palette[None, :, :]
+        lut[start:start + chunk] = np.einsum('ijk,ijk->ij', diff, diff).argmin(axis=1)
+    return lut
+
+
+def colour_histogram(frame):
+    """Normalised 64-bin (4x4x4) colour histogram of a subsampled frame, used for scene detection."""
+    small = np.asarray(frame)[::4, ::4, :3] >> 6
+    keys = (small[:, :, 0].astype(np.int32) << 4) | (small[:, :, 1].astype(np.int32) << 2) | small[:, :, 2]
+    hist = np.bincount(keys.ravel(), minlength=64).astype(np.float32)
+    return hist / max(hist.sum(), 1.0)
+
+
+class PaletteQuantizer:
+    """
+    Maps RGB frames onto one fixed palette through a precomputed lookup table.
+    The palette is reused for following frames until their colour histogram drifts
+    past SCENE_CHANGE_THRESHOLD from the frames it was built from.
+    """
+
+    def __init__(self, palette, reference_frame=None, dither=QUANTIZER_DITHER, lut_bits=QUANTIZER_LUT_BITS,
+                 scene_threshold=SCENE_CHANGE_THRESHOLD):
+        self.palette = np.asarray(palette, dtype=np.uint8).reshape(-1, 3)
+        self.dither = dither
+        self.lut_bits = lut_bits
+        self.scene_threshold = scene_threshold
+        self.lut = build_lookup_table(self.palette, lut_bits)
+        self.reference_histogram = colour_histogram(reference_frame) if reference_frame is not None else None
+        # Dither amplitude roughly matches the spacing between palette colours
+        self.dither_spread = 255.0 / max(np.cbrt(len(self.palette)), 1.0) * 0.25
+        self._pil_palette = None
+
+    @classmethod
+    def from_frames(cls, frames, max_colors=256, **kwargs):
+        palette = median_cut_palette(sample_pixels(frames), max_colors)
+        return cls(palette, reference_frame=frames[0], **kwargs)
+
+    def scene_changed(self, frame):
+        if self.reference_histogram is None:
+            return False
+        distance = float(np.abs(colour_histogram(frame) - self.reference_histogram).sum())
+        return distance > self.scene_threshold
+
+    def _lookup(self, rgb):
+        shift = 8 - self.lut_bits
+        rgb = rgb.astype(np.int32) >> shift
+        keys = (rgb[:, :, 0] << (2 * self.lut_bits)) | (rgb[:, :, 1] << self.lut_bits) | rgb[:, :, 2]
+        return self.lut[keys]
+
+    def map_frame(self, frame):
+        """Returns the frame as a 2-D uint8 array of palette indices."""
+        frame = np.asarray(frame)[:, :, :3]
+        if self.dither == 'floyd_steinberg':
+            # Error diffusion is inherently sequential; Pillow's C implementation does it per pixel
+            if self._pil_palette is None:
+                self._pil_palette = Image.new('P', (1, 1))
+                # Pad with the last colour so any padding index Pillow picks folds back onto it
+                padded = np.repeat(self.palette[-1:], 256, axis=0)
+                padded[:len(self.palette)] = self.palette
+                self._pil_palette.putpalette(padded.tobytes())
+            image = Image.fromarray(np.ascontiguousarray(frame, dtype=np.uint8))
+            quantized = image.quantize(palette=self._pil_palette, dither=Image.Dither.FLOYDSTEINBERG)
+            return np.minimum(np.asarray(quantized, dtype=np.uint8), len(self.palette) - 1)
+        if self.dither == 'ordered':
+            height, width = frame.shape[:2]
+            threshold = np.tile(_BAYER_8, ((height + 7) // 8, (width + 7) // 8))[:height, :width]
+            frame = np.clip(frame + (threshold * self.dither_spread)[:, :, None], 0, 255)
+        return self._lookup(frame)
@@ -0,0 +1,213 @@
+# In gif_writer.py
+import io
+import struct
+
+import numpy as np
+from PIL import Image
+
+
+def _table_bits(entries):
+    """Smallest GIF colour-table size exponent that holds the given number of entries."""
+    bits = 1
+    while (1 << bits) < entries:
+        bits += 1
+    return bits
+
+
+def _pad_palette(palette):
+    """Pads an (N, 3) palette to a power-of-two GIF colour table and returns (bytes, size exponent)."""
+    palette = np.asarray(palette, dtype=np.uint8).reshape(-1, 3)
+    bits = _table_bits(max(len(palette), 2))
+    table = np.zeros((1 << bits, 3), dtype=np.uint8)
+    table[:len(palette)] = palette
+    return table.tobytes(), bits
+
+
+def _skip_sub_blocks(data, pos):
+    while data[pos] != 0:
+        pos += data[pos] + 1
+    return pos + 1
+
+
+def encode_image_data(indices, palette):
+    """
+    LZW-compresses a 2-D array of palette indices with Pillow's C encoder and returns
+    the raw image data (LZW minimum code size plus data sub-blocks) for splicing into
+    another GIF stream.
+    """
+    height, width = indices.shape
+    image = Image.frombytes('P', (width, height), np.ascontiguousarray(indices, dtype=np.uint8).tobytes())
+    image.putpalette(np.asarray(palette, dtype=np.uint8).tobytes())
+    buffer = io.BytesIO()
+    # optimize=False keeps Pillow from renumbering the palette behind our back; the
+    # descriptor is rewritten by the caller, so the data must not be interlaced either
+    image.save(buffer, format='GIF', optimize=False, interlace=False)
+    data = buffer.getvalue()
+
+    pos = 13
+    if data[10] & 0x80:
+        pos += 3 << ((data[10] & 0x07) + 1)
+    while data[pos] != 0x2C:
+        if data[pos] != 0x21:
+            raise ValueError("Unexpected block in Pillow GIF output")
+        pos = _skip_sub_blocks(data, pos + 2)
+    packed = data[pos + 9]
+    pos += 10
+    if packed & 0x80:
+        pos += 3 << ((packed & 0x07) + 1)
+    end = _skip_sub_blocks(data, pos + 1)
+    return data[pos:end]
+
+
+class GifStreamWriter:
+    """
+    Writes a looping GIF89a stream frame by frame.
+
+    Frames are palette-index arrays; each may carry its own local palette, an offset
+    (for sub-rectangles) and a transparent index. Frame delays are tracked on an
+    exact timeline so rounding to centiseconds does not drift over long clips.
+    """
+
+    def __init__(self, output, width, height, global_palette, loop=0, write_header=True):
+        self._file = open(output, 'wb') if isinstance(output, str) else output
+        self._owns_file = isinstance(output, str)
+        self.width = width
+        self.height = height
+        self.frames_written = 0
+        self.bytes_written = 0
+        self._elapsed_cs = 0.0
+        self._written_cs = 0
+        self.global_palette = np.asarray(global_palette, dtype=np.uint8).reshape(-1, 3)
+        table, bits = _pad_palette(self.global_palette)
+        self._global_table = table
+
+        if write_header:
+            header = b'GIF89a' + struct.pack('<HHBBB', width, height, 0x80 | 0x70 | (bits - 1), 0, 0)
+            self._write(header + table)
+            if loop is not None:
+                self._write(b'\x21\xFF\x0BNETSCAPE2.0\x03\x01' + struct.pack('<H', loop) + b'\x00')
+
+    def _write(self, data):
+        self._file.write(data)
+        self.bytes_written += len(data)
+
+    def start_timeline_at(self, seconds):
+        """Continues the delay timeline from an offset, for writers that produce one segment of a stream."""
+        self._elapsed_cs = seconds * 100.0
+        self._written_cs = int(round(self._elapsed_cs))
+
+    def next_delay(self, duration_seconds):
+        """Centisecond delay for a frame of the given duration, carrying rounding error forward."""
+        self._elapsed_cs += duration_seconds * 100.0
+        delay = max(int(round(self._elapsed_cs)) - self._written_cs, 0)
+        self._written_cs += delay
+        return delay
+
+    def write_frame(self, indices, delay_cs, palette=None, left=0, top=0, transparent_index=None, disposal=1):
+        height, width = indices.shape
+        flags = (disposal & 0x07) << 2
+        if transparent_index is not None:
+            flags |= 0x01
+        self._write(b'\x21\xF9\x04' + struct.pack('<BHB', flags, min(delay_cs, 0xFFFF), transparent_index or 0) + b'\x00')
+
+        local_table = b''
+        packed = 0
+        encode_palette = self.global_palette
+        if palette is not None:
+            local_table, bits = _pad_palette(palette)
+            if local_table != self._global_table:
+                packed = 0x80 | (bits - 1)
+                encode_palette = palette
+            else:
+                local_table = b''
+        self._write(b'\x2C' + struct.pack('<HHHHB', left, top, width, height, packed) + local_table)
+        self._write(encode_image_data(indices, encode_palette))
+        self.frames_written += 1
+
+    def write_raw(self, data):
+        """Appends already-encoded frame blocks, e.g. a segment produced by another writer."""
+        self._write(data)
+
+    def close(self, write_trailer=True):
+        if write_trailer:
+            self._write(b'\x3B')
+        if self._owns_file:
+            self._file.close()
+
+
+class FrameDeltaWriter:
+    """
+    Front end for a GifStreamWriter that only writes what changed between frames.
+
+    A frame identical to the one on screen is dropped and its duration added to the
+    previous frame's delay. Otherwise only the bounding box of the changed pixels is
+    written, drawn over the previous frame (disposal 1). When at least min_unchanged
+    of the box did not change, those pixels are set to a transparent index so they
+    compress to long runs; in busier boxes the scattered transparent pixels break up
+    runs of real colour and cost more than they save.
+    Frames whose palette differs from the previous frame's are written in full, as
+    is every frame when enabled is False. All comparisons are vectorized over
+    palette indices.
+    """
+
+    def __init__(self, writer, enabled=True, transparency=True, min_unchanged=0.7):
+        self.writer = writer
+        self.enabled = enabled
+        self.transparency = transparency
+        self.min_unchanged = min_unchanged
+        self.frames_dropped = 0
+        self._canvas = None
+        self._canvas_palette = None
+        self._pending = None
+        self._pending_seconds = 0.0
+
+    def write_frame(self, indices, duration_seconds, palette=None):
+        indices = np.asarray(indices, dtype=np.uint8)
+        palette = self.writer.global_palette if palette is None else np.asarray(palette, dtype=np.uint8).reshape(-1, 3)
+        if not self.enabled or self._canvas is None or not np.array_equal(palette, self._canvas_palette):
+            self._queue(indices, palette, 0, 0, None)
+            self._canvas = indices.copy() if self.enabled else None
+            self._canvas_palette = palette
+        else:
+            changed = indices != self._canvas
+            rows = np.flatnonzero(changed.any(axis=1))
+            if len(rows) == 0:
+                self._pending_seconds += duration_seconds
+                self.frames_dropped += 1
+                return
+            cols = np.flatnonzero(changed.any(axis=0))
+            top, bottom, left, right = rows[0], rows[-1] + 1, cols[0], cols[-1] + 1
+            region = indices[top:bottom, left:right]
+            self._canvas[top:bottom, left:right] = region
+            transparent_index = None
+            region_changed = changed[top:bottom, left:right]
+            if self.transparency and 1.0 - region_changed.mean() >= self.min_unchanged:
+                transparent_index = self._free_index(region[region_changed], palette)
+                if transparent_index is not None:
+                    region = np.where(region_changed, region, np.uint8(transparent_index))
+            self._queue(region, palette, int(left), int(top), transparent_index)
+        self._pending_seconds = duration_seconds
+
+    @staticmethod
+    def _free_index(opaque_indices, palette):
+        """A colour-table index no opaque pixel uses, or None if the padded table is full."""
+        table_size = 1 << _table_bits(max(len(palette), 2))
+        unused = np.flatnonzero(np.bincount(opaque_indices.ravel(), minlength=table_size)[:table_size] == 0)
+        return int(unused[0]) if len(unused) else None
+
+    def _queue(self, indices, palette, left, top, transparent_index):
+        # A frame's delay is only known once the next distinct frame arrives
+        self._flush()
+        self._pending = (indices, palette, left, top, transparent_index)
+
+    def _flush(self):
+        if self._pending is None:
+            return
+        indices, palette, left, top, transparent_index = self._pending
+        self.writer.write_frame(indices, self.writer.next_delay(self._pending_seconds), palette=palette,
+                                left=left, top=top, transparent_index=transparent_index)
+        self._pending = None
+
+    def close(self, write_trailer=True):
+        self._flush()
+        self.writer.close(write_trailer=write_trailer)
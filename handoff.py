@@ -0,0 +1,213 @@
+# In handoff.py
+import os
+import json
+import time
+import shutil
+import socket
+import hashlib
+
+
+# --- Configuration ---
+# Hand uploads to a worker on the same host through a shared directory instead of object storage
+HANDOFF_ENABLED = os.environ.get('HANDOFF_ENABLED', '1') == '1'
+HANDOFF_DIR = os.environ.get('HANDOFF_DIR', '/tmp/handoff')
+HANDOFF_MAX_AGE_SECONDS = int(os.environ.get('HANDOFF_MAX_AGE_SECONDS', 6 * 3600))
+# A staged job no local worker has claimed after this long is sent through object storage instead
+HANDOFF_REROUTE_SECONDS = int(os.environ.get('HANDOFF_REROUTE_SECONDS', 120))
+NODE_ID = os.environ.get('NODE_ID', socket.gethostname())
+HASH_CHUNK_SIZE = 1024 * 1024
+
+_MARKER_PREFIX = f'.worker-{NODE_ID}-'
+
+
+def local_queue_name(queue):
+    """
+    Host-specific variant of a queue. Only workers on this host consume it, so a
+    handed-off file is always on their disk.
+    """
+    return f'handoff.{NODE_ID}.{queue}'
+
+
+def _marker_path(pid):
+    return os.path.join(HANDOFF_DIR, f'{_MARKER_PREFIX}{pid}.json')
+
+
+def mark_worker_alive(queues):
+    """Called by a worker's main process once it is consuming, advertising the handoff queues it serves."""
+    os.makedirs(HANDOFF_DIR, exist_ok=True)
+    marker_path = _marker_path(os.getpid())
+    with open(marker_path + '.tmp', 'w') as f:
+        json.dump({'pid': os.getpid(), 'node': NODE_ID, 'queues': list(queues)}, f)
+    os.replace(marker_path + '.tmp', marker_path)
+
+
+def mark_worker_stopped():
+    marker_path = _marker_path(os.getpid())
+    if os.path.exists(marker_path):
+        os.remove(marker_path)
+
+
+def _pid_running(pid):
+    try:
+        os.kill(pid, 0)
+    except PermissionError:
+        return True  # running under another user
+    except (OSError, TypeError):
+        return False
+    return True
+
+
+def local_worker_alive(queue):
+    """True if a running worker on this host has advertised the handoff variant of queue."""
+    if not os.path.isdir(HANDOFF_DIR):
+        return False
+    for filename in os.listdir(HANDOFF_DIR):
+        if not (filename.startswith(_MARKER_PREFIX) and filename.endswith('.json')):
+            continue
+        try:
+            with open(os.path.join(HANDOFF_DIR, filename)) as f:
+                marker = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if local_queue_name(queue) in marker.get('queues', ()) and _pid_running(marker.get('pid')):
+            return True
+    return False
+
+
+def stage(local_path, digest):
+    """
+    Moves a finished upload into the handoff directory and returns the handoff
+    reference for the task. The file is fsynced under a temporary name and only
+    renamed into place once complete, so a worker never sees a partial file.
+    """
+    os.makedirs(HANDOFF_DIR, exist_ok=True)
+    staged_path = os.path.join(HANDOFF_DIR, os.path.basename(local_path))
+    temp_path = staged_path + '.part'
+    try:
+        os.replace(local_path, temp_path)
+    except OSError:
+        # Different filesystem: copy instead of renaming
+        shutil.copyfile(local_path, temp_path)
+        os.remove(local_path)
+    with open(temp_path, 'rb') as f:
+        os.fsync(f.fileno())
+    os.replace(temp_path, staged_path)
+    return {'node': NODE_ID, 'path': staged_path, 'size': os.path.getsize(staged_path), 'sha256': digest}
+
+
+def claim(handoff, destination_path):
+    """
+    Verifies a staged file against its recorded size and SHA-256 and takes ownership
+    of it by renaming it to destination_path. Raises if the file is not on this node
+    or does not match.
+    """
+    path = handoff['path']
+    if not os.path.isfile(path) and os.path.isfile(destination_path):
+        # Redelivered after a worker crash: the file was already claimed on this host
+        path = destination_path
+    if handoff.get('node') != NODE_ID or not os.path.isfile(path):
+        raise FileNotFoundError(f"Handoff file {path} from node {handoff.get('node')} is not available on {NODE_ID}")
+    if os.path.getsize(path) != handoff['size']:
+        raise ValueError(f"Handoff file {path} has the wrong size")
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    if digest.hexdigest() != handoff['sha256']:
+        raise ValueError(f"Handoff file {path} failed its integrity check")
+    if path != destination_path:
+        os.replace(path, destination_path)
+    return destination_path
+
+
+def _record_path(handoff):
+    return handoff['path'] + '.task.json'
+
+
+def _tombstone_path(handoff):
+    return handoff['path'] + '.rerouted'
+
+
+def record_task(handoff, task_name, task_id, args, task_kwargs, queue_class):
+    """
+    Saves what is needed to resubmit a staged job through object storage, in case
+    the local worker never claims it (see reroute_stale). args[0] is the job's blob name.
+    """
+    record = {'task_name': task_name, 'task_id': task_id, 'args': args, 'queue_class': queue_class,
+              'task_kwargs': {key: value for key, value in task_kwargs.items() if key != 'handoff_ref'},
+              'handoff': handoff}
+    path = _record_path(handoff)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(record, f)
+    os.replace(path + '.tmp', path)
+
+
+def forget_task(handoff):
+    """Drops a staged job's file and record, e.g. when its task could not be submitted."""
+    for path in (handoff['path'], _record_path(handoff)):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def was_rerouted(handoff):
+    """True if the staged job was resubmitted through storage; the handoff task must then do nothing."""
+    return os.path.exists(_tombstone_path(handoff))
+
+
+def reroute_stale(resubmit, max_age=HANDOFF_REROUTE_SECONDS):
+    """
+    Resubmits staged jobs that no local worker has claimed within max_age, e.g. because
+    this host's worker died. A tombstone is left before the file is taken with an atomic
+    rename, so a handoff task that starts at the same moment either claims the file
+    first or finds the tombstone and stands down. resubmit(record, path) uploads the
+    file and submits the task under its original ID. Returns the number rerouted.
+    """
+    if not os.path.isdir(HANDOFF_DIR):
+        return 0
+    cutoff = time.time() - max_age
+    rerouted = 0
+    for filename in os.listdir(HANDOFF_DIR):
+        record_path = os.path.join(HANDOFF_DIR, filename)
+        if not filename.endswith('.task.json') or os.path.getmtime(record_path) >= cutoff:
+            continue
+        with open(record_path) as f:
+            record = json.load(f)
+        staged_path = record['handoff']['path']
+        taken_path = staged_path + '.rerouting'
+        tombstone_path = _tombstone_path(record['handoff'])
+        shutil.copyfile(record_path, tombstone_path)
+        try:
+            os.replace(staged_path, taken_path)
+        except FileNotFoundError:
+            # Claimed by the worker
+            os.remove(tombstone_path)
+            os.remove(record_path)
+            continue
+        try:
+            resubmit(record, taken_path)
+        except Exception:
+            # Put the job back as it was; the next sweep tries again
+            os.replace(taken_path, staged_path)
+            os.remove(tombstone_path)
+            raise
+        os.remove(record_path)
+        if os.path.exists(taken_path):
+            os.remove(taken_path)
+        rerouted += 1
+    return rerouted
+
+
+def cleanup_stale(max_age=HANDOFF_MAX_AGE_SECONDS):
+    """Removes staged files whose task never ran. Returns the number removed."""
+    if not os.path.isdir(HANDOFF_DIR):
+        return 0
+    cutoff = time.time() - max_age
+    removed = 0
+    for filename in os.listdir(HANDOFF_DIR):
+        path = os.path.join(HANDOFF_DIR, filename)
+        if filename.startswith('.worker-') or not os.path.isfile(path):
+            continue
+        if os.path.getmtime(path) < cutoff:
+            os.remove(path)
+            removed += 1
+    return removed
@@ -0,0 +1,196 @@
+# In metrics.py
+import os
+import time
+import threading
+import contextlib
+
+
+# --- Configuration ---
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') == '1'
+METRICS_REDIS_URL = os.environ.get(
+    'METRICS_REDIS_URL', os.environ.get('CELERY_RESULT_BACKEND', 'redis://localhost:6379/0')
+)
+# Updates are buffered per process and written to Redis at most this often
+METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', 2.0))
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+# name -> (type, help, histogram buckets)
+METRICS = {
+    'gifconv_stage_seconds': ('histogram', 'Time spent in each conversion stage.', DURATION_BUCKETS),
+    'gifconv_http_request_seconds': ('histogram', 'Web request handling time by endpoint.', DURATION_BUCKETS),
+    'gifconv_task_queue_wait_seconds': ('histogram', 'Time from publishing a task to a worker starting it.',
+                                        DURATION_BUCKETS),
+    'gifconv_task_run_seconds': ('histogram', 'Task run time on the worker.', DURATION_BUCKETS),
+    'gifconv_tasks_total': ('counter', 'Finished tasks by outcome.', None),
+    'gifconv_bytes_in_total': ('counter', 'Bytes received: uploads and fetched source videos.', None),
+    'gifconv_bytes_out_total': ('counter', 'Bytes sent: stored results and responses.', None),
+    'gifconv_frames_encoded_total': ('counter', 'Frames written to output encoders.', None),
+    'gifconv_cache_lookups_total': ('counter', 'Cache lookups by cache and outcome.', None),
+}
+
+_KEY_PREFIX = 'metrics:'
+
+_pending = {}
+_pending_lock = threading.Lock()
+_last_flush = time.monotonic()
+_client = None
+_client_lock = threading.Lock()
+
+
+def _get_client():
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                import redis
+                _client = redis.Redis.from_url(METRICS_REDIS_URL, socket_timeout=2, socket_connect_timeout=2)
+    return _client
+
+
+def _label_string(labels):
+    def escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return ','.join(f'{name}="{escape(value)}"' for name, value in sorted(labels.items()))
+
+
+def _add(name, field, value):
+    global _last_flush
+    with _pending_lock:
+        _pending[(name, field)] = _pending.get((name, field), 0) + value
+        due = time.monotonic() - _last_flush >= METRICS_FLUSH_INTERVAL
+        if due:
+            _last_flush = time.monotonic()
+    if due:
+        flush()
+
+
+def inc(name, value=1, **labels):
+    """Adds value to a counter."""
+    if METRICS_ENABLED and value:
+        _add(name, _label_string(labels), value)
+
+
+def observe(name, value, **labels):
+    """Records one observation in a histogram."""
+    if not METRICS_ENABLED:
+        return
+    labels_string = _label_string(labels)
+    buckets = METRICS[name][2]
+    bucket = next((index for index, bound in enumerate(buckets) if value <= bound), len(buckets))
+    _add(name, f'{labels_string}|{bucket}', 1)
+    _add(name, f'{labels_string}|sum', value)
+
+
+def record_stage(stage, seconds, timings=None):
+    """Records a conversion stage's duration; also adds it to a per-task timings dict when given."""
+    observe('gifconv_stage_seconds', seconds, stage=stage)
+    if timings is not None:
+        timings[stage] = round(timings.get(stage, 0.0) + seconds, 4)
+
+
+@contextlib.contextmanager
+def span(stage, timings=None):
+    """Times the enclosed block as one conversion stage."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - started, timings)
+
+
+class Stopwatch:
+    """Accumulates time over many short intervals, e.g. per-frame decode and encode calls."""
+
+    def __init__(self):
+        self.seconds = 0.0
+        self._started = None
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.seconds += time.perf_counter() - self._started
+
+
+def flush():
+    """Writes this process's buffered updates to Redis. Failures drop the batch rather than block callers."""
+    with _pending_lock:
+        if not _pending:
+            return
+        batch = dict(_pending)
+        _pending.clear()
+    try:
+        pipe = _get_client().pipeline(transaction=False)
+        for (name, field), value in batch.items():
+            pipe.hincrbyfloat(_KEY_PREFIX + name, field, value)
+        pipe.execute()
+    except Exception as e:
+        print(f"Metrics flush failed: {e}")
+
+
+def _number(value):
+    value = float(value)
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+def _render_histogram(name, values, buckets):
+    series = {}
+    for field, value in values.items():
+        labels_string, _, part = field.rpartition('|')
+        series.setdefault(labels_string, {})[part] = float(value)
+    lines = []
+    for labels_string, parts in sorted(series.items()):
+        prefix = f'{labels_string},' if labels_string else ''
+        cumulative = 0.0
+        for index, bound in enumerate(buckets):
+            cumulative += parts.get(str(index), 0.0)
+            lines.append(f'{name}_bucket{{{prefix}le="{bound}"}} {_number(cumulative)}')
+        cumulative += parts.get(str(len(buckets)), 0.0)
+        lines.append(f'{name}_bucket{{{prefix}le="+Inf"}} {_number(cumulative)}')
+        suffix = f'{{{labels_string}}}' if labels_string else ''
+        lines.append(f'{name}_sum{suffix} {_number(parts.get("sum", 0.0))}')
+        lines.append(f'{name}_count{suffix} {_number(cumulative)}')
+    return lines
+
+
+def queue_depths(broker_url, queues):
+    """Messages waiting in each Redis broker queue, for the gifconv_queue_depth gauge."""
+    import redis
+    client = redis.Redis.from_url(broker_url, socket_timeout=2, socket_connect_timeout=2)
+    pipe = client.pipeline(transaction=False)
+    for queue in queues:
+        pipe.llen(queue)
+    return {queue: depth for queue, depth in zip(queues, pipe.execute())}
+
+
+def render(gauges=None):
+    """
+    The Prometheus text exposition of every process's flushed metrics, plus gauges
+    computed by the caller at scrape time: {name: (help, {label dict as tuple: value})}.
+    """
+    flush()
+    lines = []
+    client = _get_client()
+    pipe = client.pipeline(transaction=False)
+    for name in METRICS:
+        pipe.hgetall(_KEY_PREFIX + name)
+    for (name, (kind, help_text, buckets)), raw in zip(METRICS.items(), pipe.execute()):
+        values = {field.decode(): value.decode() for field, value in raw.items()}
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        if kind == 'histogram':
+            lines.extend(_render_histogram(name, values, buckets))
+        else:
+            for labels_string, value in sorted(values.items()):
+                suffix = f'{{{labels_string}}}' if labels_string else ''
+                lines.append(f'{name}{suffix} {_number(value)}')
+    for name, (help_text, samples) in (gauges or {}).items():
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} gauge')
+        for labels, value in samples.items():
+            labels_string = _label_string(dict(labels))
+            suffix = f'{{{labels_string}}}' if labels_string else ''
+            lines.append(f'{name}{suffix} {_number(value)}')
+    return '\n'.join(lines) + '\n'
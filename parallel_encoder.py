@@ -0,0 +1,126 @@
+# In parallel_encoder.py
+import os
+import io
+from contextlib import closing
+from concurrent.futures import ThreadPoolExecutor
+
+import gif_encoder
+import gif_quantizer
+import gif_writer
+import video_pipeline
+
+
+# --- Configuration ---
+SEGMENT_WORKERS = int(os.environ.get('SEGMENT_WORKERS', os.cpu_count() or 1))
+# Clips shorter than this many output frames are not worth splitting
+SEGMENT_MIN_FRAMES = int(os.environ.get('SEGMENT_MIN_FRAMES', 120))
+PALETTE_SAMPLE_FRAMES = int(os.environ.get('PALETTE_SAMPLE_FRAMES', 12))
+
+
+def should_parallelize(plan, encoder_name, workers=SEGMENT_WORKERS):
+    # Segments are quantized in-process against one shared palette, which only matches what the
+    # numpy encoder produces; ffmpeg's per-clip palettegen/paletteuse output has no segmented twin
+    return encoder_name == 'numpy' and workers > 1 and plan['frame_count'] >= SEGMENT_MIN_FRAMES
+
+
+def sub_plan(plan, first_frame, frame_count):
+    """Decode plan covering output frames [first_frame, first_frame + frame_count) of plan."""
+    seconds_per_frame = plan['speed'] / plan['fps']
+    start_time = plan['start_time'] + first_frame * seconds_per_frame
+    # One spare source frame of headroom so the fps filter never comes up a frame short
+    end_time = min(plan['end_time'], start_time + (frame_count + 1) * seconds_per_frame)
+    return dict(plan, start_time=start_time, end_time=end_time, frame_count=frame_count,
+                duration=frame_count / plan['fps'])
+
+
+def split_frames(frame_count, segments):
+    """Splits [0, frame_count) into contiguous (first_frame, count) ranges of near-equal size."""
+    segments = max(1, min(segments, frame_count))
+    base, extra = divmod(frame_count, segments)
+    ranges, first = [], 0
+    for index in range(segments):
+        count = base + (1 if index < extra else 0)
+        ranges.append((first, count))
+        first += count
+    return ranges
+
+
+def sample_frames(path, plan, count, executor, frame_filter=None):
+    """Decodes single frames spread evenly over the clip, each with its own fast input seek."""
+    def decode_one(first_frame):
+        with closing(video_pipeline.iter_frames(path, sub_plan(plan, first_frame, 1))) as frames:
+            frame = next(frames, None)
+        if frame is not None and frame_filter is not None:
+            frame = frame_filter(frame)
+        return frame
+
+    first_frames = sorted({int((k + 0.5) * plan['frame_count'] / count) for k in range(count)})
+    jobs = [executor.submit(decode_one, first_frame) for first_frame in first_frames]
+    return [frame for frame in (job.result() for job in jobs) if frame is not None]
+
+
+def _encode_segment(path, plan, first_frame, frame_count, quantizer, on_frame=None, frame_filter=None):
+    """Decodes and quantizes one segment, returning its encoded frame blocks without header or trailer."""
+    buffer = io.BytesIO()
+    stream = gif_writer.GifStreamWriter(buffer, plan['width'], plan['height'], quantizer.palette, write_header=False)
+    stream.start_timeline_at(first_frame / plan['fps'])
+    # A segment cannot see the frame before it, so its first frame is always written in full
+    writer = gif_writer.FrameDeltaWriter(stream, enabled=gif_encoder.GIF_FRAME_DELTAS)
+    written = 0
+    last_indices = None
+    with closing(video_pipeline.iter_frames(path, sub_plan(plan, first_frame, frame_count))) as frames:
+        for frame in frames:
+            if written == frame_count:
+                break
+            if frame_filter is not None:
+                frame = frame_filter(frame)
+            last_indices = quantizer.map_frame(frame)
+            writer.write_frame(last_indices, 1.0 / plan['fps'])
+            written += 1
+            if on_frame is not None:
+                on_frame()
+    if last_indices is None:
+        # Padding from nothing would silently drop this segment's span from the GIF
+        raise video_pipeline.DecodeError(f"Segment at frame {first_frame} of {path} decoded no frames")
+    # Pad a short segment by holding its last frame, so segment boundaries stay on the frame grid
+    while written < frame_count:
+        writer.write_frame(last_indices, 1.0 / plan['fps'])
+        written += 1
+    writer.close(write_trailer=False)
+    return buffer.getvalue(), written
+
+
+def encode_gif_parallel(path, plan, output_path, workers=SEGMENT_WORKERS, max_colors=gif_encoder.GIF_MAX_COLORS, on_frame=None,
+                        frame_filter=None):
+    """
+    Encodes a clip as a single GIF by splitting its frame range into segments that
+    are decoded and quantized concurrently against one shared global palette, then
+    concatenated behind a single header.
+
+    Uses threads rather than processes: prefork Celery children are daemonic and
+    cannot start process pools, and the heavy lifting (ffmpeg decoding in
+    subprocesses, NumPy lookups, Pillow's LZW encoder) runs outside the GIL.
+    on_frame is called from the segment threads after every encoded frame;
+    frame_filter (e.g. a text overlay blend) is applied to every decoded frame.
+    Returns the number of frames written.
+    """
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        samples = sample_frames(path, plan, PALETTE_SAMPLE_FRAMES, executor, frame_filter)
+        if not samples:
+            raise RuntimeError("Could not decode any frames to build the palette.")
+        palette = gif_quantizer.median_cut_palette(gif_quantizer.sample_pixels(samples), max_colors)
+        quantizer = gif_quantizer.PaletteQuantizer(palette)
+        jobs = [
+            executor.submit(_encode_segment, path, plan, first, count, quantizer, on_frame, frame_filter)
+            for first, count in split_frames(plan['frame_count'], workers)
+        ]
+        writer = gif_writer.GifStreamWriter(output_path, plan['width'], plan['height'], palette)
+        frames_written = 0
+        try:
+            for job in jobs:
+                data, written = job.result()
+                writer.write_raw(data)
+                frames_written += written
+        finally:
+            writer.close()
+    return frames_written
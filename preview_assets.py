@@ -0,0 +1,133 @@
+# In preview_assets.py
+import os
+import re
+import json
+import subprocess
+import tempfile
+
+import numpy as np
+from PIL import Image
+
+import video_pipeline
+
+
+# --- Configuration ---
+FFMPEG_BINARY = os.environ.get('FFMPEG_BINARY', 'ffmpeg')
+PREVIEW_PROXY_WIDTH = int(os.environ.get('PREVIEW_PROXY_WIDTH', 480))
+PREVIEW_PROXY_FPS = int(os.environ.get('PREVIEW_PROXY_FPS', 24))
+PREVIEW_PROXY_CRF = int(os.environ.get('PREVIEW_PROXY_CRF', 32))
+PREVIEW_PROXY_MAXRATE = os.environ.get('PREVIEW_PROXY_MAXRATE', '500k')
+SPRITE_THUMB_WIDTH = int(os.environ.get('SPRITE_THUMB_WIDTH', 160))
+SPRITE_COLUMNS = int(os.environ.get('SPRITE_COLUMNS', 10))
+SPRITE_MAX_THUMBS = int(os.environ.get('SPRITE_MAX_THUMBS', 100))
+STRIP_THUMBS = int(os.environ.get('STRIP_THUMBS', 12))
+STRIP_HEIGHT = int(os.environ.get('STRIP_HEIGHT', 48))
+JPEG_QUALITY = 70
+
+PROXY_NAME = 'proxy.mp4'
+SPRITE_NAME = 'sprite.jpg'
+STRIP_NAME = 'strip.jpg'
+MANIFEST_NAME = 'manifest.json'
+
+_PTS_TIME = re.compile(r'pts_time:\s*([-\d.]+)')
+
+
+def _even(value):
+    return max(2, int(round(value / 2)) * 2)
+
+
+def build_proxy(source_path, output_path, probe):
+    """
+    Low-bitrate, video-only H.264 copy for the crop and trim UI: at most
+    PREVIEW_PROXY_WIDTH wide, with a keyframe every second so scrubbing seeks fast.
+    Returns its (width, height).
+    """
+    width = _even(min(probe['width'], PREVIEW_PROXY_WIDTH))
+    height = _even(probe['height'] * width / probe['width'])
+    fps = min(PREVIEW_PROXY_FPS, int(round(probe['fps'] or PREVIEW_PROXY_FPS)))
+    subprocess.run([
+        FFMPEG_BINARY, '-nostdin', '-hide_banner', '-loglevel', 'error', '-y', '-i', source_path,
+        '-an', '-sn', '-vf', f'scale={width}:{height}:flags=bicubic,fps={fps}',
+        '-c:v', 'libx264', '-preset', 'veryfast', '-crf', str(PREVIEW_PROXY_CRF),
+        '-maxrate', PREVIEW_PROXY_MAXRATE, '-bufsize', PREVIEW_PROXY_MAXRATE,
+        '-g', str(fps), '-pix_fmt', 'yuv420p', '-movflags', '+faststart', output_path,
+    ], check=True, capture_output=True)
+    return width, height
+
+
+def keyframe_thumbnails(video_path, probe, width=SPRITE_THUMB_WIDTH):
+    """
+    (times, frames) of a video's keyframes scaled to width. Only keyframes are
+    decoded (-skip_frame nokey), so this costs a fraction of a full decode.
+    """
+    height = _even(probe['height'] * width / probe['width'])
+    frame_bytes = width * height * 3
+    with tempfile.TemporaryFile() as stderr_file:
+        result = subprocess.run([
+            FFMPEG_BINARY, '-nostdin', '-hide_banner', '-loglevel', 'info', '-skip_frame', 'nokey',
+            '-i', video_path, '-an', '-sn', '-vf', f'scale={width}:{height}:flags=bicubic,showinfo',
+            '-fps_mode', 'passthrough', '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-',
+        ], stdout=subprocess.PIPE, stderr=stderr_file, check=True)
+        stderr_file.seek(0)
+        times = [float(match) for match in _PTS_TIME.findall(stderr_file.read().decode(errors='replace'))]
+    count = min(len(times), len(result.stdout) // frame_bytes)
+    frames = np.frombuffer(result.stdout[:count * frame_bytes], dtype=np.uint8).reshape(count, height, width, 3)
+    return times[:count], frames
+
+
+def build_sprite(times, frames, output_path, max_thumbs=SPRITE_MAX_THUMBS, columns=SPRITE_COLUMNS):
+    """
+    Tiles keyframe thumbnails row by row into one JPEG, keeping at most max_thumbs
+    spread evenly over the clip. Returns the sprite layout for the client.
+    """
+    if len(frames) > max_thumbs:
+        keep = np.linspace(0, len(frames) - 1, max_thumbs).round().astype(int)
+        times, frames = [times[index] for index in keep], frames[keep]
+    height, width = frames.shape[1:3]
+    columns = min(columns, len(frames))
+    rows = -(-len(frames) // columns)
+    sheet = np.zeros((rows * height, columns * width, 3), dtype=np.uint8)
+    for index, frame in enumerate(frames):
+        row, column = divmod(index, columns)
+        sheet[row * height:(row + 1) * height, column * width:(column + 1) * width] = frame
+    Image.fromarray(sheet).save(output_path, quality=JPEG_QUALITY, optimize=True)
+    return {'columns': columns, 'rows': rows, 'thumb_width': width, 'thumb_height': height,
+            'times': [round(time, 3) for time in times]}
+
+
+def build_strip(times, frames, duration, output_path, count=STRIP_THUMBS, height=STRIP_HEIGHT):
+    """Timeline strip: the keyframe nearest each of count evenly spaced times, side by side."""
+    targets = (np.arange(count) + 0.5) * duration / count
+    nearest = np.abs(np.asarray(times)[None, :] - targets[:, None]).argmin(axis=1)
+    width = _even(frames.shape[2] * height / frames.shape[1])
+    tiles = [np.asarray(Image.fromarray(frames[index]).resize((width, height), Image.BICUBIC)) for index in nearest]
+    Image.fromarray(np.concatenate(tiles, axis=1)).save(output_path, quality=JPEG_QUALITY, optimize=True)
+
+
+def generate(source_path, output_dir):
+    """
+    Writes the proxy video, sprite sheet, timeline strip and a manifest describing
+    them into output_dir. Returns the manifest.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    probe = video_pipeline.probe_video(source_path)
+    proxy_width, proxy_height = build_proxy(source_path, os.path.join(output_dir, PROXY_NAME), probe)
+    manifest = {
+        'width': proxy_width,
+        'height': proxy_height,
+        'source_width': probe['width'],
+        'source_height': probe['height'],
+        'duration': probe['duration'],
+        'sprite': None,
+        'strip': False,
+    }
+    # The proxy has a keyframe every second and small frames: denser and cheaper to scan than the source
+    proxy_probe = dict(probe, width=proxy_width, height=proxy_height)
+    times, frames = keyframe_thumbnails(os.path.join(output_dir, PROXY_NAME), proxy_probe)
+    if len(frames):
+        manifest['sprite'] = build_sprite(times, frames, os.path.join(output_dir, SPRITE_NAME))
+        build_strip(times, frames, probe['duration'], os.path.join(output_dir, STRIP_NAME))
+        manifest['strip'] = True
+    with open(os.path.join(output_dir, MANIFEST_NAME), 'w') as f:
+        json.dump(manifest, f)
+    return manifest
@@ -0,0 +1,160 @@
+# In progress_events.py
+import os
+import time
+import queue
+import threading
+import traceback
+
+
+# --- Configuration ---
+PROGRESS_MIN_INTERVAL = float(os.environ.get('PROGRESS_MIN_INTERVAL', 0.5))  # seconds between state writes per task
+PROGRESS_EVENTS_URL = os.environ.get(
+    'PROGRESS_EVENTS_URL', os.environ.get('CELERY_RESULT_BACKEND', 'redis://localhost:6379/0')
+)
+# Celery's Redis result backend publishes every state write on the key's own channel
+_CHANNEL_PREFIX = 'celery-task-meta-'
+TERMINAL_STATES = ('SUCCESS', 'FAILURE', 'REVOKED')
+
+
+class ProgressReporter:
+    """
+    Publishes structured progress for a running task through update_state.
+
+    Writes are throttled to one per PROGRESS_MIN_INTERVAL so per-frame calls cost a
+    clock read; stage changes are always written. Safe to call from encoder threads.
+    """
+
+    def __init__(self, task, min_interval=PROGRESS_MIN_INTERVAL):
+        self.task = task
+        self.min_interval = min_interval
+        self.stage = None
+        self.frames_done = 0
+        self.frames_total = 0
+        self._stage_started = time.monotonic()
+        self._last_sent = 0.0
+        self._lock = threading.Lock()
+
+    def set_stage(self, stage, frames_total=None):
+        with self._lock:
+            self.stage = stage
+            self.frames_done = 0
+            self.frames_total = frames_total or 0
+            self._stage_started = time.monotonic()
+            self._send(force=True)
+
+    def advance(self, frames=1):
+        with self._lock:
+            self.frames_done += frames
+            self._send()
+
+    def eta_seconds(self):
+        if not self.frames_total or not self.frames_done:
+            return None
+        elapsed = time.monotonic() - self._stage_started
+        remaining = max(self.frames_total - self.frames_done, 0)
+        return round(elapsed * remaining / self.frames_done, 1)
+
+    def _send(self, force=False):
+        now = time.monotonic()
+        if not force and now - self._last_sent < self.min_interval:
+            return
+        self._last_sent = now
+        meta = {
+            'stage': self.stage,
+            'frames_done': self.frames_done,
+            'frames_total': self.frames_total,
+            'eta_seconds': self.eta_seconds(),
+        }
+        try:
+            if self.task.request.id:
+                self.task.update_state(state='PROGRESS', meta=meta)
+        except Exception as e:
+            # Progress is best effort; never fail a conversion over it
+            print(f"Could not publish progress: {e}")
+
+
+class TaskEventListener:
+    """
+    One shared pattern subscription to the result backend per web process.
+
+    A background thread listens on celery-task-meta-* and hands decoded state
+    updates to the queues of whichever requests are watching that task, so open
+    event streams cost no Redis round-trips of their own.
+    """
+
+    def __init__(self, backend, url=PROGRESS_EVENTS_URL):
+        self.backend = backend
+        self.url = url
+        self._watchers = {}
+        self._lock = threading.Lock()
+        self._client = None
+        self._thread = None
+        self._pid = None
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            import redis
+            # Held on the listener: the subscription's connection closes when the client is collected
+            self._client = redis.Redis.from_url(self.url, socket_connect_timeout=2, health_check_interval=30)
+            pubsub = self._client.pubsub(ignore_subscribe_messages=True)
+            pubsub.psubscribe(f'{_CHANNEL_PREFIX}*')
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._listen, args=(pubsub,), daemon=True)
+            self._thread.start()
+
+    def _listen(self, pubsub):
+        try:
+            for message in pubsub.listen():
+                if message.get('type') != 'pmessage':
+                    continue
+                channel = message['channel']
+                if isinstance(channel, bytes):
+                    channel = channel.decode()
+                task_id = channel[len(_CHANNEL_PREFIX):]
+                with self._lock:
+                    watchers = list(self._watchers.get(task_id, ()))
+                if not watchers:
+                    continue
+                meta = self.backend.decode_result(message['data'])
+                for watcher in watchers:
+                    watcher.put((meta.get('status'), meta.get('result')))
+        except Exception as e:
+            print(f"Task event listener stopped: {e}\n{traceback.format_exc()}")
+        finally:
+            pubsub.close()
+            # Wake every open stream so clients reconnect or fall back to polling
+            with self._lock:
+                for watchers in self._watchers.values():
+                    for watcher in watchers:
+                        watcher.put(None)
+
+    def watch(self, task_id):
+        """Registers interest in a task and returns the queue its updates arrive on."""
+        self._ensure_started()
+        watcher = queue.Queue()
+        with self._lock:
+            self._watchers.setdefault(task_id, []).append(watcher)
+        return watcher
+
+    def unwatch(self, task_id, watcher):
+        with self._lock:
+            watchers = self._watchers.get(task_id, [])
+            if watcher in watchers:
+                watchers.remove(watcher)
+            if not watchers:
+                self._watchers.pop(task_id, None)
+
+
+_listener = None
+
+
+def get_listener(backend):
+    """Returns the process-wide listener, created on first use."""
+    global _listener
+    if _listener is None:
+        _listener = TaskEventListener(backend)
+    return _listener
@@ -0,0 +1,143 @@
+# In result_cache.py
+import os
+import json
+import time
+import hashlib
+import threading
+import traceback
+
+import metrics
+from conversion_options import options_fingerprint
+
+
+# --- Configuration ---
+RESULT_CACHE_ENABLED = os.environ.get('RESULT_CACHE_ENABLED', '1') == '1'
+RESULT_CACHE_URL = os.environ.get(
+    'RESULT_CACHE_URL', os.environ.get('CELERY_RESULT_BACKEND', 'redis://localhost:6379/0')
+)
+GIF_EXPIRY_SECONDS = int(os.environ.get('GIF_EXPIRY_SECONDS', 86400))  # GIFs are cleaned up after 24 hours
+# Entries expire this long before the GIF they point at can be deleted
+RESULT_CACHE_EXPIRY_MARGIN = int(os.environ.get('RESULT_CACHE_EXPIRY_MARGIN', 3600))
+RESULT_CACHE_MAX_ENTRIES = int(os.environ.get('RESULT_CACHE_MAX_ENTRIES', 5000))
+RESULT_CACHE_MAX_BYTES = int(os.environ.get('RESULT_CACHE_MAX_BYTES', 2 * 1024 * 1024 * 1024))
+HASH_CHUNK_SIZE = 1024 * 1024
+
+_ENTRY_PREFIX = 'gifcache:entry:'
+_INDEX_KEY = 'gifcache:index'  # sorted set of entry keys scored by creation time
+_SIZES_KEY = 'gifcache:sizes'  # hash of entry key -> GIF size in bytes
+_BYTES_KEY = 'gifcache:bytes'  # running total of _SIZES_KEY
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def _get_client():
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                import redis
+                _client = redis.Redis.from_url(RESULT_CACHE_URL, socket_timeout=2, socket_connect_timeout=2)
+    return _client
+
+
+def file_digest(path):
+    """Returns the SHA-256 hex digest of a file, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def save_stream_with_digest(stream, destination_path):
+    """Writes a binary stream to disk while hashing it, so uploads are only read once."""
+    digest = hashlib.sha256()
+    with open(destination_path, 'wb') as f:
+        for chunk in iter(lambda: stream.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+            f.write(chunk)
+    return digest.hexdigest()
+
+
+def cache_key(source_digest, options):
+    """Content-addressed key: source bytes hash plus the normalized option set."""
+    options_digest = hashlib.sha256(options_fingerprint(options).encode('utf-8')).hexdigest()
+    return f"{_ENTRY_PREFIX}{source_digest}:{options_digest}"
+
+
+def lookup(source_digest, options):
+    """Returns the cached task result for an identical conversion, or None."""
+    if not RESULT_CACHE_ENABLED or not source_digest:
+        return None
+    try:
+        raw = _get_client().get(cache_key(source_digest, options))
+        metrics.inc('gifconv_cache_lookups_total', cache='result', outcome='miss' if raw is None else 'hit')
+        if raw is None:
+            return None
+        result = json.loads(raw)
+        result['cached'] = True
+        return result
+    except Exception as e:
+        print(f"Result cache lookup failed: {e}")
+        return None
+
+
+def store(source_digest, options, result, gif_size_bytes):
+    """Caches a successful task result until shortly before its GIF expires, then evicts past the bounds."""
+    if not RESULT_CACHE_ENABLED or not source_digest:
+        return
+    ttl = GIF_EXPIRY_SECONDS - RESULT_CACHE_EXPIRY_MARGIN
+    if ttl <= 0:
+        return
+    try:
+        client = _get_client()
+        key = cache_key(source_digest, options)
+        now = time.time()
+        if client.zscore(_INDEX_KEY, key) is not None:
+            _remove(client, [key])
+        pipe = client.pipeline()
+        pipe.set(key, json.dumps(result), ex=ttl)
+        pipe.zadd(_INDEX_KEY, {key: now})
+        pipe.hset(_SIZES_KEY, key, int(gif_size_bytes))
+        pipe.incrby(_BYTES_KEY, int(gif_size_bytes))
+        pipe.execute()
+        _evict(client, now - ttl)
+    except Exception as e:
+        print(f"Result cache store failed: {e}\n{traceback.format_exc()}")
+
+
+def _evict(client, expired_before):
+    """Drops entries past their TTL, then the oldest ones until count and byte bounds hold."""
+    expired = client.zrangebyscore(_INDEX_KEY, '-inf', expired_before)
+    if expired:
+        _remove(client, expired)
+
+    total_entries = client.zcard(_INDEX_KEY)
+    total_bytes = int(client.get(_BYTES_KEY) or 0)
+    # Oldest entries are the closest to expiry anyway, so evict in creation order
+    victims = []
+    offset = 0
+    while total_entries > RESULT_CACHE_MAX_ENTRIES or total_bytes > RESULT_CACHE_MAX_BYTES:
+        batch = client.zrange(_INDEX_KEY, offset, offset + 99)
+        if not batch:
+            break
+        for key, size in zip(batch, client.hmget(_SIZES_KEY, batch)):
+            if total_entries <= RESULT_CACHE_MAX_ENTRIES and total_bytes <= RESULT_CACHE_MAX_BYTES:
+                break
+            total_entries -= 1
+            total_bytes -= int(size or 0)
+            victims.append(key)
+        offset += len(batch)
+    if victims:
+        _remove(client, victims)
+
+
+def _remove(client, keys):
+    sizes = client.hmget(_SIZES_KEY, keys)
+    pipe = client.pipeline()
+    pipe.delete(*keys)
+    pipe.zrem(_INDEX_KEY, *keys)
+    pipe.hdel(_SIZES_KEY, *keys)
+    pipe.decrby(_BYTES_KEY, sum(int(size or 0) for size in sizes))
+    pipe.execute()
@@ -0,0 +1,290 @@
+# In size_predictor.py
+import os
+import math
+import shutil
+import tempfile
+from contextlib import closing
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+import gif_encoder
+import gif_quantizer
+import gif_writer
+import parallel_encoder
+import video_pipeline
+
+
+# --- Configuration ---
+# Short bursts of consecutive frames decoded once and re-measured for every candidate
+TARGET_SAMPLE_WINDOWS = int(os.environ.get('TARGET_SAMPLE_WINDOWS', 4))
+TARGET_SAMPLE_BURST = int(os.environ.get('TARGET_SAMPLE_BURST', 6))
+# Seconds of output encoded with the real encoder to correct the sampled estimate
+TARGET_CALIBRATION_SECONDS = float(os.environ.get('TARGET_CALIBRATION_SECONDS', 2.0))
+# Aim this far below the target, since the estimate comes from a sample
+TARGET_SAFETY_MARGIN = float(os.environ.get('TARGET_SAFETY_MARGIN', 0.9))
+TARGET_MIN_WIDTH = int(os.environ.get('TARGET_MIN_WIDTH', 120))
+TARGET_MIN_FPS = int(os.environ.get('TARGET_MIN_FPS', 5))
+
+WIDTH_STEPS = (1920, 1280, 1080, 960, 800, 720, 640, 560, 480, 400, 360, 320, 280, 240, 200, 160, 120)
+FPS_STEPS = (30, 24, 20, 15, 12, 10, 8, 6, 5)
+COLOR_STEPS = (256, 128, 64, 32)
+REFERENCE_WIDTH = 480
+# Graphic control extension and image descriptor written ahead of every frame
+FRAME_OVERHEAD_BYTES = 18
+HEADER_BYTES = 800
+
+
+def _changed_rect_bytes(previous, current, palette):
+    """Encoded size of the rectangle that differs between two index frames, as diff_mode=rectangle writes it."""
+    changed = previous != current
+    rows = np.flatnonzero(changed.any(axis=1))
+    if len(rows) == 0:
+        return len(gif_writer.encode_image_data(current[:1, :1], palette))
+    cols = np.flatnonzero(changed.any(axis=0))
+    region = current[rows[0]:rows[-1] + 1, cols[0]:cols[-1] + 1]
+    return len(gif_writer.encode_image_data(region, palette))
+
+
+def _quality(plan, colors):
+    """
+    Relative quality of a candidate. Width and frame rate count about equally (halving
+    either costs a similar amount); each halving of the palette costs an eighth.
+    """
+    return plan['width'] * plan['fps'] ** 0.75 * math.log2(colors) / 8
+
+
+class SizePredictor:
+    """
+    Predicts the encoded size of a conversion at other widths, frame rates and
+    palette sizes without encoding the clip.
+
+    A few bursts of consecutive frames are decoded once at the requested size and
+    rate. For each candidate width and palette size the bursts are downscaled,
+    quantized and LZW-compressed with the same code the encoders use: the first
+    frame of a burst gives the cost of a full frame, later frames the cost of the
+    changed rectangle at each frame spacing (a lower frame rate is a wider spacing).
+    The per-frame costs are scaled to the candidate's frame count, and a single short
+    window encoded with the real encoder corrects for dithering and palette effects.
+    """
+
+    def __init__(self, path, options, encoder='ffmpeg', probe=None):
+        self.path = path
+        self.options = dict(options)
+        self.encoder = encoder
+        self.probe = probe or video_pipeline.probe_video(path)
+        self.plan = video_pipeline.build_decode_plan(options, self.probe)
+        self.correction = 1.0
+        self._calibrated = False
+        self._measurements = {}
+        self._scaled = {}
+
+        self.fps_steps = [self.plan['fps']] + [
+            fps for fps in FPS_STEPS if TARGET_MIN_FPS <= fps < self.plan['fps']
+        ]
+        self.width_steps = [self.plan['width']] + [
+            width for width in WIDTH_STEPS if TARGET_MIN_WIDTH <= width < self.plan['width']
+        ]
+        # Palette-size ratios are measured at a typical GIF width
+        self.reference_width = min(self.width_steps, key=lambda width: abs(width - REFERENCE_WIDTH))
+        self.spacings = sorted({max(1, round(self.plan['fps'] / fps)) for fps in self.fps_steps})
+        burst = min(TARGET_SAMPLE_BURST, self.spacings[-1] + 1, self.plan['frame_count'])
+        self.windows = self._decode_windows(burst)
+        if not self.windows:
+            raise RuntimeError("Could not decode any frames to predict the GIF size.")
+        pixels = gif_quantizer.sample_pixels([frame for window in self.windows for frame in window])
+        self._quantizers = {
+            colors: gif_quantizer.PaletteQuantizer(gif_quantizer.median_cut_palette(pixels, colors))
+            for colors in COLOR_STEPS
+        }
+
+    def _decode_windows(self, burst):
+        frame_count = self.plan['frame_count']
+        count = max(1, min(TARGET_SAMPLE_WINDOWS, frame_count // burst))
+        first_frames = sorted({
+            min(int((k + 0.5) * frame_count / count), frame_count - burst) for k in range(count)
+        })
+
+        def decode_window(first_frame):
+            plan = parallel_encoder.sub_plan(self.plan, first_frame, burst)
+            with closing(video_pipeline.iter_frames(self.path, plan)) as frames:
+                return [frame for _, frame in zip(range(burst), frames)]
+
+        with ThreadPoolExecutor(max_workers=parallel_encoder.SEGMENT_WORKERS) as executor:
+            windows = list(executor.map(decode_window, first_frames))
+        return [window for window in windows if window]
+
+    def candidate_plan(self, width, fps):
+        return video_pipeline.build_decode_plan(self.candidate_options(width, fps), self.probe)
+
+    def candidate_options(self, width, fps):
+        return dict(self.options, fps=str(fps), resize=str(width))
+
+    def _frames_at(self, width):
+        """The sampled windows downscaled to a candidate width."""
+        if width == self.plan['width']:
+            return self.windows
+        if width not in self._scaled:
+            # Scale down from the nearest larger size already computed rather than from full resolution
+            source_width = min([w for w in self._scaled if w > width], default=self.plan['width'])
+            source = self._scaled.get(source_width, self.windows)
+            height = max(1, int(round(self.plan['height'] * width / self.plan['width'])))
+            self._scaled[width] = [
+                [np.asarray(Image.fromarray(frame).resize((width, height), Image.BILINEAR, reducing_gap=2.0))
+                 for frame in window]
+                for window in source
+            ]
+        return self._scaled[width]
+
+    def _measure_at(self, width, colors):
+        """Mean encoded bytes of a full frame and of a changed rectangle per frame spacing."""
+        key = (width, colors)
+        if key not in self._measurements:
+            quantizer = self._quantizers[colors]
+            full_sizes, diff_sizes = [], {spacing: [] for spacing in self.spacings}
+            for window in self._frames_at(width):
+                indices = [quantizer.map_frame(frame) for frame in window]
+                full_sizes.append(len(gif_writer.encode_image_data(indices[0], quantizer.palette)))
+                for spacing in self.spacings:
+                    if spacing < len(indices):
+                        diff_sizes[spacing].append(_changed_rect_bytes(indices[0], indices[spacing], quantizer.palette))
+            self._measurements[key] = (
+                float(np.mean(full_sizes)),
+                {spacing: float(np.mean(sizes)) for spacing, sizes in diff_sizes.items() if sizes},
+            )
+        return self._measurements[key]
+
+    def _measure(self, width, colors):
+        """
+        Frame costs at a width and palette size. Every width is measured with the full
+        palette; smaller palettes scale those by the ratio measured once at a reference
+        width, which keeps the number of quantize-and-compress passes low.
+        """
+        full_bytes, diff_bytes = self._measure_at(width, COLOR_STEPS[0])
+        if colors == COLOR_STEPS[0]:
+            return full_bytes, diff_bytes
+        reference_full, reference_diff = self._measure_at(self.reference_width, COLOR_STEPS[0])
+        reduced_full, reduced_diff = self._measure_at(self.reference_width, colors)
+        return (
+            full_bytes * reduced_full / reference_full,
+            {spacing: size * reduced_diff[spacing] / max(reference_diff[spacing], 1.0)
+             for spacing, size in diff_bytes.items()},
+        )
+
+    def _writes_rectangles(self):
+        # MoviePy's imageio writer stores full frames; the other encoders write changed rectangles
+        return self.encoder != 'imageio' and gif_encoder.GIF_FRAME_DELTAS
+
+    def _raw_bytes(self, plan, colors, frame_count):
+        full_bytes, diff_bytes = self._measure(plan['width'], colors)
+        spacing = max(1, round(self.plan['fps'] / plan['fps']))
+        frame_bytes = full_bytes
+        if self._writes_rectangles() and spacing in diff_bytes:
+            frame_bytes = diff_bytes[spacing]
+        header_bytes = HEADER_BYTES + 3 * (1 << gif_writer._table_bits(colors))
+        return header_bytes + full_bytes + (frame_count - 1) * (frame_bytes + FRAME_OVERHEAD_BYTES)
+
+    def predict(self, width, fps, colors):
+        """Predicted GIF size in bytes for the clip at the given width, frame rate and palette size."""
+        plan = self.candidate_plan(width, fps)
+        return int(self.correction * self._raw_bytes(plan, colors, plan['frame_count']))
+
+    def _widest_under(self, fps, colors, budget, high):
+        """
+        Index of the widest candidate width predicted to fit the budget, by binary
+        search over width_steps[:high + 1] (size falls with width). None if none fits.
+        """
+        low, found = 0, None
+        while low <= high:
+            middle = (low + high) // 2
+            if self.predict(self.width_steps[middle], fps, colors) <= budget:
+                found, high = middle, middle - 1
+            else:
+                low = middle + 1
+        return found
+
+    def _search(self, target_bytes):
+        budget = target_bytes * TARGET_SAFETY_MARGIN
+        best, best_quality = None, -1.0
+        # Size also falls with frame rate and palette size, so a setting that is lower in
+        # either can fit at least the width the higher one did: only narrower widths need searching
+        narrowest = len(self.width_steps) - 1
+        previous_row = None
+        for colors in COLOR_STEPS:
+            row = []
+            for fps in self.fps_steps:
+                bounds = [narrowest] + row[-1:] + ([previous_row[len(row)]] if previous_row else [])
+                index = self._widest_under(fps, colors, budget, min(bounds))
+                row.append(narrowest if index is None else index)
+                if index is None:
+                    continue
+                width = self.width_steps[index]
+                quality = _quality(self.candidate_plan(width, fps), colors)
+                if quality > best_quality:
+                    best, best_quality = (width, fps, colors), quality
+            previous_row = row
+        if best is None:
+            # Nothing fits: return the smallest setting and let the caller report the miss
+            return self._choice(self.width_steps[-1], self.fps_steps[-1], COLOR_STEPS[-1], target_bytes)
+        return self._choice(*best, target_bytes)
+
+    def _choice(self, width, fps, colors, target_bytes):
+        plan = self.candidate_plan(width, fps)
+        predicted = self.predict(width, fps, colors)
+        return {
+            'width': plan['width'],
+            'height': plan['height'],
+            'fps': plan['fps'],
+            'colors': colors,
+            'predicted_bytes': predicted,
+            'fits': predicted <= target_bytes,
+            'options': self.candidate_options(width, fps),
+        }
+
+    def _encode_window(self, choice):
+        """Encodes a short window from the middle of the clip at the chosen settings; returns (bytes, frames)."""
+        plan = self.candidate_plan(choice['width'], choice['fps'])
+        frame_count = min(plan['frame_count'], max(2, int(TARGET_CALIBRATION_SECONDS * plan['fps'])))
+        window_plan = parallel_encoder.sub_plan(plan, (plan['frame_count'] - frame_count) // 2, frame_count)
+        # The numpy encoder is also the closest in-process match for imageio
+        encoder_name = 'ffmpeg' if self.encoder == 'ffmpeg' else 'numpy'
+        scratch_dir = tempfile.mkdtemp(prefix='size-calibration-')
+        try:
+            output_path = os.path.join(scratch_dir, 'window.gif')
+            encoder = gif_encoder.create_encoder(encoder_name, output_path, plan['width'], plan['height'], plan['fps'],
+                                                 max_colors=choice['colors'])
+            try:
+                with closing(video_pipeline.iter_frames(self.path, window_plan)) as frames:
+                    for frame in frames:
+                        encoder.write_frame(frame)
+            except Exception:
+                encoder.abort()
+                raise
+            written = encoder.frames_written
+            encoder.close()
+            return os.path.getsize(output_path), written
+        finally:
+            shutil.rmtree(scratch_dir, ignore_errors=True)
+
+    def fit(self, target_bytes):
+        """
+        Picks the highest-quality width, frame rate and palette size predicted to fit
+        target_bytes. The first call calibrates against one short real encode and
+        searches again. Returns the choice, including the options to render it with.
+        """
+        choice = self._search(target_bytes)
+        if not self._calibrated:
+            self._calibrated = True
+            actual_bytes, frames = self._encode_window(choice)
+            if frames:
+                plan = self.candidate_plan(choice['width'], choice['fps'])
+                raw_bytes = self._raw_bytes(plan, choice['colors'], frames)
+                self.correction = min(max(actual_bytes / raw_bytes, 0.25), 4.0)
+                choice = self._search(target_bytes)
+        return choice
+
+    def observe(self, choice, actual_bytes):
+        """Folds the size of a full encode back into the correction, for a retry when it missed."""
+        if choice['predicted_bytes'] > 0:
+            self.correction *= actual_bytes / choice['predicted_bytes']
@@ -21,6 +21,7 @@ document.addEventListener('DOMContentLoaded', () => {
     const loadingText = loadingDiv.querySelector('p');
     const gifContainer = document.getElementById('gif-container');
     const gifResult = document.getElementById('gif-result');
+    const videoResult = document.getElementById('video-result');
     const downloadBtn = document.getElementById('download-btn');
     const submitBtn = document.getElementById('submit-btn');
     const errorMessageDiv = document.getElementById('error-message');
@@ -55,6 +56,9 @@ document.addEventListener('DOMContentLoaded', () => {
         localStorage.setItem('gifHistory', JSON.stringify(history));
     };
 
+    // MP4 results play in a <video> element; GIF, WebP and APNG display as images
+    const isVideoUrl = (url) => new URL(url, window.location.href).pathname.toLowerCase().endsWith('.mp4');
+
     const renderHistory = () => {
         if (!historyList) return;
         historyList.innerHTML = '';
@@ -63,8 +67,12 @@ document.addEventListener('DOMContentLoaded', () => {
             history.forEach(item => {
                 const historyItem = document.createElement('div');
                 historyItem.className = 'history-item flex flex-col sm:flex-row items-center p-3 bg-white dark:bg-gray-800 rounded-lg shadow hover:shadow-md transition-shadow duration-150 ease-in-out';
+                const thumbnailClass = 'history-thumbnail w-24 h-24 sm:w-20 sm:h-20 object-contain rounded-md mb-2 sm:mb-0 sm:mr-4 bg-gray-100 dark:bg-gray-700';
+                const thumbnail = isVideoUrl(item.url)
+                    ? `<video src="${item.url}" class="${thumbnailClass}" autoplay loop muted playsinline></video>`
+                    : `<img src="${item.url}" alt="Recent GIF" class="${thumbnailClass}">`;
                 historyItem.innerHTML = `
-                    <img src="${item.url}" alt="Recent GIF" class="history-thumbnail w-24 h-24 sm:w-20 sm:h-20 object-contain rounded-md mb-2 sm:mb-0 sm:mr-4 bg-gray-100 dark:bg-gray-700">
+                    ${thumbnail}
                     <div class="history-info text-center sm:text-left">
                         <a href="${item.url}" download class="text-blue-600 dark:text-blue-400 hover:underline font-semibold block mb-1">Download GIF</a>
                         <p class="text-xs text-gray-500 dark:text-gray-400">Dimensions: ${item.width} x ${item.height}px</p>
@@ -120,7 +128,9 @@ document.addEventListener('DOMContentLoaded', () => {
         if(fileNameDisplay) fileNameDisplay.textContent = file.name;
         
         // Show video preview first
+        hidePreviewTimeline();
         if (videoPreview) {
+            videoPreview.removeAttribute('crossorigin');
             videoPreview.src = URL.createObjectURL(file);
             videoPreview.onloadedmetadata = () => {
                 if (startTimeInput) startTimeInput.value = 0;
@@ -132,7 +142,75 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     };
 
+    // --- Preview Timeline (URL previews) ---
+    const previewTimeline = document.getElementById('preview-timeline');
+    const previewStrip = document.getElementById('preview-strip');
+    const previewThumb = document.getElementById('preview-thumb');
+    let previewSprite = null;
+
+    const hidePreviewTimeline = () => {
+        previewTimeline?.classList.add('hidden');
+        previewSprite = null;
+    };
+
+    const showPreviewTimeline = (result) => {
+        if (!previewTimeline || !result.strip_url) return;
+        previewSprite = result.sprite_url ? { url: result.sprite_url, ...result.sprite } : null;
+        previewStrip.src = result.strip_url;
+        previewTimeline.classList.remove('hidden');
+    };
+
+    const timelineTime = (event) => {
+        const rect = previewTimeline.getBoundingClientRect();
+        const fraction = Math.min(Math.max((event.clientX - rect.left) / rect.width, 0), 1);
+        return { x: event.clientX - rect.left, width: rect.width, time: fraction * (videoPreview.duration || 0) };
+    };
+
+    if (previewTimeline && videoPreview) {
+        previewTimeline.addEventListener('mousemove', (event) => {
+            if (!previewSprite || !previewSprite.times.length) return;
+            const { x, width, time } = timelineTime(event);
+            // Nearest keyframe thumbnail in the sprite sheet
+            let index = 0;
+            previewSprite.times.forEach((t, i) => {
+                if (Math.abs(t - time) < Math.abs(previewSprite.times[index] - time)) index = i;
+            });
+            const column = index % previewSprite.columns;
+            const row = Math.floor(index / previewSprite.columns);
+            const w = previewSprite.thumb_width;
+            const h = previewSprite.thumb_height;
+            Object.assign(previewThumb.style, {
+                width: `${w}px`,
+                height: `${h}px`,
+                left: `${Math.min(Math.max(x - w / 2, 0), Math.max(width - w, 0))}px`,
+                backgroundImage: `url("${previewSprite.url}")`,
+                backgroundPosition: `-${column * w}px -${row * h}px`,
+            });
+            previewThumb.classList.remove('hidden');
+        });
+        previewTimeline.addEventListener('mouseleave', () => previewThumb.classList.add('hidden'));
+        previewTimeline.addEventListener('click', (event) => {
+            videoPreview.currentTime = timelineTime(event).time;
+        });
+    }
+
     // --- URL Upload & Preview Logic (Two-Step) ---
+    // A worker fetches a small preview copy; poll its task until the preview URL is ready.
+    // Gives up after PREVIEW_TIMEOUT_MS (the task's time limit plus time queued) so a lost task never spins forever
+    const PREVIEW_TIMEOUT_MS = 5 * 60 * 1000;
+    async function waitForPreview(taskId) {
+        const deadline = Date.now() + PREVIEW_TIMEOUT_MS;
+        while (Date.now() < deadline) {
+            await new Promise((resolve) => setTimeout(resolve, 1500));
+            const response = await fetch(`/status/${taskId}`);
+            const data = await response.json();
+            if (data.status === 'SUCCESS' || data.status === 'FAILURE' || data.state === 'FAILURE') {
+                return data;
+            }
+        }
+        return { status: 'FAILURE', error: 'Fetching the video preview took too long. Please try again.' };
+    }
+
     const urlInput = document.getElementById('video-url');
     if (urlInput && submitBtn) {
         urlInput.addEventListener('change', async function() {
@@ -148,11 +226,17 @@ document.addEventListener('DOMContentLoaded', () => {
                 const formData = new FormData();
                 formData.append('video_url', url);
                 const response = await fetch('/upload_url', { method: 'POST', body: formData });
-                const result = await response.json();
+                let result = await response.json();
+                if (response.ok && result.task_id) {
+                    result = await waitForPreview(result.task_id);
+                }
                 if (response.ok && result.preview_url) {
-                    // Show preview using backend-served temp file
+                    // Show the proxy; crop values drawn on it are scaled to the source by the worker
                     if (videoPreview) {
+                        // Storage serves it cross-origin; CORS keeps the crop canvas readable
+                        videoPreview.crossOrigin = 'anonymous';
                         videoPreview.src = result.preview_url;
+                        showPreviewTimeline(result);
                         videoPreview.onloadedmetadata = () => {
                             if (startTimeInput) startTimeInput.value = 0;
                             if (endTimeInput) endTimeInput.value = Math.floor(videoPreview.duration);
@@ -279,57 +363,151 @@ document.addEventListener('DOMContentLoaded', () => {
     }
 
     // --- Polling and Form Submit Logic ---
+    let pendingAdjustments = [];
+
+    function showGifResult(data) {
+        hideElement(loadingDiv);
+        submitBtn.disabled = false;
+        submitBtn.textContent = 'Convert to GIF';
+
+        // Set the image (or video) source to the direct GCS URL for viewing
+        if (isVideoUrl(data.gif_url)) {
+            gifResult.classList.add('hidden');
+            gifResult.removeAttribute('src');
+            videoResult.src = data.gif_url;
+            videoResult.classList.remove('hidden');
+        } else {
+            videoResult.classList.add('hidden');
+            videoResult.removeAttribute('src');
+            gifResult.src = data.gif_url;
+            gifResult.classList.remove('hidden');
+        }
+
+        // Extract the filename from the full GCS URL
+        const gcsUrl = new URL(data.gif_url);
+        const filename = gcsUrl.pathname.split('/').pop();
+
+        // Point the download button to your Flask download route
+        downloadBtn.href = `/download_gif/${filename}`;
+        downloadBtn.setAttribute('download', filename);
+
+        gifDimensions.textContent = `Dimensions: ${data.width}px x ${data.height}px`;
+        if (data.chosen) {
+            // Target-size mode: show what the worker picked to fit the limit
+            gifDimensions.textContent += `, ${(data.bytes / 1048576).toFixed(1)} MB at ${data.chosen.fps} FPS, ${data.chosen.colors} colours`;
+        }
+        if (pendingAdjustments.length) {
+            // The server scaled the job down to fit its processing budget
+            gifDimensions.textContent += ` (${pendingAdjustments.join(', ')})`;
+            pendingAdjustments = [];
+        }
+        showElement(gifContainer);
+
+        saveToHistory({ url: data.gif_url, width: data.width, height: data.height });
+        renderHistory();
+    }
+
+    function showTaskFailure(message) {
+        hideElement(loadingDiv);
+        submitBtn.disabled = false;
+        submitBtn.textContent = 'Convert to GIF';
+        errorMessageDiv.textContent = message;
+        showElement(errorMessageDiv);
+    }
+
+    // Applies one status payload; returns true once the task has finished
+    function handleTaskStatus(data) {
+        if (data.status === 'SUCCESS') {
+            showGifResult(data);
+            return true;
+        }
+        if (data.state === 'FAILURE' || data.status === 'FAILURE') {
+            showTaskFailure(data.error || 'Conversion failed in the background.');
+            return true;
+        }
+        if (loadingText) {
+            if (data.state === 'PROGRESS' && data.stage) {
+                let text = data.stage.charAt(0).toUpperCase() + data.stage.slice(1);
+                if (data.frames_total) {
+                    text += ` ${Math.min(data.frames_done, data.frames_total)}/${data.frames_total} frames`;
+                }
+                if (data.eta_seconds != null) {
+                    text += ` (about ${Math.ceil(data.eta_seconds)}s left)`;
+                }
+                loadingText.textContent = text;
+            } else {
+                loadingText.textContent = data.status || 'Processing...';
+            }
+        }
+        return false;
+    }
+
     function pollTaskStatus(taskId) {
         const interval = setInterval(async () => {
             try {
                 const response = await fetch(`/status/${taskId}`);
                 const data = await response.json();
-
-                if (data.status === 'SUCCESS') {
+                if (handleTaskStatus(data)) {
                     clearInterval(interval);
-                    hideElement(loadingDiv);
-                    submitBtn.disabled = false;
-                    submitBtn.textContent = 'Convert to GIF';
-                    
-                    // Set the image source to the direct GCS URL for viewing
-                    gifResult.src = data.gif_url;
-                    
-                    // --- THIS IS THE MODIFIED PART ---
-                    // Extract the filename from the full GCS URL
-                    const gcsUrl = new URL(data.gif_url);
-                    const filename = gcsUrl.pathname.split('/').pop();
-
-                    // Point the download button to your Flask download route
-                    downloadBtn.href = `/download_gif/${filename}`;
-                    // --- END OF MODIFIED PART ---
-                    
-                    gifDimensions.textContent = `Dimensions: ${data.width}px x ${data.height}px`;
-                    showElement(gifContainer);
-                    
-                    saveToHistory({ url: data.gif_url, width: data.width, height: data.height });
-                    renderHistory();
-
-                } else if (data.state === 'FAILURE') {
-                    clearInterval(interval);
-                    hideElement(loadingDiv);
-                    submitBtn.disabled = false;
-                    submitBtn.textContent = 'Convert to GIF';
-                    errorMessageDiv.textContent = data.error || 'Conversion failed in the background.';
-                    showElement(errorMessageDiv);
-                } else {
-                    if (loadingText) loadingText.textContent = data.status || 'Processing...';
                 }
             } catch (error) {
                 clearInterval(interval);
-                hideElement(loadingDiv);
-                submitBtn.disabled = false;
-                submitBtn.textContent = 'Convert to GIF';
-                errorMessageDiv.textContent = 'Error checking task status.';
-                showElement(errorMessageDiv);
+                showTaskFailure('Error checking task status.');
             }
         }, 2500);
     }
 
+    // Server-sent events push every progress update; polling is the fallback
+    function watchTaskStatus(taskId) {
+        if (!window.EventSource) {
+            pollTaskStatus(taskId);
+            return;
+        }
+        let finished = false;
+        const source = new EventSource(`/events/${taskId}`);
+        source.onmessage = (event) => {
+            if (handleTaskStatus(JSON.parse(event.data))) {
+                finished = true;
+                source.close();
+            }
+        };
+        source.onerror = () => {
+            source.close();
+            if (!finished) pollTaskStatus(taskId);
+        };
+    }
+
+    // Sends the file straight to storage in chunks, then asks the server to enqueue the conversion.
+    // Resolves to null when direct uploads are unavailable so the caller can fall back to /convert.
+    async function uploadDirect(file, formData) {
+        const sessionResponse = await fetch('/uploads', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ filename: file.name, size: file.size, content_type: file.type || 'application/octet-stream' }),
+        });
+        if (sessionResponse.status === 404 || sessionResponse.status === 405) return null;
+        const session = await sessionResponse.json();
+        if (!sessionResponse.ok) return { ok: false, result: session };
+
+        for (let start = 0; start < file.size; start += session.chunk_size) {
+            const end = Math.min(start + session.chunk_size, file.size);
+            // Resumable sessions answer 308 until the last chunk arrives
+            const chunkResponse = await fetch(session.upload_url, {
+                method: 'PUT',
+                headers: { 'Content-Range': `bytes ${start}-${end - 1}/${file.size}` },
+                body: file.slice(start, end),
+            });
+            if (!chunkResponse.ok && chunkResponse.status !== 308) {
+                return { ok: false, result: { error: 'Upload failed. Please try again.' } };
+            }
+            if (loadingText) loadingText.textContent = `Uploading video... ${Math.round(end / file.size * 100)}%`;
+        }
+
+        formData.delete('video');
+        const completeResponse = await fetch(session.complete_url, { method: 'POST', body: formData });
+        return { ok: completeResponse.ok, result: await completeResponse.json() };
+    }
+
     if (form) {
         form.addEventListener('submit', async function(event) {
             event.preventDefault();
@@ -347,14 +525,32 @@ document.addEventListener('DOMContentLoaded', () => {
             if (fileInput && fileInput.files.length === 0 && urlInput && urlInput.value.trim() !== '') {
                 // Remove the 'video' field if empty to avoid sending an empty file
                 formData.delete('video');
+                // Crop coordinates are in preview pixels; the worker rescales them to the downloaded video
+                if (videoPreview && videoPreview.videoWidth) {
+                    formData.append('crop_reference_width', videoPreview.videoWidth);
+                }
             }
             try {
-                const response = await fetch('/convert', { method: 'POST', body: formData });
-                const result = await response.json();
+                let ok = false;
+                let result = null;
+                const file = fileInput && fileInput.files.length > 0 ? fileInput.files[0] : null;
+                if (file) {
+                    const direct = await uploadDirect(file, formData);
+                    if (direct) ({ ok, result } = direct);
+                }
+                if (!result) {
+                    const response = await fetch('/convert', { method: 'POST', body: formData });
+                    result = await response.json();
+                    ok = response.ok;
+                }
 
-                if (response.ok && result.task_id) {
+                if (ok && result.cached && result.gif_url) {
+                    // Identical conversion already exists; no task was queued
+                    showGifResult(result);
+                } else if (ok && result.task_id) {
+                    pendingAdjustments = result.adjustments || [];
                     submitBtn.textContent = 'Converting...';
-                    pollTaskStatus(result.task_id);
+                    watchTaskStatus(result.task_id);
                 } else {
                     errorMessageDiv.textContent = result.error || 'Upload failed.';
                     showElement(errorMessageDiv);
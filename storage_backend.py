@@ -0,0 +1,222 @@
+# In storage_backend.py
+import os
+import shutil
+import threading
+import datetime
+from urllib.parse import quote
+
+
+# --- Configuration ---
+BUCKET_NAME = os.environ.get('GCS_BUCKET_NAME', "video-to-gif-cheap-us-central1")  # Single-region, low-cost bucket
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'gcs')  # 'gcs' or 'local'
+LOCAL_STORAGE_ROOT = os.environ.get('LOCAL_STORAGE_ROOT', '/tmp/local_storage')
+LOCAL_STORAGE_PUBLIC_URL = os.environ.get('LOCAL_STORAGE_PUBLIC_URL', 'http://localhost:5000/storage')
+# GCS requires resumable chunks to be a multiple of 256 KB
+TRANSFER_CHUNK_SIZE = int(os.environ.get('STORAGE_CHUNK_SIZE', 8 * 1024 * 1024))
+STORAGE_POOL_SIZE = int(os.environ.get('STORAGE_POOL_SIZE', 32))
+
+
+class GCSStorage:
+    """Google Cloud Storage backend sharing one pooled client per process."""
+
+    def __init__(self, bucket_name=BUCKET_NAME, chunk_size=TRANSFER_CHUNK_SIZE, pool_size=STORAGE_POOL_SIZE):
+        self.bucket_name = bucket_name
+        self.chunk_size = chunk_size
+        self.pool_size = pool_size
+        self._lock = threading.Lock()
+        self._bucket = None
+        self._pid = None
+
+    def _get_bucket(self):
+        # Clients are not fork-safe, so a forked Celery child builds its own on first use
+        if self._bucket is None or self._pid != os.getpid():
+            with self._lock:
+                if self._bucket is None or self._pid != os.getpid():
+                    from google.cloud import storage
+                    import google.auth
+                    from google.auth.transport.requests import AuthorizedSession
+                    from requests.adapters import HTTPAdapter
+
+                    credentials, project = google.auth.default(
+                        scopes=["https://www.googleapis.com/auth/devstorage.read_write"]
+                    )
+                    session = AuthorizedSession(credentials)
+                    adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+                    session.mount("https://", adapter)
+                    client = storage.Client(project=project, credentials=credentials, _http=session)
+                    self._bucket = client.bucket(self.bucket_name)
+                    self._pid = os.getpid()
+        return self._bucket
+
+    def _blob(self, name):
+        return self._get_bucket().blob(name, chunk_size=self.chunk_size)
+
+    def upload_file(self, local_file_path, destination_name, content_type=None):
+        """Uploads a local file with chunked resumable transfer and returns its public URL."""
+        blob = self._blob(destination_name)
+        blob.upload_from_filename(local_file_path, content_type=content_type)
+        return blob.public_url
+
+    def download_file(self, name, local_destination_path):
+        """Streams an object to a local path in chunks."""
+        self._blob(name).download_to_filename(local_destination_path)
+        return local_destination_path
+
+    def delete(self, name):
+        self._get_bucket().blob(name).delete()
+
+    def exists(self, name):
+        return self._get_bucket().blob(name).exists()
+
+    def size(self, name):
+        """Object size in bytes, or None if it does not exist."""
+        blob = self._get_bucket().get_blob(name)
+        return blob.size if blob is not None else None
+
+    def create_upload_session(self, name, content_type=None, size=None, origin=None):
+        """
+        Starts a resumable upload and returns its session URL. Clients PUT chunks to it
+        directly with Content-Range; origin is echoed in CORS headers for browsers.
+        """
+        return self._blob(name).create_resumable_upload_session(content_type=content_type, size=size, origin=origin)
+
+    def public_url(self, name):
+        return self._get_bucket().blob(name).public_url
+
+    def signed_url(self, name, expiration=600, method="GET", **kwargs):
+        return self._get_bucket().blob(name).generate_signed_url(
+            version="v4", expiration=expiration, method=method, **kwargs
+        )
+
+    def list_objects(self, prefix=None):
+        """Yields (name, time_created) for objects under prefix."""
+        for blob in self._get_bucket().list_blobs(prefix=prefix):
+            yield blob.name, blob.time_created
+
+    def local_path(self, name):
+        """Object storage has no local path; callers fall back to URLs."""
+        return None
+
+
+class LocalStorage:
+    """Local-filesystem stand-in for GCS, used for offline runs and benchmarks."""
+
+    def __init__(self, root=LOCAL_STORAGE_ROOT, public_base_url=LOCAL_STORAGE_PUBLIC_URL, chunk_size=TRANSFER_CHUNK_SIZE):
+        self.root = os.path.abspath(root)
+        self.public_base_url = public_base_url.rstrip('/')
+        self.chunk_size = chunk_size
+        os.makedirs(self.root, exist_ok=True)
+
+    def local_path(self, name):
+        path = os.path.abspath(os.path.join(self.root, name))
+        if os.path.commonpath([path, self.root]) != self.root:
+            raise ValueError(f"Object name escapes storage root: {name}")
+        return path
+
+    def _copy(self, source_path, destination_path):
+        os.makedirs(os.path.dirname(destination_path), exist_ok=True)
+        temp_path = destination_path + '.part'
+        with open(source_path, 'rb') as src, open(temp_path, 'wb') as dst:
+            shutil.copyfileobj(src, dst, self.chunk_size)
+        os.replace(temp_path, destination_path)
+
+    def upload_file(self, local_file_path, destination_name, content_type=None):
+        self._copy(local_file_path, self.local_path(destination_name))
+        return self.public_url(destination_name)
+
+    def download_file(self, name, local_destination_path):
+        path = self.local_path(name)
+        if not os.path.isfile(path):
+            raise FileNotFoundError(f"No such object: {name}")
+        self._copy(path, local_destination_path)
+        return local_destination_path
+
+    def delete(self, name):
+        os.remove(self.local_path(name))
+
+    def exists(self, name):
+        return os.path.isfile(self.local_path(name))
+
+    def size(self, name):
+        path = self.local_path(name)
+        return os.path.getsize(path) if os.path.isfile(path) else None
+
+    def create_upload_session(self, name, content_type=None, size=None, origin=None):
+        """There is no upload server to hand out; chunks are PUT to the app and passed to receive_chunk."""
+        return None
+
+    def receive_chunk(self, name, offset, stream, total_size):
+        """
+        Writes one chunk of a resumable upload at offset, mirroring GCS semantics:
+        the object only appears once all total_size bytes have arrived. Returns the
+        number of bytes stored so far.
+        """
+        path = self.local_path(name)
+        part_path = path + '.part'
+        if os.path.exists(path):
+            raise ValueError(f"Upload of {name} is already complete")
+        os.makedirs(os.path.dirname(part_path), exist_ok=True)
+        received = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        if offset != received:
+            raise ValueError(f"Chunk starts at {offset} but {received} bytes have been received")
+        with open(part_path, 'ab') as f:
+            for chunk in iter(lambda: stream.read(self.chunk_size), b''):
+                if received + len(chunk) > total_size:
+                    f.close()
+                    # The upload can never complete, so its partial file would only wait for expiry
+                    os.remove(part_path)
+                    raise ValueError("Chunk runs past the declared upload size")
+                f.write(chunk)
+                received += len(chunk)
+        if received == total_size:
+            os.replace(part_path, path)
+        return received
+
+    def public_url(self, name):
+        return f"{self.public_base_url}/{quote(name)}"
+
+    def signed_url(self, name, expiration=600, method="GET", **kwargs):
+        return self.public_url(name)
+
+    def list_objects(self, prefix=None):
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                if filename.endswith('.part'):
+                    continue
+                path = os.path.join(dirpath, filename)
+                name = os.path.relpath(path, self.root).replace(os.sep, '/')
+                if prefix and not name.startswith(prefix):
+                    continue
+                created = datetime.datetime.fromtimestamp(os.path.getmtime(path), tz=datetime.timezone.utc)
+                yield name, created
+
+
+_storage = None
+_storage_lock = threading.Lock()
+
+
+def get_storage():
+    """Returns the process-wide storage backend selected by STORAGE_BACKEND."""
+    global _storage
+    if _storage is None:
+        with _storage_lock:
+            if _storage is None:
+                if STORAGE_BACKEND == 'local':
+                    _storage = LocalStorage()
+                else:
+                    _storage = GCSStorage()
+    return _storage
+
+
+def preload():
+    """Imports the selected backend's client libraries. Safe before a fork, unlike building the client."""
+    if STORAGE_BACKEND != 'local':
+        import google.cloud.storage
+        import google.auth.transport.requests
+
+
+def connect():
+    """Builds this process's storage client now rather than during its first transfer."""
+    storage = get_storage()
+    if isinstance(storage, GCSStorage):
+        storage._get_bucket()
@@ -0,0 +1,48 @@
+# In task_client.py
+import os
+import time
+
+from celery import Celery
+from celery.signals import before_task_publish
+from kombu import Queue
+
+import task_routing
+
+
+# Tasks are defined in celery_tasks, which pulls in the whole media stack; the web tier
+# only needs their names, so it submits through this app and never imports that module
+CONVERT_TASK = 'celery_tasks.convert_video_to_gif_task'
+CONVERT_VARIANTS_TASK = 'celery_tasks.convert_variants_task'
+INGEST_URL_TASK = 'celery_tasks.ingest_url_task'
+FETCH_PREVIEW_TASK = 'celery_tasks.fetch_preview_task'
+
+celery_app = Celery(
+    'tasks',
+    broker=os.environ.get('CELERY_BROKER_URL', 'redis://localhost:6379/0'),
+    backend=os.environ.get('CELERY_RESULT_BACKEND', 'redis://localhost:6379/0')
+)
+celery_app.conf.update(
+    # A worker started without -Q serves both; production runs one worker per queue (see supervisord.conf)
+    task_queues=[Queue(queue) for queue in task_routing.QUEUES],
+    task_default_queue=task_routing.INTERACTIVE_QUEUE,
+    # Acknowledge after the task finishes, so a job whose worker dies is redelivered
+    task_acks_late=True,
+    task_reject_on_worker_lost=True,
+    # Conversions are long and uneven; never reserve more than one per process
+    worker_prefetch_multiplier=1,
+    task_soft_time_limit=task_routing.BULK_SOFT_TIME_LIMIT,
+    task_time_limit=task_routing.BULK_TIME_LIMIT,
+    broker_transport_options={'visibility_timeout': task_routing.VISIBILITY_TIMEOUT},
+)
+
+
+@before_task_publish.connect
+def _stamp_enqueue_time(headers=None, **kwargs):
+    """Stamps every published task so the worker can measure how long it sat in the queue."""
+    if headers is not None:
+        headers.setdefault('enqueued_at', time.time())
+
+
+def submit(task_name, args=None, kwargs=None, **options):
+    """Enqueues a task by name with apply_async options (queue, time limits); returns its AsyncResult."""
+    return celery_app.signature(task_name, args=args, kwargs=kwargs).apply_async(**options)
@@ -0,0 +1,40 @@
+# In task_routing.py
+import os
+
+
+# --- Configuration ---
+INTERACTIVE_QUEUE = os.environ.get('INTERACTIVE_QUEUE', 'interactive')
+BULK_QUEUE = os.environ.get('BULK_QUEUE', 'bulk')
+# Jobs estimated to process more pixels than this (decode + output) go to the bulk queue
+ROUTING_BULK_PIXELS = int(os.environ.get('ROUTING_BULK_PIXELS', 1_000_000_000))
+INTERACTIVE_SOFT_TIME_LIMIT = int(os.environ.get('INTERACTIVE_SOFT_TIME_LIMIT', 120))
+INTERACTIVE_TIME_LIMIT = int(os.environ.get('INTERACTIVE_TIME_LIMIT', 150))
+BULK_SOFT_TIME_LIMIT = int(os.environ.get('BULK_SOFT_TIME_LIMIT', 900))
+BULK_TIME_LIMIT = int(os.environ.get('BULK_TIME_LIMIT', 960))
+
+QUEUES = (INTERACTIVE_QUEUE, BULK_QUEUE)
+# Unacked messages are redelivered after this long, so it must outlast the longest job
+VISIBILITY_TIMEOUT = BULK_TIME_LIMIT + 300
+
+
+def queue_for(estimate):
+    """Picks the queue for a job from its admission estimate; jobs of unknown cost are treated as bulk."""
+    if estimate is None or estimate['pixels_processed'] > ROUTING_BULK_PIXELS:
+        return BULK_QUEUE
+    return INTERACTIVE_QUEUE
+
+
+def time_limits(queue):
+    """(soft, hard) time limits in seconds for tasks on a queue."""
+    if queue == INTERACTIVE_QUEUE:
+        return INTERACTIVE_SOFT_TIME_LIMIT, INTERACTIVE_TIME_LIMIT
+    return BULK_SOFT_TIME_LIMIT, BULK_TIME_LIMIT
+
+
+def publish_options(queue_class, queue=None):
+    """
+    apply_async keyword arguments for a conversion of the given class: its queue
+    (or a more specific one such as a host's handoff queue) and the matching time limits.
+    """
+    soft_limit, hard_limit = time_limits(queue_class)
+    return {'queue': queue or queue_class, 'soft_time_limit': soft_limit, 'time_limit': hard_limit}
@@ -0,0 +1,71 @@
+# In task_states.py
+import os
+import time
+import threading
+
+
+# --- Configuration ---
+# Finished tasks cannot change state, so their results are served from memory for this long
+STATUS_MEMO_SECONDS = int(os.environ.get('STATUS_MEMO_SECONDS', 300))
+STATUS_MEMO_MAX_ENTRIES = int(os.environ.get('STATUS_MEMO_MAX_ENTRIES', 10000))
+MEMO_STATES = ('SUCCESS', 'FAILURE')
+
+_memo = {}  # task_id -> (expires_at, state, info)
+_memo_lock = threading.Lock()
+
+
+def _memo_get(task_id, now):
+    entry = _memo.get(task_id)
+    if entry is None:
+        return None
+    if entry[0] < now:
+        _memo.pop(task_id, None)
+        return None
+    return entry[1], entry[2]
+
+
+def remember(task_id, state, info):
+    """Memoizes a terminal state; other states are left for the backend to answer."""
+    if state not in MEMO_STATES or STATUS_MEMO_SECONDS <= 0:
+        return
+    now = time.monotonic()
+    with _memo_lock:
+        if len(_memo) >= STATUS_MEMO_MAX_ENTRIES:
+            for key in [key for key, entry in _memo.items() if entry[0] < now]:
+                del _memo[key]
+            # Still full of live entries: drop the oldest (dicts keep insertion order)
+            while len(_memo) >= STATUS_MEMO_MAX_ENTRIES:
+                del _memo[next(iter(_memo))]
+        _memo[task_id] = (now + STATUS_MEMO_SECONDS, state, info)
+
+
+def get_states(backend, task_ids):
+    """
+    Returns {task_id: (state, info)} for many tasks. Memoized terminal results are
+    answered from memory; the rest are read with a single MGET on the result backend.
+    Tasks the backend knows nothing about are reported as PENDING, as AsyncResult does.
+    """
+    now = time.monotonic()
+    states = {}
+    missing = []
+    with _memo_lock:
+        for task_id in task_ids:
+            cached = _memo_get(task_id, now)
+            if cached is not None:
+                states[task_id] = cached
+            elif task_id not in missing:
+                missing.append(task_id)
+    if missing:
+        values = backend.mget([backend.get_key_for_task(task_id) for task_id in missing])
+        for task_id, value in zip(missing, values):
+            if not value:
+                states[task_id] = ('PENDING', None)
+                continue
+            meta = backend.decode_result(value)
+            states[task_id] = (meta['status'], meta.get('result'))
+            remember(task_id, meta['status'], meta.get('result'))
+    return states
+
+
+def get_state(backend, task_id):
+    return get_states(backend, [task_id])[task_id]
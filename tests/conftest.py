@@ -0,0 +1,24 @@
+import os
+import shutil
+import subprocess
+import sys
+
+import pytest
+
+# The application modules live flat in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+requires_ffmpeg = pytest.mark.skipif(shutil.which('ffmpeg') is None, reason='needs ffmpeg')
+
+
+@pytest.fixture(scope='session')
+def sample_video(tmp_path_factory):
+    """A 2s 320x240 30fps H.264 (yuv420p) test pattern and its probe, without needing ffprobe."""
+    if shutil.which('ffmpeg') is None:
+        pytest.skip('needs ffmpeg')
+    path = str(tmp_path_factory.mktemp('videos') / 'testsrc.mp4')
+    subprocess.run(['ffmpeg', '-nostdin', '-hide_banner', '-loglevel', 'error', '-y',
+                    '-f', 'lavfi', '-i', 'testsrc2=size=320x240:rate=30:duration=2',
+                    '-c:v', 'libx264', '-pix_fmt', 'yuv420p', path], check=True)
+    probe = {'width': 320, 'height': 240, 'duration': 2.0, 'fps': 30.0, 'codec': 'h264', 'nb_frames': 60}
+    return path, probe
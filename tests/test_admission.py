@@ -0,0 +1,109 @@
+import subprocess
+
+import pytest
+
+import admission
+import video_pipeline
+
+PROBE = {'width': 1920, 'height': 1080, 'duration': 60.0, 'fps': 30.0, 'codec': 'h264'}
+
+
+def _fail_probe(source):
+    raise RuntimeError('moov atom not found')
+
+
+def test_unreadable_sources_are_refused_as_unsupported_media(monkeypatch):
+    monkeypatch.setattr(video_pipeline, 'probe_video', _fail_probe)
+    with pytest.raises(admission.AdmissionError) as raised:
+        admission.admit('broken.mp4', {}, policy='clamp')
+    assert raised.value.status_code == 415
+    assert raised.value.estimate is None
+
+
+def test_sources_that_hang_the_probe_are_refused_as_unsupported_media(monkeypatch):
+    def hanging_probe(source):
+        raise subprocess.TimeoutExpired(['ffprobe', source], video_pipeline.PROBE_TIMEOUT_SECONDS)
+
+    monkeypatch.setattr(video_pipeline, 'probe_video', hanging_probe)
+    with pytest.raises(admission.AdmissionError) as raised:
+        admission.admit('https://example.com/stalled.mp4', {}, policy='clamp')
+    assert raised.value.status_code == 415
+    assert 'too long' in str(raised.value)
+
+
+def test_probe_passes_a_timeout_to_ffprobe(monkeypatch):
+    calls = []
+
+    def fake_run(cmd, **kwargs):
+        calls.append(kwargs)
+        raise subprocess.TimeoutExpired(cmd, kwargs.get('timeout'))
+
+    monkeypatch.setattr(video_pipeline.subprocess, 'run', fake_run)
+    with pytest.raises(subprocess.TimeoutExpired):
+        video_pipeline.probe_video('stalled.mp4')
+    assert calls[0]['timeout'] == video_pipeline.PROBE_TIMEOUT_SECONDS
+
+
+def test_sources_without_frames_are_refused_as_unsupported_media(monkeypatch):
+    monkeypatch.setattr(video_pipeline, 'probe_video', lambda source: dict(PROBE, duration=0.0))
+    with pytest.raises(admission.AdmissionError) as raised:
+        admission.admit('empty.mp4', {}, policy='clamp')
+    assert raised.value.status_code == 415
+
+
+def test_over_budget_jobs_are_refused_as_too_large(monkeypatch):
+    monkeypatch.setattr(video_pipeline, 'probe_video', lambda source: PROBE)
+    with pytest.raises(admission.AdmissionError) as raised:
+        admission.admit('long.mp4', {'fps': '30'}, policy='reject')
+    assert raised.value.status_code == 413
+    assert raised.value.estimate['output_frames'] == 1800
+
+
+def _probe(width, height, duration, fps=30.0):
+    return {'width': width, 'height': height, 'duration': duration, 'fps': fps, 'codec': 'h264'}
+
+
+def test_jobs_within_budget_are_not_clamped():
+    options = {'fps': '10', 'resize': '320', 'end_time': '5'}
+    clamped, estimate, adjustments = admission.clamp_options(options, _probe(640, 360, 10.0))
+    assert (clamped, adjustments) == (options, [])
+    assert admission.over_budget(estimate) == []
+
+
+def test_oversized_frames_are_scaled_down_first():
+    options, estimate, adjustments = admission.clamp_options({'fps': '10', 'end_time': '5'}, _probe(1920, 1080, 10.0))
+    assert adjustments == ['width reduced to 1280px']
+    assert options['resize'] == '1280'
+    assert (estimate['width'], estimate['height']) == (1280, 720)
+
+
+def test_frame_rate_is_lowered_before_the_clip_is_shortened():
+    options, estimate, adjustments = admission.clamp_options({'fps': '15'}, _probe(640, 360, 100.0))
+    assert adjustments == ['frame rate reduced to 12 fps']
+    assert estimate['output_frames'] == admission.ADMISSION_MAX_OUTPUT_FRAMES
+
+
+def test_clip_is_shortened_once_the_frame_rate_is_at_its_floor():
+    options, estimate, adjustments = admission.clamp_options({'fps': '10'}, _probe(640, 360, 200.0))
+    assert adjustments == [f'frame rate reduced to {admission.ADMISSION_MIN_FPS} fps', 'clip shortened to end at 150s']
+    assert (options['start_time'], options['end_time']) == ('0.0', '150.0')
+    assert estimate['output_frames'] == admission.ADMISSION_MAX_OUTPUT_FRAMES
+
+
+def test_width_is_reduced_again_to_fit_the_size_limit(monkeypatch):
+    monkeypatch.setattr(admission, 'ADMISSION_MAX_GIF_BYTES', 1024 * 1024)
+    options, estimate, adjustments = admission.clamp_options({'fps': '10', 'end_time': '10'}, _probe(640, 360, 10.0))
+    assert adjustments[-1].endswith('to fit the size limit')
+    assert int(options['resize']) % 2 == 0
+    assert estimate['estimated_gif_bytes'] <= admission.ADMISSION_MAX_GIF_BYTES
+
+
+@pytest.mark.parametrize('probe,options', [
+    (_probe(3840, 2160, 600.0, fps=60.0), {'fps': '30'}),
+    (_probe(1280, 720, 3600.0), {'fps': '24', 'speed': '0.5'}),
+    (_probe(7680, 4320, 30.0), {'fps': '10', 'start_time': '5'}),
+])
+def test_clamped_jobs_fit_every_budget(probe, options):
+    _, estimate, adjustments = admission.clamp_options(options, probe)
+    assert adjustments
+    assert admission.over_budget(estimate) == []
@@ -0,0 +1,95 @@
+import subprocess
+
+import numpy as np
+import pytest
+from PIL import Image, ImageSequence
+
+from conftest import requires_ffmpeg
+
+import animation_encoder
+import conversion_options
+
+pytestmark = requires_ffmpeg
+
+WIDTH, HEIGHT = 63, 47
+
+
+def _frames(count=6):
+    frames = []
+    for index in range(count):
+        frame = np.zeros((HEIGHT, WIDTH, 3), dtype=np.uint8)
+        frame[:, :, 2] = 255
+        frame[10:30, 5 + 5 * index:25 + 5 * index] = (255, 255, 0)
+        frames.append(frame)
+    return frames
+
+
+def _encode(path, output_format, frames, fps=10):
+    encoder = animation_encoder.FfmpegAnimationEncoder(str(path), WIDTH, HEIGHT, fps, output_format)
+    for frame in frames:
+        encoder.write_frame(frame)
+    encoder.close()
+    return encoder
+
+
+@pytest.mark.parametrize('output_format, extension', [('webp', '.webp'), ('apng', '.png')])
+def test_image_formats_hold_every_frame_and_loop_forever(tmp_path, output_format, extension):
+    frames = _frames()
+    path = tmp_path / f'clip{extension}'
+    _encode(path, output_format, frames)
+    image = Image.open(str(path))
+    assert image.size == (WIDTH, HEIGHT)
+    assert image.info.get('loop') == 0
+    decoded = [np.asarray(frame.convert('RGB'), dtype=np.int16) for frame in ImageSequence.Iterator(image)]
+    assert len(decoded) == len(frames)
+    tolerance = 0 if output_format == 'apng' else 40
+    assert np.abs(decoded[-1] - frames[-1]).mean() <= tolerance
+
+
+def test_mp4_is_padded_to_even_dimensions(tmp_path):
+    frames = _frames()
+    path = tmp_path / 'clip.mp4'
+    _encode(path, 'mp4', frames)
+    raw = subprocess.run(['ffmpeg', '-nostdin', '-loglevel', 'error', '-i', str(path), '-f', 'rawvideo',
+                          '-pix_fmt', 'rgb24', '-'], capture_output=True, check=True).stdout
+    assert len(raw) == len(frames) * (WIDTH + 1) * (HEIGHT + 1) * 3
+    # faststart puts the index ahead of the media data, so playback can start before the download ends
+    data = path.read_bytes()
+    assert data.index(b'moov') < data.index(b'mdat')
+
+
+def test_alpha_channels_are_dropped(tmp_path):
+    frames = [np.dstack([frame, np.full((HEIGHT, WIDTH), 255, dtype=np.uint8)]) for frame in _frames(2)]
+    path = tmp_path / 'clip.png'
+    _encode(path, 'apng', frames)
+    assert Image.open(str(path)).n_frames == 2
+
+
+def test_an_empty_encode_fails_and_an_aborted_one_leaves_nothing(tmp_path):
+    encoder = animation_encoder.FfmpegAnimationEncoder(str(tmp_path / 'empty.webp'), WIDTH, HEIGHT, 10, 'webp')
+    with pytest.raises(RuntimeError):
+        encoder.close()
+
+    path = tmp_path / 'aborted.webp'
+    encoder = animation_encoder.FfmpegAnimationEncoder(str(path), WIDTH, HEIGHT, 10, 'webp')
+    encoder.write_frame(_frames(1)[0])
+    encoder.abort()
+    assert not path.exists()
+
+
+def test_unknown_formats_are_refused():
+    with pytest.raises(ValueError):
+        animation_encoder._codec_args('avif')
+
+
+@pytest.mark.parametrize('requested, expected', [('WebP', 'webp'), (' apng ', 'apng'), ('mp4', 'mp4'),
+                                                 ('avif', 'gif'), (None, 'gif')])
+def test_output_formats_are_normalized(requested, expected):
+    assert conversion_options.normalize_options({'output_format': requested})['output_format'] == expected
+
+
+@pytest.mark.parametrize('filename, mimetype', [('clip.gif', 'image/gif'), ('clip.WEBP', 'image/webp'),
+                                                ('clip.png', 'image/apng'), ('clip.mp4', 'video/mp4'),
+                                                ('clip.bin', 'application/octet-stream')])
+def test_results_are_served_with_their_format_type(filename, mimetype):
+    assert conversion_options.output_mimetype(filename) == mimetype
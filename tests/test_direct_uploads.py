@@ -0,0 +1,152 @@
+import io
+import os
+import types
+
+import pytest
+
+import admission
+import expiry_index
+import storage_backend
+import task_client
+import task_routing
+
+fakeredis = pytest.importorskip('fakeredis')
+
+VIDEO = b'\x00\x00\x00\x18ftypmp42' + b'video bytes' * 100
+
+
+@pytest.fixture
+def storage(tmp_path, monkeypatch):
+    storage = storage_backend.LocalStorage(str(tmp_path / 'storage'))
+    monkeypatch.setattr(storage_backend, '_storage', storage)
+    return storage
+
+
+@pytest.fixture
+def client(storage, monkeypatch):
+    import app
+
+    monkeypatch.setattr(expiry_index, '_client', fakeredis.FakeRedis())
+    monkeypatch.setattr(admission, 'admit', lambda source, options: (options, None, []))
+    submitted = []
+
+    def submit(task_name, args=None, kwargs=None, **options):
+        submitted.append(args)
+        return types.SimpleNamespace(id=f'task-{len(submitted)}')
+
+    monkeypatch.setattr(task_client, 'submit', submit)
+    client = app.app.test_client()
+    client.submitted = submitted
+    return client
+
+
+def _start(client, size=len(VIDEO)):
+    response = client.post('/uploads', json={'filename': 'clip.mp4', 'size': size})
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def _stored_files(storage):
+    return [open(os.path.join(root, name), 'rb').read() for root, _, names in os.walk(storage.root) for name in names]
+
+
+def _put(client, session, data, offset=0, total=len(VIDEO)):
+    return client.put(f"/uploads/{session['upload_id']}", data=data,
+                      headers={'Content-Range': f'bytes {offset}-{offset + len(data) - 1}/{total}'})
+
+
+def test_a_completed_upload_is_enqueued_once(client):
+    session = _start(client)
+    assert _put(client, session, VIDEO).status_code == 200
+    first = client.post(f"/uploads/{session['upload_id']}/complete", data={'fps': '10'})
+    assert first.status_code == 200
+    replay = client.post(f"/uploads/{session['upload_id']}/complete", data={'fps': '10'})
+    assert replay.status_code == 409
+    assert len(client.submitted) == 1
+
+
+def test_an_incomplete_upload_is_not_consumed(client):
+    session = _start(client)
+    assert _put(client, session, VIDEO[:100]).status_code == 308
+    assert client.post(f"/uploads/{session['upload_id']}/complete").status_code == 409
+    assert _put(client, session, VIDEO[100:], offset=100).status_code == 200
+    assert client.post(f"/uploads/{session['upload_id']}/complete").status_code == 200
+    assert len(client.submitted) == 1
+
+
+def test_a_failed_submission_can_be_completed_again(client, monkeypatch):
+    session = _start(client)
+    _put(client, session, VIDEO)
+
+    def broker_down(*args, **kwargs):
+        raise ConnectionError('broker is down')
+
+    with monkeypatch.context() as patched:
+        patched.setattr(task_client, 'submit', broker_down)
+        assert client.post(f"/uploads/{session['upload_id']}/complete").status_code == 500
+    assert client.post(f"/uploads/{session['upload_id']}/complete").status_code == 200
+
+
+def test_sessions_are_only_started_for_videos_within_the_limit(client):
+    import app
+
+    assert client.post('/uploads', json={'filename': 'notes.txt', 'size': 10}).status_code == 400
+    assert client.post('/uploads', json={'filename': 'clip.mp4'}).status_code == 400
+    too_big = client.post('/uploads', json={'filename': 'clip.mp4', 'size': app.DIRECT_UPLOAD_MAX_BYTES + 1})
+    assert too_big.status_code == 413
+    session = _start(client)
+    assert session['upload_url'].endswith(f"/uploads/{session['upload_id']}")
+    assert session['complete_url'].endswith(f"/uploads/{session['upload_id']}/complete")
+
+
+def test_chunks_resume_only_at_the_received_offset(client, storage):
+    session = _start(client)
+    response = _put(client, session, VIDEO[:100])
+    assert response.status_code == 308
+    assert response.headers['Range'] == 'bytes=0-99'
+    assert _put(client, session, VIDEO[200:300], offset=200).status_code == 400
+    assert _put(client, session, VIDEO[100:], offset=100, total=len(VIDEO) + 1).status_code == 400
+    assert _put(client, session, VIDEO[100:], offset=100).get_json() == {'size': len(VIDEO)}
+    assert _stored_files(storage) == [VIDEO]
+
+
+def test_forged_or_tampered_upload_ids_are_refused(client):
+    session = _start(client)
+    forged = session['upload_id'][:-2] + ('AA' if not session['upload_id'].endswith('AA') else 'BB')
+    assert _put(client, {'upload_id': forged}, VIDEO).status_code == 404
+    assert client.post(f'/uploads/{forged}/complete').status_code == 400
+
+
+def test_rejected_uploads_are_deleted_and_not_enqueued(client, storage, monkeypatch):
+    def reject(source, options):
+        raise admission.AdmissionError('Could not read the video.', status_code=415)
+
+    monkeypatch.setattr(admission, 'admit', reject)
+    session = _start(client)
+    _put(client, session, VIDEO)
+    assert client.post(f"/uploads/{session['upload_id']}/complete").status_code == 415
+    assert client.submitted == []
+    assert _stored_files(storage) == []
+
+
+def test_chunks_past_the_declared_size_drop_the_partial_file(storage):
+    with pytest.raises(ValueError):
+        storage.receive_chunk('video_uploads/clip.mp4', 0, io.BytesIO(VIDEO + b'extra'), len(VIDEO))
+    assert not os.path.exists(storage.local_path('video_uploads/clip.mp4') + '.part')
+    assert storage.receive_chunk('video_uploads/clip.mp4', 0, io.BytesIO(VIDEO), len(VIDEO)) == len(VIDEO)
+    assert storage.size('video_uploads/clip.mp4') == len(VIDEO)
+
+
+@pytest.mark.parametrize('path, task_name', [('/convert', task_client.INGEST_URL_TASK),
+                                             ('/upload_url', task_client.FETCH_PREVIEW_TASK)])
+def test_url_tasks_get_the_interactive_queue_and_its_time_limits(client, monkeypatch, path, task_name):
+    published = []
+
+    def submit(name, args=None, kwargs=None, **options):
+        published.append((name, options))
+        return types.SimpleNamespace(id='task-1')
+
+    monkeypatch.setattr(task_client, 'submit', submit)
+    response = client.post(path, data={'video_url': 'https://example.com/watch?v=clip'})
+    assert response.status_code == 200
+    assert published == [(task_name, task_routing.publish_options(task_routing.INTERACTIVE_QUEUE))]
@@ -0,0 +1,118 @@
+import types
+
+import pytest
+
+import storage_backend
+
+GIF = b'GIF89a' + bytes(range(256)) * 4
+
+
+class SignedStorage:
+    """Cloud storage as the download route sees it: no local path, only signed URLs."""
+
+    def __init__(self):
+        self.signed = []
+
+    def local_path(self, name):
+        return None
+
+    def signed_url(self, name, expiration=600, **kwargs):
+        self.signed.append((name, kwargs))
+        return f'https://storage.example.com/{name}?signature=x'
+
+
+class UpstreamResponse:
+    def __init__(self, status_code, body=b'', headers=None):
+        self.status_code = status_code
+        self.body = body
+        self.headers = headers or {}
+        self.closed = False
+
+    def iter_content(self, chunk_size):
+        for start in range(0, len(self.body), chunk_size):
+            yield self.body[start:start + chunk_size]
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def web():
+    import app
+
+    return app
+
+
+@pytest.fixture
+def upstream(web, monkeypatch):
+    storage = SignedStorage()
+    monkeypatch.setattr(storage_backend, '_storage', storage)
+    monkeypatch.setattr(web, 'DOWNLOAD_MODE', 'proxy')
+    calls = []
+    upstream = types.SimpleNamespace(response=None, calls=calls, storage=storage)
+
+    def get(url, headers=None, **kwargs):
+        calls.append((url, headers))
+        return upstream.response
+
+    monkeypatch.setattr(web, '_get_download_session', lambda: types.SimpleNamespace(get=get))
+    return upstream
+
+
+def test_ranges_are_forwarded_and_partial_content_streamed_back(web, upstream):
+    upstream.response = UpstreamResponse(206, GIF[:100], {'Content-Range': f'bytes 0-99/{len(GIF)}',
+                                                          'Content-Length': '100', 'ETag': '"v1"',
+                                                          'Set-Cookie': 'not=forwarded'})
+    # Buffered, the client closes the WSGI iterable as a server does at the end of a response
+    response = web.app.test_client().get('/download_gif/clip.gif', headers={'Range': 'bytes=0-99'}, buffered=True)
+    assert response.status_code == 206
+    assert response.data == GIF[:100]
+    assert response.headers['Content-Range'] == f'bytes 0-99/{len(GIF)}'
+    assert response.headers['ETag'] == '"v1"'
+    assert response.headers['Content-Disposition'] == 'attachment; filename="clip.gif"'
+    assert 'Set-Cookie' not in response.headers
+    assert upstream.calls[0][1] == {'Range': 'bytes=0-99'}
+    assert upstream.response.closed
+
+
+def test_not_modified_is_passed_through_without_a_body(web, upstream):
+    upstream.response = UpstreamResponse(304, headers={'ETag': '"v1"'})
+    response = web.app.test_client().get('/download_gif/clip.gif', headers={'If-None-Match': '"v1"'})
+    assert response.status_code == 304
+    assert response.data == b''
+    assert upstream.calls[0][1] == {'If-None-Match': '"v1"'}
+    assert upstream.response.closed
+
+
+def test_missing_objects_are_not_found(web, upstream):
+    upstream.response = UpstreamResponse(403)
+    assert web.app.test_client().get('/download_gif/gone.gif').status_code == 404
+    assert upstream.response.closed
+
+
+def test_redirect_mode_hands_out_a_signed_url(web, upstream, monkeypatch):
+    monkeypatch.setattr(web, 'DOWNLOAD_MODE', 'redirect')
+    response = web.app.test_client().get('/download_gif/clip.webp')
+    assert response.status_code == 302
+    assert response.headers['Location'].startswith('https://storage.example.com/clip.webp')
+    assert upstream.storage.signed == [('clip.webp', {'response_disposition': 'attachment; filename="clip.webp"',
+                                                      'response_type': 'image/webp'})]
+    assert upstream.calls == []
+
+
+def test_local_storage_serves_ranges_from_disk(web, tmp_path, monkeypatch):
+    storage = storage_backend.LocalStorage(str(tmp_path))
+    (tmp_path / 'clip.gif').write_bytes(GIF)
+    monkeypatch.setattr(storage_backend, '_storage', storage)
+    response = web.app.test_client().get('/download_gif/clip.gif', headers={'Range': 'bytes=6-9'})
+    assert response.status_code == 206
+    assert response.data == GIF[6:10]
+    assert response.headers['Content-Disposition'].startswith('attachment')
+
+
+def test_the_connection_is_returned_when_the_client_disconnects(web, upstream):
+    upstream.response = UpstreamResponse(200, GIF, {'Content-Length': str(len(GIF))})
+    response = web.app.test_client().get('/download_gif/clip.gif')
+    next(response.response)
+    response.close()
+    assert upstream.response.closed
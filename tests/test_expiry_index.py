@@ -0,0 +1,142 @@
+import os
+import time
+
+import pytest
+
+import expiry_index
+import storage_backend
+
+fakeredis = pytest.importorskip('fakeredis')
+
+
+@pytest.fixture
+def redis_client(monkeypatch):
+    client = fakeredis.FakeRedis()
+    monkeypatch.setattr(expiry_index, '_client', client)
+    return client
+
+
+@pytest.fixture
+def storage(tmp_path):
+    return storage_backend.LocalStorage(str(tmp_path / 'storage'))
+
+
+def _store(storage, tmp_path, name):
+    source = tmp_path / 'source'
+    source.write_bytes(b'gif bytes')
+    storage.upload_file(str(source), name)
+
+
+def _stored(storage):
+    return sorted(name for name, _ in storage.list_objects())
+
+
+def test_only_expired_objects_are_deleted(redis_client, storage, tmp_path):
+    for name in ('old.gif', 'new.gif'):
+        _store(storage, tmp_path, name)
+    expiry_index.register('old.gif', ttl_seconds=-1)
+    expiry_index.register('new.gif', ttl_seconds=3600)
+    assert expiry_index.expire_storage(storage) == 1
+    assert _stored(storage) == ['new.gif']
+    assert redis_client.zrange(expiry_index._OBJECTS_KEY, 0, -1) == [b'new.gif']
+
+
+def test_objects_already_gone_are_dropped_from_the_index(redis_client, storage):
+    expiry_index.register('deleted.gif', ttl_seconds=-1)
+    assert expiry_index.expire_storage(storage) == 0
+    assert redis_client.zcard(expiry_index._OBJECTS_KEY) == 0
+
+
+def test_failed_deletions_are_retried_later(redis_client, monkeypatch):
+    class FlakyStorage:
+        def delete(self, name):
+            raise ConnectionError('storage is down')
+
+    expiry_index.register('clip.gif', ttl_seconds=-1)
+    assert expiry_index.expire_storage(FlakyStorage()) == 0
+    retry_at = redis_client.zscore(expiry_index._OBJECTS_KEY, 'clip.gif')
+    assert retry_at == pytest.approx(time.time() + expiry_index.EXPIRY_RETRY_SECONDS, abs=5)
+
+
+def test_one_cleaner_runs_at_a_time_and_releases_its_lock(redis_client, storage, tmp_path):
+    _store(storage, tmp_path, 'old.gif')
+    expiry_index.register('old.gif', ttl_seconds=-1)
+    redis_client.set(expiry_index._LOCK_KEY, 'another-process')
+    assert expiry_index.expire_storage(storage) is None
+    assert _stored(storage) == ['old.gif']
+    redis_client.delete(expiry_index._LOCK_KEY)
+    assert expiry_index.expire_storage(storage) == 1
+    assert not redis_client.exists(expiry_index._LOCK_KEY)
+
+
+def test_existing_objects_are_indexed_once(redis_client, storage, tmp_path):
+    for name in ('video_uploads/clip.mp4', 'clip.gif', 'robots.txt'):
+        _store(storage, tmp_path, name)
+    old = time.time() - 7200
+    os.utime(storage.local_path('clip.gif'), (old, old))
+    ttls = {'video_uploads/clip.mp4': 86400, 'clip.gif': 3600}
+    assert expiry_index.expire_storage(storage, backfill_ttl=ttls.get) == 1
+    assert _stored(storage) == ['robots.txt', 'video_uploads/clip.mp4']
+    assert redis_client.zrange(expiry_index._OBJECTS_KEY, 0, -1) == [b'video_uploads/clip.mp4']
+
+    # Later runs never list the bucket again
+    _store(storage, tmp_path, 'unindexed.gif')
+    expiry_index.expire_storage(storage, backfill_ttl=lambda name: -1)
+    assert 'unindexed.gif' in _stored(storage)
+
+
+def test_registering_never_fails_the_caller(monkeypatch):
+    class DownRedis:
+        def zadd(self, *args, **kwargs):
+            raise ConnectionError('redis is down')
+
+    monkeypatch.setattr(expiry_index, '_client', DownRedis())
+    expiry_index.register('clip.gif')
+    expiry_index.register_local('/tmp/clip.mp4')
+
+
+def test_claims_are_granted_once_until_released(redis_client):
+    assert expiry_index.claim_once('upload-complete:clip.mp4', 60)
+    assert not expiry_index.claim_once('upload-complete:clip.mp4', 60)
+    expiry_index.release_claim('upload-complete:clip.mp4')
+    assert expiry_index.claim_once('upload-complete:clip.mp4', 60)
+
+
+def test_host_locks_elect_one_holder(tmp_path, monkeypatch):
+    monkeypatch.setattr(expiry_index, 'HOST_LOCK_DIR', str(tmp_path))
+    with expiry_index.host_lock('job') as first:
+        with expiry_index.host_lock('job') as second:
+            assert first and not second
+    with expiry_index.host_lock('job') as again:
+        assert again
+
+
+def _touch(path, used, data=b'x' * 100):
+    path.write_bytes(data)
+    os.utime(path, (used, used))
+
+
+def test_scratch_is_trimmed_least_recently_used_first(tmp_path):
+    now = time.time()
+    _touch(tmp_path / 'old.mp4', now - 300)
+    _touch(tmp_path / 'old.info.json', now - 10)
+    (tmp_path / 'old.preview').mkdir()
+    _touch(tmp_path / 'old.preview' / 'sprite.jpg', now - 300)
+    os.utime(tmp_path / 'old.preview', (now - 300, now - 300))
+    _touch(tmp_path / 'middle.mp4', now - 200)
+    _touch(tmp_path / 'new.mp4', now - 100)
+    _touch(tmp_path / '.lock', now - 1000)
+    # The old files count as used when the most recent of them was
+    assert expiry_index.trim_scratch(str(tmp_path), budget_bytes=400) == (1, 100)
+    assert sorted(os.listdir(tmp_path)) == ['.lock', 'new.mp4', 'old.info.json', 'old.mp4', 'old.preview']
+    assert expiry_index.trim_scratch(str(tmp_path), budget_bytes=100) == (2, 400)
+    assert os.listdir(tmp_path) == ['.lock']
+
+
+def test_scratch_entries_past_their_age_are_trimmed_within_budget(tmp_path):
+    now = time.time()
+    _touch(tmp_path / 'stale.mp4', now - 7200)
+    _touch(tmp_path / 'fresh.mp4', now - 60)
+    assert expiry_index.trim_scratch(str(tmp_path), budget_bytes=10 ** 9, max_age=3600) == (1, 100)
+    assert os.listdir(tmp_path) == ['fresh.mp4']
+    assert expiry_index.trim_scratch(str(tmp_path / 'missing'), budget_bytes=0) == (0, 0)
@@ -0,0 +1,46 @@
+import io
+
+import numpy as np
+import pytest
+from PIL import Image, ImageSequence
+
+from conftest import requires_ffmpeg
+
+import gif_encoder
+
+
+def _clip(count=4, repeats=3):
+    """Frames of a moving square, each shown `repeats` times in a row."""
+    frames = []
+    for index in range(count):
+        frame = np.zeros((48, 64, 3), dtype=np.uint8)
+        frame[:, 32:] = (255, 255, 255)
+        frame[8:24, 4 + 8 * index:20 + 8 * index] = (255, 0, 0)
+        frames.extend([frame] * repeats)
+    return frames
+
+
+def _encode(name, path, frames, fps=10):
+    encoder = gif_encoder.create_encoder(name, str(path), 64, 48, fps)
+    for frame in frames:
+        encoder.write_frame(frame)
+    encoder.close()
+    image = Image.open(str(path))
+    decoded = [(np.asarray(frame.convert('RGB')), frame.info['duration']) for frame in ImageSequence.Iterator(image)]
+    return decoded
+
+
+@pytest.mark.parametrize('name', ['numpy', pytest.param('ffmpeg', marks=requires_ffmpeg)])
+def test_repeated_frames_become_longer_delays(name, tmp_path):
+    decoded = _encode(name, tmp_path / 'clip.gif', _clip())
+    assert len(decoded) == 4
+    assert [delay for _, delay in decoded] == [300] * 4
+    assert decoded[-1][0][16, 36].tolist() == [255, 0, 0]
+
+
+@pytest.mark.parametrize('name', ['numpy', pytest.param('ffmpeg', marks=requires_ffmpeg)])
+def test_delta_frames_can_be_switched_off(name, tmp_path, monkeypatch):
+    monkeypatch.setattr(gif_encoder, 'GIF_FRAME_DELTAS', False)
+    decoded = _encode(name, tmp_path / 'clip.gif', _clip())
+    assert len(decoded) == 12
+    assert sum(delay for _, delay in decoded) == 1200
@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+
+import gif_quantizer
+
+COLOURS = np.array([[0, 0, 0], [255, 255, 255], [255, 0, 0], [0, 128, 255]], dtype=np.uint8)
+
+
+def _frame(seed=0, height=24, width=32):
+    """A frame painted only in COLOURS."""
+    rng = np.random.default_rng(seed)
+    return COLOURS[rng.integers(0, len(COLOURS), size=(height, width))]
+
+
+def test_median_cut_splits_until_every_box_is_one_colour():
+    palette = gif_quantizer.median_cut_palette(gif_quantizer.sample_pixels([_frame()]), max_colors=256)
+    assert set(map(tuple, palette)) == set(map(tuple, COLOURS))
+
+
+def test_median_cut_never_exceeds_max_colors():
+    rng = np.random.default_rng(1)
+    pixels = rng.integers(0, 256, size=(5000, 3), dtype=np.uint8)
+    assert len(gif_quantizer.median_cut_palette(pixels, max_colors=16)) == 16
+
+
+def test_undithered_frames_of_palette_colours_round_trip_exactly():
+    frame = _frame()
+    quantizer = gif_quantizer.PaletteQuantizer(COLOURS, dither='none')
+    indices = quantizer.map_frame(frame)
+    assert indices.dtype == np.uint8 and indices.shape == frame.shape[:2]
+    np.testing.assert_array_equal(quantizer.palette[indices], frame)
+
+
+@pytest.mark.parametrize('dither', ['ordered', 'floyd_steinberg'])
+def test_dithered_frames_stay_close_to_the_source(dither):
+    gradient = np.repeat(np.linspace(0, 255, 64, dtype=np.uint8)[None, :, None], 16, axis=0).repeat(3, axis=2)
+    quantizer = gif_quantizer.PaletteQuantizer.from_frames([gradient], max_colors=16, dither=dither)
+    indices = quantizer.map_frame(gradient)
+    assert indices.shape == gradient.shape[:2] and indices.max() < len(quantizer.palette)
+    error = np.abs(quantizer.palette[indices].astype(int) - gradient).mean()
+    assert error < 16
+
+
+def test_scene_change_is_detected_against_the_reference_frame():
+    frame = _frame()
+    quantizer = gif_quantizer.PaletteQuantizer.from_frames([frame], max_colors=8)
+    assert not quantizer.scene_changed(_frame(seed=2))
+    assert quantizer.scene_changed(np.full_like(frame, 200))
@@ -0,0 +1,178 @@
+import io
+
+import numpy as np
+from PIL import Image, ImageSequence
+
+import gif_writer
+
+PALETTE = np.array([[0, 0, 0], [255, 255, 255], [255, 0, 0], [0, 0, 255], [0, 255, 0]], dtype=np.uint8)
+
+
+def _frames(count=4, height=20, width=30):
+    """Frames of palette indices: a background and a square that moves one step per frame."""
+    frames = []
+    for index in range(count):
+        indices = np.zeros((height, width), dtype=np.uint8)
+        indices[:, width // 2:] = 1
+        indices[4:10, 2 + 3 * index:8 + 3 * index] = 2
+        frames.append(indices)
+    return frames
+
+
+def _decode(data):
+    """The GIF's frames as RGB arrays, composited as a browser shows them, and their delays in ms."""
+    image = Image.open(io.BytesIO(data))
+    frames, delays = [], []
+    for frame in ImageSequence.Iterator(image):
+        frames.append(np.asarray(frame.convert('RGB')))
+        delays.append(frame.info['duration'])
+    return frames, delays
+
+
+def _write(frames, durations, delta=None):
+    output = io.BytesIO()
+    writer = gif_writer.GifStreamWriter(output, frames[0].shape[1], frames[0].shape[0], PALETTE)
+    if delta is None:
+        for indices, seconds in zip(frames, durations):
+            writer.write_frame(indices, writer.next_delay(seconds))
+        writer.close()
+    else:
+        front = gif_writer.FrameDeltaWriter(writer, **delta)
+        for indices, seconds in zip(frames, durations):
+            front.write_frame(indices, seconds)
+        front.close()
+    return output.getvalue(), writer
+
+
+def test_frames_round_trip_through_pillow():
+    frames = _frames()
+    data, writer = _write(frames, [0.1] * len(frames))
+    decoded, delays = _decode(data)
+    assert len(decoded) == len(frames)
+    for indices, rgb in zip(frames, decoded):
+        np.testing.assert_array_equal(rgb, PALETTE[indices])
+    assert delays == [100] * len(frames)
+    assert writer.bytes_written == len(data)
+
+
+def test_delays_carry_rounding_error_instead_of_drifting():
+    frames = _frames(3)
+    _, delays = _decode(_write(frames, [1 / 30] * 3)[0])
+    # 3.33cs per frame: rounded per frame this would be 3+3+3; on the timeline it is 3+4+3
+    assert delays == [30, 40, 30]
+
+
+def test_local_palettes_round_trip():
+    frames = _frames(2)
+    output = io.BytesIO()
+    writer = gif_writer.GifStreamWriter(output, 30, 20, PALETTE)
+    swapped = PALETTE[[1, 0, 3, 2, 4]]
+    writer.write_frame(frames[0], 10)
+    writer.write_frame(frames[1], 10, palette=swapped)
+    writer.close()
+    decoded, _ = _decode(output.getvalue())
+    np.testing.assert_array_equal(decoded[0], PALETTE[frames[0]])
+    np.testing.assert_array_equal(decoded[1], swapped[frames[1]])
+
+
+def test_delta_frames_decode_to_the_original_frames():
+    frames = _frames()
+    full, _ = _write(frames, [0.1] * len(frames))
+    data, writer = _write(frames, [0.1] * len(frames), delta={'enabled': True})
+    decoded, _ = _decode(data)
+    assert len(decoded) == len(frames)
+    for indices, rgb in zip(frames, decoded):
+        np.testing.assert_array_equal(rgb, PALETTE[indices])
+    assert len(data) < len(full)
+
+
+def test_repeated_frames_are_dropped_and_their_time_kept():
+    frames = _frames(2)
+    sequence = [frames[0], frames[0], frames[0], frames[1]]
+    data, _ = _write(sequence, [0.1] * len(sequence), delta={'enabled': True})
+    decoded, delays = _decode(data)
+    assert len(decoded) == 2
+    assert delays == [300, 100]
+    np.testing.assert_array_equal(decoded[1], PALETTE[frames[1]])
+
+
+def test_disabled_delta_writer_writes_every_frame():
+    frames = _frames(2)
+    sequence = [frames[0], frames[0], frames[1]]
+    decoded, delays = _decode(_write(sequence, [0.1] * 3, delta={'enabled': False})[0])
+    assert len(decoded) == 3 and delays == [100, 100, 100]
+
+
+class RecordingWriter:
+    """The GifStreamWriter calls FrameDeltaWriter makes, recorded instead of encoded."""
+
+    def __init__(self, palette=PALETTE):
+        self.global_palette = palette
+        self.frames = []
+
+    def next_delay(self, seconds):
+        return int(round(seconds * 100))
+
+    def write_frame(self, indices, delay_cs, palette=None, left=0, top=0, transparent_index=None):
+        self.frames.append({'shape': indices.shape, 'left': left, 'top': top, 'delay': delay_cs,
+                            'transparent_index': transparent_index, 'indices': indices.copy()})
+
+    def close(self, write_trailer=True):
+        pass
+
+
+def test_only_the_changed_rectangle_is_written():
+    frames = _frames(2)
+    recorder = RecordingWriter()
+    delta = gif_writer.FrameDeltaWriter(recorder)
+    for indices in frames:
+        delta.write_frame(indices, 0.1)
+    delta.close()
+    first, second = recorder.frames
+    assert first['shape'] == (20, 30) and (first['left'], first['top']) == (0, 0)
+    # The square moved from columns 2-7 to 5-10 on rows 4-9
+    assert second['shape'] == (6, 9) and (second['left'], second['top']) == (2, 4)
+
+
+def test_unchanged_pixels_inside_the_rectangle_become_transparent():
+    base = np.zeros((20, 20), dtype=np.uint8)
+    moved = base.copy()
+    moved[0, 0] = moved[19, 19] = 1
+    recorder = RecordingWriter()
+    delta = gif_writer.FrameDeltaWriter(recorder)
+    delta.write_frame(base, 0.1)
+    delta.write_frame(moved, 0.1)
+    delta.close()
+    frame = recorder.frames[1]
+    assert frame['shape'] == (20, 20)
+    transparent = frame['transparent_index']
+    assert transparent != 1
+    assert (frame['indices'] == transparent).sum() == 20 * 20 - 2
+
+
+def test_busy_rectangles_are_written_opaque():
+    base = np.zeros((10, 10), dtype=np.uint8)
+    busy = np.ones((10, 10), dtype=np.uint8)
+    busy[5, 5] = 0
+    recorder = RecordingWriter()
+    delta = gif_writer.FrameDeltaWriter(recorder, min_unchanged=0.7)
+    delta.write_frame(base, 0.1)
+    delta.write_frame(busy, 0.1)
+    delta.close()
+    assert recorder.frames[1]['transparent_index'] is None
+
+
+def test_a_new_palette_is_written_as_a_full_frame():
+    frames = _frames(2)
+    recorder = RecordingWriter()
+    delta = gif_writer.FrameDeltaWriter(recorder)
+    delta.write_frame(frames[0], 0.1)
+    delta.write_frame(frames[1], 0.1, palette=PALETTE[[1, 0, 3, 2, 4]])
+    delta.close()
+    assert recorder.frames[1]['shape'] == (20, 30) and recorder.frames[1]['transparent_index'] is None
+
+
+def test_a_full_colour_table_has_no_transparent_index():
+    full_palette = np.zeros((256, 3), dtype=np.uint8)
+    assert gif_writer.FrameDeltaWriter._free_index(np.arange(256, dtype=np.uint8), full_palette) is None
+    assert gif_writer.FrameDeltaWriter._free_index(np.array([0, 1, 2, 4], dtype=np.uint8), PALETTE) == 3
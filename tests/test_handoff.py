@@ -0,0 +1,186 @@
+import hashlib
+import json
+import os
+import types
+
+import pytest
+
+import handoff
+
+
+@pytest.fixture(autouse=True)
+def handoff_dir(tmp_path, monkeypatch):
+    path = tmp_path / 'handoff'
+    monkeypatch.setattr(handoff, 'HANDOFF_DIR', str(path))
+    return path
+
+
+def _stage(tmp_path, name='clip.mp4', data=b'video bytes' * 100):
+    source = tmp_path / name
+    source.write_bytes(data)
+    return handoff.stage(str(source), hashlib.sha256(data).hexdigest())
+
+
+def _age(path, seconds):
+    old = os.path.getmtime(path) - seconds
+    os.utime(path, (old, old))
+
+
+def test_claim_takes_a_staged_file_that_matches(tmp_path):
+    ref = _stage(tmp_path)
+    destination = str(tmp_path / 'claimed.mp4')
+    assert handoff.claim(ref, destination) == destination
+    assert not os.path.exists(ref['path'])
+    assert open(destination, 'rb').read() == b'video bytes' * 100
+
+
+def test_claim_rejects_a_file_that_changed(tmp_path):
+    ref = _stage(tmp_path)
+    with open(ref['path'], 'r+b') as f:
+        f.write(b'X')
+    with pytest.raises(ValueError):
+        handoff.claim(ref, str(tmp_path / 'claimed.mp4'))
+
+
+def test_claim_rejects_a_file_from_another_node(tmp_path):
+    ref = dict(_stage(tmp_path), node='elsewhere')
+    with pytest.raises(FileNotFoundError):
+        handoff.claim(ref, str(tmp_path / 'claimed.mp4'))
+
+
+def test_stale_unclaimed_jobs_are_rerouted_once(tmp_path):
+    ref = _stage(tmp_path)
+    handoff.record_task(ref, 'convert', 'task-1', ['video_uploads/clip.mp4', {'fps': 10}],
+                        {'source_digest': ref['sha256'], 'handoff_ref': ref}, 'interactive')
+    resubmitted = []
+
+    def resubmit(record, path):
+        resubmitted.append((record, open(path, 'rb').read()))
+
+    assert handoff.reroute_stale(resubmit) == 0
+    _age(handoff._record_path(ref), handoff.HANDOFF_REROUTE_SECONDS + 1)
+    assert handoff.reroute_stale(resubmit) == 1
+    record, data = resubmitted[0]
+    assert record['task_id'] == 'task-1' and record['args'][0] == 'video_uploads/clip.mp4'
+    assert 'handoff_ref' not in record['task_kwargs']
+    assert data == b'video bytes' * 100
+    assert handoff.was_rerouted(ref)
+    assert not os.path.exists(ref['path'])
+    with pytest.raises(FileNotFoundError):
+        handoff.claim(ref, str(tmp_path / 'claimed.mp4'))
+    assert handoff.reroute_stale(resubmit) == 0
+
+
+def test_claimed_jobs_are_not_rerouted(tmp_path):
+    ref = _stage(tmp_path)
+    handoff.record_task(ref, 'convert', 'task-1', ['video_uploads/clip.mp4', {}], {'handoff_ref': ref}, 'interactive')
+    handoff.claim(ref, str(tmp_path / 'claimed.mp4'))
+    _age(handoff._record_path(ref), handoff.HANDOFF_REROUTE_SECONDS + 1)
+    assert handoff.reroute_stale(lambda record, path: pytest.fail('claimed job was resubmitted')) == 0
+    assert not handoff.was_rerouted(ref)
+    assert not os.path.exists(handoff._record_path(ref))
+
+
+def test_a_failed_reroute_puts_the_job_back(tmp_path):
+    ref = _stage(tmp_path)
+    handoff.record_task(ref, 'convert', 'task-1', ['video_uploads/clip.mp4', {}], {'handoff_ref': ref}, 'interactive')
+    _age(handoff._record_path(ref), handoff.HANDOFF_REROUTE_SECONDS + 1)
+
+    def resubmit(record, path):
+        raise RuntimeError('storage is down')
+
+    with pytest.raises(RuntimeError):
+        handoff.reroute_stale(resubmit)
+    assert not handoff.was_rerouted(ref)
+    assert handoff.claim(ref, str(tmp_path / 'claimed.mp4'))
+
+
+def test_forget_task_drops_the_file_and_record(tmp_path):
+    ref = _stage(tmp_path)
+    handoff.record_task(ref, 'convert', 'task-1', ['video_uploads/clip.mp4', {}], {'handoff_ref': ref}, 'interactive')
+    handoff.forget_task(ref)
+    assert os.listdir(handoff.HANDOFF_DIR) == []
+
+
+def test_a_running_worker_advertises_its_handoff_queues():
+    assert not handoff.local_worker_alive('interactive')
+    handoff.mark_worker_alive([handoff.local_queue_name('interactive'), 'interactive'])
+    assert handoff.local_worker_alive('interactive')
+    assert not handoff.local_worker_alive('bulk')
+    handoff.mark_worker_stopped()
+    assert not handoff.local_worker_alive('interactive')
+
+
+def test_markers_of_dead_workers_are_ignored(handoff_dir):
+    handoff_dir.mkdir()
+    (handoff_dir / f'{handoff._MARKER_PREFIX}99999999.json').write_text(
+        json.dumps({'pid': 99999999, 'queues': [handoff.local_queue_name('interactive')]}))
+    assert not handoff.local_worker_alive('interactive')
+
+
+def test_a_redelivered_task_finds_the_file_it_already_claimed(tmp_path):
+    ref = _stage(tmp_path)
+    destination = str(tmp_path / 'claimed.mp4')
+    handoff.claim(ref, destination)
+    assert handoff.claim(ref, destination) == destination
+
+
+def test_stale_staged_files_are_removed_but_worker_markers_kept(tmp_path):
+    ref = _stage(tmp_path)
+    handoff.mark_worker_alive([handoff.local_queue_name('interactive')])
+    for filename in os.listdir(handoff.HANDOFF_DIR):
+        _age(os.path.join(handoff.HANDOFF_DIR, filename), handoff.HANDOFF_MAX_AGE_SECONDS + 1)
+    assert handoff.cleanup_stale() == 1
+    assert not os.path.exists(ref['path'])
+    assert handoff.local_worker_alive('interactive')
+    handoff.mark_worker_stopped()
+
+
+def test_a_task_whose_job_was_rerouted_stands_down(tmp_path):
+    celery_tasks = pytest.importorskip('celery_tasks')
+    from celery.exceptions import Ignore
+
+    ref = _stage(tmp_path)
+    handoff.record_task(ref, 'convert', 'task-1', ['video_uploads/clip.mp4', {}], {'handoff_ref': ref}, 'interactive')
+    _age(handoff._record_path(ref), handoff.HANDOFF_REROUTE_SECONDS + 1)
+    handoff.reroute_stale(lambda record, path: None)
+    with pytest.raises(Ignore):
+        celery_tasks._claim_handoff(ref, str(tmp_path / 'claimed.mp4'))
+
+
+def test_a_missing_file_that_was_not_rerouted_is_an_error(tmp_path):
+    celery_tasks = pytest.importorskip('celery_tasks')
+
+    ref = _stage(tmp_path)
+    os.remove(ref['path'])
+    with pytest.raises(FileNotFoundError):
+        celery_tasks._claim_handoff(ref, str(tmp_path / 'claimed.mp4'))
+
+
+def test_the_web_tier_records_handed_off_jobs_and_forgets_unsubmitted_ones(tmp_path, monkeypatch):
+    import app
+    import task_client
+
+    submitted = []
+
+    def submit(task_name, args=None, kwargs=None, **options):
+        submitted.append(options)
+        return types.SimpleNamespace(id=options['task_id'])
+
+    monkeypatch.setattr(task_client, 'submit', submit)
+    ref = _stage(tmp_path)
+    task = app._submit_staged('convert', ['video_uploads/clip.mp4', {}], {'handoff_ref': ref}, 'interactive',
+                              handoff.local_queue_name('interactive'))
+    with open(handoff._record_path(ref)) as f:
+        assert json.load(f)['task_id'] == task.id
+    assert submitted[0]['queue'] == handoff.local_queue_name('interactive')
+
+    def broker_down(*args, **kwargs):
+        raise ConnectionError('broker is down')
+
+    monkeypatch.setattr(task_client, 'submit', broker_down)
+    other = _stage(tmp_path, name='other.mp4')
+    with pytest.raises(ConnectionError):
+        app._submit_staged('convert', ['video_uploads/other.mp4', {}], {'handoff_ref': other}, 'interactive', None)
+    assert not os.path.exists(other['path'])
+    assert not os.path.exists(handoff._record_path(other))
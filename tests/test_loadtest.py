@@ -0,0 +1,108 @@
+import functools
+import http.server
+import importlib.util
+import json
+import os
+import threading
+
+import pytest
+import requests
+
+_spec = importlib.util.spec_from_file_location(
+    'loadtest', os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks', 'loadtest.py'))
+loadtest = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(loadtest)
+
+DATA = bytes(range(256)) * 40
+
+
+@pytest.fixture
+def file_server(tmp_path):
+    (tmp_path / 'clip.mp4').write_bytes(DATA)
+    handler = functools.partial(loadtest.RangeRequestHandler, directory=str(tmp_path))
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{server.server_address[1]}/clip.mp4'
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.mark.parametrize('header, start, end', [('bytes=100-199', 100, 199), ('bytes=10000-', 10000, len(DATA) - 1),
+                                                ('bytes=-50', len(DATA) - 50, len(DATA) - 1),
+                                                ('bytes=10200-99999', 10200, len(DATA) - 1)])
+def test_the_file_server_answers_single_ranges(file_server, header, start, end):
+    response = requests.get(file_server, headers={'Range': header}, timeout=10)
+    assert response.status_code == 206
+    assert response.content == DATA[start:end + 1]
+    assert response.headers['Content-Range'] == f'bytes {start}-{end}/{len(DATA)}'
+
+
+def test_the_file_server_refuses_unsatisfiable_ranges(file_server):
+    response = requests.get(file_server, headers={'Range': f'bytes={len(DATA)}-'}, timeout=10)
+    assert response.status_code == 416
+    assert response.headers['Content-Range'] == f'bytes */{len(DATA)}'
+
+
+def test_the_file_server_sends_whole_files_without_a_range(file_server):
+    response = requests.get(file_server, timeout=10)
+    assert response.status_code == 200
+    assert response.content == DATA
+
+
+def test_percentiles_use_the_nearest_rank():
+    values = list(range(1, 101))
+    assert loadtest.percentile(values, 0.5) == 50
+    assert loadtest.percentile(values, 0.95) == 95
+    assert loadtest.percentile(values, 0.99) == 99
+    assert loadtest.percentile([7], 0.99) == 7
+    assert loadtest.percentile([], 0.5) is None
+
+
+class FakeSession:
+    def __init__(self, outcomes):
+        self.outcomes = list(outcomes)
+
+    def request(self, method, url, **kwargs):
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return type('Response', (), {'status_code': outcome, 'content': b''})()
+
+
+def test_requests_are_recorded_by_endpoint_with_their_errors():
+    recorder = loadtest.Recorder()
+    session = FakeSession([200, 200, 503, requests.ConnectionError('refused'), 202])
+    for _ in range(4):
+        recorder.request(session, 'GET /status', 'GET', 'http://localhost/status')
+    assert recorder.request(session, 'POST /convert', 'POST', 'http://localhost/convert').status_code == 202
+    recorder.conversion('completed', 4.0)
+    recorder.conversion('completed', 2.0)
+    recorder.conversion('failed')
+
+    endpoints, conversions = loadtest.summarize(recorder, elapsed=2.0)
+    status = endpoints['GET /status']
+    assert status['requests'] == 4 and status['errors'] == 2
+    assert status['statuses'] == {'200': 2, '503': 1, 'exception': 1}
+    assert status['throughput_rps'] == 2.0
+    assert endpoints['POST /convert']['errors'] == 0
+    assert conversions == {'completed': 2, 'failed': 1, 'abandoned': 0, 'per_minute': 60.0,
+                           'p50_seconds': 2.0, 'p95_seconds': 4.0}
+
+
+def test_the_mix_is_parsed_into_weights():
+    assert loadtest.parse_mix('upload=3,url=1,form') == {'upload': 3.0, 'url': 1.0, 'form': 1.0}
+    with pytest.raises(SystemExit):
+        loadtest.parse_mix('upload=1,download=2')
+
+
+def _stats(p95_ms):
+    return {'throughput_rps': 10.0, 'p50_ms': 10.0, 'p95_ms': p95_ms, 'p99_ms': 50.0}
+
+
+def test_p95_regressions_past_the_limit_fail_the_run(tmp_path):
+    baseline = tmp_path / 'baseline.json'
+    baseline.write_text(json.dumps({'endpoints': {'GET /status': _stats(20.0)}}))
+    assert not loadtest.compare({'GET /status': _stats(21.0), 'GET /new': _stats(500.0)}, str(baseline), 10)
+    assert loadtest.compare({'GET /status': _stats(30.0)}, str(baseline), 10)
+    assert not loadtest.compare({'GET /status': _stats(30.0)}, str(baseline), None)
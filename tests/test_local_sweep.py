@@ -0,0 +1,48 @@
+import os
+import time
+
+import pytest
+
+import celery_tasks
+import expiry_index
+import handoff
+
+fakeredis = pytest.importorskip('fakeredis')
+
+
+@pytest.fixture(autouse=True)
+def index(tmp_path, monkeypatch):
+    monkeypatch.setattr(expiry_index, '_client', fakeredis.FakeRedis())
+    monkeypatch.setattr(expiry_index, 'HOST_LOCK_DIR', str(tmp_path))
+    monkeypatch.setattr(handoff, 'HANDOFF_DIR', str(tmp_path / 'handoff'))
+
+
+def test_the_worker_sweep_removes_expired_temp_files(tmp_path):
+    expired, live = tmp_path / 'expired.mp4', tmp_path / 'live.mp4'
+    expired.write_bytes(b'x')
+    live.write_bytes(b'x')
+    expiry_index.register_local(str(expired), ttl_seconds=-1)
+    expiry_index.register_local(str(live))
+    celery_tasks.sweep_local_files()
+    assert not expired.exists()
+    assert live.exists()
+
+
+def test_the_worker_sweep_removes_stale_handoffs(tmp_path):
+    staged = tmp_path / 'handoff' / 'clip.mp4'
+    staged.parent.mkdir()
+    staged.write_bytes(b'x')
+    old = time.time() - handoff.HANDOFF_MAX_AGE_SECONDS - 1
+    os.utime(staged, (old, old))
+    celery_tasks.sweep_local_files()
+    assert not staged.exists()
+
+
+def test_the_sweep_skips_while_another_process_on_the_host_holds_it(tmp_path):
+    expired = tmp_path / 'expired.mp4'
+    expired.write_bytes(b'x')
+    expiry_index.register_local(str(expired), ttl_seconds=-1)
+    with expiry_index.host_lock('local-cleanup') as elected:
+        assert elected
+        celery_tasks.sweep_local_files()
+    assert expired.exists()
@@ -0,0 +1,133 @@
+import pytest
+
+import metrics
+
+fakeredis = pytest.importorskip('fakeredis')
+
+TOKEN = 'scrape-token'
+
+
+@pytest.fixture
+def redis_client(monkeypatch):
+    client = fakeredis.FakeRedis()
+    monkeypatch.setattr(metrics, '_client', client)
+    monkeypatch.setattr(metrics, 'METRICS_ENABLED', True)
+    monkeypatch.setattr(metrics, '_pending', {})
+    return client
+
+
+@pytest.fixture
+def web(redis_client, monkeypatch):
+    import app
+
+    monkeypatch.setattr(app, 'METRICS_TOKEN', TOKEN)
+    monkeypatch.setattr(metrics, 'queue_depths', lambda broker_url, queues: {queue: 0 for queue in queues})
+    return app
+
+
+def test_metrics_need_the_bearer_token(web):
+    client = web.app.test_client()
+    assert client.get('/metrics').status_code == 401
+    assert client.get('/metrics', headers={'Authorization': 'Bearer wrong'}).status_code == 401
+    assert client.get('/metrics', headers={'Authorization': f'Basic {TOKEN}'}).status_code == 401
+    response = client.get('/metrics', headers={'Authorization': f'Bearer {TOKEN}'})
+    assert response.status_code == 200
+    assert b'gifconv_queue_depth' in response.data
+
+
+def test_metrics_are_not_served_without_a_configured_token(web, monkeypatch):
+    monkeypatch.setattr(web, 'METRICS_TOKEN', '')
+    response = web.app.test_client().get('/metrics', headers={'Authorization': 'Bearer '})
+    assert response.status_code == 404
+
+
+def _samples(text):
+    return dict(line.rsplit(' ', 1) for line in text.splitlines() if line and not line.startswith('#'))
+
+
+def test_counters_add_up_across_processes(redis_client):
+    metrics.inc('gifconv_tasks_total', outcome='success')
+    metrics.flush()
+    # Another process writing to the same Redis
+    metrics.inc('gifconv_tasks_total', 2, outcome='success')
+    metrics.inc('gifconv_tasks_total', outcome='failure')
+    samples = _samples(metrics.render())
+    assert samples['gifconv_tasks_total{outcome="success"}'] == '3'
+    assert samples['gifconv_tasks_total{outcome="failure"}'] == '1'
+
+
+def test_histograms_are_cumulative_with_sum_and_count(redis_client):
+    for seconds in (0.003, 0.2, 0.2, 1000):
+        metrics.observe('gifconv_stage_seconds', seconds, stage='encode')
+    samples = _samples(metrics.render())
+    assert samples['gifconv_stage_seconds_bucket{stage="encode",le="0.005"}'] == '1'
+    assert samples['gifconv_stage_seconds_bucket{stage="encode",le="0.1"}'] == '1'
+    assert samples['gifconv_stage_seconds_bucket{stage="encode",le="0.25"}'] == '3'
+    assert samples['gifconv_stage_seconds_bucket{stage="encode",le="600"}'] == '3'
+    assert samples['gifconv_stage_seconds_bucket{stage="encode",le="+Inf"}'] == '4'
+    assert samples['gifconv_stage_seconds_count{stage="encode"}'] == '4'
+    assert float(samples['gifconv_stage_seconds_sum{stage="encode"}']) == pytest.approx(1000.403)
+
+
+def test_label_values_are_escaped(redis_client):
+    metrics.inc('gifconv_cache_lookups_total', cache='a"b\\c\nd')
+    assert 'gifconv_cache_lookups_total{cache="a\\"b\\\\c\\nd"} 1' in metrics.render()
+
+
+def test_gauges_are_rendered_with_their_labels(redis_client):
+    text = metrics.render({'gifconv_queue_depth': ('Waiting tasks.', {(('queue', 'bulk'),): 4})})
+    assert '# TYPE gifconv_queue_depth gauge' in text
+    assert 'gifconv_queue_depth{queue="bulk"} 4' in text
+
+
+def test_updates_are_buffered_until_the_flush_interval(redis_client, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(metrics.time, 'monotonic', lambda: now[0])
+    monkeypatch.setattr(metrics, '_last_flush', now[0])
+    monkeypatch.setattr(metrics, 'METRICS_FLUSH_INTERVAL', 2.0)
+    metrics.inc('gifconv_bytes_in_total', 100)
+    metrics.inc('gifconv_bytes_in_total', 50)
+    assert redis_client.hgetall('metrics:gifconv_bytes_in_total') == {}
+    now[0] += 2.0
+    metrics.inc('gifconv_bytes_in_total', 1)
+    assert redis_client.hgetall('metrics:gifconv_bytes_in_total') == {b'': b'151'}
+
+
+def test_a_failed_flush_drops_the_batch_without_raising(redis_client, monkeypatch):
+    class DownRedis:
+        def pipeline(self, transaction=False):
+            raise ConnectionError('redis is down')
+
+    monkeypatch.setattr(metrics, '_client', DownRedis())
+    metrics.inc('gifconv_tasks_total', outcome='success')
+    metrics.flush()
+    assert metrics._pending == {}
+
+
+def test_disabled_metrics_record_nothing(redis_client, monkeypatch):
+    monkeypatch.setattr(metrics, 'METRICS_ENABLED', False)
+    metrics.inc('gifconv_tasks_total', outcome='success')
+    metrics.observe('gifconv_stage_seconds', 1.0, stage='encode')
+    assert metrics._pending == {}
+
+
+def test_spans_record_the_stage_and_add_to_the_task_timings(redis_client):
+    timings = {'encode': 1.0}
+    with metrics.span('encode', timings):
+        pass
+    with pytest.raises(ValueError):
+        with metrics.span('upload', timings):
+            raise ValueError('upload failed')
+    assert set(timings) == {'encode', 'upload'} and timings['encode'] >= 1.0
+    samples = _samples(metrics.render())
+    assert samples['gifconv_stage_seconds_count{stage="encode"}'] == '1'
+    assert samples['gifconv_stage_seconds_count{stage="upload"}'] == '1'
+
+
+def test_web_requests_are_timed_by_endpoint(web):
+    client = web.app.test_client()
+    client.get('/status')
+    client.get('/no-such-page')
+    text = client.get('/metrics', headers={'Authorization': f'Bearer {TOKEN}'}).get_data(as_text=True)
+    assert 'gifconv_http_request_seconds_count{endpoint="/status",method="GET",status="400"} 1' in text
+    assert 'gifconv_http_request_seconds_count{endpoint="unmatched",method="GET",status="404"} 1' in text
@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+
+import gif_quantizer
+import parallel_encoder
+import video_pipeline
+
+
+def test_only_the_numpy_encoder_splits_long_clips():
+    plan = {'frame_count': parallel_encoder.SEGMENT_MIN_FRAMES}
+    assert parallel_encoder.should_parallelize(plan, 'numpy', workers=4)
+    assert not parallel_encoder.should_parallelize(plan, 'ffmpeg', workers=4)
+    assert not parallel_encoder.should_parallelize(plan, 'imageio', workers=4)
+
+
+def test_short_clips_and_single_workers_are_not_split():
+    short = {'frame_count': parallel_encoder.SEGMENT_MIN_FRAMES - 1}
+    assert not parallel_encoder.should_parallelize(short, 'numpy', workers=4)
+    assert not parallel_encoder.should_parallelize({'frame_count': 1000}, 'numpy', workers=1)
+
+
+def test_split_frames_covers_every_frame_once():
+    ranges = parallel_encoder.split_frames(10, 3)
+    assert ranges == [(0, 4), (4, 3), (7, 3)]
+    assert parallel_encoder.split_frames(2, 8) == [(0, 1), (1, 1)]
+
+
+def test_a_segment_that_decodes_nothing_raises(monkeypatch):
+    def no_frames(path, plan):
+        yield from ()
+
+    monkeypatch.setattr(video_pipeline, 'iter_frames', no_frames)
+    quantizer = gif_quantizer.PaletteQuantizer(np.array([[0, 0, 0], [255, 255, 255]], dtype=np.uint8))
+    plan = {'width': 8, 'height': 8, 'fps': 10, 'speed': 1.0, 'start_time': 0.0, 'end_time': 2.0}
+    with pytest.raises(video_pipeline.DecodeError):
+        parallel_encoder._encode_segment('clip.mp4', plan, 10, 10, quantizer)
@@ -0,0 +1,80 @@
+import importlib.util
+import json
+import os
+import shutil
+
+import pytest
+
+from conftest import requires_ffmpeg
+
+_spec = importlib.util.spec_from_file_location(
+    'pipeline_bench', os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                   'benchmarks', 'pipeline_bench.py'))
+pipeline_bench = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(pipeline_bench)
+
+
+def test_the_quick_matrix_changes_one_option_at_a_time():
+    combos = pipeline_bench.option_matrix('quick')
+    assert combos[0] == pipeline_bench.BASE_OPTIONS
+    assert len(combos) == 1 + sum(len(values) - 1 for values in pipeline_bench.OPTION_VALUES.values())
+    for combo in combos[1:]:
+        assert sum(combo[key] != pipeline_bench.BASE_OPTIONS[key] for key in combo) == 1
+    assert len({pipeline_bench.options_label(combo) for combo in combos}) == len(combos)
+
+
+def test_the_full_matrix_covers_every_combination():
+    combos = pipeline_bench.option_matrix('full')
+    assert len(combos) == 3 * 3 * 2 * 2 * 2
+    assert len({pipeline_bench.options_label(combo) for combo in combos}) == len(combos)
+
+
+def test_cases_become_task_options():
+    combo = dict(pipeline_bench.BASE_OPTIONS, crop='center', overlay='caption')
+    options = pipeline_bench.conversion_options(combo, 1280, 720)
+    assert (options['crop_x'], options['crop_y'], options['crop_width'], options['crop_height']) == (320, 180, 640, 360)
+    assert options['text_overlay'] == pipeline_bench.CAPTION_OPTIONS['text_overlay']
+    assert 'crop_x' not in pipeline_bench.conversion_options(pipeline_bench.BASE_OPTIONS, 1280, 720)
+
+
+def _result(label, wall_seconds, **extra):
+    return dict({'video_name': 'clip', 'label': label, 'mode': 'e2e', 'wall_seconds': wall_seconds,
+                 'frames_per_second': 100 / wall_seconds, 'output_bytes': 1000, 'peak_rss_mb': 100.0}, **extra)
+
+
+def test_wall_time_regressions_past_the_limit_fail_the_run(tmp_path):
+    baseline = tmp_path / 'baseline.json'
+    baseline.write_text(json.dumps({'results': [_result('a', 1.0), _result('b', 1.0), _result('c', 1.0, error='x')]}))
+    assert not pipeline_bench.compare([_result('a', 1.05), _result('b', 0.5)], str(baseline), 10)
+    assert pipeline_bench.compare([_result('a', 1.2), _result('b', 0.5)], str(baseline), 10)
+    # Without a limit, and for cases missing from either run, changes are only reported
+    assert not pipeline_bench.compare([_result('a', 1.2)], str(baseline), None)
+    assert not pipeline_bench.compare([_result('c', 5.0), _result('new', 5.0)], str(baseline), 10)
+
+
+def test_a_failing_case_is_reported_instead_of_raised(tmp_path):
+    case = {'video': str(tmp_path / 'missing.mp4'), 'options': {'fps': '10'}, 'mode': 'stages'}
+    assert 'error' in pipeline_bench.run_case_subprocess(case, timeout=120)
+
+
+@requires_ffmpeg
+def test_source_videos_are_generated_once(tmp_path):
+    path = pipeline_bench.generate_video(str(tmp_path), 160, 120, 0.5, 'high', 'h264')
+    assert os.path.basename(path) == '160x120_0.5s_high_h264.mp4'
+    modified = os.path.getmtime(path)
+    assert pipeline_bench.generate_video(str(tmp_path), 160, 120, 0.5, 'high', 'h264') == path
+    assert os.path.getmtime(path) == modified
+    assert os.listdir(tmp_path) == [os.path.basename(path)]
+
+
+@requires_ffmpeg
+@pytest.mark.skipif(shutil.which('ffprobe') is None, reason='needs ffprobe')
+@pytest.mark.parametrize('mode', ['e2e', 'stages'])
+def test_a_case_runs_and_reports_its_measurements(tmp_path, mode):
+    video = pipeline_bench.generate_video(str(tmp_path), 160, 120, 1, 'medium', 'h264')
+    options = pipeline_bench.conversion_options(pipeline_bench.BASE_OPTIONS, 160, 120)
+    result = pipeline_bench.run_case_subprocess({'video': video, 'options': options, 'mode': mode}, timeout=300)
+    assert 'error' not in result, result.get('error')
+    assert result['frames'] == 10 and result['output_bytes'] > 0
+    if mode == 'stages':
+        assert {'download', 'upload'} <= set(result['stages'])
@@ -0,0 +1,63 @@
+import json
+import subprocess
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import preview_assets
+import video_pipeline
+
+
+def _thumbs(count, height=30, width=40):
+    return np.stack([np.full((height, width, 3), index, dtype=np.uint8) for index in range(count)])
+
+
+def test_sprites_tile_thumbnails_row_by_row(tmp_path):
+    path = str(tmp_path / 'sprite.jpg')
+    layout = preview_assets.build_sprite([0.0, 1.0, 2.0], _thumbs(3), path, columns=2)
+    assert layout == {'columns': 2, 'rows': 2, 'thumb_width': 40, 'thumb_height': 30, 'times': [0.0, 1.0, 2.0]}
+    assert Image.open(path).size == (80, 60)
+
+
+def test_long_clips_keep_an_even_spread_of_thumbnails(tmp_path):
+    times = [float(index) for index in range(50)]
+    layout = preview_assets.build_sprite(times, _thumbs(50), str(tmp_path / 'sprite.jpg'), max_thumbs=5, columns=10)
+    assert layout['times'] == [0.0, 12.0, 24.0, 37.0, 49.0]
+    assert (layout['columns'], layout['rows']) == (5, 1)
+
+
+def test_strips_pick_the_keyframe_nearest_each_slot(tmp_path):
+    path = str(tmp_path / 'strip.jpg')
+    frames = np.stack([np.full((30, 40, 3), value, dtype=np.uint8) for value in (0, 255)])
+    preview_assets.build_strip([0.0, 5.0], frames, 10.0, path, count=4, height=24)
+    strip = np.asarray(Image.open(path).convert('L'), dtype=int)
+    assert strip.shape == (24, 4 * 32)
+    # Slots are centred at 1.25s, 3.75s, 6.25s and 8.75s; only the first is nearer 0s than 5s
+    assert [round(strip[:, slot * 32:(slot + 1) * 32].mean() / 255) for slot in range(4)] == [0, 1, 1, 1]
+
+
+def test_previews_are_built_from_a_small_seekable_proxy(sample_video, tmp_path, monkeypatch):
+    path, probe = sample_video
+    monkeypatch.setattr(video_pipeline, 'probe_video', lambda source: probe)
+    monkeypatch.setattr(preview_assets, 'PREVIEW_PROXY_WIDTH', 160)
+    output_dir = tmp_path / 'preview'
+    manifest = preview_assets.generate(path, str(output_dir))
+    assert (manifest['width'], manifest['height']) == (160, 120)
+    assert (manifest['source_width'], manifest['source_height'], manifest['duration']) == (320, 240, 2.0)
+    assert json.loads((output_dir / preview_assets.MANIFEST_NAME).read_text()) == manifest
+
+    raw = subprocess.run(['ffmpeg', '-nostdin', '-loglevel', 'error', '-i', str(output_dir / preview_assets.PROXY_NAME),
+                          '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-'], capture_output=True, check=True).stdout
+    assert len(raw) == 2 * preview_assets.PREVIEW_PROXY_FPS * 160 * 120 * 3
+    # A keyframe every second
+    assert manifest['sprite']['times'] == [0.0, 1.0]
+    assert manifest['sprite']['thumb_width'] == preview_assets.SPRITE_THUMB_WIDTH
+    assert manifest['strip']
+    assert Image.open(output_dir / preview_assets.STRIP_NAME).height == preview_assets.STRIP_HEIGHT
+
+
+def test_proxy_dimensions_are_rounded_to_even_numbers(sample_video, tmp_path):
+    path, _ = sample_video
+    probe = {'width': 315, 'height': 237, 'duration': 2.0, 'fps': 30.0}
+    assert preview_assets.build_proxy(path, str(tmp_path / 'proxy.mp4'), probe) == (316, 238)
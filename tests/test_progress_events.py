@@ -0,0 +1,115 @@
+import json
+import types
+
+import pytest
+
+import progress_events
+
+fakeredis = pytest.importorskip('fakeredis')
+
+
+class FakeTask:
+    def __init__(self, task_id='task-1'):
+        self.request = types.SimpleNamespace(id=task_id)
+        self.updates = []
+
+    def update_state(self, state, meta):
+        self.updates.append((state, dict(meta)))
+
+
+def test_stage_changes_are_always_published():
+    task = FakeTask()
+    progress = progress_events.ProgressReporter(task, min_interval=3600)
+    progress.set_stage('downloading')
+    progress.set_stage('encoding', frames_total=10)
+    assert [meta['stage'] for _, meta in task.updates] == ['downloading', 'encoding']
+    assert task.updates[-1] == ('PROGRESS', {'stage': 'encoding', 'frames_done': 0, 'frames_total': 10,
+                                             'eta_seconds': None})
+
+
+def test_frame_updates_are_throttled():
+    task = FakeTask()
+    progress = progress_events.ProgressReporter(task, min_interval=3600)
+    progress.set_stage('encoding', frames_total=100)
+    for _ in range(50):
+        progress.advance()
+    assert len(task.updates) == 1
+    assert progress.frames_done == 50
+
+    unthrottled = FakeTask()
+    progress = progress_events.ProgressReporter(unthrottled, min_interval=0)
+    progress.set_stage('encoding', frames_total=3)
+    for _ in range(3):
+        progress.advance()
+    assert [meta['frames_done'] for _, meta in unthrottled.updates] == [0, 1, 2, 3]
+
+
+def test_eta_follows_the_rate_so_far(monkeypatch):
+    progress = progress_events.ProgressReporter(FakeTask(), min_interval=3600)
+    progress.frames_total, progress.frames_done, progress._stage_started = 40, 10, 100.0
+    monkeypatch.setattr(progress_events.time, 'monotonic', lambda: 110.0)
+    assert progress.eta_seconds() == 30.0
+
+
+def test_publishing_failures_never_fail_the_task():
+    task = FakeTask()
+
+    def broken_update(state, meta):
+        raise ConnectionError('backend is down')
+
+    task.update_state = broken_update
+    progress = progress_events.ProgressReporter(task, min_interval=0)
+    progress.set_stage('encoding', frames_total=2)
+    progress.advance()
+
+
+def test_tasks_run_outside_a_worker_publish_nothing():
+    task = FakeTask(task_id=None)
+    progress_events.ProgressReporter(task).set_stage('encoding')
+    assert task.updates == []
+
+
+def test_the_listener_hands_state_writes_to_the_tasks_watchers(monkeypatch):
+    import redis
+
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(redis.Redis, 'from_url', staticmethod(lambda url, **kwargs: fakeredis.FakeRedis(server=server)))
+    listener = progress_events.TaskEventListener(types.SimpleNamespace(decode_result=json.loads))
+    watcher = listener.watch('task-1')
+    other = listener.watch('task-2')
+    publisher = fakeredis.FakeRedis(server=server)
+    publisher.publish('celery-task-meta-task-1', json.dumps({'status': 'PROGRESS', 'result': {'stage': 'encoding'}}))
+    publisher.publish('celery-task-meta-task-1', json.dumps({'status': 'SUCCESS', 'result': {'gif_url': 'x'}}))
+    assert watcher.get(timeout=5) == ('PROGRESS', {'stage': 'encoding'})
+    assert watcher.get(timeout=5) == ('SUCCESS', {'gif_url': 'x'})
+    assert other.empty()
+
+    listener.unwatch('task-1', watcher)
+    listener.unwatch('task-2', other)
+    assert listener._watchers == {}
+
+
+def test_the_event_stream_follows_a_task_to_its_result(monkeypatch):
+    import queue
+
+    import app
+    import task_states
+
+    updates = queue.Queue()
+    updates.put(('PROGRESS', {'stage': 'encoding', 'frames_done': 5, 'frames_total': 10, 'eta_seconds': 1.0}))
+    updates.put(('SUCCESS', {'status': 'SUCCESS', 'gif_url': 'https://example.com/clip.gif'}))
+    unwatched = []
+    listener = types.SimpleNamespace(watch=lambda task_id: updates,
+                                     unwatch=lambda task_id, watcher: unwatched.append(task_id))
+    monkeypatch.setattr(progress_events, 'get_listener', lambda backend: listener)
+    monkeypatch.setattr(task_states, 'get_state', lambda backend, task_id: ('PENDING', None))
+    monkeypatch.setattr(task_states, 'remember', lambda task_id, state, info: None)
+
+    response = app.app.test_client().get('/events/task-1')
+    assert response.mimetype == 'text/event-stream'
+    events = [json.loads(line[len('data: '):]) for line in response.get_data(as_text=True).split('\n\n')
+              if line.startswith('data: ')]
+    assert [event.get('state', event.get('status')) for event in events] == ['PENDING', 'PROGRESS', 'SUCCESS']
+    assert events[1]['frames_done'] == 5
+    assert events[2]['gif_url'] == 'https://example.com/clip.gif'
+    assert unwatched == ['task-1']
@@ -0,0 +1,80 @@
+import io
+
+import pytest
+
+import result_cache
+
+fakeredis = pytest.importorskip('fakeredis')
+
+DIGEST = 'a' * 64
+
+
+@pytest.fixture
+def client(monkeypatch):
+    client = fakeredis.FakeRedis()
+    monkeypatch.setattr(result_cache, '_client', client)
+    monkeypatch.setattr(result_cache, 'RESULT_CACHE_ENABLED', True)
+    return client
+
+
+def _store(name, size):
+    result_cache.store(name, {'fps': '10'}, {'status': 'SUCCESS', 'gif_url': f'https://example.com/{name}.gif'}, size)
+
+
+def test_keys_match_for_options_that_render_the_same_gif():
+    form = {'fps': '10', 'resize': '', 'start_time': '0', 'end_time': '', 'text_overlay': ''}
+    assert result_cache.cache_key(DIGEST, form) == result_cache.cache_key(DIGEST, {})
+    assert result_cache.cache_key(DIGEST, {'fps': '10.0', 'speed': '1'}) == result_cache.cache_key(DIGEST, {'fps': 10})
+
+
+def test_keys_differ_by_source_and_by_options():
+    key = result_cache.cache_key(DIGEST, {'fps': '10'})
+    assert result_cache.cache_key('b' * 64, {'fps': '10'}) != key
+    assert result_cache.cache_key(DIGEST, {'fps': '12'}) != key
+    assert result_cache.cache_key(DIGEST, {'fps': '10', 'output_format': 'webp'}) != key
+
+
+def test_saving_a_stream_hashes_what_it_writes(tmp_path):
+    path = tmp_path / 'upload.mp4'
+    digest = result_cache.save_stream_with_digest(io.BytesIO(b'video bytes' * 1000), str(path))
+    assert path.read_bytes() == b'video bytes' * 1000
+    assert digest == result_cache.file_digest(str(path))
+
+
+def test_stored_results_are_returned_as_cached(client):
+    _store(DIGEST, 100)
+    result = result_cache.lookup(DIGEST, {'fps': 10})
+    assert result == {'status': 'SUCCESS', 'gif_url': f'https://example.com/{DIGEST}.gif', 'cached': True}
+    assert result_cache.lookup(DIGEST, {'fps': 12}) is None
+
+
+def test_storing_again_replaces_the_entry_and_its_size(client):
+    _store(DIGEST, 100)
+    _store(DIGEST, 300)
+    assert client.zcard(result_cache._INDEX_KEY) == 1
+    assert int(client.get(result_cache._BYTES_KEY)) == 300
+
+
+def test_oldest_entries_are_evicted_past_the_entry_bound(client, monkeypatch):
+    monkeypatch.setattr(result_cache, 'RESULT_CACHE_MAX_ENTRIES', 3)
+    for index in range(5):
+        _store(f'{index}' * 64, 10)
+    assert [result_cache.lookup(f'{index}' * 64, {}) is not None for index in range(5)] == [False, False, True, True, True]
+    assert int(client.get(result_cache._BYTES_KEY)) == 30
+
+
+def test_oldest_entries_are_evicted_past_the_byte_bound(client, monkeypatch):
+    monkeypatch.setattr(result_cache, 'RESULT_CACHE_MAX_BYTES', 250)
+    for index in range(3):
+        _store(f'{index}' * 64, 100)
+    assert result_cache.lookup('0' * 64, {}) is None
+    assert result_cache.lookup('1' * 64, {}) is not None
+    assert client.hlen(result_cache._SIZES_KEY) == 2
+    assert int(client.get(result_cache._BYTES_KEY)) == 200
+
+
+def test_disabled_cache_neither_stores_nor_returns(client, monkeypatch):
+    monkeypatch.setattr(result_cache, 'RESULT_CACHE_ENABLED', False)
+    _store(DIGEST, 100)
+    assert client.zcard(result_cache._INDEX_KEY) == 0
+    assert result_cache.lookup(DIGEST, {}) is None
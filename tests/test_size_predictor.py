@@ -0,0 +1,84 @@
+import os
+from contextlib import closing
+
+import numpy as np
+import pytest
+
+import conversion_options
+import gif_encoder
+import gif_quantizer
+import size_predictor
+import video_pipeline
+
+
+@pytest.fixture
+def predictor(sample_video):
+    path, probe = sample_video
+    return size_predictor.SizePredictor(path, {'fps': '15'}, encoder='numpy', probe=probe)
+
+
+def _encode(path, predictor, choice, output_path):
+    plan = predictor.candidate_plan(choice['width'], choice['fps'])
+    encoder = gif_encoder.create_encoder('numpy', output_path, plan['width'], plan['height'], plan['fps'],
+                                         max_colors=choice['colors'])
+    with closing(video_pipeline.iter_frames(path, plan)) as frames:
+        for frame in frames:
+            encoder.write_frame(frame)
+    encoder.close()
+    return os.path.getsize(output_path)
+
+
+def test_candidates_never_exceed_the_requested_settings(predictor):
+    assert predictor.width_steps == [320, 280, 240, 200, 160, 120]
+    assert predictor.fps_steps == [15, 12, 10, 8, 6, 5]
+
+
+def test_predicted_size_falls_with_width_frame_rate_and_palette(predictor):
+    full = predictor.predict(320, 15, 256)
+    assert predictor.predict(240, 15, 256) < full
+    assert predictor.predict(320, 10, 256) < full
+    assert predictor.predict(320, 15, 64) < full
+
+
+def test_the_chosen_settings_encode_within_the_target(sample_video, predictor, tmp_path):
+    path, _ = sample_video
+    target = predictor.predict(320, 15, 256) // 2
+    choice = predictor.fit(target)
+    assert choice['fits']
+    assert (choice['width'], choice['fps'], choice['colors']) != (320, 15, 256)
+    assert choice['options']['resize'] == str(choice['width'])
+    assert _encode(path, predictor, choice, str(tmp_path / 'fit.gif')) <= target
+
+
+def test_a_generous_target_keeps_the_requested_settings(predictor):
+    choice = predictor.fit(10 * predictor.predict(320, 15, 256))
+    assert (choice['width'], choice['fps'], choice['colors']) == (320, 15, 256)
+
+
+def test_an_unreachable_target_returns_the_smallest_setting(predictor):
+    choice = predictor.fit(1000)
+    assert (choice['width'], choice['fps'], choice['colors']) == (120, 5, 32)
+    assert not choice['fits']
+
+
+def test_a_miss_is_folded_back_into_the_next_prediction(predictor):
+    choice = predictor.fit(predictor.predict(320, 15, 256) // 2)
+    before = predictor.correction
+    predictor.observe(choice, choice['predicted_bytes'] * 1.2)
+    assert predictor.correction == pytest.approx(before * 1.2)
+    assert predictor.predict(choice['width'], choice['fps'], choice['colors']) > choice['predicted_bytes']
+
+
+def test_unchanged_frames_cost_a_single_pixel():
+    palette = np.array([[0, 0, 0], [255, 255, 255]], dtype=np.uint8)
+    frame = gif_quantizer.PaletteQuantizer(palette).map_frame(np.zeros((32, 32, 3), dtype=np.uint8))
+    changed = frame.copy()
+    changed[4:8, 4:20] = 1
+    assert size_predictor._changed_rect_bytes(frame, frame, palette) < size_predictor._changed_rect_bytes(
+        frame, changed, palette)
+
+
+@pytest.mark.parametrize('value, expected', [('2000000', 2000000), ('1.5e6', 1500000), ('0', None), ('-5', None),
+                                             ('', None), ('lots', None), (None, None)])
+def test_target_sizes_are_normalized(value, expected):
+    assert conversion_options.normalize_options({'target_bytes': value})['target_bytes'] == expected
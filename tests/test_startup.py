@@ -0,0 +1,76 @@
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_spec = importlib.util.spec_from_file_location('startup_bench', os.path.join(ROOT, 'benchmarks', 'startup_bench.py'))
+startup_bench = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(startup_bench)
+
+
+def test_the_web_tier_never_loads_the_media_stack(tmp_path):
+    result = startup_bench.run_target_subprocess('web', str(tmp_path), timeout=120)
+    assert 'error' not in result, result.get('error')
+    assert result['heavy_modules'] == []
+
+
+def test_workers_load_the_media_stack_before_forking(tmp_path):
+    bare = startup_bench.run_target_subprocess('worker', str(tmp_path), timeout=120)
+    assert 'error' not in bare, bare.get('error')
+    assert 'moviepy' not in bare['heavy_modules'] and 'yt_dlp' not in bare['heavy_modules']
+    warm = startup_bench.run_target_subprocess('worker-warm', str(tmp_path), timeout=120)
+    assert 'error' not in warm, warm.get('error')
+    for name in ('moviepy', 'yt_dlp'):
+        if importlib.util.find_spec(name) is not None:
+            assert name in warm['heavy_modules']
+
+
+def test_tasks_are_submitted_by_name_with_their_routing(tmp_path):
+    """Publishes through task_client on an in-memory broker and reads the message back."""
+    script = '''
+import json
+import task_client
+import task_routing
+
+task_client.submit(task_client.CONVERT_TASK, ['video_uploads/clip.mp4', {}], {'source_digest': 'abc'},
+                   **task_routing.publish_options(task_routing.BULK_QUEUE))
+with task_client.celery_app.connection_for_read() as connection:
+    message = connection.SimpleQueue(task_routing.BULK_QUEUE).get(timeout=5)
+print(json.dumps({'task': message.headers['task'], 'enqueued_at': message.headers.get('enqueued_at'),
+                  'time_limit': message.headers.get('timelimit'), 'body': message.decode()}))
+'''
+    env = dict(os.environ, CELERY_BROKER_URL='memory://', CELERY_RESULT_BACKEND='cache+memory://')
+    import task_routing
+
+    completed = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, cwd=ROOT, env=env,
+                               timeout=120)
+    assert completed.returncode == 0, completed.stderr
+    message = json.loads(completed.stdout.strip().splitlines()[-1])
+    assert message['task'] == 'celery_tasks.convert_video_to_gif_task'
+    assert message['enqueued_at'] is not None
+    # Celery's header lists the hard limit first
+    assert message['time_limit'] == [task_routing.BULK_TIME_LIMIT, task_routing.BULK_SOFT_TIME_LIMIT]
+    assert message['body'][0] == ['video_uploads/clip.mp4', {}]
+    assert message['body'][1] == {'source_digest': 'abc'}
+
+
+def test_task_names_match_the_worker_registrations():
+    celery_tasks = pytest.importorskip('celery_tasks')
+    import task_client
+
+    for name in (task_client.CONVERT_TASK, task_client.CONVERT_VARIANTS_TASK, task_client.INGEST_URL_TASK,
+                 task_client.FETCH_PREVIEW_TASK):
+        assert name in celery_tasks.celery_app.tasks
+
+
+def test_the_slowest_imports_are_read_from_an_importtime_log():
+    log = '\n'.join(['import time: self [us] | cumulative | imported package',
+                     'import time:       100 |        100 |   json.decoder',
+                     'import time:       200 |       2500 | json',
+                     'import time:      1000 |     300000 | numpy'])
+    assert startup_bench.slowest_imports(log, 2) == [('numpy', 0.3), ('json', 0.0025)]
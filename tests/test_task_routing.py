@@ -0,0 +1,37 @@
+import admission
+import task_routing
+
+
+def _estimate(pixels):
+    return {'pixels_processed': pixels}
+
+
+def test_jobs_up_to_the_pixel_budget_are_interactive():
+    assert task_routing.queue_for(_estimate(0)) == task_routing.INTERACTIVE_QUEUE
+    assert task_routing.queue_for(_estimate(task_routing.ROUTING_BULK_PIXELS)) == task_routing.INTERACTIVE_QUEUE
+
+
+def test_jobs_over_the_pixel_budget_are_bulk():
+    assert task_routing.queue_for(_estimate(task_routing.ROUTING_BULK_PIXELS + 1)) == task_routing.BULK_QUEUE
+
+
+def test_jobs_of_unknown_cost_are_bulk():
+    assert task_routing.queue_for(None) == task_routing.BULK_QUEUE
+
+
+def test_routing_follows_the_admission_estimate():
+    probe = {'width': 640, 'height': 360, 'duration': 10.0, 'fps': 30.0}
+    short = admission.estimate_cost({'end_time': '2', 'resize': '320'}, probe)
+    whole = admission.estimate_cost({}, dict(probe, width=1920, height=1080, duration=600.0))
+    assert task_routing.queue_for(short) == task_routing.INTERACTIVE_QUEUE
+    assert task_routing.queue_for(whole) == task_routing.BULK_QUEUE
+
+
+def test_publish_options_carry_the_class_time_limits_onto_a_specific_queue():
+    options = task_routing.publish_options(task_routing.INTERACTIVE_QUEUE, queue='handoff.node.interactive')
+    assert options == {'queue': 'handoff.node.interactive',
+                       'soft_time_limit': task_routing.INTERACTIVE_SOFT_TIME_LIMIT,
+                       'time_limit': task_routing.INTERACTIVE_TIME_LIMIT}
+    assert task_routing.publish_options(task_routing.BULK_QUEUE)['queue'] == task_routing.BULK_QUEUE
+    assert task_routing.time_limits(task_routing.BULK_QUEUE) == (task_routing.BULK_SOFT_TIME_LIMIT,
+                                                                   task_routing.BULK_TIME_LIMIT)
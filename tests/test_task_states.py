@@ -0,0 +1,86 @@
+import json
+
+import pytest
+
+import task_states
+
+
+class FakeBackend:
+    """The two calls task_states makes on Celery's Redis result backend, counting round-trips."""
+
+    def __init__(self, results):
+        self.results = {f'celery-task-meta-{task_id}': json.dumps(meta) for task_id, meta in results.items()}
+        self.mget_calls = []
+
+    def get_key_for_task(self, task_id):
+        return f'celery-task-meta-{task_id}'
+
+    def mget(self, keys):
+        self.mget_calls.append(list(keys))
+        return [self.results.get(key) for key in keys]
+
+    def decode_result(self, value):
+        return json.loads(value)
+
+
+@pytest.fixture(autouse=True)
+def empty_memo(monkeypatch):
+    monkeypatch.setattr(task_states, '_memo', {})
+
+
+def test_many_states_are_read_in_one_round_trip():
+    backend = FakeBackend({'a': {'status': 'SUCCESS', 'result': {'gif_url': 'x'}},
+                           'b': {'status': 'PROGRESS', 'result': {'stage': 'encoding'}}})
+    states = task_states.get_states(backend, ['a', 'b', 'c', 'a'])
+    assert states == {'a': ('SUCCESS', {'gif_url': 'x'}), 'b': ('PROGRESS', {'stage': 'encoding'}),
+                      'c': ('PENDING', None)}
+    assert backend.mget_calls == [['celery-task-meta-a', 'celery-task-meta-b', 'celery-task-meta-c']]
+
+
+def test_finished_tasks_are_answered_from_memory():
+    backend = FakeBackend({'a': {'status': 'SUCCESS', 'result': {'gif_url': 'x'}},
+                           'b': {'status': 'PROGRESS', 'result': {}}})
+    task_states.get_states(backend, ['a', 'b'])
+    backend.results.clear()
+    assert task_states.get_state(backend, 'a') == ('SUCCESS', {'gif_url': 'x'})
+    assert task_states.get_state(backend, 'b') == ('PENDING', None)
+    assert backend.mget_calls[1:] == [['celery-task-meta-b']]
+
+
+def test_memoized_results_expire(monkeypatch):
+    monkeypatch.setattr(task_states, 'STATUS_MEMO_SECONDS', 10)
+    now = [1000.0]
+    monkeypatch.setattr(task_states.time, 'monotonic', lambda: now[0])
+    task_states.remember('a', 'FAILURE', 'boom')
+    assert task_states.get_state(FakeBackend({}), 'a') == ('FAILURE', 'boom')
+    now[0] += 11
+    assert task_states.get_state(FakeBackend({}), 'a') == ('PENDING', None)
+
+
+def test_the_memo_stays_within_its_size_limit(monkeypatch):
+    monkeypatch.setattr(task_states, 'STATUS_MEMO_MAX_ENTRIES', 3)
+    for task_id in 'abcde':
+        task_states.remember(task_id, 'SUCCESS', {})
+    assert list(task_states._memo) == ['c', 'd', 'e']
+
+
+def test_unfinished_states_are_not_memoized():
+    task_states.remember('a', 'PROGRESS', {'stage': 'encoding'})
+    assert task_states._memo == {}
+
+
+def test_the_batch_endpoint_validates_its_ids(monkeypatch):
+    import app
+
+    monkeypatch.setattr(task_states, 'get_states',
+                        lambda backend, task_ids: {task_id: ('PENDING', None) for task_id in task_ids})
+    client = app.app.test_client()
+    response = client.get('/status?ids=a,b')
+    assert response.status_code == 200
+    assert response.get_json() == {'a': {'state': 'PENDING', 'status': 'Pending...'},
+                                   'b': {'state': 'PENDING', 'status': 'Pending...'}}
+    assert client.post('/status', json={'task_ids': ['a']}).status_code == 200
+    assert client.post('/status', json={'task_ids': 'a'}).status_code == 400
+    assert client.get('/status').status_code == 400
+    too_many = ','.join(f't{index}' for index in range(app.STATUS_BATCH_MAX_TASKS + 1))
+    assert client.get(f'/status?ids={too_many}').status_code == 400
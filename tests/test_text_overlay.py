@@ -0,0 +1,87 @@
+import numpy as np
+import pytest
+
+import font_index
+import text_overlay
+
+
+@pytest.fixture
+def fonts(monkeypatch):
+    """The index over matplotlib's bundled DejaVu fonts only, as on a host with no fonts installed."""
+    monkeypatch.setattr(font_index, 'FONT_DIRS', [])
+    monkeypatch.setattr(font_index, '_index', None)
+    yield font_index.get_index()
+    font_index._index = None
+
+
+def test_font_names_resolve_however_they_are_written(fonts):
+    path = font_index.resolve('DejaVu Sans')
+    assert path and path.endswith('DejaVuSans.ttf')
+    assert font_index.resolve('dejavu-sans') == path
+    assert font_index.resolve('DejaVuSans.ttf') == path
+    assert font_index.resolve('DejaVu Sans Bold').endswith('DejaVuSans-Bold.ttf')
+
+
+def test_unknown_fonts_fall_back_to_an_installed_one(fonts):
+    assert font_index.resolve('No Such Font') == font_index.resolve('DejaVu Sans')
+    assert font_index.resolve(None) == font_index.resolve('DejaVu Sans')
+
+
+def test_font_files_are_used_as_given(fonts):
+    path = font_index.resolve('DejaVu Serif')
+    assert font_index.resolve(path) == path
+
+
+def test_blending_matches_alpha_compositing():
+    rgba = np.zeros((4, 6, 4), dtype=np.uint8)
+    rgba[1:3, 2:5] = (255, 0, 0, 128)
+    overlay = text_overlay.Overlay(rgba, 10, 20)
+    # Cropped to the opaque bounding box
+    assert (overlay.x, overlay.y, overlay.width, overlay.height) == (12, 21, 3, 2)
+
+    frame = np.full((40, 40, 3), 100, dtype=np.uint8)
+    blended = overlay.blend(frame)
+    expected = np.round((np.array([255, 0, 0]) * 128 + 100 * 127) / 255)
+    assert np.array_equal(blended[21:23, 12:15], np.broadcast_to(expected, (2, 3, 3)))
+    assert (blended[:21] == 100).all() and (blended[23:] == 100).all()
+    assert (blended[:, :12] == 100).all() and (blended[:, 15:] == 100).all()
+
+
+def test_read_only_frames_are_copied_before_blending():
+    rgba = np.full((2, 2, 4), 255, dtype=np.uint8)
+    frame = np.zeros((4, 4, 3), dtype=np.uint8)
+    frame.flags.writeable = False
+    blended = text_overlay.Overlay(rgba, 0, 0).blend(frame)
+    assert blended is not frame
+    assert (frame == 0).all()
+    assert (blended[:2, :2] == 255).all()
+
+
+def test_transparent_captions_leave_frames_alone():
+    frame = np.zeros((4, 4, 3), dtype=np.uint8)
+    assert text_overlay.Overlay(np.zeros((2, 2, 4), dtype=np.uint8), 0, 0).blend(frame) is frame
+
+
+def test_captions_are_placed_by_position(fonts):
+    options = {'text_overlay': 'Hello', 'text_size': '20', 'text_bg_color': 'black'}
+    top = text_overlay.overlay_for_options(dict(options, text_position='top'), 320, 240)
+    bottom = text_overlay.overlay_for_options(dict(options, text_position='bottom'), 320, 240)
+    assert top.y == 0
+    assert bottom.y + bottom.height == 240
+    assert top.width == int(320 * 0.96)
+
+
+def test_captions_are_rendered_once_per_text_and_size(fonts):
+    options = {'text_overlay': 'Cached caption', 'text_color': 'yellow'}
+    first = text_overlay.overlay_for_options(options, 320, 240)
+    assert text_overlay.overlay_for_options(dict(options), 320, 240) is first
+    assert text_overlay.overlay_for_options(options, 640, 480) is not first
+    assert text_overlay.overlay_for_options({'text_overlay': ''}, 320, 240) is None
+
+
+def test_long_captions_wrap_within_the_box(fonts):
+    short = text_overlay.overlay_for_options({'text_overlay': 'word', 'text_bg_color': 'none'}, 200, 400)
+    long = text_overlay.overlay_for_options({'text_overlay': ' '.join(['word'] * 30), 'text_bg_color': 'none'},
+                                            200, 400)
+    assert long.width <= int(200 * 0.96)
+    assert long.height > short.height
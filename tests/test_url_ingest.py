@@ -0,0 +1,76 @@
+import os
+import subprocess
+
+import numpy as np
+import pytest
+
+import url_ingest
+import video_pipeline
+from conftest import requires_ffmpeg
+
+yt_dlp = pytest.importorskip('yt_dlp')
+
+
+def _fmt(format_id, width, vcodec, acodec='none'):
+    return {'format_id': format_id, 'url': f'https://example.com/{format_id}', 'ext': 'mp4', 'protocol': 'https',
+            'width': width, 'height': width * 9 // 16, 'vcodec': vcodec, 'acodec': acodec}
+
+
+def _select(formats, max_width):
+    with yt_dlp.YoutubeDL({'quiet': True}) as ydl:
+        selector = ydl.build_format_selector(url_ingest.format_selector(max_width))
+        ctx = {'formats': formats, 'incomplete_formats': False, 'has_merged_format': False}
+        return [chosen['format_id'] for chosen in selector(ctx)]
+
+
+def test_prefers_video_only_h264_within_the_width():
+    formats = [_fmt('muxed-640', 640, 'avc1.4d401e', acodec='mp4a.40.2'), _fmt('vp9-640', 640, 'vp9'),
+               _fmt('avc-640', 640, 'avc1.4d401e'), _fmt('avc-1920', 1920, 'avc1.640028')]
+    assert _select(formats, 640) == ['avc-640']
+
+
+def test_never_picks_a_muxed_format_over_a_video_only_one():
+    formats = [_fmt('muxed-640', 640, 'avc1.4d401e', acodec='mp4a.40.2'), _fmt('vp9-640', 640, 'vp9')]
+    assert _select(formats, 640) == ['vp9-640']
+
+
+def test_falls_back_to_the_narrowest_video_only_format():
+    formats = [_fmt('muxed-1920', 1920, 'avc1.640028', acodec='mp4a.40.2'), _fmt('vp9-1280', 1280, 'vp9'),
+               _fmt('vp9-1920', 1920, 'vp9')]
+    assert _select(formats, 640) == ['vp9-1280']
+
+
+def _first_frame(path, seek=None):
+    cmd = ['ffmpeg', '-nostdin', '-loglevel', 'error'] + (['-ss', str(seek)] if seek is not None else [])
+    cmd += ['-i', path, '-frames:v', '1', '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-']
+    return np.frombuffer(subprocess.run(cmd, capture_output=True, check=True).stdout, np.uint8).astype(int)
+
+
+@requires_ffmpeg
+def test_sections_start_at_the_requested_time_not_the_keyframe_before(tmp_path, monkeypatch):
+    if 'libvpx-vp9' not in video_pipeline.ffmpeg_encoders():
+        pytest.skip('needs libvpx-vp9')
+    # One keyframe every 3s: a stream copy of the section would start 1.5s early
+    source = str(tmp_path / 'source.webm')
+    subprocess.run(['ffmpeg', '-nostdin', '-loglevel', 'error', '-y', '-f', 'lavfi',
+                    '-i', 'testsrc2=size=320x240:rate=30:duration=3', '-c:v', 'libvpx-vp9',
+                    '-deadline', 'realtime', '-g', '90', source], check=True)
+    monkeypatch.setattr(url_ingest, 'URL_CACHE_DIR', str(tmp_path / 'cache'))
+    monkeypatch.setattr(video_pipeline, 'probe_video', lambda path: {'width': 320, 'height': 240, 'duration': 1.0})
+    info = {'id': 'clip', 'title': 'clip', 'extractor': 'generic', 'extractor_key': 'Generic',
+            'webpage_url': 'https://example.com/clip', 'duration': 3.0,
+            'formats': [{'format_id': 'src', 'url': f'file:{source}', 'ext': 'webm', 'protocol': 'http',
+                         'width': 320, 'height': 240, 'vcodec': 'vp9', 'acodec': 'none'}]}
+    os.makedirs(url_ingest.URL_CACHE_DIR)
+    with yt_dlp.YoutubeDL({'quiet': True, 'noprogress': True, 'enable_file_urls': True,
+                           'format': url_ingest.format_selector(320)}) as ydl:
+        meta = url_ingest._download(ydl, info, ('Generic', 'clip'), 1.5, 2.5)
+    first = _first_frame(meta['path'])
+    assert np.abs(first - _first_frame(source, 1.5)).mean() < 3
+    assert np.abs(first - _first_frame(source, 0.0)).mean() > 10
+
+
+def test_original_size_is_capped_at_the_url_width_limit():
+    assert url_ingest.required_width({'resize': 'original'}) == url_ingest.URL_MAX_WIDTH
+    assert url_ingest.required_width({'resize': '4000'}) == url_ingest.URL_MAX_WIDTH
+    assert url_ingest.required_width({'resize': '320'}) == 320
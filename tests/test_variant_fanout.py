@@ -0,0 +1,161 @@
+import io
+import json
+import types
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import variant_fanout
+import video_pipeline
+
+PLAN = {'width': 32, 'height': 24, 'fps': 10, 'frame_count': 4}
+
+
+def _sink(tmp_path):
+    return variant_fanout.VariantSink(str(tmp_path / 'out.gif'), PLAN, {'fps': '10'}, np.ones(4, dtype=int), 'numpy')
+
+
+def test_sink_holds_the_last_frame_when_the_decode_comes_up_short(tmp_path):
+    sink = _sink(tmp_path)
+    for index in range(2):
+        sink.put(index, np.full((24, 32, 3), 60 * index, dtype=np.uint8))
+    sink.close()
+    assert sink.frames_written == PLAN['frame_count']
+
+
+def test_sink_fails_instead_of_writing_an_empty_output(tmp_path):
+    sink = _sink(tmp_path)
+    with pytest.raises(video_pipeline.DecodeError):
+        sink.close()
+
+
+PROBE = {'width': 320, 'height': 240, 'duration': 2.0, 'fps': 30.0}
+
+
+def test_a_shared_decode_samples_every_variant_exactly():
+    plans = [video_pipeline.build_decode_plan({'fps': '10', 'resize': '160'}, PROBE),
+             video_pipeline.build_decode_plan({'fps': '15', 'resize': '240', 'start_time': '0.5'}, PROBE)]
+    shared = variant_fanout.shared_plan(plans, PROBE)
+    assert shared['fps'] == 30
+    assert (shared['width'], shared['height']) == (240, 180)
+    assert (shared['start_time'], shared['end_time'], shared['frame_count']) == (0.0, 2.0, 60)
+    for plan in plans:
+        repeats = variant_fanout.frame_repeats(plan, shared)
+        assert repeats.sum() == plan['frame_count']
+        assert repeats.max() == 1
+    assert np.flatnonzero(variant_fanout.frame_repeats(plans[0], shared))[:4].tolist() == [0, 3, 6, 9]
+    assert np.flatnonzero(variant_fanout.frame_repeats(plans[1], shared))[:2].tolist() == [15, 17]
+
+
+def test_a_shared_decode_never_runs_faster_than_the_source():
+    plans = [video_pipeline.build_decode_plan({'fps': '10'}, PROBE), video_pipeline.build_decode_plan({'fps': '24'}, PROBE)]
+    assert variant_fanout.shared_plan(plans, PROBE)['fps'] == 30
+
+
+def test_variants_that_crop_alike_share_one_decode(sample_video, tmp_path, monkeypatch):
+    path, probe = sample_video
+    monkeypatch.setattr(video_pipeline, 'probe_video', lambda source: probe)
+    decodes = []
+    iter_frames = video_pipeline.iter_frames
+
+    def counting_iter_frames(source, plan):
+        decodes.append(plan)
+        return iter_frames(source, plan)
+
+    monkeypatch.setattr(video_pipeline, 'iter_frames', counting_iter_frames)
+    crop = {'crop_x': '0', 'crop_y': '0', 'crop_width': '160', 'crop_height': '120'}
+    variants = [({'fps': '10', 'resize': '160'}, str(tmp_path / 'small.gif'), 64),
+                ({'fps': '15', 'output_format': 'webp'}, str(tmp_path / 'large.webp'), 256),
+                (dict(crop, fps='10'), str(tmp_path / 'crop.gif'), 256)]
+    results = variant_fanout.render_variants(path, variants, encoder_name='numpy')
+    assert results == [(160, 120), (320, 240), (160, 120)]
+    assert len(decodes) == 2
+    for (options, output_path, _), (width, height), frames in zip(variants, results, (20, 30, 20)):
+        image = Image.open(output_path)
+        assert image.size == (width, height)
+        assert image.n_frames <= frames
+
+
+def test_a_failing_variant_does_not_fail_the_others(sample_video, tmp_path, monkeypatch):
+    path, probe = sample_video
+    monkeypatch.setattr(video_pipeline, 'probe_video', lambda source: probe)
+    variants = [({'fps': '10', 'resize': '160'}, str(tmp_path / 'missing' / 'small.gif'), 256),
+                ({'fps': '10', 'resize': '240'}, str(tmp_path / 'medium.gif'), 256)]
+    results = variant_fanout.render_variants(path, variants, encoder_name='numpy')
+    assert isinstance(results[0], Exception)
+    assert results[1] == (240, 180)
+    assert Image.open(variants[1][1]).size == (240, 180)
+
+
+@pytest.fixture
+def batch_client(tmp_path, monkeypatch):
+    fakeredis = pytest.importorskip('fakeredis')
+    import admission
+    import app
+    import expiry_index
+    import storage_backend
+    import task_client
+
+    monkeypatch.setattr(storage_backend, '_storage', storage_backend.LocalStorage(str(tmp_path / 'storage')))
+    monkeypatch.setattr(expiry_index, '_client', fakeredis.FakeRedis())
+    monkeypatch.setattr(admission, 'admit', lambda source, options: (
+        options, {'pixels_processed': 1000}, ['fps lowered'] if options['fps'] == '60' else []))
+    submitted = []
+
+    def submit(task_name, args=None, kwargs=None, **options):
+        submitted.append((task_name, args))
+        return types.SimpleNamespace(id='task-1')
+
+    monkeypatch.setattr(task_client, 'submit', submit)
+    client = app.app.test_client()
+    client.submitted = submitted
+    return client
+
+
+def _post_batch(client, variants, **form):
+    data = dict(form, video=(io.BytesIO(b'video bytes'), 'clip.mp4'))
+    if variants is not None:
+        data['variants'] = variants if isinstance(variants, str) else json.dumps(variants)
+    return client.post('/convert_batch', data=data, content_type='multipart/form-data')
+
+
+def test_a_batch_is_submitted_as_one_task(batch_client):
+    import task_client
+
+    response = _post_batch(batch_client, [{'resize': 160}, {'resize': '480', 'fps': '60'}], fps='10')
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body['variants'] == 2 and body['adjustments'] == ['variant 2: fps lowered']
+    task_name, (blob_name, variants) = batch_client.submitted[0]
+    assert task_name == task_client.CONVERT_VARIANTS_TASK
+    assert blob_name.startswith('video_uploads/')
+    assert [(variant['resize'], variant['fps']) for variant in variants] == [('160', '10'), ('480', '60')]
+
+
+@pytest.mark.parametrize('variants', [None, 'not json', {'resize': '160'}, [], ['160']])
+def test_malformed_variant_lists_are_refused(batch_client, variants):
+    assert _post_batch(batch_client, variants).status_code == 400
+    assert batch_client.submitted == []
+
+
+def test_too_many_variants_are_refused(batch_client):
+    import app
+
+    assert _post_batch(batch_client, [{'resize': '160'}] * (app.BATCH_MAX_VARIANTS + 1)).status_code == 400
+    assert batch_client.submitted == []
+
+
+def test_a_rejected_variant_rejects_the_batch(batch_client, monkeypatch):
+    import admission
+
+    def admit(source, options):
+        if options['resize'] == '4000':
+            raise admission.AdmissionError('Too large.', status_code=413)
+        return options, None, []
+
+    monkeypatch.setattr(admission, 'admit', admit)
+    response = _post_batch(batch_client, [{'resize': '160'}, {'resize': '4000'}])
+    assert response.status_code == 413
+    assert response.get_json()['error'].startswith('Variant 2:')
+    assert batch_client.submitted == []
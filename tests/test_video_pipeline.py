@@ -0,0 +1,112 @@
+import numpy as np
+import pytest
+
+import video_pipeline
+
+
+def _plan(probe, **options):
+    return video_pipeline.build_decode_plan(options, probe)
+
+
+def test_plan_defaults_to_the_whole_clip_at_source_size():
+    plan = _plan({'width': 640, 'height': 360, 'duration': 4.0}, fps=10)
+    assert (plan['start_time'], plan['end_time']) == (0.0, 4.0)
+    assert (plan['width'], plan['height'], plan['crop']) == (640, 360, None)
+    assert plan['frame_count'] == 40
+
+
+def test_plan_clamps_the_crop_to_the_frame_and_resizes_from_its_width():
+    plan = _plan({'width': 640, 'height': 360, 'duration': 4.0},
+                 crop_x=600, crop_y=-20, crop_width=100, crop_height=100, resize=20)
+    assert plan['crop'] == (600, 0, 40, 100)
+    assert (plan['width'], plan['height']) == (20, 50)
+
+
+def test_plan_ignores_an_end_time_past_the_clip_and_applies_speed():
+    plan = _plan({'width': 640, 'height': 360, 'duration': 4.0}, start_time=1, end_time=9, speed=2, fps=10)
+    assert (plan['start_time'], plan['end_time']) == (1.0, 4.0)
+    assert plan['duration'] == pytest.approx(1.5)
+    assert plan['frame_count'] == 15
+
+
+def test_filter_graph_crops_exactly():
+    plan = _plan({'width': 640, 'height': 360, 'duration': 4.0},
+                 crop_x=3, crop_y=5, crop_width=101, crop_height=77)
+    assert 'crop=101:77:3:5:exact=1' in video_pipeline.build_filter_graph(plan)
+
+
+def test_iter_frames_yields_every_frame_at_the_plan_size(sample_video):
+    path, probe = sample_video
+    plan = _plan(probe, end_time=1, fps=10, resize=160)
+    frames = list(video_pipeline.iter_frames(path, plan))
+    assert len(frames) == plan['frame_count'] == 10
+    assert all(frame.shape == (plan['height'], plan['width'], 3) for frame in frames)
+
+
+@pytest.mark.parametrize('crop', [(3, 5, 101, 77), (0, 0, 99, 99), (1, 1, 33, 17)])
+def test_iter_frames_handles_odd_crops_on_subsampled_sources(sample_video, crop):
+    # 4:2:0 sources used to have odd crops rounded down by ffmpeg, shearing every frame
+    path, probe = sample_video
+    x, y, width, height = crop
+    plan = _plan(probe, end_time=1, fps=10, crop_x=x, crop_y=y, crop_width=width, crop_height=height)
+    frames = list(video_pipeline.iter_frames(path, plan))
+    assert len(frames) == plan['frame_count'] == 10
+    assert frames[0].shape == (height, width, 3)
+
+    full = next(iter(video_pipeline.iter_frames(path, _plan(probe, end_time=1, fps=10))))
+    expected = full[y:y + height, x:x + width]
+    # Chroma is resampled differently at an odd offset, so compare brightness: on this
+    # pattern an aligned crop is within about 6 levels, one shifted by a pixel over 20
+    difference = frames[0].mean(axis=2) - expected.mean(axis=2)
+    assert np.abs(difference).mean() < 10
+
+
+@pytest.fixture
+def corrupt_video(sample_video, tmp_path):
+    """The sample clip cut off a third of the way in, as a truncated upload would be."""
+    path, probe = sample_video
+    with open(path, 'rb') as f:
+        data = f.read()
+    truncated = tmp_path / 'truncated.mp4'
+    truncated.write_bytes(data[:len(data) // 3])
+    return str(truncated), probe
+
+
+def test_iter_frames_raises_when_ffmpeg_fails(corrupt_video):
+    path, probe = corrupt_video
+    with pytest.raises(video_pipeline.DecodeError):
+        list(video_pipeline.iter_frames(path, _plan(probe, fps=10)))
+
+
+def test_closing_iter_frames_early_is_not_an_error(sample_video):
+    path, probe = sample_video
+    frames = video_pipeline.iter_frames(path, _plan(probe, fps=10))
+    next(frames)
+    frames.close()
+
+
+def test_frame_source_raises_instead_of_inventing_black_frames(corrupt_video):
+    path, probe = corrupt_video
+    source = video_pipeline.SequentialFrameSource(path, _plan(probe, fps=10))
+    with pytest.raises(video_pipeline.DecodeError):
+        source.get_frame(0.0)
+    source.close()
+
+
+def test_frame_source_raises_when_the_decoder_yields_nothing(sample_video):
+    path, probe = sample_video
+    # The probe claims more clip than there is, so the trim starts past the end of the stream
+    plan = _plan(dict(probe, duration=10.0), start_time=5, fps=10)
+    source = video_pipeline.SequentialFrameSource(path, plan)
+    with pytest.raises(video_pipeline.DecodeError):
+        source.get_frame(0.0)
+    source.close()
+
+
+def test_frame_source_holds_the_last_frame_when_the_decoder_comes_up_short(sample_video):
+    path, probe = sample_video
+    plan = _plan(dict(probe, duration=3.0), fps=10)
+    source = video_pipeline.SequentialFrameSource(path, plan)
+    last = source.get_frame(1.9)
+    assert source.get_frame(2.9) is last
+    source.close()
@@ -0,0 +1,169 @@
+# In text_overlay.py
+import os
+import functools
+
+import numpy as np
+from PIL import Image, ImageColor, ImageDraw, ImageFont
+
+import font_index
+
+
+# --- Configuration ---
+OVERLAY_CACHE_SIZE = int(os.environ.get('OVERLAY_CACHE_SIZE', 64))
+
+# UI text position -> (horizontal, vertical) placement of the caption box in the frame
+POSITION_MAP = {
+    'center': ('center', 'center'),
+    'top': ('center', 'top'),
+    'bottom': ('center', 'bottom'),
+    'left': ('left', 'center'),
+    'right': ('right', 'center'),
+    'top-left': ('left', 'top'),
+    'top-right': ('right', 'top'),
+    'bottom-left': ('left', 'bottom'),
+    'bottom-right': ('right', 'bottom'),
+}
+
+
+def _noneify(val):
+    if val is None:
+        return None
+    if isinstance(val, str) and val.strip().lower() in ('none', 'null', ''):
+        return None
+    return val
+
+
+def _parse_colour(val, default):
+    try:
+        return ImageColor.getrgb(val)[:3]
+    except (ValueError, AttributeError, TypeError):
+        return default
+
+
+def _load_font(font_path, font_size):
+    if font_path:
+        try:
+            return ImageFont.truetype(font_path, size=font_size)
+        except OSError:
+            pass
+    return ImageFont.load_default(size=font_size)
+
+
+def _wrap(draw, text, font, max_width):
+    """Greedy word wrap, like MoviePy's caption method; explicit newlines are kept."""
+    lines = []
+    for paragraph in text.split('\n'):
+        line = ''
+        for word in paragraph.split(' '):
+            candidate = f'{line} {word}' if line else word
+            if line and draw.textlength(candidate, font=font) > max_width:
+                lines.append(line)
+                line = word
+            else:
+                line = candidate
+        lines.append(line)
+    return lines
+
+
+class Overlay:
+    """
+    A pre-rendered RGBA caption placed at (x, y) on frames of a fixed size.
+
+    Alpha and the premultiplied colour are precomputed as integers, so blending a
+    frame is one vectorized multiply-add over the caption's bounding box.
+    """
+
+    def __init__(self, rgba, x, y):
+        alpha = rgba[:, :, 3]
+        rows = np.flatnonzero(alpha.any(axis=1))
+        cols = np.flatnonzero(alpha.any(axis=0))
+        if len(rows) == 0:
+            rgba = rgba[:0, :0]
+        else:
+            # Only the opaque bounding box needs blending
+            rgba = rgba[rows[0]:rows[-1] + 1, cols[0]:cols[-1] + 1]
+            x, y = x + int(cols[0]), y + int(rows[0])
+        self.x = x
+        self.y = y
+        self.height, self.width = rgba.shape[:2]
+        alpha = rgba[:, :, 3:4].astype(np.uint16)
+        self._inverse_alpha = 255 - alpha
+        # +127 rounds the later division by 255 to nearest
+        self._premultiplied = rgba[:, :, :3].astype(np.uint16) * alpha + 127
+        for array in (self._inverse_alpha, self._premultiplied):
+            array.flags.writeable = False
+
+    def blend(self, frame):
+        """Returns the frame with the caption alpha-blended on top."""
+        if self.width == 0:
+            return frame
+        if not frame.flags.writeable:
+            frame = frame.copy()
+        region = frame[self.y:self.y + self.height, self.x:self.x + self.width, :3]
+        region[:] = (region * self._inverse_alpha + self._premultiplied) // 255
+        return frame
+
+
+@functools.lru_cache(maxsize=OVERLAY_CACHE_SIZE)
+def render_overlay(text, font_path, font_size, color, bg_color, text_align, position, frame_width, frame_height):
+    """
+    Renders a caption box for frames of the given size. The box spans 96% of the
+    frame width and is sized from the font size and line count as the MoviePy
+    TextClip captions were; text is centred vertically and aligned per text_align.
+    Cached, so repeated conversions with the same caption skip rendering.
+    """
+    lines_requested = text.count('\n') + 1
+    if lines_requested == 1:
+        box_height = int(font_size * 2.2) + 12
+    else:
+        box_height = int(font_size * lines_requested * 1.5) + 16
+    box_height = max(1, min(box_height, int(frame_height * 0.8)))
+    box_width = max(1, int(frame_width * 0.96))
+
+    font = _load_font(font_path, font_size)
+    image = Image.new('RGBA', (box_width, box_height), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(image)
+    if bg_color is not None:
+        draw.rectangle([0, 0, box_width, box_height], fill=(*bg_color, 255))
+
+    margin = max(2, font_size // 4)
+    lines = _wrap(draw, text, font, box_width - 2 * margin)
+    ascent, descent = font.getmetrics()
+    line_height = ascent + descent
+    top = (box_height - line_height * len(lines)) / 2
+    for i, line in enumerate(lines):
+        line_width = draw.textlength(line, font=font)
+        if text_align == 'left':
+            left = margin
+        elif text_align == 'right':
+            left = box_width - margin - line_width
+        else:
+            left = (box_width - line_width) / 2
+        draw.text((left, top + i * line_height), line, font=font, fill=(*color, 255))
+
+    horizontal, vertical = POSITION_MAP.get(position, ('center', 'center'))
+    x = {'left': 0, 'right': frame_width - box_width}.get(horizontal, (frame_width - box_width) // 2)
+    y = {'top': 0, 'bottom': frame_height - box_height}.get(vertical, (frame_height - box_height) // 2)
+    return Overlay(np.asarray(image), max(x, 0), max(y, 0))
+
+
+def overlay_for_options(options, frame_width, frame_height):
+    """The cached Overlay for a conversion's text options, or None if it has no text."""
+    text = options.get('text_overlay')
+    if not text:
+        return None
+    font_name = options.get('font_style') or options.get('text_font')
+    try:
+        font_size = int(options.get('text_size') or options.get('text-size') or 24)
+    except (TypeError, ValueError):
+        font_size = 24
+    color = _parse_colour(options.get('text_color') or options.get('text-color') or 'white', (255, 255, 255))
+    bg_color = _noneify(options.get('text_bg_color') or options.get('text-bg-color'))
+    if bg_color is not None:
+        bg_color = _parse_colour(bg_color, None)
+    text_align = (options.get('text_align') or options.get('text-align') or 'center').lower()
+    position = (options.get('text_position') or options.get('text-position') or 'center').lower()
+    return render_overlay(
+        text, font_index.resolve(font_name), max(font_size, 1), color, bg_color, text_align, position,
+        int(frame_width), int(frame_height),
+    )
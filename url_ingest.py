@@ -0,0 +1,261 @@
+# In url_ingest.py
+import os
+import json
+import time
+import uuid
+
+import metrics
+import expiry_index
+import video_pipeline
+from conversion_options import normalize_options
+
+
+# --- Configuration ---
+URL_CACHE_DIR = os.environ.get('URL_CACHE_DIR', '/tmp/url_cache')
+URL_CACHE_MAX_AGE_SECONDS = int(os.environ.get('URL_CACHE_MAX_AGE_SECONDS', 6 * 3600))
+# Disk budget for the cache; least recently used downloads are evicted first past it
+URL_CACHE_MAX_BYTES = int(os.environ.get('URL_CACHE_MAX_BYTES', 2 * 1024 ** 3))
+# Format width cap for conversions that keep the original size (and no crop asks for more)
+URL_MAX_WIDTH = int(os.environ.get('URL_MAX_WIDTH', 1280))
+URL_PREVIEW_MAX_WIDTH = int(os.environ.get('URL_PREVIEW_MAX_WIDTH', 640))
+URL_PREVIEW_MAX_SECONDS = int(os.environ.get('URL_PREVIEW_MAX_SECONDS', 600))
+URL_CACHE_CLEANUP_INTERVAL = 3600
+
+_last_cleanup = 0.0
+
+
+class IngestError(Exception):
+    """Raised when a URL cannot be resolved or downloaded."""
+
+
+def video_key(url):
+    """
+    (extractor, video id) for a URL, worked out offline from the extractors' URL
+    patterns so a cached download can be found without touching the network.
+    None for URLs only the generic extractor would handle.
+    """
+    import yt_dlp
+
+    for extractor in yt_dlp.extractor.gen_extractor_classes():
+        if extractor.ie_key() == 'Generic' or not extractor.suitable(url):
+            continue
+        try:
+            video_id = extractor.get_temp_id(url)
+        except Exception:
+            video_id = None
+        return (extractor.ie_key(), str(video_id)) if video_id else None
+    return None
+
+
+def warm_up():
+    """
+    Loads yt-dlp and compiles every extractor's URL pattern, which would otherwise
+    take a few hundred milliseconds out of the first URL job in each process.
+    """
+    video_key('https://example.com/')
+
+
+def format_selector(max_width):
+    """
+    Video-only formats no wider than max_width, H.264 first (cheapest to decode),
+    falling back to muxed formats, the narrowest video-only format and only then to
+    any format with video, since the audio track is never used. Formats that do not
+    report a width are allowed through.
+    """
+    return (f'bv[width<=?{max_width}][vcodec^=avc1]/bv[width<=?{max_width}]'
+            f'/b[width<=?{max_width}]/wv/bv*[width<=?{max_width}]/w')
+
+
+def required_width(options, crop_reference_width=None):
+    """
+    Narrowest source the conversion can be made from without upscaling: the output
+    width, widened by the crop's share of the frame when a crop was drawn on a
+    preview crop_reference_width pixels wide. Capped at URL_MAX_WIDTH, which also
+    applies to resize='original': admission scales frames down to
+    ADMISSION_MAX_FRAME_PIXELS (1280x720 by default) anyway, so a wider download
+    would only cost bandwidth. Raise both together to convert wider originals.
+    """
+    opts = normalize_options(options)
+    if opts['resize'] == 'original' or (opts['crop'] and not crop_reference_width):
+        # Crop coordinates of unknown scale are taken as full-size ones
+        return URL_MAX_WIDTH
+    width = opts['resize']
+    if opts['crop'] and opts['crop'][2] > 0:
+        width = width * crop_reference_width / opts['crop'][2]
+    return min(int(width + 0.5), URL_MAX_WIDTH)
+
+
+def _entry_path(name, extension):
+    return os.path.join(URL_CACHE_DIR, f'{name}{extension}')
+
+
+def _cached_entries(key):
+    """Metadata of every unexpired cached download of a video."""
+    if key is None or not os.path.isdir(URL_CACHE_DIR):
+        return []
+    prefix = f'{key[0]}-{key[1]}-'
+    cutoff = time.time() - URL_CACHE_MAX_AGE_SECONDS
+    entries = []
+    for filename in os.listdir(URL_CACHE_DIR):
+        if not (filename.startswith(prefix) and filename.endswith('.json')):
+            continue
+        try:
+            with open(os.path.join(URL_CACHE_DIR, filename)) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if os.path.isfile(meta.get('path', '')) and os.path.getmtime(meta['path']) >= cutoff:
+            entries.append(meta)
+    return entries
+
+
+def _covers(meta, min_width, start, end):
+    """True if a cached download spans [start, end] at min_width (or the widest the video offers)."""
+    if meta['start'] > start + 1e-3:
+        return False
+    if meta['end'] is not None and (end is None or end > meta['end'] + 1e-3):
+        return False
+    return meta['width'] >= min_width or meta['width'] >= meta.get('best_width', 0)
+
+
+def find_cached(key, min_width, start=0.0, end=None):
+    """The narrowest cached download covering the window, or None."""
+    matches = [meta for meta in _cached_entries(key) if _covers(meta, min_width, start, end)]
+    if not matches:
+        return None
+    meta = min(matches, key=lambda entry: (entry['width'], (entry['end'] or 1e12) - entry['start']))
+    os.utime(meta['path'])
+    os.utime(os.path.splitext(meta['path'])[0] + '.json')
+    return meta
+
+
+def _download(ydl, info, key, start, end):
+    """Downloads the selected format of an extracted video, limited to [start, end] if given."""
+    import yt_dlp
+
+    name = f'{key[0]}-{key[1]}-{uuid.uuid4().hex[:8]}'
+    ydl.params['outtmpl'] = {'default': _entry_path(name, '.%(ext)s')}
+    if end is not None and info.get('duration') and end >= info['duration']:
+        end = None
+    if start > 0 or end is not None:
+        # Only the section is fetched: ffmpeg seeks in the remote stream and re-encodes it. A stream
+        # copy would start at the keyframe before start (up to a GOP early in WebM), while
+        # options_for_section takes the section's first frame to be exactly at start
+        ydl.params['download_ranges'] = yt_dlp.utils.download_range_func(None, [(start, end or float('inf'))])
+        ydl.params['force_keyframes_at_cuts'] = True
+    info = ydl.process_ie_result(info, download=True)
+    downloads = info.get('requested_downloads') or [info]
+    path = downloads[0].get('filepath') or ydl.prepare_filename(info)
+    try:
+        # Direct links report no dimensions, and a failed section copy leaves an empty file
+        probe = video_pipeline.probe_video(path)
+    except Exception:
+        probe = None
+    if probe is None or probe['width'] <= 0:
+        if os.path.exists(path):
+            os.remove(path)
+        raise IngestError("The video could not be downloaded.")
+    widths = [fmt.get('width') or 0 for fmt in info.get('formats') or [] if fmt.get('vcodec') != 'none']
+    meta = {
+        'extractor': key[0],
+        'id': key[1],
+        'path': path,
+        'start': start,
+        'end': end,
+        'width': probe['width'],
+        'height': probe['height'],
+        'best_width': max(widths, default=0),
+        'duration': info.get('duration') or (start + probe['duration'] if end is None else None),
+        'title': info.get('title'),
+    }
+    with open(_entry_path(name, '.json.tmp'), 'w') as f:
+        json.dump(meta, f)
+    os.replace(_entry_path(name, '.json.tmp'), _entry_path(name, '.json'))
+    return meta
+
+
+def fetch(url, min_width, start=0.0, end=None):
+    """
+    Returns the cache metadata (including 'path') of a local copy of the video at
+    url that spans [start, end] seconds at min_width or better. Served from the
+    cache when possible; otherwise only video is downloaded, in the narrowest
+    format that is wide enough, and only the requested section of it.
+    """
+    global _last_cleanup
+    import yt_dlp
+
+    os.makedirs(URL_CACHE_DIR, exist_ok=True)
+    if time.time() - _last_cleanup > URL_CACHE_CLEANUP_INTERVAL:
+        # The cache lives on worker disks, so workers expire it as they use it
+        _last_cleanup = time.time()
+        cleanup_stale()
+    key = video_key(url)
+    meta = find_cached(key, min_width, start, end)
+    if meta is not None:
+        print(f"URL cache hit for {key[0]} {key[1]}")
+        metrics.inc('gifconv_cache_lookups_total', cache='url', outcome='hit')
+        return meta
+
+    ydl_opts = {
+        'format': format_selector(min_width),
+        'noplaylist': True,
+        'quiet': True,
+        'noprogress': True,
+        'no_warnings': True,
+        'cachedir': False,
+        'merge_output_format': 'mp4',
+    }
+    try:
+        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            info = ydl.extract_info(url, download=False, process=False)
+            while info.get('_type') in ('url', 'url_transparent') and info.get('url'):
+                # A link to the real page (embeds, short links): resolve it to learn the video's id
+                info = ydl.extract_info(info['url'], ie_key=info.get('ie_key'), download=False, process=False)
+            if info.get('_type') in ('playlist', 'multi_video'):
+                raise IngestError("Playlists are not supported; link a single video.")
+            key = (info.get('extractor_key') or 'generic', str(info.get('id')))
+            meta = find_cached(key, min_width, start, end)
+            metrics.inc('gifconv_cache_lookups_total', cache='url', outcome='miss' if meta is None else 'hit')
+            if meta is not None:
+                return meta
+            meta = _download(ydl, info, key, start, end)
+            metrics.inc('gifconv_bytes_in_total', os.path.getsize(meta['path']), source='url')
+            cleanup_stale()
+            return meta
+    except yt_dlp.utils.DownloadError as e:
+        raise IngestError(f"Failed to download video from URL: {e}")
+
+
+def options_for_section(options, meta, crop_reference_width=None):
+    """
+    Rewrites conversion options for a cached download: times become relative to the
+    section it starts at, and a crop drawn on a preview crop_reference_width pixels
+    wide is scaled to the download's width.
+    """
+    options = dict(options)
+    opts = normalize_options(options)
+    if meta['start']:
+        options['start_time'] = str(max(opts['start_time'] - meta['start'], 0.0))
+        if opts['end_time'] is not None:
+            options['end_time'] = str(opts['end_time'] - meta['start'])
+    if opts['crop'] and crop_reference_width and meta['width'] and crop_reference_width != meta['width']:
+        scale = meta['width'] / crop_reference_width
+        for name, value in zip(('crop_x', 'crop_y', 'crop_width', 'crop_height'), opts['crop']):
+            options[name] = str(int(round(value * scale)))
+    options.pop('crop_reference_width', None)
+    return options
+
+
+def cleanup_stale(max_age=URL_CACHE_MAX_AGE_SECONDS, budget_bytes=URL_CACHE_MAX_BYTES):
+    """
+    Removes cached downloads (with their metadata and preview assets) unused for
+    max_age seconds, then the least recently used ones until the cache fits in
+    budget_bytes. One worker process per host does it at a time. Returns the number removed.
+    """
+    with expiry_index.host_lock('url-cache') as elected:
+        if not elected:
+            return 0
+        removed, freed = expiry_index.trim_scratch(URL_CACHE_DIR, budget_bytes, max_age=max_age)
+    if removed:
+        print(f"Evicted {removed} cached downloads ({freed} bytes) from {URL_CACHE_DIR}")
+    return removed
@@ -0,0 +1,194 @@
+# In variant_fanout.py
+import os
+import math
+import queue
+import threading
+
+import numpy as np
+from PIL import Image
+
+import animation_encoder
+import gif_encoder
+import metrics
+import text_overlay
+import video_pipeline
+from conversion_options import normalize_options
+
+
+# --- Configuration ---
+# Frames buffered per sink; a slow encoder holds the shared decoder back once its queue is full
+VARIANT_QUEUE_FRAMES = int(os.environ.get('VARIANT_QUEUE_FRAMES', 8))
+
+_END = object()
+
+
+def _decode_key(plan):
+    """Variants can share a decode when they crop and retime the source the same way."""
+    return plan['crop'], plan['speed']
+
+
+def shared_plan(plans, probe):
+    """
+    One decode plan that covers every variant plan of a group: the union of their
+    time ranges, at the widest of their sizes, and at a frame rate every variant can
+    sample exactly (the LCM of their rates), or the source's own rate when that LCM
+    would decode more frames than the source has.
+    """
+    first = plans[0]
+    start_time = min(plan['start_time'] for plan in plans)
+    end_time = max(plan['end_time'] for plan in plans)
+    rates = [plan['fps'] for plan in plans]
+    fps = math.lcm(*rates)
+    source_fps = (probe.get('fps') or 0) * first['speed']
+    if fps > max(max(rates), source_fps):
+        # e.g. 10 and 24 fps would need 120; past the source's rate there are no new frames to decode
+        fps = max(max(rates), int(math.ceil(source_fps)))
+    pre_scale_width, pre_scale_height = (first['crop'][2:] if first['crop']
+                                         else (first['source_width'], first['source_height']))
+    width = max(plan['width'] for plan in plans)
+    height = pre_scale_height
+    if width != pre_scale_width:
+        height = max(1, int(round(pre_scale_height * width / pre_scale_width)))
+    duration = (end_time - start_time) / first['speed']
+    return dict(first, start_time=start_time, end_time=end_time, fps=fps, duration=duration,
+                width=width, height=height, frame_count=max(1, int(duration * fps)))
+
+
+def frame_repeats(plan, shared):
+    """
+    How many times each frame of the shared decode appears in a variant: index i of
+    the result is the number of the variant's output frames that sample shared frame i
+    (rounded to the nearest frame, like ffmpeg's fps filter).
+    """
+    offset = (plan['start_time'] - shared['start_time']) / shared['speed']
+    times = offset + np.arange(plan['frame_count']) / plan['fps']
+    indices = np.clip(np.floor(times * shared['fps'] + 0.5 + 1e-6).astype(int), 0, shared['frame_count'] - 1)
+    return np.bincount(indices, minlength=shared['frame_count'])
+
+
+class VariantSink:
+    """
+    Encodes one variant on its own thread from frames of a shared decode: each frame
+    is scaled to the variant's size, captioned and written as many times as the
+    variant samples it. A sink that fails keeps draining its queue so the decoder
+    and the other sinks are never blocked; the error is kept in .error.
+    """
+
+    def __init__(self, output_path, plan, options, repeats, encoder_name, max_colors=gif_encoder.GIF_MAX_COLORS):
+        self.output_path = output_path
+        self.plan = plan
+        self.options = options
+        self.repeats = repeats
+        self.encoder_name = encoder_name
+        self.max_colors = max_colors
+        self.error = None
+        self.frames_written = 0
+        self._queue = queue.Queue(maxsize=VARIANT_QUEUE_FRAMES)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def wants(self, index):
+        return index < len(self.repeats) and self.repeats[index] > 0
+
+    def put(self, index, frame):
+        self._queue.put((index, frame))
+
+    def close(self):
+        """Signals the end of the decode and waits for the encoder to finish. Raises the sink's error, if any."""
+        self._queue.put(_END)
+        self._thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def _create_encoder(self):
+        output_format = normalize_options(self.options)['output_format']
+        width, height, fps = self.plan['width'], self.plan['height'], self.plan['fps']
+        if output_format != 'gif':
+            return animation_encoder.FfmpegAnimationEncoder(self.output_path, width, height, fps, output_format)
+        return gif_encoder.create_encoder(self.encoder_name, self.output_path, width, height, fps,
+                                          max_colors=self.max_colors)
+
+    def _prepare(self, frame, overlay):
+        height, width = self.plan['height'], self.plan['width']
+        if frame.shape[0] != height or frame.shape[1] != width:
+            frame = np.asarray(Image.fromarray(frame).resize((width, height), Image.BICUBIC))
+        return overlay.blend(frame) if overlay is not None else frame
+
+    def _run(self):
+        encoder = None
+        last_frame = None
+        ended = False
+        try:
+            encoder = self._create_encoder()
+            overlay = text_overlay.overlay_for_options(self.options, self.plan['width'], self.plan['height'])
+            while True:
+                item = self._queue.get()
+                if item is _END:
+                    ended = True
+                    break
+                index, frame = item
+                last_frame = self._prepare(frame, overlay)
+                for _ in range(self.repeats[index]):
+                    encoder.write_frame(last_frame)
+                    self.frames_written += 1
+            if last_frame is None:
+                raise video_pipeline.DecodeError(f"ffmpeg decoded no frames for {self.output_path}")
+            # The decoder came up short: hold the last frame, as the single-variant path does
+            while last_frame is not None and self.frames_written < self.plan['frame_count']:
+                encoder.write_frame(last_frame)
+                self.frames_written += 1
+            encoder.close()
+        except Exception as e:
+            self.error = e
+            if encoder is not None:
+                encoder.abort()
+            # Errors after the end of the decode (finishing the encode) have nothing left to drain
+            while not ended and self._queue.get() is not _END:
+                pass
+
+
+def render_variants(path, variants, encoder_name='ffmpeg', progress=None):
+    """
+    Renders several conversions of one video. variants is a list of
+    (options, output_path, max_colors); variants that crop and retime alike share a
+    single ffmpeg decode whose frames are fanned out to one encoder sink per variant,
+    all encoding concurrently. Returns one (width, height) or exception per variant.
+    """
+    if encoder_name == 'imageio':
+        # MoviePy's write_gif needs a clip of its own; the sinks take frames one at a time
+        encoder_name = 'ffmpeg'
+    probe = video_pipeline.probe_video(path)
+    plans = [video_pipeline.build_decode_plan(options, probe) for options, _, _ in variants]
+    groups = {}
+    for index, plan in enumerate(plans):
+        groups.setdefault(_decode_key(plan), []).append(index)
+    shared_plans = {key: shared_plan([plans[index] for index in indices], probe) for key, indices in groups.items()}
+
+    if progress is not None:
+        progress.set_stage('encoding', frames_total=sum(plan['frame_count'] for plan in shared_plans.values()))
+    results = [None] * len(variants)
+    for key, indices in groups.items():
+        shared = shared_plans[key]
+        print(f"Decoding {len(indices)} variants with filter graph: {video_pipeline.build_filter_graph(shared)}")
+        sinks = {}
+        for index in indices:
+            options, output_path, max_colors = variants[index]
+            sinks[index] = VariantSink(output_path, plans[index], options, frame_repeats(plans[index], shared),
+                                       encoder_name, max_colors=max_colors)
+        try:
+            for frame_index, frame in enumerate(video_pipeline.iter_frames(path, shared)):
+                for sink in sinks.values():
+                    if sink.wants(frame_index):
+                        sink.put(frame_index, frame)
+                if progress is not None:
+                    progress.advance()
+        finally:
+            for index, sink in sinks.items():
+                try:
+                    sink.close()
+                    results[index] = (plans[index]['width'], plans[index]['height'])
+                    metrics.inc('gifconv_frames_encoded_total', sink.frames_written,
+                                format=normalize_options(variants[index][0])['output_format'])
+                except Exception as e:
+                    results[index] = e
+    return results
@@ -0,0 +1,269 @@
+# In video_pipeline.py
+import os
+import json
+import math
+import functools
+import subprocess
+import tempfile
+
+from conversion_options import normalize_options
+
+
+# --- Configuration ---
+FFMPEG_BINARY = os.environ.get('FFMPEG_BINARY', 'ffmpeg')
+FFPROBE_BINARY = os.environ.get('FFPROBE_BINARY', 'ffprobe')
+SCALE_FLAGS = os.environ.get('SCALE_FLAGS', 'bicubic')
+# ffprobe reads only headers, but a URL source or a damaged container can make it hang
+PROBE_TIMEOUT_SECONDS = int(os.environ.get('PROBE_TIMEOUT_SECONDS', 30))
+
+
+class DecodeError(Exception):
+    """Raised when ffmpeg fails to decode a source that probed fine, so no blank output is encoded."""
+
+
+def _parse_rate(rate):
+    """Parses an ffprobe rate such as '30000/1001' into a float."""
+    try:
+        num, _, den = str(rate).partition('/')
+        num = float(num)
+        den = float(den) if den else 1.0
+        return num / den if den else 0.0
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def probe_video(path):
+    """
+    Reads the first video stream's geometry, frame rate and duration with ffprobe.
+    Width and height are reported as displayed, i.e. after rotation metadata is applied.
+    Raises subprocess.TimeoutExpired if ffprobe takes longer than PROBE_TIMEOUT_SECONDS.
+    """
+    cmd = [
+        FFPROBE_BINARY, '-v', 'error', '-select_streams', 'v:0',
+        '-show_entries', 'stream=width,height,codec_name,r_frame_rate,avg_frame_rate,nb_frames,duration'
+                         ':stream_tags=rotate:stream_side_data=rotation:format=duration',
+        '-of', 'json', path,
+    ]
+    result = subprocess.run(cmd, capture_output=True, text=True, timeout=PROBE_TIMEOUT_SECONDS, check=True)
+    data = json.loads(result.stdout or '{}')
+    streams = data.get('streams') or []
+    if not streams:
+        raise ValueError(f"No video stream found in {path}")
+    stream = streams[0]
+
+    width = int(stream.get('width') or 0)
+    height = int(stream.get('height') or 0)
+    rotation = 0
+    try:
+        rotation = int(float((stream.get('tags') or {}).get('rotate', 0)))
+    except (TypeError, ValueError):
+        pass
+    for side_data in stream.get('side_data_list') or []:
+        if 'rotation' in side_data:
+            try:
+                rotation = int(float(side_data['rotation']))
+            except (TypeError, ValueError):
+                pass
+    if abs(rotation) % 180 == 90:
+        width, height = height, width
+
+    duration = 0.0
+    for candidate in (stream.get('duration'), (data.get('format') or {}).get('duration')):
+        try:
+            duration = float(candidate)
+            if duration > 0:
+                break
+        except (TypeError, ValueError):
+            continue
+
+    fps = _parse_rate(stream.get('avg_frame_rate')) or _parse_rate(stream.get('r_frame_rate'))
+    return {
+        'width': width,
+        'height': height,
+        'duration': duration,
+        'fps': fps,
+        'codec': stream.get('codec_name'),
+        'nb_frames': int(stream['nb_frames']) if str(stream.get('nb_frames', '')).isdigit() else None,
+    }
+
+
+def build_decode_plan(options, probe):
+    """
+    Resolves conversion options against the probed source into a single decode plan.
+    Applies the same fallbacks as the MoviePy path (clip bounds, crop clamping, speed,
+    width-driven resize) so both engines produce GIFs with identical timing and size.
+    """
+    opts = normalize_options(options)
+    duration = probe['duration']
+    src_width, src_height = probe['width'], probe['height']
+
+    start_time = opts['start_time']
+    end_time = duration
+    if opts['end_time'] is not None and 0 < opts['end_time'] <= duration:
+        end_time = opts['end_time']
+    if start_time >= end_time:
+        start_time = 0.0
+        if end_time <= start_time and duration > 0:
+            end_time = duration
+
+    # vfx.Crop slices the frame, so out-of-range boxes are clipped to the frame edges
+    crop = None
+    width, height = src_width, src_height
+    if opts['crop']:
+        x, y, crop_w, crop_h = opts['crop']
+        x = min(max(x, 0), src_width)
+        y = min(max(y, 0), src_height)
+        crop_w = min(x + crop_w, src_width) - x
+        crop_h = min(y + crop_h, src_height) - y
+        if crop_w > 0 and crop_h > 0:
+            crop = (x, y, crop_w, crop_h)
+            width, height = crop_w, crop_h
+
+    speed = opts['speed']
+    clip_duration = (end_time - start_time) / speed
+
+    if opts['resize'] != 'original' and width > 0:
+        resize_width = opts['resize']
+        height = max(1, int(round(height * resize_width / width)))
+        width = resize_width
+
+    fps = opts['fps']
+    return {
+        'start_time': start_time,
+        'end_time': end_time,
+        'crop': crop,
+        'speed': speed,
+        'fps': fps,
+        'duration': clip_duration,
+        'width': width,
+        'height': height,
+        'source_width': src_width,
+        'source_height': src_height,
+        'frame_count': max(1, int(clip_duration * fps)),
+    }
+
+
+def build_filter_graph(plan):
+    """Turns a decode plan into one ffmpeg filter chain: crop, retime, resample, scale."""
+    filters = []
+    if plan['crop']:
+        x, y, crop_w, crop_h = plan['crop']
+        # Without exact=1, crop rounds odd sizes and offsets down to the chroma grid on 4:2:0
+        # sources, and the emitted frames no longer match the plan's size
+        filters.append(f"crop={crop_w}:{crop_h}:{x}:{y}:exact=1")
+    if plan['speed'] != 1.0:
+        filters.append(f"setpts=(PTS-STARTPTS)/{plan['speed']}")
+    else:
+        filters.append("setpts=PTS-STARTPTS")
+    # Drop frames before scaling so only kept frames pay for the resize
+    filters.append(f"fps={plan['fps']}")
+    pre_scale_size = tuple(plan['crop'][2:]) if plan['crop'] else (plan['source_width'], plan['source_height'])
+    if (plan['width'], plan['height']) != pre_scale_size:
+        filters.append(f"scale={plan['width']}:{plan['height']}:flags={SCALE_FLAGS}")
+    return ','.join(filters)
+
+
+def build_decode_command(path, plan, output='-'):
+    """ffmpeg command that seeks, trims and filters at decode time and emits raw RGB frames."""
+    # Round the seek down: rounding up past a frame's timestamp would drop that frame
+    seek = math.floor(plan['start_time'] * 1000) / 1000
+    return [
+        FFMPEG_BINARY, '-nostdin', '-hide_banner', '-loglevel', 'error',
+        '-ss', f"{seek:.3f}",
+        '-t', f"{plan['end_time'] - seek:.3f}",
+        '-i', path,
+        '-an', '-sn',
+        '-vf', build_filter_graph(plan),
+        '-frames:v', str(plan['frame_count']),
+        '-f', 'rawvideo', '-pix_fmt', 'rgb24',
+        output,
+    ]
+
+
+@functools.lru_cache(maxsize=1)
+def ffmpeg_encoders():
+    """Names of the encoders the ffmpeg binary was built with, probed once per process."""
+    output = subprocess.run([FFMPEG_BINARY, '-hide_banner', '-encoders'], capture_output=True, text=True,
+                            timeout=30, check=True).stdout
+    # The list follows a legend ending in a ' ------' line: ' V....D libx264   description'
+    listing = output.partition(' ------')[2]
+    return frozenset(line.split()[1] for line in listing.splitlines() if len(line.split()) > 1)
+
+
+def iter_frames(path, plan):
+    """Yields HxWx3 uint8 frames of the final size; Python never sees full-resolution frames."""
+    # Imported here so the web tier, which only probes and plans, never loads numpy
+    import numpy as np
+
+    frame_bytes = plan['width'] * plan['height'] * 3
+    with tempfile.TemporaryFile() as stderr_file:
+        process = subprocess.Popen(
+            build_decode_command(path, plan), stdout=subprocess.PIPE, stderr=stderr_file,
+            bufsize=frame_bytes,
+        )
+        finished = False
+        try:
+            while True:
+                buffer = process.stdout.read(frame_bytes)
+                if len(buffer) < frame_bytes:
+                    break
+                yield np.frombuffer(buffer, dtype=np.uint8).reshape(plan['height'], plan['width'], 3)
+            finished = True
+        finally:
+            process.stdout.close()
+            # A consumer that stops early closes the generator; only then is ffmpeg killed
+            if not finished and process.poll() is None:
+                process.kill()
+            return_code = process.wait()
+        if return_code != 0:
+            stderr_file.seek(0)
+            raise DecodeError(f"ffmpeg decode of {path} exited with {return_code}: "
+                              f"{stderr_file.read().decode(errors='replace').strip()}")
+
+
+class SequentialFrameSource:
+    """
+    Random-access facade over iter_frames for MoviePy consumers.
+    Consumers read frames in time order, so seeking forward just advances the
+    pipe; seeking backwards restarts the decoder.
+    """
+
+    def __init__(self, path, plan):
+        self.path = path
+        self.plan = plan
+        self._frames = None
+        self._index = -1
+        self._frame = None
+
+    def get_frame(self, t):
+        index = min(int(t * self.plan['fps'] + 1e-6), self.plan['frame_count'] - 1)
+        if self._frames is None or index < self._index:
+            self.close()
+            self._frames = iter_frames(self.path, self.plan)
+            self._index = -1
+        while self._index < index:
+            frame = next(self._frames, None)
+            if frame is None:
+                # Decoder came up short; hold the last frame like MoviePy does at clip end
+                break
+            self._frame = frame
+            self._index += 1
+        if self._frame is None:
+            raise DecodeError(f"ffmpeg decoded no frames from {self.path}")
+        return self._frame
+
+    def close(self):
+        if self._frames is not None:
+            self._frames.close()
+            self._frames = None
+
+
+def open_filtered_clip(path, options):
+    """Returns a MoviePy clip backed by the ffmpeg filter graph, plus its decode plan."""
+    from moviepy import VideoClip
+
+    plan = build_decode_plan(options, probe_video(path))
+    source = SequentialFrameSource(path, plan)
+    clip = VideoClip(frame_function=source.get_frame, duration=plan['frame_count'] / plan['fps'])
+    clip.close = source.close
+    return clip, plan